@@ -1,21 +1,17 @@
 """
 Admin configuration for the core app.
 """
+import importlib.util
 import json
 
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
-# Make pygments optional
-try:
-    from pygments import highlight
-    from pygments.lexers import JsonLexer
-    from pygments.formatters import HtmlFormatter
-    PYGMENTS_AVAILABLE = True
-except ImportError:
-    PYGMENTS_AVAILABLE = False
+# Make pygments optional; it is only imported when a change page is rendered
+PYGMENTS_AVAILABLE = importlib.util.find_spec('pygments') is not None
 
+from .db_routers import use_replica
 from .models import AuditLog
 
 
@@ -50,6 +46,15 @@ class AuditLogAdmin(admin.ModelAdmin):
     user_email.short_description = 'User Email'
     user_email.admin_order_field = 'user__email'
     
+    def changelist_view(self, request, extra_context=None):
+        """Serve the (read-only, potentially large) audit listing from the replica."""
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            # Evaluate the lazy result list while still routed to the replica
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+    
     def details_display(self, obj):
         """Display the details as formatted and highlighted JSON if pygments is available, otherwise as plain text."""
         # Convert the details to a pretty-printed JSON string
@@ -57,6 +62,9 @@ class AuditLogAdmin(admin.ModelAdmin):
         
         if PYGMENTS_AVAILABLE:
             # Highlight the JSON if pygments is available
+            from pygments import highlight
+            from pygments.formatters import HtmlFormatter
+            from pygments.lexers import JsonLexer
             formatter = HtmlFormatter(style='colorful')
             highlighted = highlight(json_str, JsonLexer(), formatter)
             style = "<style>{}</style><br>".format(formatter.get_style_defs())
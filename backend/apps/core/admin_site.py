@@ -1,5 +1,13 @@
+import os
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import AdminSite
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from . import profiling
 
 class CustomAdminSite(AdminSite):
     site_header = 'Ripple Fox Administration'
@@ -13,5 +21,33 @@ class CustomAdminSite(AdminSite):
         context['site_url'] = '/'
         return context
 
+    def get_urls(self):
+        urls = [
+            path('profiles/', self.admin_view(self.profiles_view), name='profiles'),
+            path('profiles/<str:name>/', self.admin_view(self.profile_download_view), name='profile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def profiles_view(self, request):
+        """List request profiles captured by ProfilingMiddleware."""
+        if not request.user.is_superuser:
+            raise Http404
+        context = {
+            **self.each_context(request),
+            'title': 'Request profiles',
+            'profiles': profiling.list_artifacts(),
+            'profiling_enabled': getattr(settings, 'PROFILING_ENABLED', False),
+        }
+        return TemplateResponse(request, 'admin/profiles.html', context)
+
+    def profile_download_view(self, request, name):
+        """Download a stored profile or SQL report."""
+        if not request.user.is_superuser:
+            raise Http404
+        artifact = profiling.artifact_path(name)
+        if artifact is None:
+            raise Http404
+        return FileResponse(open(artifact, 'rb'), as_attachment=True, filename=os.path.basename(artifact))
+
 # Create an instance of our custom admin site
 custom_admin_site = CustomAdminSite(name='custom_admin')
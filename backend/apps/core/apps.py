@@ -0,0 +1,17 @@
+"""App configuration for the core app."""
+
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    """AppConfig for the core application."""
+
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.core'
+    verbose_name = 'Core'
+
+    def ready(self):
+        """Register signal handlers for database connections and Celery task metrics."""
+        import apps.core.signals  # noqa
+        from apps.core.metrics import connect_celery_signals
+        connect_celery_signals()
@@ -0,0 +1,47 @@
+"""
+Direct Redis access for code that needs more than the cache API.
+
+Bit arrays and Lua scripts have no equivalent in ``django.core.cache``, so
+modules that use them talk to Redis themselves. :func:`redis_client` gives
+them a client for the same server as the default cache, built from the
+public ``CACHES`` setting rather than from the cache backend's internals.
+Keys should still go through ``cache.make_key`` so they share the cache's
+prefix and version.
+"""
+import threading
+
+from django.conf import settings
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def redis_client():
+    """Return a Redis client for the default cache, or None if it is not Redis.
+
+    One client (and so one connection pool) is kept per process.
+    """
+    config = settings.CACHES.get('default', {})
+    if config.get('BACKEND') != 'django.core.cache.backends.redis.RedisCache':
+        return None
+    location = config['LOCATION']
+    # As in Django's backend, the first of several servers is the one written to
+    if isinstance(location, str):
+        location = location.split(',')[0]
+    else:
+        location = location[0]
+    client = _clients.get(location)
+    if client is None:
+        import redis
+
+        with _clients_lock:
+            client = _clients.get(location)
+            if client is None:
+                options = config.get('OPTIONS', {})
+                client = redis.Redis.from_url(
+                    location,
+                    socket_connect_timeout=options.get('socket_connect_timeout'),
+                    socket_timeout=options.get('socket_timeout'),
+                )
+                _clients[location] = client
+    return client
@@ -0,0 +1,164 @@
+"""
+Database routers for the core app.
+
+Writes always go to ``default``. Reads go to the ``replica`` alias only inside
+an explicit :func:`use_replica` block (or a view decorated with it), and only
+while the replica is within ``DATABASE_REPLICA_MAX_LAG`` seconds of the
+primary. A request that has written, or whose client wrote recently (see
+:class:`apps.core.middleware.ReplicaPinningMiddleware`), is pinned to the
+primary so users always read their own writes.
+"""
+import logging
+import threading
+import time
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .env_utils import REPLICA_DATABASE_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# How long a replication-lag measurement is reused before querying again
+LAG_CHECK_INTERVAL = 1.0
+
+_replica_reads = ContextVar('replica_reads', default=None)
+_request_state = ContextVar('replica_request_state', default=None)
+
+_lag_lock = threading.Lock()
+_lag_cache = {'value': 0.0, 'checked_at': float('-inf')}
+
+
+def replica_configured() -> bool:
+    """Return True if a replica database alias is configured."""
+    return REPLICA_DATABASE_ALIAS in settings.DATABASES
+
+
+def replica_lag() -> float:
+    """
+    Return the replica's replication lag in seconds.
+
+    The measurement is cached for ``LAG_CHECK_INTERVAL`` so routing adds at
+    most one cheap query per second per process. Replicas that cannot report
+    lag (SQLite) count as current; errors count as infinitely stale.
+    """
+    now = time.monotonic()
+    if now - _lag_cache['checked_at'] < LAG_CHECK_INTERVAL:
+        return _lag_cache['value']
+    with _lag_lock:
+        if now - _lag_cache['checked_at'] < LAG_CHECK_INTERVAL:
+            return _lag_cache['value']
+        connection = connections[REPLICA_DATABASE_ALIAS]
+        lag = 0.0
+        if connection.vendor == 'postgresql':
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                        'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+                    )
+                    lag = float(cursor.fetchone()[0])
+            except DatabaseError as e:
+                logger.warning("Could not measure replica lag: %s", e)
+                lag = float('inf')
+        _lag_cache.update(value=lag, checked_at=now)
+        return lag
+
+
+@contextmanager
+def request_scope(pinned=False):
+    """
+    Track read-your-writes state for one request.
+
+    Yields the mutable state dict; ``state['wrote']`` becomes True once the
+    request writes, so the middleware can tell the client to stay pinned.
+    """
+    state = {'pinned': pinned, 'wrote': False}
+    token = _request_state.set(state)
+    try:
+        yield state
+    finally:
+        _request_state.reset(token)
+
+
+def pin_to_primary():
+    """Send all further reads in the current request to the primary."""
+    state = _request_state.get()
+    if state is not None:
+        state['pinned'] = True
+        state['wrote'] = True
+
+
+def is_pinned_to_primary() -> bool:
+    """Return True if the current request must read from the primary."""
+    state = _request_state.get()
+    return bool(state and state['pinned'])
+
+
+class use_replica(ContextDecorator):
+    """
+    Route ORM reads inside the block to the read replica.
+
+    Works as a context manager or a decorator::
+
+        with use_replica():
+            User.objects.count()
+
+        @use_replica(max_lag=30)
+        def reports_view(request): ...
+
+    Args:
+        max_lag: Maximum acceptable replication lag in seconds; defaults to
+            ``settings.DATABASE_REPLICA_MAX_LAG``
+    """
+
+    def __init__(self, max_lag=None):
+        self.max_lag = max_lag
+        self._token = None
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call keeps concurrent requests apart.
+        return type(self)(self.max_lag)
+
+    def __enter__(self):
+        max_lag = self.max_lag
+        if max_lag is None:
+            max_lag = getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5.0)
+        self._token = _replica_reads.set(max_lag)
+        return self
+
+    def __exit__(self, *exc):
+        _replica_reads.reset(self._token)
+        return False
+
+
+class PrimaryReplicaRouter:
+    """
+    Send opted-in reads to a sufficiently fresh replica and everything else
+    to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        max_lag = _replica_reads.get()
+        if max_lag is None or is_pinned_to_primary() or not replica_configured():
+            return None
+        if replica_lag() > max_lag:
+            return None
+        return REPLICA_DATABASE_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Anything read after a write in the same request must see it.
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primary and replica hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication.
+        if db == REPLICA_DATABASE_ALIAS:
+            return False
+        return None
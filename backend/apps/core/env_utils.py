@@ -1,10 +1,30 @@
 """
-Environment variable validation for the VC project.
+Environment variable loading and validation for the VC project.
+
+Settings read the environment through these helpers. The core values
+(secrets, hosts, email, broker) are parsed once into a frozen
+:class:`EnvSettings` by :func:`load_settings`, which also loads the
+``.env`` file and validates the result; nothing here runs at import time.
 """
 import os
-from typing import Optional, Dict, List
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple
 from django.core.exceptions import ImproperlyConfigured
 
+try:
+    from dotenv import load_dotenv
+    DOTENV_AVAILABLE = True
+except ImportError:
+    DOTENV_AVAILABLE = False
+
+# backend/.env, next to .env.example
+DEFAULT_ENV_FILE = Path(__file__).resolve().parent.parent.parent / '.env'
+
+# Development-only fallback; validate_environment() rejects it when DEBUG is off
+INSECURE_SECRET_KEY = 'django-insecure-your-secure-key-here-1234567890'
+
 # Required environment variables with descriptions
 REQUIRED_VARIABLES = {
     # Django settings
@@ -19,11 +39,27 @@ OPTIONAL_VARIABLES = {
     'ENVIRONMENT': 'development',
     'LOG_LEVEL': 'INFO',
     # Database settings
+    'DB_ENGINE': 'sqlite',
     'DB_NAME': 'db.sqlite3',
     'DB_USER': '',
     'DB_PASSWORD': '',
     'DB_HOST': 'localhost',
     'DB_PORT': '5432',
+    'DB_CONN_MAX_AGE': '60',
+    'DB_CONN_HEALTH_CHECKS': 'True',
+    'DB_CONNECT_TIMEOUT': '5',
+    'DB_POOL': 'False',
+    'DB_POOL_MIN_SIZE': '2',
+    'DB_POOL_MAX_SIZE': '10',
+    'DB_REPLICA_HOST': '',
+    'DB_REPLICA_PORT': '',
+    'DB_REPLICA_MAX_LAG': '5',
+    'DB_REPLICA_PIN_SECONDS': '10',
+    'DB_SQLITE_PATH': '',
+    'DB_SQLITE_REPLICA_PATH': '',
+    'DB_SQLITE_WAL': 'False',
+    # Cache settings
+    'CACHE_URL': '',
     # Email settings
     'EMAIL_HOST': 'localhost',
     'EMAIL_PORT': '25',
@@ -31,12 +67,99 @@ OPTIONAL_VARIABLES = {
     'DEFAULT_FROM_EMAIL': 'webmaster@localhost',
 }
 
-def validate_environment() -> None:
+@dataclass(frozen=True)
+class EnvSettings:
+    """Core settings parsed from the environment."""
+
+    debug: bool
+    environment: str
+    secret_key: str
+    allowed_hosts: Tuple[str, ...]
+    jwt_secret_key: str
+    email_backend: str
+    email_host: str
+    email_port: int
+    email_use_tls: bool
+    email_host_user: str
+    email_host_password: str
+    default_from_email: str
+    celery_broker_url: str
+    celery_result_backend: str
+    aws_access_key_id: str
+    aws_secret_access_key: str
+    aws_storage_bucket_name: str
+
+
+@lru_cache(maxsize=None)
+def load_settings(env_file: Optional[str] = None) -> EnvSettings:
     """
-    Validate that all required environment variables are set.
-    This is now a no-op since we're making all variables optional with defaults.
+    Load, validate and cache the core settings.
+
+    Values already in the process environment win over the ``.env`` file,
+    so container/orchestrator settings are never overridden.
+
+    Args:
+        env_file: Path of the ``.env`` file (default: ``backend/.env``)
+
+    Returns:
+        EnvSettings: The parsed settings, cached for the life of the process
+
+    Raises:
+        ImproperlyConfigured: If the configuration is unsafe or invalid
     """
-    pass
+    path = Path(env_file) if env_file else DEFAULT_ENV_FILE
+    if DOTENV_AVAILABLE and path.is_file():
+        load_dotenv(path, override=False)
+
+    secret_key = get_env_variable('SECRET_KEY', '') or INSECURE_SECRET_KEY
+    env = EnvSettings(
+        debug=get_boolean_env('DEBUG', True),
+        environment=get_env_variable('ENVIRONMENT', 'development'),
+        secret_key=secret_key,
+        allowed_hosts=tuple(get_list_env('ALLOWED_HOSTS', default=['localhost', '127.0.0.1'])),
+        jwt_secret_key=get_env_variable('JWT_SECRET_KEY', '') or secret_key,
+        email_backend=get_env_variable('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend'),
+        email_host=get_env_variable('EMAIL_HOST', 'smtp.gmail.com'),
+        email_port=get_int_env('EMAIL_PORT', 587),
+        email_use_tls=get_boolean_env('EMAIL_USE_TLS', True),
+        email_host_user=get_env_variable('EMAIL_HOST_USER', ''),
+        email_host_password=get_env_variable('EMAIL_HOST_PASSWORD', ''),
+        default_from_email=get_env_variable('DEFAULT_FROM_EMAIL', 'webmaster@localhost'),
+        celery_broker_url=get_env_variable('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
+        celery_result_backend=get_env_variable('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0'),
+        aws_access_key_id=get_env_variable('AWS_ACCESS_KEY_ID', ''),
+        aws_secret_access_key=get_env_variable('AWS_SECRET_ACCESS_KEY', ''),
+        aws_storage_bucket_name=get_env_variable('AWS_STORAGE_BUCKET_NAME', ''),
+    )
+    validate_environment(env)
+    return env
+
+
+def validate_environment(env: Optional[EnvSettings] = None) -> None:
+    """
+    Validate the loaded settings.
+
+    Development runs with defaults for everything; with ``DEBUG`` off a real
+    ``SECRET_KEY`` and an explicit ``ALLOWED_HOSTS`` are required.
+
+    Args:
+        env: Settings to check (default: :func:`load_settings`)
+
+    Raises:
+        ImproperlyConfigured: Listing every problem found
+    """
+    if env is None:
+        env = load_settings()
+    errors = []
+    if not env.debug:
+        if env.secret_key == INSECURE_SECRET_KEY or env.secret_key.startswith('django-insecure'):
+            errors.append(f"SECRET_KEY must be set when DEBUG is off ({REQUIRED_VARIABLES['SECRET_KEY']})")
+        if not env.allowed_hosts or '*' in env.allowed_hosts:
+            errors.append('ALLOWED_HOSTS must list the served hostnames when DEBUG is off')
+    if not 0 < env.email_port < 65536:
+        errors.append(f'EMAIL_PORT {env.email_port} is not a valid port')
+    if errors:
+        raise ImproperlyConfigured('Invalid environment: ' + '; '.join(errors))
 
 def get_env_variable(var_name: str, default: str = '', required: bool = False) -> str:
     """
@@ -69,10 +192,10 @@ def get_boolean_env(var_name: str, default: bool = False) -> bool:
     Returns:
         bool: The boolean value of the environment variable
     """
-    value = os.getenv(var_name, '').lower()
+    value = os.getenv(var_name, '').strip().lower()
     if value in ('true', '1', 'yes', 'y'):
         return True
-    elif value in ('false', '0', 'no', 'n', ''):
+    elif value in ('false', '0', 'no', 'n'):
         return False
     return default
 
@@ -127,5 +250,156 @@ def get_list_env(var_name: str, separator: str = ',', default: Optional[list] =
         return default
     return [item.strip() for item in value.split(separator) if item.strip()]
 
-# Call validation when module is imported
-validate_environment()
+REPLICA_DATABASE_ALIAS = 'replica'
+
+
+def _postgres_database(host: str, port: str) -> Dict:
+    """
+    Build a PostgreSQL connection entry from the DB_* environment variables.
+
+    Connections are persistent (``DB_CONN_MAX_AGE`` seconds) and health-checked
+    before reuse, so a request does not pay the TCP/TLS/auth handshake. When
+    ``DB_POOL`` is enabled and the installed Django/psycopg support it, a
+    server-side-free psycopg pool is used instead of persistent connections.
+    """
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': get_env_variable('DB_NAME', 'voltconglomerate'),
+        'USER': get_env_variable('DB_USER', ''),
+        'PASSWORD': get_env_variable('DB_PASSWORD', ''),
+        'HOST': host,
+        'PORT': port,
+        'CONN_MAX_AGE': get_int_env('DB_CONN_MAX_AGE', 60),
+        'CONN_HEALTH_CHECKS': get_boolean_env('DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': {
+            'connect_timeout': get_int_env('DB_CONNECT_TIMEOUT', 5),
+        },
+    }
+    if get_boolean_env('DB_POOL', False) and psycopg_pool_supported():
+        # Django refuses persistent connections together with a pool.
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {
+            'min_size': get_int_env('DB_POOL_MIN_SIZE', 2),
+            'max_size': get_int_env('DB_POOL_MAX_SIZE', 10),
+            'timeout': get_int_env('DB_CONNECT_TIMEOUT', 5),
+        }
+    return config
+
+
+def _sqlite_database(base_dir, name: str) -> Dict:
+    """Build a SQLite connection entry; relative paths resolve against base_dir."""
+    if not os.path.isabs(name):
+        name = os.path.join(base_dir, name)
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': get_int_env('DB_CONN_MAX_AGE', 0),
+        'OPTIONS': {
+            # Seconds to wait on a locked database before raising.
+            'timeout': get_int_env('DB_CONNECT_TIMEOUT', 20),
+        },
+    }
+
+
+def psycopg_pool_supported() -> bool:
+    """
+    Return True if the native connection pool (Django 5.1+ with psycopg 3
+    and psycopg_pool) is available in this environment.
+    """
+    import django
+    if django.VERSION < (5, 1):
+        return False
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_database_config(base_dir) -> Dict[str, Dict]:
+    """
+    Build the DATABASES setting from environment variables.
+
+    ``DB_ENGINE`` selects ``postgresql`` or ``sqlite`` (the default). If
+    ``DB_REPLICA_HOST`` (PostgreSQL) or ``DB_SQLITE_REPLICA_PATH`` (SQLite, for
+    local testing) is set, a read-only ``replica`` alias is added that tests
+    mirror onto ``default``.
+
+    Args:
+        base_dir: Directory that relative SQLite paths are resolved against
+
+    Returns:
+        Dict[str, Dict]: A mapping suitable for ``settings.DATABASES``
+    """
+    engine = get_env_variable('DB_ENGINE', '').strip().lower() or 'sqlite'
+    if engine in ('postgres', 'postgresql'):
+        default_port = get_env_variable('DB_PORT', '5432')
+        databases = {
+            'default': _postgres_database(get_env_variable('DB_HOST', 'localhost'), default_port),
+        }
+        replica_host = get_env_variable('DB_REPLICA_HOST', '')
+        if replica_host:
+            replica = _postgres_database(
+                replica_host, get_env_variable('DB_REPLICA_PORT', '') or default_port
+            )
+            replica['TEST'] = {'MIRROR': 'default'}
+            databases[REPLICA_DATABASE_ALIAS] = replica
+        return databases
+    if engine in ('sqlite', 'sqlite3'):
+        path = get_env_variable('DB_SQLITE_PATH', '') or 'db.sqlite3'
+        databases = {'default': _sqlite_database(base_dir, path)}
+        replica_path = get_env_variable('DB_SQLITE_REPLICA_PATH', '')
+        if replica_path:
+            replica = _sqlite_database(base_dir, replica_path)
+            replica['TEST'] = {'MIRROR': 'default'}
+            databases[REPLICA_DATABASE_ALIAS] = replica
+        return databases
+    raise ImproperlyConfigured(f"Unsupported DB_ENGINE {engine!r}; use 'postgresql' or 'sqlite'")
+
+
+def get_sqlite_pragmas() -> Dict[str, str]:
+    """
+    Return the PRAGMAs applied to every new SQLite connection.
+
+    With ``DB_SQLITE_WAL`` enabled this is the local/edge profile: WAL
+    journaling lets readers proceed while a writer commits, and
+    ``synchronous=NORMAL`` skips the fsync on every transaction.
+    """
+    if not get_boolean_env('DB_SQLITE_WAL', False):
+        return {}
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': str(get_int_env('DB_CONNECT_TIMEOUT', 20) * 1000),
+        'temp_store': 'MEMORY',
+        'cache_size': '-20000',
+    }
+
+def get_cache_config() -> Dict[str, Dict]:
+    """
+    Build the CACHES setting from ``CACHE_URL``.
+
+    A ``redis://`` URL selects Django's Redis backend so counters and locks
+    are shared across workers; anything else falls back to per-process
+    local memory.
+    """
+    cache_url = get_env_variable('CACHE_URL', '')
+    if cache_url.startswith(('redis://', 'rediss://', 'unix://')):
+        return {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': cache_url,
+                'OPTIONS': {
+                    'socket_connect_timeout': get_int_env('CACHE_CONNECT_TIMEOUT', 2),
+                    'socket_timeout': get_int_env('CACHE_CONNECT_TIMEOUT', 2),
+                },
+            }
+        }
+    return {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ripplefox-default',
+        }
+    }
+
@@ -0,0 +1,23 @@
+"""
+Password hashers for the Ripple Fox platform.
+"""
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from .metrics import timed
+
+
+class InstrumentedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's default PBKDF2 hasher with hash and verify timings exported.
+
+    Keeps the ``pbkdf2_sha256`` algorithm name, so existing hashes verify
+    unchanged.
+    """
+
+    @timed('password_hash')
+    def encode(self, password, salt, iterations=None):
+        return super().encode(password, salt, iterations)
+
+    @timed('password_verify')
+    def verify(self, password, encoded):
+        return super().verify(password, encoded)
@@ -0,0 +1,128 @@
+"""
+``Idempotency-Key`` support for POST endpoints.
+
+A client sends an ``Idempotency-Key`` header (any unique string, such as a
+UUID) with a request it may repeat. The first request runs normally and its
+response is stored in the cache for ``IDEMPOTENCY_TTL`` seconds. Repeats get
+the stored response back, marked ``Idempotent-Replayed: true``, without the
+view running again: no second password hash, no second email.
+
+* A repeat that arrives while the first is still running gets 409 with
+  ``Retry-After``.
+* Reusing a key with a different request body gets 422.
+* 5xx responses are not stored, so the client can retry them.
+
+Keys are scoped per view and per authenticated user. Anonymous requests
+share a scope, but a stored response is only replayed for an identical
+body. Point ``CACHE_URL`` at Redis in production so all workers see the
+same keys.
+"""
+import functools
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http.request import RawPostDataException
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.core.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# Upper bound on how long a first request may hold its key before a repeat may run
+LOCK_SECONDS = 60
+
+
+def _cache_key(request, scope, key):
+    user = getattr(request, 'user', None)
+    owner = user.pk if user is not None and user.is_authenticated else 'anon'
+    digest = hashlib.sha256(f'{scope}\n{owner}\n{key}'.encode()).hexdigest()
+    return f'idempotency:{digest}'
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256(f'{request.method} {request.get_full_path()}\n'.encode())
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # The body stream was already consumed (e.g. a multipart upload was parsed)
+        digest.update(repr(sorted(request.data.items())).encode())
+    return digest.hexdigest()
+
+
+def _replay(stored):
+    response = Response(stored['data'], status=stored['status'], headers=stored['headers'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method=None, *, scope=None):
+    """Make an APIView handler honour the ``Idempotency-Key`` header.
+
+    Usable bare (``@idempotent``) or with a scope shared between views
+    (``@idempotent(scope='registration')``). Only DRF ``Response`` objects are
+    stored; anything else is returned as is.
+
+    Args:
+        view_method: The handler, when used without arguments
+        scope: Key namespace (default: the view class)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return func(self, request, *args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+                return Response(
+                    {'detail': f'Invalid {IDEMPOTENCY_HEADER} header.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            cache_key = _cache_key(request, scope or f'{type(self).__module__}.{type(self).__qualname__}', key)
+            fingerprint = _fingerprint(request)
+            lock_key = f'{cache_key}:lock'
+            # Claim the key first, then look for a stored response, so a request
+            # finishing between the two steps is still seen
+            locked = cache.add(lock_key, 1, timeout=LOCK_SECONDS)
+            try:
+                stored = cache.get(cache_key)
+                record_cache_lookup('idempotency', hit=stored is not None)
+                if stored is not None:
+                    if stored['fingerprint'] != fingerprint:
+                        logger.warning("Rejected reused %s on %s", IDEMPOTENCY_HEADER, request.path)
+                        return Response(
+                            {'detail': f'{IDEMPOTENCY_HEADER} was already used for a different request.'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                        )
+                    return _replay(stored)
+                if not locked:
+                    return Response(
+                        {'detail': f'A request with this {IDEMPOTENCY_HEADER} is still being processed.'},
+                        status=status.HTTP_409_CONFLICT,
+                        headers={'Retry-After': '1'}
+                    )
+
+                response = func(self, request, *args, **kwargs)
+                if isinstance(response, Response) and response.status_code < 500:
+                    cache.set(cache_key, {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                        'headers': {k: v for k, v in response.items() if k.lower() != 'content-type'},
+                    }, timeout=getattr(settings, 'IDEMPOTENCY_TTL', 86400))
+                return response
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+
+        return wrapper
+
+    if view_method is not None:
+        return decorator(view_method)
+    return decorator
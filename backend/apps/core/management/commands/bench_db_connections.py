@@ -0,0 +1,64 @@
+"""
+Management command to measure per-request database connection overhead.
+
+Simulates the request lifecycle (``request_started`` -> query ->
+``request_finished``) with connection-per-request (``CONN_MAX_AGE=0``) and
+with persistent connections, and reports the cost of each.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+
+class Command(BaseCommand):
+    help = 'Benchmark connection-per-request against persistent database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Simulated requests per mode')
+        parser.add_argument('--database', default='default', help='Database alias to benchmark')
+        parser.add_argument('--max-age', type=int, default=60, help='CONN_MAX_AGE for the persistent run')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        requests = options['requests']
+        connection = connections[alias]
+        original_max_age = connection.settings_dict['CONN_MAX_AGE']
+
+        self.stdout.write(f"Database: {alias} ({connection.vendor}), {requests} simulated requests per mode")
+        try:
+            results = {
+                'per-request (CONN_MAX_AGE=0)': self._run(connection, requests, 0),
+                f"persistent (CONN_MAX_AGE={options['max_age']})": self._run(
+                    connection, requests, options['max_age']
+                ),
+            }
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original_max_age
+
+        baseline = None
+        for label, (elapsed, connects) in results.items():
+            per_request_ms = elapsed / requests * 1000
+            line = f"{label:<32} {per_request_ms:8.3f} ms/request  {connects:5d} connects"
+            if baseline is None:
+                baseline = per_request_ms
+            elif per_request_ms:
+                line += f"  ({baseline / per_request_ms:.1f}x faster)"
+            self.stdout.write(line)
+
+    def _run(self, connection, requests, max_age):
+        """Run the simulated request loop and return (seconds, connections opened)."""
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        connects = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            close_old_connections()
+            if connection.connection is None:
+                connects += 1
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            close_old_connections()
+        return time.perf_counter() - start, connects
@@ -0,0 +1,158 @@
+"""
+Management command to compare gunicorn worker models: memory per worker and throughput per core.
+"""
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+BACKEND_DIR = Path(__file__).resolve().parents[4]
+CONFIG_FILE = BACKEND_DIR / 'config' / 'gunicorn.conf.py'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark gunicorn: RSS/USS/PSS per worker and requests per second per CPU core'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--worker-class', action='append', dest='worker_classes',
+            help='gthread, gevent or uvicorn (repeatable; default gthread)',
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--concurrency', type=int, default=16, help='Client threads')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per run')
+        parser.add_argument('--path', default='/livez')
+        parser.add_argument('--compare-preload', action='store_true', help='Also run each class without --preload')
+
+    def handle(self, *args, **options):
+        try:
+            import psutil
+        except ImportError:
+            raise CommandError('psutil is required to measure worker memory')
+
+        runs = []
+        for worker_class in options['worker_classes'] or ['gthread']:
+            runs.append((worker_class, True))
+            if options['compare_preload']:
+                runs.append((worker_class, False))
+
+        self.stdout.write(
+            f"{'worker class':<14}{'preload':<9}{'RSS MB':>9}{'USS MB':>9}{'PSS MB':>9}{'req/s':>10}{'req/s/core':>12}"
+        )
+        for worker_class, preload in runs:
+            result = self._run(psutil, worker_class, preload, options)
+            self.stdout.write(
+                f"{worker_class:<14}{str(preload):<9}{result['rss']:>9.1f}{result['uss']:>9.1f}"
+                f"{result['pss']:>9.1f}{result['rps']:>10.0f}{result['rps_per_core']:>12.0f}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Memory is the mean per worker; req/s/core divides requests by worker CPU seconds used.'
+        ))
+
+    def _run(self, psutil, worker_class, preload, options):
+        port = self._free_port()
+        env = {
+            **os.environ,
+            'GUNICORN_WORKER_CLASS': worker_class,
+            'GUNICORN_WORKERS': str(options['workers']),
+            'GUNICORN_PRELOAD': str(preload),
+            'GUNICORN_BIND': f'127.0.0.1:{port}',
+            'GUNICORN_MAX_REQUESTS': '0',
+            'LOG_LEVEL': 'warning',
+        }
+        # A file rather than a pipe, so a chatty server never blocks on a full buffer
+        log = tempfile.TemporaryFile()
+        master = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', str(CONFIG_FILE)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+        )
+        try:
+            workers = self._wait_for_workers(psutil, master, log, port, options)
+            cpu_before = sum(sum(w.cpu_times()[:2]) for w in workers)
+            requests = self._load(port, options)
+            cpu_used = sum(sum(w.cpu_times()[:2]) for w in workers) - cpu_before
+            memory = [w.memory_full_info() for w in workers]
+        finally:
+            master.send_signal(signal.SIGTERM)
+            try:
+                master.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                master.kill()
+            log.close()
+
+        mb = 1024 * 1024
+        return {
+            'rss': sum(m.rss for m in memory) / len(memory) / mb,
+            'uss': sum(m.uss for m in memory) / len(memory) / mb,
+            'pss': sum(getattr(m, 'pss', 0) for m in memory) / len(memory) / mb,
+            'rps': requests / options['duration'],
+            'rps_per_core': requests / cpu_used if cpu_used else 0.0,
+        }
+
+    def _wait_for_workers(self, psutil, master, log, port, options, deadline=60):
+        start = time.monotonic()
+        while time.monotonic() - start < deadline:
+            if master.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'gunicorn exited: {log.read().decode()[-500:]}')
+            workers = psutil.Process(master.pid).children()
+            if len(workers) == options['workers'] and self._request(port, options['path']):
+                # Touch every worker once so memory reflects a serving process
+                for _ in range(options['workers'] * 4):
+                    self._request(port, options['path'])
+                return workers
+            time.sleep(0.2)
+        raise CommandError('gunicorn did not become ready')
+
+    @staticmethod
+    def _request(port, path):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', path, headers={'Host': 'localhost'})
+            ok = conn.getresponse().status == 200
+            conn.close()
+            return ok
+        except OSError:
+            return False
+
+    @staticmethod
+    def _load(port, options):
+        stop = time.monotonic() + options['duration']
+        counts = [0] * options['concurrency']
+
+        def client(index):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            while time.monotonic() < stop:
+                try:
+                    conn.request('GET', options['path'], headers={'Host': 'localhost'})
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        counts[index] += 1
+                    if response.getheader('Connection', '').lower() == 'close':
+                        conn.close()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.close()
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(counts)
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
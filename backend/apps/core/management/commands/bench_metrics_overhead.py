@@ -0,0 +1,49 @@
+"""
+Management command to measure the per-request cost of MetricsMiddleware.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from apps.core import metrics
+from apps.core.middleware import MetricsMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the overhead MetricsMiddleware adds to each request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Requests per run')
+        parser.add_argument('--path', default='/livez', help='Path used to label the requests')
+
+    def handle(self, *args, **options):
+        if not metrics.PROMETHEUS_AVAILABLE:
+            raise CommandError('prometheus_client is not installed')
+        requests = options['requests']
+        match = resolve(options['path'])
+        factory = RequestFactory()
+
+        def view(request):
+            request.resolver_match = match
+            return HttpResponse()
+
+        instrumented = MetricsMiddleware(view)
+        bare = self._run(view, factory, options['path'], requests)
+        with_metrics = self._run(instrumented, factory, options['path'], requests)
+
+        overhead_us = (with_metrics - bare) / requests * 1e6
+        self.stdout.write(f"bare handler:       {bare / requests * 1e6:8.2f} us/request")
+        self.stdout.write(f"with metrics:       {with_metrics / requests * 1e6:8.2f} us/request")
+        self.stdout.write(self.style.SUCCESS(f"middleware overhead {overhead_us:8.2f} us/request"))
+
+    @staticmethod
+    def _run(handler, factory, path, requests):
+        request = factory.get(path)
+        handler(request)  # warm up label children
+        start = time.perf_counter()
+        for _ in range(requests):
+            handler(request)
+        return time.perf_counter() - start
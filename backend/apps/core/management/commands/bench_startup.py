@@ -0,0 +1,80 @@
+"""
+Management command to measure process startup: import cost and time to first request.
+"""
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+BACKEND_DIR = Path(__file__).resolve().parents[4]
+
+# Runs in a fresh interpreter, the way a gunicorn worker boots
+FIRST_REQUEST_SCRIPT = '''
+import io, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+loaded = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+status = []
+b''.join(application(environ, lambda s, h, exc_info=None: status.append(s)))
+done = time.perf_counter()
+print(loaded - start, done - start, status[0])
+'''
+
+
+class Command(BaseCommand):
+    help = 'Benchmark interpreter startup: -X importtime breakdown and time to first request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes to time')
+        parser.add_argument('--path', default='/livez', help='Path of the first request')
+        parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings')}
+
+        loads, firsts = [], []
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-c', FIRST_REQUEST_SCRIPT, options['path']],
+                cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr else 'startup failed')
+            load, first, status = result.stdout.strip().splitlines()[-1].split(' ', 2)
+            loads.append(float(load))
+            firsts.append(float(first))
+
+        self.stdout.write(f"app loaded (median of {options['runs']}):   {statistics.median(loads) * 1000:8.1f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"first request {options['path']} ({status}): {statistics.median(firsts) * 1000:8.1f} ms"
+        ))
+
+        self.stdout.write("\nSlowest imports (cumulative, from python -X importtime):")
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', FIRST_REQUEST_SCRIPT, options['path']],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+        )
+        for cumulative, module in self._slowest_imports(result.stderr, options['top']):
+            self.stdout.write(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    @staticmethod
+    def _slowest_imports(stderr, top):
+        """Parse ``-X importtime`` output into the ``top`` (cumulative us, module) pairs."""
+        rows = []
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, module = line.split(':', 1)[1].split('|')
+            rows.append((int(cumulative_us), module.rstrip()))
+        rows.sort(reverse=True)
+        return rows[:top]
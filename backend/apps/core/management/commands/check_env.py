@@ -2,7 +2,7 @@
 Management command to verify environment configuration.
 """
 from django.core.management.base import BaseCommand
-from core.env_utils import get_env_variable, get_boolean_env, get_int_env, get_list_env
+from apps.core.env_utils import get_env_variable, get_boolean_env, get_int_env, get_list_env
 
 class Command(BaseCommand):
     help = 'Verify that all required environment variables are properly configured'
@@ -20,7 +20,7 @@ class Command(BaseCommand):
         # Test optional variables with defaults
         self.check_optional('DEBUG', 'bool', get_boolean_env('DEBUG', False))
         self.check_optional('EMAIL_PORT', 'int', get_int_env('EMAIL_PORT', 587))
-        self.check_optional('ALLOWED_HOSTS', 'list', get_list_env('ALLOWED_HOSTS', ['localhost', '127.0.0.1']))
+        self.check_optional('ALLOWED_HOSTS', 'list', get_list_env('ALLOWED_HOSTS', default=['localhost', '127.0.0.1']))
         
         self.stdout.write(self.style.SUCCESS('\nEnvironment configuration check completed!'))
     
@@ -42,6 +42,13 @@ class Command(BaseCommand):
     
     def check_database_config(self):
         """Check database configuration."""
+        from django.conf import settings
+        for alias, config in settings.DATABASES.items():
+            self.stdout.write(
+                f"  {alias}: {config['ENGINE'].rsplit('.', 1)[-1]} "
+                f"(CONN_MAX_AGE={config.get('CONN_MAX_AGE', 0)}, "
+                f"pool={'pool' in config.get('OPTIONS', {})})"
+            )
         try:
             from django.db import connection
             with connection.cursor() as cursor:
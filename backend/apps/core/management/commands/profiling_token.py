@@ -0,0 +1,21 @@
+"""
+Management command to mint a signed X-Profile header for request profiling.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.core.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile header value that profiles the requests it is sent with'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', default='manual', help='Free-form label recorded in the token')
+
+    def handle(self, *args, **options):
+        token = make_profile_token(options['label'])
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            self.stderr.write(self.style.WARNING('PROFILING_ENABLED is off; the header will be ignored'))
+        self.stdout.write(f'X-Profile: {token}')
+        self.stdout.write(f"Valid for {getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)} seconds")
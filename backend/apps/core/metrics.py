@@ -0,0 +1,165 @@
+"""
+Prometheus metrics for the Ripple Fox platform.
+
+Metrics are recorded with ``prometheus_client`` when it is installed and are
+no-ops otherwise. Under gunicorn, set ``PROMETHEUS_MULTIPROC_DIR`` to an
+empty, writable directory before the server starts so every worker writes
+its samples there and ``/metrics`` aggregates all of them.
+"""
+import logging
+import os
+import sys
+import time
+from contextlib import ContextDecorator
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class _NoopMetric:
+    """Stand-in used when prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    REQUEST_LATENCY = Histogram(
+        'ripplefox_http_request_duration_seconds',
+        'Request latency by view',
+        ['view', 'method'],
+        buckets=LATENCY_BUCKETS,
+    )
+    REQUESTS = Counter(
+        'ripplefox_http_requests_total',
+        'Requests by view and status class',
+        ['view', 'method', 'status'],
+    )
+    REQUEST_QUERIES = Histogram(
+        'ripplefox_http_request_db_queries',
+        'Database queries issued per request',
+        ['view'],
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+    OPERATION_LATENCY = Histogram(
+        'ripplefox_operation_duration_seconds',
+        'Latency of instrumented hot-path operations',
+        ['operation'],
+        buckets=LATENCY_BUCKETS,
+    )
+    CACHE_LOOKUPS = Counter(
+        'ripplefox_cache_lookups_total',
+        'Application cache lookups by cache name and result',
+        ['cache', 'result'],
+    )
+    CELERY_TASK_LATENCY = Histogram(
+        'ripplefox_celery_task_duration_seconds',
+        'Celery task run time by task and final state',
+        ['task', 'state'],
+        buckets=LATENCY_BUCKETS + (30.0, 60.0, 300.0),
+    )
+else:
+    REQUEST_LATENCY = REQUESTS = REQUEST_QUERIES = _NoopMetric()
+    OPERATION_LATENCY = CACHE_LOOKUPS = CELERY_TASK_LATENCY = _NoopMetric()
+
+
+class timed(ContextDecorator):
+    """
+    Record the duration of an operation in ``OPERATION_LATENCY``.
+
+    Usable as a context manager or decorator::
+
+        with timed('jwt_issue'):
+            refresh = RefreshToken.for_user(user)
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self._start = None
+
+    def _recreate_cm(self):
+        return type(self)(self.operation)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        OPERATION_LATENCY.labels(self.operation).observe(time.perf_counter() - self._start)
+        return False
+
+
+def record_cache_lookup(cache_name, hit):
+    """Count a hit or miss for an application-level cache."""
+    CACHE_LOOKUPS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+        tuple: ``(payload bytes, content type)``
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Drop a dead worker's live-gauge files (call from gunicorn's child_exit)."""
+    if PROMETHEUS_AVAILABLE and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+_celery_task_starts = {}
+
+
+def _task_prerun(task_id=None, **kwargs):
+    _celery_task_starts[task_id] = time.perf_counter()
+
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    start = _celery_task_starts.pop(task_id, None)
+    if start is not None and task is not None:
+        CELERY_TASK_LATENCY.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - start)
+
+
+def connect_celery_signals():
+    """Time every Celery task run in this process.
+
+    Only Celery workers run tasks, and they import celery before Django is
+    set up, so web processes skip this rather than paying for the import.
+    """
+    if 'celery' not in sys.modules:
+        return
+    try:
+        from celery.signals import task_postrun, task_prerun
+    except ImportError:
+        return
+    task_prerun.connect(_task_prerun, weak=False, dispatch_uid='ripplefox-metrics-prerun')
+    task_postrun.connect(_task_postrun, weak=False, dispatch_uid='ripplefox-metrics-postrun')
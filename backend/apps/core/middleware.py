@@ -0,0 +1,107 @@
+"""Middleware for the core app."""
+
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+from .db_routers import request_scope
+
+REPLICA_PIN_COOKIE = 'rf_primary_pin'
+
+
+class ReplicaPinningMiddleware:
+    """
+    Give each client read-your-writes consistency across replica routing.
+
+    When a request writes to the database, the response sets a short-lived
+    cookie holding the time until which the client stays pinned. Requests
+    carrying an unexpired pin read from the primary even inside
+    ``use_replica`` blocks, so a user never sees a replica that has not yet
+    caught up with their own change.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_scope(pinned=self._has_active_pin(request)) as state:
+            response = self.get_response(request)
+        if state['wrote']:
+            pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(
+                REPLICA_PIN_COOKIE,
+                str(int(time.time()) + pin_seconds),
+                max_age=pin_seconds,
+                httponly=True,
+                samesite='Lax',
+                secure=request.is_secure(),
+            )
+        return response
+
+    @staticmethod
+    def _has_active_pin(request):
+        try:
+            return int(request.COOKIES.get(REPLICA_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+
+class _QueryCounter:
+    """``execute_wrapper`` callable that counts queries on a connection."""
+
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Record per-view latency, status and database query counts.
+
+    Views are labelled by their URL route pattern (not the concrete path)
+    to keep label cardinality bounded. Labelled children are cached so the
+    hot path is a dict lookup plus three observations.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.PROMETHEUS_AVAILABLE:
+            raise MiddlewareNotUsed('prometheus_client is not installed')
+        self.get_response = get_response
+        self._children = {}
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        wrapped = [connection.execute_wrappers for connection in connections.all()]
+        for wrappers in wrapped:
+            wrappers.append(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            for wrappers in wrapped:
+                wrappers.remove(counter)
+
+        match = request.resolver_match
+        view = match.route if match is not None else '<unresolved>'
+        key = (view, request.method, response.status_code // 100)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (
+                metrics.REQUEST_LATENCY.labels(view, request.method),
+                metrics.REQUESTS.labels(view, request.method, f'{key[2]}xx'),
+                metrics.REQUEST_QUERIES.labels(view),
+            )
+        latency, requests, queries = children
+        latency.observe(duration)
+        requests.inc()
+        queries.observe(counter.count)
+        return response
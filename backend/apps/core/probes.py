@@ -0,0 +1,160 @@
+"""
+Dependency checks for the readiness probe.
+
+Each check runs on a shared thread pool so the database, cache and broker
+are probed concurrently, and the probe answers within ``READINESS_TIMEOUT``
+even if a dependency hangs. A pool thread cannot be interrupted, so every
+check also bounds its own I/O by the timeout, and a probe that finds a
+check still running from an earlier one waits on that run instead of
+starting another.
+"""
+import copy
+import logging
+import math
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='readiness')
+_running = {}
+_running_lock = threading.Lock()
+_local = threading.local()
+
+
+def _probe_connection(timeout):
+    """Return this pool thread's own connection to the default database, with timeouts bounded by ``timeout``.
+
+    The application's connection settings allow slow connects and queries;
+    the probe's connection must fail fast instead.
+    """
+    probe = getattr(_local, 'connection', None)
+    if probe is not None and probe.probe_timeout == timeout:
+        return probe
+    if probe is not None:
+        probe.close()
+    default = connections['default']
+    settings_dict = copy.deepcopy(default.settings_dict)
+    options = settings_dict.setdefault('OPTIONS', {})
+    options.pop('pool', None)
+    seconds = max(1, math.ceil(timeout))
+    if default.vendor == 'postgresql':
+        # libpq treats connect timeouts under 2 seconds as 2
+        options['connect_timeout'] = max(2, seconds)
+        options['options'] = f"{options.get('options', '')} -c statement_timeout={int(timeout * 1000)}".strip()
+    elif default.vendor == 'mysql':
+        options.update(connect_timeout=seconds, read_timeout=seconds)
+    elif default.vendor == 'sqlite':
+        options['timeout'] = timeout
+    probe = type(default)(settings_dict, alias=default.alias)
+    probe.probe_timeout = timeout
+    _local.connection = probe
+    return probe
+
+
+def check_database(timeout):
+    """Run ``SELECT 1`` on the default database, on a connection that gives up after ``timeout``."""
+    connection = _probe_connection(timeout)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Exception:
+        # Reconnect next time rather than reuse a connection in an unknown state
+        connection.close()
+        raise
+
+
+def check_cache(timeout):
+    """Round-trip a key through the default cache."""
+    cache.set('readiness-probe', 1, timeout=10)
+    if cache.get('readiness-probe') != 1:
+        raise RuntimeError('cache read-back failed')
+
+
+def check_broker(timeout):
+    """Ping the Celery broker (Redis PING, or a TCP connect for other brokers)."""
+    url = getattr(settings, 'CELERY_BROKER_URL', '')
+    if not url:
+        raise RuntimeError('CELERY_BROKER_URL is not set')
+    parsed = urlparse(url)
+    if parsed.scheme in ('redis', 'rediss'):
+        import redis
+        client = redis.Redis.from_url(url, socket_connect_timeout=timeout, socket_timeout=timeout)
+        try:
+            client.ping()
+        finally:
+            client.close()
+        return
+    default_ports = {'amqp': 5672, 'amqps': 5671}
+    port = parsed.port or default_ports.get(parsed.scheme, 5672)
+    socket.create_connection((parsed.hostname, port), timeout=timeout).close()
+
+
+CHECKS = {
+    'database': check_database,
+    'cache': check_cache,
+    'broker': check_broker,
+}
+
+
+def run_readiness_checks(names=None, timeout=None):
+    """Run the named dependency checks concurrently.
+
+    Args:
+        names: Check names from ``CHECKS``; defaults to ``settings.READINESS_CHECKS``
+        timeout: Overall deadline in seconds; defaults to ``settings.READINESS_TIMEOUT``
+
+    Returns:
+        tuple: ``(ready, results)`` where results maps each check name to a
+        dict with its ``status`` and ``duration_ms``
+    """
+    if names is None:
+        names = getattr(settings, 'READINESS_CHECKS', ['database', 'cache'])
+    if timeout is None:
+        timeout = getattr(settings, 'READINESS_TIMEOUT', 1.0)
+
+    start = time.perf_counter()
+    futures = {}
+    with _running_lock:
+        for name in names:
+            check = CHECKS.get(name)
+            if check is None:
+                logger.warning("Unknown readiness check: %s", name)
+                continue
+            future = _running.get(name)
+            if future is None or future.done():
+                future = _running[name] = _executor.submit(_timed, check, timeout)
+            # else still running for an earlier probe: wait on that run rather than tie up another worker
+            futures[future] = name
+    wait(futures, timeout=timeout)
+
+    results = {}
+    for future, name in futures.items():
+        if not future.done():
+            results[name] = {'status': 'timeout', 'duration_ms': round((time.perf_counter() - start) * 1000, 2)}
+            continue
+        duration, error = future.result()
+        result = {'status': 'ok' if error is None else 'error', 'duration_ms': round(duration * 1000, 2)}
+        if error is not None:
+            result['error'] = error
+        results[name] = result
+    ready = all(result['status'] == 'ok' for result in results.values())
+    return ready, results
+
+
+def _timed(check, timeout):
+    start = time.perf_counter()
+    try:
+        check(timeout)
+    except Exception as e:
+        logger.warning("Readiness check %s failed: %s", check.__name__, e)
+        return time.perf_counter() - start, str(e)
+    return time.perf_counter() - start, None
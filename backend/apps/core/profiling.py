@@ -0,0 +1,264 @@
+"""
+Opt-in request profiling.
+
+When ``PROFILING_ENABLED`` is set, :class:`ProfilingMiddleware` profiles a
+request if it carries a valid signed ``X-Profile`` header (see the
+``profiling_token`` management command) or is picked by
+``PROFILING_SAMPLE_RATE``. Each profiled request leaves two artifacts in
+``PROFILING_ARTIFACT_DIR`` (default ``PRIVATE_ROOT/profiles``, which the web
+server does not serve): the call profile (a pstats dump, or HTML when
+pyinstrument is installed) and a JSON report with the SQL query log and
+duplicate-query analysis. Both can be downloaded by superusers from the
+admin site. Query parameters (password hashes, tokens, emails) are never
+stored: the log keeps only a keyed fingerprint of them, enough to tell
+exact duplicates apart from queries that merely share a statement.
+
+When profiling is disabled the middleware removes itself at startup, so it
+costs nothing per request.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+    PYINSTRUMENT_AVAILABLE = True
+except ImportError:
+    PYINSTRUMENT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+SIGNING_SALT = 'ripplefox.profiling'
+ARTIFACT_NAME_RE = re.compile(r'^[\w.-]+\.(prof|html|json)$')
+
+# Per-process key for query parameter fingerprints, so stored fingerprints cannot be matched against guesses
+_PARAMS_KEY = secrets.token_bytes(16)
+
+
+def artifact_dir():
+    """Return the directory profiling artifacts are written to."""
+    return getattr(settings, 'PROFILING_ARTIFACT_DIR', None) or os.path.join(settings.PRIVATE_ROOT, 'profiles')
+
+
+def params_fingerprint(params):
+    """Return a keyed digest of query parameters: equal for equal parameters, revealing nothing of them."""
+    return hmac.new(_PARAMS_KEY, repr(params).encode(), hashlib.blake2b).hexdigest()[:16]
+
+
+def make_profile_token(label='manual'):
+    """Return a signed value for the ``X-Profile`` request header."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(label)
+
+
+def list_artifacts():
+    """List stored profiles, newest first.
+
+    Returns:
+        list: Dicts with the profile ``id``, report metadata and artifact file names
+    """
+    directory = artifact_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            'id': name[:-len('.json')],
+            'report_file': name,
+            'profile_file': report.get('profile_file'),
+            'path': report.get('path'),
+            'method': report.get('method'),
+            'status': report.get('status'),
+            'duration_ms': report.get('duration_ms'),
+            'query_count': report.get('query_count'),
+            'duplicate_queries': report.get('duplicate_query_count'),
+            'created_at': report.get('created_at'),
+        })
+    profiles.sort(key=lambda p: p['created_at'] or '', reverse=True)
+    return profiles
+
+
+def artifact_path(name):
+    """Return the absolute path of a stored artifact, or None if the name is invalid."""
+    if not ARTIFACT_NAME_RE.match(name):
+        return None
+    path = os.path.join(artifact_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+class _SQLRecorder:
+    """``execute_wrapper`` callable that logs every query with its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': params_fingerprint(params),
+                'many': many,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+    def analyse(self):
+        """Summarise exact duplicates and repeated statements (likely N+1)."""
+        exact = Counter((q['sql'], q['params']) for q in self.queries)
+        similar = Counter(q['sql'] for q in self.queries)
+        duplicates = [
+            {'sql': sql, 'params': params, 'count': count}
+            for (sql, params), count in exact.most_common() if count > 1
+        ]
+        repeated = [
+            {'sql': sql, 'count': count}
+            for sql, count in similar.most_common() if count > 1
+        ]
+        return duplicates, repeated
+
+
+class _CallProfiler:
+    """pyinstrument when installed, cProfile otherwise."""
+
+    def __init__(self):
+        self._profiler = PyinstrumentProfiler() if PYINSTRUMENT_AVAILABLE else cProfile.Profile()
+
+    def start(self):
+        if PYINSTRUMENT_AVAILABLE:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if PYINSTRUMENT_AVAILABLE:
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def save(self, directory, profile_id):
+        """Write the profile and return its file name."""
+        if PYINSTRUMENT_AVAILABLE:
+            name = f'{profile_id}.html'
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(self._profiler.output_html())
+        else:
+            name = f'{profile_id}.prof'
+            self._profiler.dump_stats(os.path.join(directory, name))
+        return name
+
+
+class ProfilingMiddleware:
+    """Profile selected requests and store the artifacts for later download."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed('Request profiling is disabled')
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.token_max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+        self.max_artifacts = getattr(settings, 'PROFILING_MAX_ARTIFACTS', 200)
+        self.signer = signing.TimestampSigner(salt=SIGNING_SALT)
+
+    def __call__(self, request):
+        if not self._should_profile(request):
+            return self.get_response(request)
+
+        profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        recorder = _SQLRecorder()
+        wrapped = [connection.execute_wrappers for connection in connections.all()]
+        for wrappers in wrapped:
+            wrappers.append(recorder)
+        profiler = _CallProfiler()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+            duration = time.perf_counter() - start
+            for wrappers in wrapped:
+                wrappers.remove(recorder)
+
+        try:
+            self._store(profile_id, request, response, profiler, recorder, duration)
+            response['X-Profile-Id'] = profile_id
+        except OSError as e:
+            logger.error("Could not store profile %s: %s", profile_id, e)
+        return response
+
+    def _should_profile(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token:
+            try:
+                self.signer.unsign(token, max_age=self.token_max_age)
+                return True
+            except signing.BadSignature:
+                logger.warning("Rejected invalid profiling token for %s", request.path)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _store(self, profile_id, request, response, profiler, recorder, duration):
+        directory = artifact_dir()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        profile_file = profiler.save(directory, profile_id)
+
+        duplicates, repeated = recorder.analyse()
+        report = {
+            'id': profile_id,
+            'created_at': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'profile_file': profile_file,
+            'query_count': len(recorder.queries),
+            'query_time_ms': round(sum(q['duration_ms'] for q in recorder.queries), 3),
+            'duplicate_query_count': sum(d['count'] - 1 for d in duplicates),
+            'duplicate_queries': duplicates,
+            'repeated_statements': repeated,
+            'queries': recorder.queries,
+        }
+        with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(
+            "Profiled %s %s in %.1f ms (%d queries, %d duplicates): %s",
+            request.method, request.path, report['duration_ms'],
+            report['query_count'], report['duplicate_query_count'], profile_id,
+        )
+        self._prune(directory)
+
+    def _prune(self, directory):
+        """Keep only the newest ``PROFILING_MAX_ARTIFACTS`` profiles."""
+        reports = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+        for name in reports[:-self.max_artifacts] if self.max_artifacts else []:
+            stem = name[:-len('.json')]
+            for suffix in ('.json', '.prof', '.html'):
+                try:
+                    os.remove(os.path.join(directory, stem + suffix))
+                except FileNotFoundError:
+                    pass
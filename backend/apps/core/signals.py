@@ -0,0 +1,29 @@
+"""Signals for the core app."""
+
+import logging
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Apply the configured SQLITE_PRAGMAS to each new SQLite connection.
+
+    Args:
+        sender: The database wrapper class.
+        connection: The new database connection wrapper.
+        **kwargs: Additional keyword arguments.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    logger.debug("Applied SQLite pragmas to %s", connection.alias)
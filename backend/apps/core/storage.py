@@ -0,0 +1,28 @@
+"""
+File storage for uploads that must not be publicly reachable.
+
+``MEDIA_ROOT`` is served as-is by the web server, so anything staff-only
+(settlement files and the like) is stored under ``PRIVATE_ROOT`` instead
+and only handed out by views that check permissions.
+"""
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class PrivateStorage(FileSystemStorage):
+    """File system storage under ``PRIVATE_ROOT``, read when used so settings overrides apply."""
+
+    @property
+    def base_location(self):
+        return settings.PRIVATE_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def private_storage():
+    """Return a storage rooted at ``PRIVATE_ROOT``; use as ``FileField(storage=private_storage)``."""
+    return PrivateStorage(file_permissions_mode=0o600, directory_permissions_mode=0o700)
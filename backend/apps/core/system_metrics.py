@@ -0,0 +1,142 @@
+"""
+Background sampler for host and process resource metrics.
+
+psutil calls such as ``cpu_percent(interval=1)`` block, and ``disk_usage``
+and ``virtual_memory`` hit /proc on every call. Instead of doing that work
+per request, a daemon thread samples everything every
+``SYSTEM_METRICS_INTERVAL`` seconds and request handlers read the latest
+in-memory snapshot.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_BYTES_PER_MB = 1024 * 1024
+_BYTES_PER_GB = 1024 ** 3
+
+
+class SystemMetricsSampler:
+    """
+    Periodically sample psutil metrics on a daemon thread.
+
+    The sampler starts lazily on first use and restarts itself after a fork,
+    so gunicorn's preloading master never owns the thread.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._snapshot = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._process = None
+        self._static = None
+
+    def get(self):
+        """Return the latest snapshot, starting the sampler if necessary.
+
+        Returns:
+            dict: The most recent metrics, or ``{'available': False}`` if
+            psutil is not installed.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        return self._snapshot
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop.set()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                import psutil
+            except ImportError:
+                self._snapshot = {'available': False}
+                self._pid = os.getpid()
+                return
+            self._process = psutil.Process()
+            # Prime the CPU counters; the first non-blocking reading is meaningless.
+            psutil.cpu_percent(interval=None)
+            self._process.cpu_percent(interval=None)
+            self._static = {
+                'cpu_cores': psutil.cpu_count(logical=False),
+                'cpu_threads': psutil.cpu_count(),
+                'boot_time': datetime.fromtimestamp(psutil.boot_time()).isoformat(),
+                'process_start_time': self._process.create_time(),
+            }
+            self._sample(psutil)
+            self._stop.clear()
+            self._pid = os.getpid()
+            thread = threading.Thread(
+                target=self._run, args=(psutil,), name='system-metrics-sampler', daemon=True
+            )
+            thread.start()
+
+    def _run(self, psutil):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample(psutil)
+            except Exception as e:
+                logger.warning("System metrics sampling failed: %s", e)
+
+    def _sample(self, psutil):
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        process_memory = self._process.memory_info()
+        now = time.time()
+        # Replace the whole dict so readers never see a half-written snapshot.
+        self._snapshot = {
+            'available': True,
+            'sampled_at': datetime.fromtimestamp(now).isoformat(),
+            'cpu': {
+                'cores': self._static['cpu_cores'],
+                'threads': self._static['cpu_threads'],
+                'usage_percent': psutil.cpu_percent(interval=None),
+            },
+            'memory': {
+                'total_gb': round(memory.total / _BYTES_PER_GB, 2),
+                'available_gb': round(memory.available / _BYTES_PER_GB, 2),
+                'used_gb': round(memory.used / _BYTES_PER_GB, 2),
+                'used_percent': memory.percent,
+            },
+            'disk': {
+                'total_gb': round(disk.total / _BYTES_PER_GB, 2),
+                'used_gb': round(disk.used / _BYTES_PER_GB, 2),
+                'free_gb': round(disk.free / _BYTES_PER_GB, 2),
+                'used_percent': disk.percent,
+            },
+            'process': {
+                'memory_used_mb': round(process_memory.rss / _BYTES_PER_MB, 2),
+                'cpu_percent': self._process.cpu_percent(interval=None),
+                'start_time': datetime.fromtimestamp(self._static['process_start_time']).isoformat(),
+                'uptime_seconds': int(now - self._static['process_start_time']),
+            },
+            'boot_time': self._static['boot_time'],
+        }
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_system_metrics():
+    """Return the latest cached system metrics snapshot.
+
+    Returns:
+        dict: Metrics sampled by the process-wide :class:`SystemMetricsSampler`
+    """
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = SystemMetricsSampler(getattr(settings, 'SYSTEM_METRICS_INTERVAL', 15.0))
+    return _sampler.get()
@@ -0,0 +1,418 @@
+"""
+Tests for the core app.
+"""
+import dataclasses
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from . import probes
+from .cache_utils import redis_client
+from .db_routers import PrimaryReplicaRouter, request_scope, use_replica
+from .env_utils import (
+    REPLICA_DATABASE_ALIAS, get_boolean_env, get_database_config, get_sqlite_pragmas, load_settings,
+    validate_environment,
+)
+from .idempotency import idempotent
+from .middleware import REPLICA_PIN_COOKIE, ReplicaPinningMiddleware
+from .profiling import ProfilingMiddleware, artifact_dir, make_profile_token
+from .warmup import warm_up
+
+User = get_user_model()
+
+
+class EnvironmentTestCase(TestCase):
+    """Test cases for the cached settings loader."""
+
+    def test_settings_are_loaded_once(self):
+        """Repeated loads return the same parsed object."""
+        self.assertIs(load_settings(), load_settings())
+
+    def test_production_requires_real_secret_and_hosts(self):
+        """With DEBUG off the development secret key and wildcard hosts are rejected."""
+        env = dataclasses.replace(load_settings(), debug=False, allowed_hosts=('*',))
+        with self.assertRaisesMessage(ImproperlyConfigured, 'SECRET_KEY'):
+            validate_environment(env)
+        validate_environment(dataclasses.replace(env, secret_key='s3cr3t' * 8, allowed_hosts=('api.example.com',)))
+
+
+@mock.patch.dict(os.environ, {
+    'DB_ENGINE': '', 'DB_SQLITE_PATH': '', 'DB_SQLITE_REPLICA_PATH': '', 'DB_REPLICA_HOST': '',
+})
+class DatabaseConfigTestCase(TestCase):
+    """Test cases for building DATABASES and the SQLite profile from the environment."""
+
+    def test_boolean_env(self):
+        """Unset and empty variables give the default; recognised words parse either way."""
+        with mock.patch.dict(os.environ, {'FLAG': ''}):
+            self.assertTrue(get_boolean_env('FLAG', True))
+            self.assertFalse(get_boolean_env('FLAG', False))
+        with mock.patch.dict(os.environ, {'FLAG': ' No '}):
+            self.assertFalse(get_boolean_env('FLAG', True))
+        with mock.patch.dict(os.environ, {'FLAG': 'yes'}):
+            self.assertTrue(get_boolean_env('FLAG', False))
+        with mock.patch.dict(os.environ, {'FLAG': 'maybe'}):
+            self.assertTrue(get_boolean_env('FLAG', True))
+        os.environ.pop('FLAG', None)
+        self.assertTrue(get_boolean_env('FLAG', True))
+
+    def test_sqlite(self):
+        """SQLite is the default; relative paths resolve against the base directory."""
+        databases = get_database_config('/srv/app')
+        self.assertEqual(list(databases), ['default'])
+        self.assertEqual(databases['default']['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(databases['default']['NAME'], '/srv/app/db.sqlite3')
+        with mock.patch.dict(os.environ, {'DB_SQLITE_PATH': '/data/main.db', 'DB_SQLITE_REPLICA_PATH': 'copy.db'}):
+            databases = get_database_config('/srv/app')
+        self.assertEqual(databases['default']['NAME'], '/data/main.db')
+        self.assertEqual(databases[REPLICA_DATABASE_ALIAS]['NAME'], '/srv/app/copy.db')
+        self.assertEqual(databases[REPLICA_DATABASE_ALIAS]['TEST'], {'MIRROR': 'default'})
+
+    def test_postgres(self):
+        """PostgreSQL connections persist and are health-checked; a replica host adds a mirrored alias."""
+        environ = {
+            'DB_ENGINE': 'postgresql', 'DB_NAME': 'ripple', 'DB_HOST': 'db', 'DB_PORT': '6432',
+            'DB_CONN_MAX_AGE': '120', 'DB_CONNECT_TIMEOUT': '3', 'DB_CONN_HEALTH_CHECKS': '', 'DB_POOL': 'True',
+        }
+        with mock.patch.dict(os.environ, environ), mock.patch(
+            'apps.core.env_utils.psycopg_pool_supported', return_value=False
+        ):
+            databases = get_database_config('/srv/app')
+            self.assertEqual(list(databases), ['default'])
+            with mock.patch.dict(os.environ, {'DB_REPLICA_HOST': 'db-replica', 'DB_REPLICA_PORT': ''}):
+                replica = get_database_config('/srv/app')[REPLICA_DATABASE_ALIAS]
+        default = databases['default']
+        self.assertEqual(default['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((default['NAME'], default['HOST'], default['PORT']), ('ripple', 'db', '6432'))
+        self.assertEqual(default['CONN_MAX_AGE'], 120)
+        self.assertTrue(default['CONN_HEALTH_CHECKS'])
+        # Without psycopg 3 and Django 5.1 the pool falls back to persistent connections
+        self.assertEqual(default['OPTIONS'], {'connect_timeout': 3})
+        self.assertEqual((replica['HOST'], replica['PORT']), ('db-replica', '6432'))
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+
+    def test_pool_and_unknown_engine(self):
+        """The native pool turns persistent connections off; an unknown engine is refused."""
+        with mock.patch.dict(os.environ, {'DB_ENGINE': 'postgres', 'DB_POOL': '1', 'DB_POOL_MAX_SIZE': '20'}), \
+                mock.patch('apps.core.env_utils.psycopg_pool_supported', return_value=True):
+            default = get_database_config('/srv/app')['default']
+        self.assertEqual(default['CONN_MAX_AGE'], 0)
+        self.assertEqual(default['OPTIONS']['pool']['max_size'], 20)
+        with mock.patch.dict(os.environ, {'DB_ENGINE': 'mysql'}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'DB_ENGINE'):
+                get_database_config('/srv/app')
+
+    def test_sqlite_pragmas(self):
+        """The WAL profile is applied only when asked for."""
+        with mock.patch.dict(os.environ, {'DB_SQLITE_WAL': ''}):
+            self.assertEqual(get_sqlite_pragmas(), {})
+        with mock.patch.dict(os.environ, {'DB_SQLITE_WAL': 'true', 'DB_CONNECT_TIMEOUT': '7'}):
+            pragmas = get_sqlite_pragmas()
+        self.assertEqual(pragmas['journal_mode'], 'WAL')
+        self.assertEqual(pragmas['synchronous'], 'NORMAL')
+        self.assertEqual(pragmas['busy_timeout'], '7000')
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test cases for replica read routing."""
+
+    def setUp(self):
+        """Set up a router that sees a configured, up-to-date replica."""
+        for target, value in (('replica_configured', True), ('replica_lag', 0.0)):
+            patcher = mock.patch(f'apps.core.db_routers.{target}', return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_use_primary_by_default(self):
+        """Reads outside use_replica() are not routed."""
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_reads_use_replica_when_opted_in(self):
+        """Reads inside use_replica() go to a fresh replica."""
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+
+    def test_stale_replica_falls_back_to_primary(self):
+        """Reads go to the primary when replica lag exceeds the bound."""
+        with mock.patch('apps.core.db_routers.replica_lag', return_value=30.0):
+            with use_replica(max_lag=5):
+                self.assertIsNone(self.router.db_for_read(User))
+            with use_replica(max_lag=60):
+                self.assertEqual(self.router.db_for_read(User), 'replica')
+
+    def test_write_pins_request_to_primary(self):
+        """Reads after a write in the same request go to the primary."""
+        with request_scope():
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(User), 'replica')
+                self.router.db_for_write(User)
+                self.assertIsNone(self.router.db_for_read(User))
+
+    def test_middleware_pins_client_after_write(self):
+        """A write sets the pin cookie and the next request reads the primary."""
+        def write_view(request):
+            self.router.db_for_write(User)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(write_view)(self.factory.post('/'))
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+
+        def read_view(request):
+            with use_replica():
+                return HttpResponse(self.router.db_for_read(User) or 'default')
+
+        request = self.factory.get('/')
+        request.COOKIES[REPLICA_PIN_COOKIE] = response.cookies[REPLICA_PIN_COOKIE].value
+        self.assertEqual(ReplicaPinningMiddleware(read_view)(request).content, b'default')
+        self.assertEqual(ReplicaPinningMiddleware(read_view)(self.factory.get('/')).content, b'replica')
+
+
+class ProbeTestCase(TestCase):
+    """Test cases for the liveness, readiness and health endpoints."""
+
+    def test_liveness(self):
+        """Liveness answers without touching the database."""
+        with self.assertNumQueries(0):
+            response = self.client.get('/livez')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_readiness(self):
+        """Readiness reports every configured dependency check."""
+        with self.settings(READINESS_CHECKS=['database', 'cache']):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['checks']), {'database', 'cache'})
+
+    def test_readiness_reports_failures(self):
+        """A failing dependency makes the service unready."""
+        with self.settings(READINESS_CHECKS=['broker'], CELERY_BROKER_URL=''):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['broker']['status'], 'error')
+
+    def test_hung_check_holds_one_worker(self):
+        """A check that hangs times out, and later probes wait on the same run instead of starting more."""
+        released, calls = threading.Event(), []
+
+        def hang(timeout):
+            calls.append(timeout)
+            released.wait(5)
+
+        with mock.patch.dict(probes.CHECKS, {'hang': hang}):
+            for _ in range(3):
+                ready, results = probes.run_readiness_checks(['hang'], timeout=0.05)
+                self.assertFalse(ready)
+                self.assertEqual(results['hang']['status'], 'timeout')
+            released.set()
+            probes._running['hang'].result(timeout=5)
+            self.assertTrue(probes.run_readiness_checks(['hang'], timeout=1)[0])
+        self.assertEqual(len(calls), 2)
+
+    def test_database_check_has_own_timeout(self):
+        """The database check uses a connection of its own, bounded by the probe timeout."""
+        probes.check_database(0.5)
+        probe = probes._local.connection
+        self.assertIsNot(probe, connections['default'])
+        self.assertEqual(probe.settings_dict['OPTIONS']['timeout'], 0.5)
+        self.assertEqual(connections['default'].settings_dict['OPTIONS'].get('timeout'), 20)
+        probe.close()
+
+    def test_health_uses_sampled_metrics(self):
+        """The health endpoint serves resource metrics from the sampler."""
+        response = self.client.get('/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['dependencies']['database'], 'connected')
+        self.assertIn('resources', response.json())
+
+
+class MetricsTestCase(TestCase):
+    """Test cases for the Prometheus metrics endpoint."""
+
+    def test_metrics_include_request_latency(self):
+        """Requests handled by MetricsMiddleware show up in /metrics."""
+        self.client.get('/livez')
+        with self.settings(DEBUG=True):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'ripplefox_http_request_duration_seconds_bucket', response.content)
+        self.assertIn(b'view="livez"', response.content)
+
+    def test_metrics_token_required_when_configured(self):
+        """A configured METRICS_TOKEN must be presented as a bearer token; without one only DEBUG serves it."""
+        with self.settings(METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(response.status_code, 200)
+
+
+class ProfilingTestCase(TestCase):
+    """Test cases for the opt-in request profiler."""
+
+    def setUp(self):
+        self.artifact_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.artifact_dir, ignore_errors=True)
+        self.factory = RequestFactory()
+
+    def _view(self, request):
+        """Issue the same query twice so the duplicate shows up in the report."""
+        list(User.objects.filter(email='nobody@example.com'))
+        list(User.objects.filter(email='nobody@example.com'))
+        return HttpResponse('ok')
+
+    def test_disabled_middleware_is_removed(self):
+        """With profiling off the middleware drops out of the stack."""
+        with self.settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(self._view)
+
+    def test_signed_header_profiles_request(self):
+        """A valid X-Profile header stores a profile and an SQL report with duplicates."""
+        with self.settings(PROFILING_ENABLED=True, PROFILING_ARTIFACT_DIR=self.artifact_dir):
+            middleware = ProfilingMiddleware(self._view)
+            request = self.factory.get('/slow/', HTTP_X_PROFILE=make_profile_token('test'))
+            response = middleware(request)
+
+        profile_id = response['X-Profile-Id']
+        with open(os.path.join(self.artifact_dir, f'{profile_id}.json')) as f:
+            report = json.load(f)
+        self.assertEqual(report['path'], '/slow/')
+        self.assertEqual(report['query_count'], 2)
+        self.assertEqual(report['duplicate_query_count'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.artifact_dir, report['profile_file'])))
+        # Parameter values are never written out
+        with open(os.path.join(self.artifact_dir, f'{profile_id}.json')) as f:
+            self.assertNotIn('nobody@example.com', f.read())
+
+    def test_artifacts_are_not_public(self):
+        """By default profiles go under PRIVATE_ROOT, outside the served media directory."""
+        with self.settings(PROFILING_ARTIFACT_DIR='', PRIVATE_ROOT='/srv/private', MEDIA_ROOT='/srv/media'):
+            self.assertEqual(artifact_dir(), '/srv/private/profiles')
+
+    def test_forged_header_is_ignored(self):
+        """An unsigned header does not trigger profiling."""
+        with self.settings(PROFILING_ENABLED=True, PROFILING_ARTIFACT_DIR=self.artifact_dir):
+            middleware = ProfilingMiddleware(self._view)
+            response = middleware(self.factory.get('/slow/', HTTP_X_PROFILE='manual:forged'))
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.artifact_dir), [])
+
+    def test_admin_lists_and_serves_profiles(self):
+        """Superusers can browse and download stored profiles."""
+        with self.settings(PROFILING_ENABLED=True, PROFILING_ARTIFACT_DIR=self.artifact_dir):
+            middleware = ProfilingMiddleware(self._view)
+            profile_id = middleware(self.factory.get('/slow/', HTTP_X_PROFILE=make_profile_token()))['X-Profile-Id']
+            admin = User.objects.create_superuser(email='admin@example.com', password='pass12345')
+            self.client.force_login(admin)
+            listing = self.client.get('/admin/profiles/')
+            download = self.client.get(f'/admin/profiles/{profile_id}.json/')
+        self.assertContains(listing, '/slow/')
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(self.client.get('/admin/profiles/..%2Fsecret.json/').status_code, 404)
+
+
+class WarmupTestCase(TestCase):
+    """Test cases for the pre-fork warm-up."""
+
+    def test_warm_up_builds_resolver_and_templates(self):
+        """Warm-up populates the URL resolver, template cache and content types."""
+        results = warm_up()
+        self.assertGreater(results['url_resolver']['count'], 0)
+        self.assertGreater(results['templates']['count'], 0)
+        self.assertGreater(results['content_types']['count'], 0)
+
+
+class IdempotencyTestCase(TestCase):
+    """Test cases for Idempotency-Key handling."""
+
+    class CountingView(APIView):
+        authentication_classes = []
+        permission_classes = [AllowAny]
+        calls = 0
+
+        @idempotent
+        def post(self, request):
+            type(self).calls += 1
+            status_code = 500 if request.data.get('fail') else 201
+            return Response({'call': type(self).calls}, status=status_code, headers={'Location': '/thing/1/'})
+
+    def setUp(self):
+        cache.clear()
+        self.CountingView.calls = 0
+        self.view = self.CountingView.as_view()
+        self.factory = APIRequestFactory()
+
+    def _post(self, data, key='abc'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.view(self.factory.post('/things/', data, format='json', **headers))
+
+    def test_repeat_is_replayed(self):
+        """The second request gets the stored response and the view runs once."""
+        first = self._post({'name': 'x'})
+        second = self._post({'name': 'x'})
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Location'], '/thing/1/')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.CountingView.calls, 1)
+
+    def test_without_key_view_always_runs(self):
+        """Requests without the header are not deduplicated."""
+        self._post({'name': 'x'}, key=None)
+        self._post({'name': 'x'}, key=None)
+        self.assertEqual(self.CountingView.calls, 2)
+
+    def test_key_reused_with_other_body(self):
+        """Reusing a key for a different request is rejected."""
+        self._post({'name': 'x'})
+        self.assertEqual(self._post({'name': 'y'}).status_code, 422)
+
+    def test_in_flight_request_conflicts(self):
+        """A repeat while the first still holds the key gets 409."""
+        with mock.patch.object(cache, 'add', return_value=False):
+            response = self._post({'name': 'x'})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.CountingView.calls, 0)
+
+    def test_server_errors_are_not_stored(self):
+        """A 5xx can be retried with the same key."""
+        self._post({'fail': True})
+        self._post({'fail': True})
+        self.assertEqual(self.CountingView.calls, 2)
+
+
+class CacheUtilsTestCase(TestCase):
+    """Test cases for direct Redis access."""
+
+    def test_redis_client_follows_default_cache(self):
+        """No client for local memory; one shared client for the Redis cache's first server."""
+        self.assertIsNone(redis_client())
+        redis_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://cache.invalid:6390/2,redis://replica.invalid:6390/2',
+            'OPTIONS': {'socket_timeout': 2},
+        }}
+        with override_settings(CACHES=redis_cache):
+            client = redis_client()
+            self.assertIs(redis_client(), client)
+        kwargs = client.connection_pool.connection_kwargs
+        self.assertEqual((kwargs['host'], kwargs['port'], kwargs['db']), ('cache.invalid', 6390, 2))
@@ -8,8 +8,10 @@ from . import views
 app_name = 'core'
 
 urlpatterns = [
-    # Health check endpoint
+    # Health check endpoints
     path('health/', views.health_check, name='health-check'),
+    path('livez/', views.liveness, name='livez'),
+    path('readyz/', views.readiness, name='readyz'),
     
     # System information endpoint (protected)
     path('system-info/', views.system_info, name='system-info'),
@@ -4,28 +4,101 @@ import platform
 import socket
 from datetime import datetime
 
-try:
-    import psutil
-    PSU_AVAILABLE = True
-except ImportError:
-    PSU_AVAILABLE = False
-
 import django
 from django.conf import settings
 from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
+from . import metrics
+from .probes import run_readiness_checks
+from .system_metrics import get_system_metrics
+
+# Static for the life of the process, so computed once at import
+_PLATFORM_INFO = {
+    'python': platform.python_version(),
+    'os': platform.platform(),
+    'os_name': platform.system(),
+    'os_version': platform.release(),
+    'hostname': socket.gethostname(),
+}
+
+
+@never_cache
+def liveness(request):
+    """Liveness probe: the process is up and serving requests.
+
+    Performs no I/O, so it stays cheap under any load and never fails
+    because of a downstream dependency.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        JsonResponse: ``{"status": "ok"}``
+    """
+    return JsonResponse({'status': 'ok'})
+
+
+@never_cache
+def readiness(request):
+    """Readiness probe: the database, cache and broker are reachable.
+
+    Checks run concurrently with a deadline of ``READINESS_TIMEOUT`` seconds.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        JsonResponse: Per-check results; 503 if any check failed
+    """
+    ready, checks = run_readiness_checks()
+    return JsonResponse(
+        {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+        status=200 if ready else 503,
+    )
+
+
+@never_cache
+def metrics_view(request):
+    """Expose Prometheus metrics, aggregated across gunicorn workers.
+
+    If ``METRICS_TOKEN`` is set, the scraper must send it as a bearer token.
+    Without one the endpoint only exists when ``DEBUG`` is on.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        HttpResponse: Metrics in the Prometheus text format
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=404)
+    if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return HttpResponse('prometheus_client is not installed', status=503, content_type='text/plain')
+    payload, content_type = metrics.render_metrics()
+    return HttpResponse(payload, content_type=content_type)
+
+
 class HealthCheckView(APIView):
     """API endpoint for health checks."""
-    
+
     permission_classes = [AllowAny]
-    
+    authentication_classes = []
+    # Probes must never be rate limited
+    throttle_classes = []
+
     def get(self, request, format=None):
         """Check the health of the application.
-        
+
         Returns:
             Response: JSON response with health check information
         """
@@ -36,11 +109,18 @@ class HealthCheckView(APIView):
                 db_status = 'connected'
         except Exception as e:
             db_status = f'error: {str(e)}'
-        
-        # Get memory usage
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        
+
+        # Resource usage comes from the background sampler, not a live psutil call
+        snapshot = get_system_metrics()
+        resources = {'available': False}
+        if snapshot.get('available'):
+            resources = {
+                'memory_used_mb': snapshot['process']['memory_used_mb'],
+                'cpu_percent': snapshot['cpu']['usage_percent'],
+                'disk_usage': snapshot['disk'],
+                'sampled_at': snapshot['sampled_at'],
+            }
+
         # Prepare response
         data = {
             'status': 'ok',
@@ -52,27 +132,23 @@ class HealthCheckView(APIView):
                 'django': django.get_version(),
             },
             'system': {
-                'python': platform.python_version(),
-                'os': platform.platform(),
-                'hostname': socket.gethostname(),
-            },
-            'resources': {
-                'memory_used_mb': memory_info.rss / (1024 * 1024),  # Convert to MB
-                'cpu_percent': psutil.cpu_percent(),
-                'disk_usage': psutil.disk_usage('/')._asdict(),
+                'python': _PLATFORM_INFO['python'],
+                'os': _PLATFORM_INFO['os'],
+                'hostname': _PLATFORM_INFO['hostname'],
             },
+            'resources': resources,
         }
-        
+
         return Response(data, status=status.HTTP_200_OK)
 
 class SystemInfoView(APIView):
     """API endpoint for system information. Requires authentication."""
-    
+
     permission_classes = [IsAuthenticated]
-    
+
     def get(self, request, format=None):
         """Get system information.
-        
+
         Returns:
             Response: JSON response with system information
         """
@@ -84,23 +160,26 @@ class SystemInfoView(APIView):
                 if 'postgresql' in settings.DATABASES['default']['ENGINE']:
                     cursor.execute('SELECT version()')
                     db_info['version'] = cursor.fetchone()[0]
-                    
+
                     cursor.execute('SELECT pg_size_pretty(pg_database_size(current_database()))')
                     db_info['size'] = cursor.fetchone()[0]
-                    
+
                     cursor.execute('SELECT count(*) FROM pg_stat_activity')
                     db_info['connections'] = cursor.fetchone()[0]
         except Exception as e:
             db_info['error'] = str(e)
-        
+
+        snapshot = get_system_metrics()
+        available = snapshot.get('available', False)
+
         # Get system metrics
         system_info = {
             'system': {
-                'python_version': platform.python_version(),
+                'python_version': _PLATFORM_INFO['python'],
                 'django_version': django.get_version(),
-                'os': platform.system(),
-                'os_version': platform.release(),
-                'hostname': socket.gethostname(),
+                'os': _PLATFORM_INFO['os_name'],
+                'os_version': _PLATFORM_INFO['os_version'],
+                'hostname': _PLATFORM_INFO['hostname'],
             },
             'application': {
                 'debug': settings.DEBUG,
@@ -109,75 +188,42 @@ class SystemInfoView(APIView):
                 'current_time': datetime.now().isoformat(),
             }
         }
-        
-        # Add psutil metrics if available
-        if PSU_AVAILABLE:
+
+        # Add sampled metrics if psutil is available
+        if available:
             system_info['system'].update({
-                'cpu_count': psutil.cpu_count(logical=False),
-                'cpu_percent': psutil.cpu_percent(interval=1),
-                'memory_percent': psutil.virtual_memory().percent,
-                'disk_usage': psutil.disk_usage('/').percent,
-                'boot_time': datetime.fromtimestamp(psutil.boot_time()).isoformat(),
+                'cpu_count': snapshot['cpu']['cores'],
+                'cpu_percent': snapshot['cpu']['usage_percent'],
+                'memory_percent': snapshot['memory']['used_percent'],
+                'disk_usage': snapshot['disk']['used_percent'],
+                'boot_time': snapshot['boot_time'],
             })
-        
+
         # Prepare response
         data = {
             'system': system_info,
             'database': db_info,
             'resources': {
-                'cpu': {
-                    'cores': psutil.cpu_count(logical=False) if PSU_AVAILABLE else None,
-                    'threads': psutil.cpu_count() if PSU_AVAILABLE else None,
-                    'usage_percent': psutil.cpu_percent(interval=1) if PSU_AVAILABLE else None,
-                },
-                'memory': {
-                    'total_gb': round(psutil.virtual_memory().total / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'available_gb': round(psutil.virtual_memory().available / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'used_gb': round(psutil.virtual_memory().used / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'used_percent': psutil.virtual_memory().percent if PSU_AVAILABLE else None,
-                },
-                'disk': {
-                    'total_gb': round(psutil.disk_usage('/').total / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'used_gb': round(psutil.disk_usage('/').used / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'free_gb': round(psutil.disk_usage('/').free / (1024 ** 3), 2) if PSU_AVAILABLE else None,
-                    'used_percent': psutil.disk_usage('/').percent if PSU_AVAILABLE else None,
-                }
+                'cpu': snapshot.get('cpu', {}),
+                'memory': snapshot.get('memory', {}),
+                'disk': snapshot.get('disk', {}),
+                'sampled_at': snapshot.get('sampled_at'),
             },
             'services': {
-                'database': 'postgresql',
-                'cache': 'redis',
+                'database': settings.DATABASES['default']['ENGINE'].split('.')[-1],
+                'cache': settings.CACHES['default']['BACKEND'].split('.')[-2],
                 'server': 'gunicorn' if not settings.DEBUG else 'django',
             },
             'timestamps': {
                 'server_time': datetime.now().isoformat(),
-                'server_start_time': datetime.fromtimestamp(process.create_time()).isoformat(),
-                'uptime_seconds': int(datetime.now().timestamp() - process.create_time()),
+                'server_start_time': snapshot['process']['start_time'] if available else None,
+                'uptime_seconds': snapshot['process']['uptime_seconds'] if available else None,
             },
         }
-        
-        return Response(data, status=status.HTTP_200_OK)
 
-def health_check(request):
-    """Wrapper for HealthCheckView to be used in URL patterns.
-    
-    Args:
-        request: HTTP request object
-        
-    Returns:
-        Response: Health check response
-    """
-    view = HealthCheckView.as_view()
-    return view(request._request)
+        return Response(data, status=status.HTTP_200_OK)
 
 
-def system_info(request):
-    """Wrapper for SystemInfoView to be used in URL patterns.
-    
-    Args:
-        request: HTTP request object
-        
-    Returns:
-        Response: System information response
-    """
-    view = SystemInfoView.as_view()
-    return view(request._request)
+# Function-style entry points used in URL patterns
+health_check = HealthCheckView.as_view()
+system_info = SystemInfoView.as_view()
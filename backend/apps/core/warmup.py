@@ -0,0 +1,109 @@
+"""
+Pre-fork warm-up for preloaded gunicorn masters.
+
+With ``preload_app`` the master imports the project once and forks workers
+from it. Anything built lazily on first use (the URL resolver, compiled
+templates, the content-type cache, optional modules imported inside
+functions) would otherwise be rebuilt separately in every worker. Doing it
+in the master before fork means workers start hot and share those pages
+copy-on-write, especially once ``gc.freeze()`` stops the collector from
+touching them.
+"""
+import importlib
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily by request code, so the master imports them up front
+DEFAULT_WARMUP_MODULES = [
+    'pyotp',
+    'qrcode',
+    'rest_framework_simplejwt.tokens',
+    'apps.users.serializers',
+]
+
+
+def warm_url_resolver():
+    """Import every view module and build the resolver's reverse lookup tables."""
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 - populates the lookup tables
+    return len(resolver.url_patterns)
+
+
+def warm_templates():
+    """Compile every template into the cached loader.
+
+    Returns:
+        int: Number of templates compiled
+    """
+    count = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = str(directory)
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if not name.endswith(('.html', '.txt')):
+                        continue
+                    template_name = os.path.relpath(os.path.join(root, name), directory)
+                    try:
+                        engine.get_template(template_name)
+                        count += 1
+                    except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+                        logger.debug("Skipped template %s during warm-up: %s", template_name, e)
+    return count
+
+
+def warm_content_types():
+    """Fill the ContentType cache used by permission checks and the admin."""
+    from django.contrib.contenttypes.models import ContentType
+
+    try:
+        return len(ContentType.objects.get_for_models(*apps.get_models()))
+    except DatabaseError as e:
+        logger.warning("Skipped content type warm-up: %s", e)
+        return 0
+
+
+def warm_modules():
+    """Import modules that request code only imports on first use."""
+    loaded = 0
+    for module in getattr(settings, 'WARMUP_MODULES', DEFAULT_WARMUP_MODULES):
+        try:
+            importlib.import_module(module)
+            loaded += 1
+        except ImportError as e:
+            logger.debug("Skipped warm-up import of %s: %s", module, e)
+    return loaded
+
+
+def warm_up():
+    """Run every warm-up step and release connections before workers fork.
+
+    Returns:
+        dict: Per-step ``count`` and ``duration_ms``
+    """
+    results = {}
+    for name, step in (
+        ('modules', warm_modules),
+        ('url_resolver', warm_url_resolver),
+        ('templates', warm_templates),
+        ('content_types', warm_content_types),
+    ):
+        start = time.perf_counter()
+        count = step()
+        results[name] = {'count': count, 'duration_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    # Sockets must not be shared between forked workers
+    connections.close_all()
+    caches.close_all()
+    logger.info("Pre-fork warm-up complete: %s", results)
+    return results
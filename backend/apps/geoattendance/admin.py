@@ -0,0 +1,56 @@
+from django.contrib import admin
+
+from .models import CheckIn, DailyTimesheet, Geofence, Site, TrailChunk
+
+
+class GeofenceInline(admin.TabularInline):
+    model = Geofence
+    extra = 0
+    fields = ('kind', 'latitude', 'longitude', 'radius', 'polygon', 'is_active')
+
+
+@admin.register(Site)
+class SiteAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code', 'is_active', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'code', 'address')
+    inlines = [GeofenceInline]
+
+
+@admin.register(Geofence)
+class GeofenceAdmin(admin.ModelAdmin):
+    list_display = ('site', 'kind', 'latitude', 'longitude', 'radius', 'is_active', 'updated_at')
+    list_filter = ('kind', 'is_active')
+    search_fields = ('site__name', 'site__code')
+    raw_id_fields = ('site',)
+
+
+@admin.register(CheckIn)
+class CheckInAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'site', 'latitude', 'longitude', 'accuracy', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('user__email', 'site__name')
+    raw_id_fields = ('user', 'site', 'geofence')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(DailyTimesheet)
+class DailyTimesheetAdmin(admin.ModelAdmin):
+    list_display = ('user', 'day', 'worked_seconds', 'break_seconds', 'overtime_seconds', 'sessions', 'flags')
+    search_fields = ('user__email',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'day'
+    readonly_fields = (
+        'user', 'day', 'worked_seconds', 'break_seconds', 'overtime_seconds', 'sessions', 'first_in', 'last_out',
+        'flags', 'computed_at',
+    )
+
+
+@admin.register(TrailChunk)
+class TrailChunkAdmin(admin.ModelAdmin):
+    list_display = ('user', 'day', 'count', 'start_at', 'end_at', 'created_at')
+    search_fields = ('user__email',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'day'
+    exclude = ('data',)
+    readonly_fields = ('user', 'day', 'count', 'start_at', 'end_at', 'created_at')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class GeoAttendanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.geoattendance'
+
+    def ready(self):
+        import apps.geoattendance.signals  # noqa
@@ -0,0 +1,348 @@
+"""
+In-memory spatial index of GeoAttendance geofences.
+
+:func:`locate` answers "which site is this position at?" without touching
+the database. Every active fence is bucketed into the cells of a
+``GEOFENCE_CELL_DEGREES`` latitude/longitude grid that its bounding box
+overlaps, and each cell keeps the indices of its circles and of its polygons'
+edges as arrays. A lookup is one dict access for the cell, then one
+vectorized pass over its candidates: haversine for circles (compared
+against a per-circle threshold computed at build time) and a ray-casting
+crossing count over polygon edges. Fences whose bounding box spans more
+than ``GEOFENCE_MAX_CELLS`` cells are checked on every lookup instead of
+being copied into thousands of cells.
+
+When a position is inside several fences, the smallest one wins, so a
+building inside a larger compound resolves to the building.
+
+Each process builds the index on first use and keeps it. Saving or
+deleting a site or fence drops this process's copy and, once the
+transaction commits, bumps a version in the cache; other processes compare
+versions at most every ``GEOFENCE_INDEX_REFRESH`` seconds and rebuild when
+it changed.
+
+Polygon tests treat latitude and longitude as plane coordinates, which is
+accurate at fence scale. Fences crossing the antimeridian are not supported.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.core.metrics import timed
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8  # Metres, mean
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+VERSION_KEY = 'geoattendance:fence_version'
+
+Fence = namedtuple('Fence', ['id', 'site_id', 'kind', 'latitude', 'longitude', 'radius', 'polygon'])
+Match = namedtuple('Match', ['site_id', 'fence_id'])
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle distance in metres between two points given in degrees."""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _polygon_area(polygon):
+    """Approximate area in square metres (shoelace formula on a local projection)."""
+    scale = math.cos(math.radians(sum(vertex[0] for vertex in polygon) / len(polygon)))
+    total = 0.0
+    for (y1, x1), (y2, x2) in zip(polygon, polygon[1:] + polygon[:1]):
+        total += (x1 * y2 - x2 * y1) * scale
+    return abs(total) / 2 * METRES_PER_DEGREE ** 2
+
+
+class FenceIndex:
+    """Fences bucketed in a latitude/longitude grid, with vectorized containment tests.
+
+    Args:
+        fences: Iterable of :class:`Fence`
+        cell_degrees: Grid cell size in degrees
+        max_cells: Fences overlapping more cells than this are checked on every lookup
+    """
+
+    def __init__(self, fences, cell_degrees=0.01, max_cells=4096):
+        self.cell_degrees = cell_degrees
+        self.fence_ids, self.site_ids, areas = [], [], []
+        # Circles: latitude, longitude, haversine threshold, fence; edges: y1, x1, y2, slope, fence
+        circle_rows, edge_rows = [], []
+        cells, everywhere = {}, ([], [])
+
+        for fence in fences:
+            position = len(self.fence_ids)
+            if fence.kind == 'polygon':
+                polygon = [(float(latitude), float(longitude)) for latitude, longitude in fence.polygon or ()]
+                if len(polygon) < 3:
+                    continue
+                area = _polygon_area(polygon)
+                first = len(edge_rows)
+                for (y1, x1), (y2, x2) in zip(polygon, polygon[1:] + polygon[:1]):
+                    edge_rows.append((y1, x1, y2, (x2 - x1) / (y2 - y1) if y2 != y1 else 0.0, position))
+                slot, members = 1, range(first, len(edge_rows))
+                south, north = min(y for y, _ in polygon), max(y for y, _ in polygon)
+                west, east = min(x for _, x in polygon), max(x for _, x in polygon)
+            else:
+                if not fence.radius or fence.radius <= 0:
+                    continue
+                area = math.pi * fence.radius ** 2
+                # Inside when the haversine term is at most sin^2(r / 2R); no asin per lookup
+                limit = math.sin(min(fence.radius / (2 * EARTH_RADIUS), math.pi / 2)) ** 2
+                slot, members = 0, (len(circle_rows),)
+                circle_rows.append((fence.latitude, fence.longitude, limit, position))
+                reach = fence.radius / METRES_PER_DEGREE
+                wide = reach / max(math.cos(math.radians(fence.latitude)), 0.01)
+                south, north = fence.latitude - reach, fence.latitude + reach
+                west, east = fence.longitude - wide, fence.longitude + wide
+
+            self.fence_ids.append(fence.id)
+            self.site_ids.append(fence.site_id)
+            areas.append(area)
+            rows = range(self._cell_of(south), self._cell_of(north) + 1)
+            columns = range(self._cell_of(west), self._cell_of(east) + 1)
+            if len(rows) * len(columns) > max_cells:
+                everywhere[slot].extend(members)
+                continue
+            for row in rows:
+                for column in columns:
+                    cell = cells.get((row, column))
+                    if cell is None:
+                        cell = cells[row, column] = ([], [])
+                    cell[slot].extend(members)
+
+        self.size = len(self.fence_ids)
+        if NUMPY_AVAILABLE:
+            self.areas = np.array(areas, dtype=np.float64)
+            circles = np.array(circle_rows, dtype=np.float64).reshape(-1, 4)
+            self.circle_phi = np.radians(circles[:, 0])
+            self.circle_lambda = np.radians(circles[:, 1])
+            self.circle_cos = np.cos(self.circle_phi)
+            self.circle_limit = circles[:, 2]
+            self.circle_fence = circles[:, 3].astype(np.int64)
+            edges = np.array(edge_rows, dtype=np.float64).reshape(-1, 5)
+            self.edge_y1, self.edge_x1, self.edge_y2, self.edge_slope = (edges[:, i] for i in range(4))
+            self.edge_fence = edges[:, 4].astype(np.int64)
+
+            def pack(cell):
+                return tuple(np.array(members + extra, dtype=np.int64) for members, extra in zip(cell, everywhere))
+        else:
+            self.areas, self.circle_rows, self.edge_rows = areas, circle_rows, edge_rows
+
+            def pack(cell):
+                return tuple(members + extra for members, extra in zip(cell, everywhere))
+
+        self._cells = {key: pack(cell) for key, cell in cells.items()}
+        self._everywhere = pack(([], []))
+
+    def __len__(self):
+        return self.size
+
+    def _cell_of(self, degrees):
+        return math.floor(degrees / self.cell_degrees)
+
+    def candidates(self, latitude, longitude):
+        """Return the circle and edge indices that may contain a position."""
+        return self._cells.get((self._cell_of(latitude), self._cell_of(longitude)), self._everywhere)
+
+    def locate(self, latitude, longitude):
+        """Return the :class:`Match` for the smallest fence containing a position, or None."""
+        circles, edges = self.candidates(latitude, longitude)
+        if NUMPY_AVAILABLE:
+            inside = self._inside_vectorized(circles, edges, latitude, longitude)
+            if not inside.size:
+                return None
+            best = inside[np.argmin(self.areas[inside])] if inside.size > 1 else inside[0]
+        else:
+            inside = self._inside_python(circles, edges, latitude, longitude)
+            if not inside:
+                return None
+            best = min(inside, key=self.areas.__getitem__)
+        return Match(self.site_ids[best], self.fence_ids[best])
+
+    def _inside_vectorized(self, circles, edges, latitude, longitude):
+        inside = []
+        if circles.size:
+            phi = math.radians(latitude)
+            a = (
+                np.sin((self.circle_phi[circles] - phi) / 2) ** 2
+                + math.cos(phi) * self.circle_cos[circles]
+                * np.sin((self.circle_lambda[circles] - math.radians(longitude)) / 2) ** 2
+            )
+            inside.append(self.circle_fence[circles[a <= self.circle_limit[circles]]])
+        if edges.size:
+            # Ray casting towards +longitude: count the edges straddling the latitude east of the point
+            edges = edges[(self.edge_y1[edges] > latitude) != (self.edge_y2[edges] > latitude)]
+            edges = edges[
+                longitude < self.edge_x1[edges] + (latitude - self.edge_y1[edges]) * self.edge_slope[edges]
+            ]
+            if edges.size:
+                owners, crossings = np.unique(self.edge_fence[edges], return_counts=True)
+                inside.append(owners[crossings % 2 == 1])
+        if not inside:
+            return circles[:0]
+        return inside[0] if len(inside) == 1 else np.concatenate(inside)
+
+    def locate_many(self, latitudes, longitudes):
+        """Resolve many positions at once.
+
+        Positions are grouped by cell, and each group is tested against its
+        cell's candidates as one positions-by-candidates matrix.
+
+        Returns:
+            list: A :class:`Match` or None per position, in order
+        """
+        if not NUMPY_AVAILABLE:
+            return [self.locate(latitude, longitude) for latitude, longitude in zip(latitudes, longitudes)]
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        results = [None] * len(latitudes)
+        if not len(latitudes):
+            return results
+        rows = np.floor(latitudes / self.cell_degrees).astype(np.int64)
+        columns = np.floor(longitudes / self.cell_degrees).astype(np.int64)
+        order = np.lexsort((columns, rows))
+        boundaries = np.flatnonzero((np.diff(rows[order]) != 0) | (np.diff(columns[order]) != 0)) + 1
+        for group in np.split(order, boundaries):
+            if len(group) == 1:
+                results[group[0]] = self.locate(latitudes[group[0]], longitudes[group[0]])
+                continue
+            circles, edges = self._cells.get((int(rows[group[0]]), int(columns[group[0]])), self._everywhere)
+            best = self._smallest_inside(circles, edges, latitudes[group], longitudes[group])
+            for position, fence in zip(group.tolist(), best.tolist()):
+                if fence >= 0:
+                    results[position] = Match(self.site_ids[fence], self.fence_ids[fence])
+        return results
+
+    def _smallest_inside(self, circles, edges, latitudes, longitudes):
+        """Return the smallest fence containing each position, or -1."""
+        candidates, inside = [], []
+        latitudes, longitudes = latitudes[:, None], longitudes[:, None]
+        if circles.size:
+            phi = np.radians(latitudes)
+            a = (
+                np.sin((self.circle_phi[circles] - phi) / 2) ** 2
+                + np.cos(phi) * self.circle_cos[circles]
+                * np.sin((self.circle_lambda[circles] - np.radians(longitudes)) / 2) ** 2
+            )
+            candidates.append(self.circle_fence[circles])
+            inside.append(a <= self.circle_limit[circles])
+        if edges.size:
+            y1 = self.edge_y1[edges]
+            crosses = ((y1 > latitudes) != (self.edge_y2[edges] > latitudes)) & (
+                longitudes < self.edge_x1[edges] + (latitudes - y1) * self.edge_slope[edges]
+            )
+            # A fence's edges are contiguous in every candidate list
+            owners = self.edge_fence[edges]
+            starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+            candidates.append(owners[starts])
+            inside.append(np.add.reduceat(crosses.astype(np.int32), starts, axis=1) % 2 == 1)
+        if not candidates:
+            return np.full(len(latitudes), -1, dtype=np.int64)
+        fences = np.concatenate(candidates)
+        inside = np.hstack(inside)
+        best = np.argmin(np.where(inside, self.areas[fences], np.inf), axis=1)
+        return np.where(inside.any(axis=1), fences[best], -1)
+
+    def _inside_python(self, circles, edges, latitude, longitude):
+        phi = math.radians(latitude)
+        inside = []
+        for i in circles:
+            circle_latitude, circle_longitude, limit, fence = self.circle_rows[i]
+            other = math.radians(circle_latitude)
+            a = (
+                math.sin((other - phi) / 2) ** 2
+                + math.cos(phi) * math.cos(other) * math.sin(math.radians(circle_longitude - longitude) / 2) ** 2
+            )
+            if a <= limit:
+                inside.append(fence)
+        crossings = {}
+        for i in edges:
+            y1, x1, y2, slope, fence = self.edge_rows[i]
+            if (y1 > latitude) != (y2 > latitude) and longitude < x1 + (latitude - y1) * slope:
+                crossings[fence] = crossings.get(fence, 0) + 1
+        inside.extend(fence for fence, count in crossings.items() if count % 2)
+        return inside
+
+
+_state = {'index': None, 'version': None, 'checked': 0.0}
+_lock = threading.Lock()
+
+
+def load_fences():
+    """Return the active fences of active sites."""
+    from .models import Geofence
+    rows = (
+        Geofence.objects.filter(is_active=True, site__is_active=True)
+        .values_list('pk', 'site_id', 'kind', 'latitude', 'longitude', 'radius', 'polygon')
+    )
+    return [Fence(*row) for row in rows.iterator(chunk_size=5000)]
+
+
+def build_index(fences=None):
+    """Build a :class:`FenceIndex` from ``fences``, or from the database."""
+    with timed('geofence_index_build'):
+        index = FenceIndex(
+            load_fences() if fences is None else fences,
+            cell_degrees=getattr(settings, 'GEOFENCE_CELL_DEGREES', 0.01),
+            max_cells=getattr(settings, 'GEOFENCE_MAX_CELLS', 4096),
+        )
+    logger.info(f"Built geofence index: {len(index)} fences in {len(index._cells)} cells")
+    return index
+
+
+def get_index():
+    """Return this process's index, rebuilding it if the fences changed."""
+    state = _state
+    now = time.monotonic()
+    index = state['index']
+    if index is not None and now - state['checked'] < getattr(settings, 'GEOFENCE_INDEX_REFRESH', 5):
+        return index
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    if index is not None and version == state['version']:
+        state['checked'] = now
+        return index
+    with _lock:
+        if state['index'] is None or state['version'] != version:
+            state['index'] = build_index()
+            state['version'] = version
+        state['checked'] = time.monotonic()
+        return state['index']
+
+
+def invalidate_index():
+    """Drop this process's index and tell the others theirs is stale."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    _state['index'] = None
+
+
+def fences_changed():
+    """Mark the index stale after sites or fences changed; other processes hear of it on commit."""
+    _state['index'] = None
+    transaction.on_commit(invalidate_index)
+
+
+def locate(latitude, longitude):
+    """Return the :class:`Match` for the site at a position, or None."""
+    return get_index().locate(latitude, longitude)
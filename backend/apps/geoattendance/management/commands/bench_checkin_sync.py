@@ -0,0 +1,142 @@
+"""
+Management command to benchmark offline check-in sync.
+
+Creates ``--sites`` sites with a circular fence each and a user whose
+device queued ``--events`` check-ins over the past week at a handful of
+them, with a few per cent each outside every fence, repeated and malformed.
+The queue is uploaded as gzipped JSON Lines through the sync endpoint,
+then uploaded again (every event now a duplicate). For comparison,
+``--sample`` check-ins are posted one request each to the live check-in
+endpoint and extrapolated.
+"""
+import gzip
+import json
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.geoattendance.geofence import METRES_PER_DEGREE, invalidate_index
+from apps.geoattendance.models import CheckIn, Geofence, Site
+from apps.geoattendance.views import CheckInSyncView, CheckInView
+
+
+class Command(BaseCommand):
+    help = 'Benchmark a bulk offline check-in upload against one request per check-in'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000, help='Check-ins in the uploaded queue')
+        parser.add_argument('--sites', type=int, default=1000, help='Sites, one fence each')
+        parser.add_argument('--visited', type=int, default=20, help='Sites the queued check-ins are at')
+        parser.add_argument('--sample', type=int, default=300, help='Check-ins posted one request each')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark sites, user and check-ins')
+
+    def handle(self, *args, **options):
+        if min(options['events'], options['sites'], options['visited']) < 1 or options['sample'] < 0:
+            raise CommandError('--events, --sites and --visited must be positive')
+        run = uuid.uuid4().hex[:8]
+        rng = random.Random(0)
+        user, sites = self._setup(run, rng, options)
+        self.stdout.write(f"Database: {connection.vendor}; {options['events']} events, {options['sites']} sites")
+        try:
+            body, planted = self._queue(rng, sites[:options['visited']], options['events'])
+            self.stdout.write(f"Upload: {len(body) / 1e3:.0f} kB gzipped JSON Lines")
+            factory = APIRequestFactory()
+            view = CheckInSyncView.as_view()
+            timings = []
+            for label in ('First upload', 'Same upload again'):
+                request = factory.post(
+                    '/api/v1/geoattendance/check-ins/sync/', body, content_type='application/x-ndjson',
+                    HTTP_CONTENT_ENCODING='gzip',
+                )
+                force_authenticate(request, user=user)
+                started = time.perf_counter()
+                response = view(request)
+                elapsed = time.perf_counter() - started
+                timings.append(elapsed)
+                if response.status_code != 200:
+                    raise CommandError(f'Sync answered {response.status_code}: {response.data}')
+                counts = {key: response.data[key] for key in ('created', 'duplicate', 'rejected')}
+                self.stdout.write(
+                    f"{label}: {elapsed:.3f}s = {options['events'] / elapsed:.0f} events/s; {counts}"
+                )
+                if label == 'First upload' and counts != planted:
+                    raise CommandError(f'Expected {planted}')
+            self._single(factory, user, sites[0], timings[0], options)
+        finally:
+            if not options['keep']:
+                self._cleanup(run, user)
+
+    @staticmethod
+    def _setup(run, rng, options):
+        user = get_user_model().objects.create_user(email=f'bench-{run}@example.com', password=None)
+        with transaction.atomic():
+            sites = Site.objects.bulk_create([Site(name=f'bench-{run}-{i}') for i in range(options['sites'])])
+            Geofence.objects.bulk_create([
+                Geofence(site=site, latitude=rng.uniform(6.3, 6.7), longitude=rng.uniform(3.2, 3.6), radius=150)
+                for site in sites
+            ])
+        # bulk_create sends no signals
+        invalidate_index()
+        return user, list(Geofence.objects.filter(site__in=sites[:options['visited']]))
+
+    @staticmethod
+    def _queue(rng, fences, count):
+        start = timezone.now() - timedelta(days=7)
+        planted = {'created': 0, 'duplicate': 0, 'rejected': 0}
+        lines, accepted = [], []
+        for i in range(count):
+            roll = rng.random()
+            if roll < 0.02 and accepted:
+                lines.append(rng.choice(accepted))
+                planted['duplicate'] += 1
+                continue
+            if roll < 0.03:
+                lines.append('{"id": "broken"')
+                planted['rejected'] += 1
+                continue
+            fence = rng.choice(fences)
+            # A few from the road, far from any site
+            latitude = fence.latitude + (rng.uniform(-100, 100) / METRES_PER_DEGREE if roll > 0.06 else 1.0)
+            lines.append(json.dumps({
+                'id': f'event-{i}', 'kind': 'in' if i % 2 else 'out',
+                'latitude': latitude, 'longitude': fence.longitude,
+                'accuracy': rng.uniform(5, 30), 'recorded_at': (start + timedelta(seconds=60 * i)).isoformat(),
+            }))
+            if roll > 0.06:
+                accepted.append(lines[-1])
+            planted['created' if roll > 0.06 else 'rejected'] += 1
+        return gzip.compress('\n'.join(lines).encode()), planted
+
+    def _single(self, factory, user, fence, bulk_elapsed, options):
+        if not options['sample']:
+            return
+        view = CheckInView.as_view()
+        started = time.perf_counter()
+        for _ in range(options['sample']):
+            request = factory.post('/api/v1/geoattendance/check-ins/', {
+                'latitude': fence.latitude, 'longitude': fence.longitude, 'accuracy': 10,
+            }, format='json')
+            force_authenticate(request, user=user)
+            if view(request).status_code != 201:
+                raise CommandError('Single check-in failed')
+        per_event = (time.perf_counter() - started) / options['sample']
+        total = per_event * options['events']
+        self.stdout.write(
+            f"One request each: {1 / per_event:.0f} check-ins/s; {options['events']} would take about "
+            f"{total:.1f}s in-process, before any network round trips ({total / bulk_elapsed:.0f}x the upload)"
+        )
+
+    @staticmethod
+    def _cleanup(run, user):
+        with transaction.atomic():
+            CheckIn.objects.filter(user=user).delete()
+            Site.objects.filter(name__startswith=f'bench-{run}-').delete()
+            user.delete()
+        invalidate_index()
@@ -0,0 +1,122 @@
+"""
+Management command to benchmark geofence lookups.
+
+Builds an index of ``--sites`` synthetic sites clustered around
+``--cities`` cities (circles of 50-300 m and small polygons, some inside
+larger compound fences, plus a few regional fences far too big to bucket)
+and resolves ``--lookups`` positions, half of them near a site and half
+anywhere in a city. Reports the build time and the latency per lookup, then
+resolves ``--sample`` of the positions by testing every fence (one
+vectorized pass over all of them, no grid) to compare speed and check that
+both agree.
+"""
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.geoattendance.geofence import METRES_PER_DEGREE, NUMPY_AVAILABLE, Fence, FenceIndex, build_index
+
+
+class Command(BaseCommand):
+    help = 'Benchmark grid-indexed geofence lookups against testing every fence'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=50000, help='Sites, one or two fences each')
+        parser.add_argument('--cities', type=int, default=20, help='Clusters the sites are spread around')
+        parser.add_argument('--lookups', type=int, default=100000, help='Positions resolved through the index')
+        parser.add_argument('--sample', type=int, default=1000, help='Positions also resolved without the index')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        if min(options['sites'], options['cities'], options['lookups']) < 1 or options['sample'] < 0:
+            raise CommandError('--sites, --cities and --lookups must be positive')
+        rng = random.Random(options['seed'])
+        cities = [(rng.uniform(4.5, 12.5), rng.uniform(3.0, 13.5)) for _ in range(options['cities'])]
+        fences = self._fences(rng, cities, options['sites'])
+
+        started = time.perf_counter()
+        index = build_index(fences)
+        built = time.perf_counter() - started
+        self.stdout.write(
+            f"{'NumPy' if NUMPY_AVAILABLE else 'Pure Python'}; {len(index)} fences for {options['sites']} sites "
+            f"in {len(index._cells)} cells, built in {built:.2f}s"
+        )
+
+        points = self._points(rng, cities, fences, options['lookups'])
+        matches, timings = [], []
+        clock = time.perf_counter_ns
+        for latitude, longitude in points:
+            started = clock()
+            matches.append(index.locate(latitude, longitude))
+            timings.append(clock() - started)
+        self._report('Grid index', timings, sum(match is not None for match in matches))
+
+        if options['sample']:
+            self._compare(fences, points, matches, options['sample'])
+
+    @staticmethod
+    def _fences(rng, cities, sites):
+        fences = []
+        for site in range(sites):
+            latitude, longitude = rng.choice(cities)
+            latitude += rng.gauss(0, 0.12)
+            longitude += rng.gauss(0, 0.12)
+            if rng.random() < 0.3:
+                # A building footprint: a rough hexagon of 60-300 m across
+                size = rng.uniform(30, 150) / METRES_PER_DEGREE
+                polygon = [
+                    [latitude + size * rng.uniform(0.7, 1) * math.sin(step * math.pi / 3),
+                     longitude + size * rng.uniform(0.7, 1) * math.cos(step * math.pi / 3)]
+                    for step in range(6)
+                ]
+                fences.append(Fence(len(fences), site, 'polygon', latitude, longitude, None, polygon))
+            else:
+                fences.append(Fence(len(fences), site, 'circle', latitude, longitude, rng.uniform(50, 300), None))
+            if rng.random() < 0.02:
+                # The compound around it
+                fences.append(Fence(len(fences), site, 'circle', latitude, longitude, rng.uniform(800, 2000), None))
+        for latitude, longitude in cities[:3]:
+            fences.append(Fence(len(fences), sites, 'circle', latitude, longitude, 60000, None))
+        return fences
+
+    @staticmethod
+    def _points(rng, cities, fences, count):
+        points = []
+        for i in range(count):
+            if i % 2:
+                fence, spread = rng.choice(fences), 200 / METRES_PER_DEGREE
+                points.append((
+                    fence.latitude + rng.uniform(-spread, spread), fence.longitude + rng.uniform(-spread, spread)
+                ))
+            else:
+                latitude, longitude = rng.choice(cities)
+                points.append((latitude + rng.gauss(0, 0.15), longitude + rng.gauss(0, 0.15)))
+        return points
+
+    def _report(self, label, timings, found):
+        timings = sorted(timings)
+
+        def percentile(share):
+            return timings[min(len(timings) - 1, int(len(timings) * share))] / 1000
+
+        self.stdout.write(
+            f"{label}: {len(timings)} lookups, {found} at a site; p50 {percentile(0.5):.1f} us, "
+            f"p99 {percentile(0.99):.1f} us, mean {sum(timings) / len(timings) / 1000:.1f} us"
+        )
+
+    def _compare(self, fences, points, matches, sample):
+        # Every fence in one shared candidate list: the same tests, no bucketing
+        everything = FenceIndex(fences, max_cells=0)
+        timings, differ = [], 0
+        clock = time.perf_counter_ns
+        for point, indexed in zip(points[:sample], matches):
+            started = clock()
+            match = everything.locate(*point)
+            timings.append(clock() - started)
+            differ += match != indexed
+        self._report('Every fence', timings, sum(match is not None for match in matches[:sample]))
+        if differ:
+            raise CommandError(f'{differ} of {len(timings)} lookups differ between the index and a full scan')
+        self.stdout.write(self.style.SUCCESS(f'Index and full scan agree on {len(timings)} lookups'))
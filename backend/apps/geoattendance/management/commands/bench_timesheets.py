@@ -0,0 +1,175 @@
+"""
+Management command to benchmark timesheet computation.
+
+Creates ``--users`` users checking in and out at one site on the working
+days of the past ``--days`` days (with some split shifts, night shifts,
+double taps and forgotten check-outs), inserted in bulk. Then measures:
+
+* a full recompute of the range in this process, and across ``--workers``
+  processes, which must produce identical totals;
+* an incremental refresh after ``--changed`` per cent of the users check in
+  again, which only touches their queued user-days;
+* the month-end report endpoint, read from the stored daily totals.
+"""
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.geoattendance.models import CheckIn, DailyTimesheet, Site, TimesheetChange
+from apps.geoattendance.timesheets import recompute_range, refresh_timesheets
+from apps.geoattendance.views import TimesheetReportView
+
+
+class Command(BaseCommand):
+    help = 'Benchmark materialized daily timesheets: full and parallel recomputes, incremental refresh and reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Employees')
+        parser.add_argument('--days', type=int, default=30, help='Days of check-ins, ending yesterday')
+        parser.add_argument('--workers', type=int, default=max(os.cpu_count() or 1, 2), help='Processes to compare')
+        parser.add_argument('--changed', type=float, default=1.0, help='Per cent of users with new check-ins')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users and check-ins')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['days'], options['workers']) < 1:
+            raise CommandError('--users, --days and --workers must be positive')
+        run = uuid.uuid4().hex[:8]
+        last_day = timezone.localdate() - timedelta(days=1)
+        first_day = last_day - timedelta(days=options['days'] - 1)
+        started = time.perf_counter()
+        site, user_ids, count = self._setup(run, first_day, last_day, options)
+        self.stdout.write(
+            f"Database: {connection.vendor}, {os.cpu_count()} CPUs; {options['users']} users, {count} check-ins "
+            f"from {first_day} to {last_day}; setup {time.perf_counter() - started:.1f}s"
+        )
+        try:
+            TimesheetChange.objects.filter(user_id__in=user_ids).delete()
+            serial = self._recompute(first_day, last_day, user_ids, 1)
+            parallel = self._recompute(first_day, last_day, user_ids, options['workers'])
+            if serial != parallel:
+                raise CommandError('Parallel recompute disagrees with the serial one')
+            self._refresh(site, user_ids, last_day, options)
+            self._report(first_day, last_day, user_ids[0])
+        finally:
+            if not options['keep']:
+                self._cleanup(run, site, user_ids)
+
+    def _setup(self, run, first_day, last_day, options):
+        rng = random.Random(0)
+        password = make_password(None)
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(email=f'bench-{run}-{i}@example.com', password=password, is_staff=not i)
+            for i in range(options['users'])
+        ], batch_size=1000)
+        site = Site.objects.create(name=f'bench-{run}')
+        rows = []
+        day = first_day
+        while day <= last_day:
+            if day.weekday() < 5:
+                midnight = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+                for user in users:
+                    rows.extend((user.pk, *event) for event in self._shift(rng, midnight))
+            day += timedelta(days=1)
+        self._insert(site, rows)
+        return site, [user.pk for user in users], len(rows)
+
+    @staticmethod
+    def _shift(rng, midnight):
+        roll = rng.random()
+        if roll < 0.05:
+            return []
+        start = midnight + timedelta(hours=21 if roll > 0.95 else 8, minutes=rng.randint(-30, 30))
+        length = timedelta(hours=rng.uniform(7, 10))
+        events = [(start, 'in')]
+        if roll < 0.3:
+            lunch = start + timedelta(hours=4)
+            events += [(lunch, 'out'), (lunch + timedelta(minutes=rng.randint(15, 60)), 'in')]
+        if roll < 0.35:
+            events.append((start + timedelta(seconds=30), 'in'))
+        if rng.random() > 0.02:
+            events.append((start + length, 'out'))
+        return events
+
+    @staticmethod
+    def _insert(site, rows):
+        # bulk_create would send half a million rows through the ORM
+        quote = connection.ops.quote_name
+        opts = CheckIn._meta
+        fields = ('user', 'site', 'kind', 'latitude', 'longitude', 'recorded_at', 'created_at')
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(opts.db_table), ', '.join(quote(opts.get_field(name).column) for name in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        prepare_user = opts.get_field('user').target_field.get_db_prep_value
+        adapt = connection.ops.adapt_datetimefield_value
+        now = adapt(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (prepare_user(user_id, connection), site.pk, kind, 6.4281, 3.4219, adapt(moment), now)
+                for user_id, moment, kind in rows
+            ])
+
+    def _recompute(self, first_day, last_day, user_ids, workers):
+        started = time.perf_counter()
+        written = recompute_range(first_day, last_day, user_ids=user_ids, workers=workers)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Full recompute, {workers} worker{'s' if workers > 1 else ''}: {elapsed:.2f}s for {written} daily "
+            f"timesheets = {len(user_ids) / elapsed:.0f} users/s"
+        )
+        return sorted(
+            DailyTimesheet.objects.filter(user_id__in=user_ids, day__range=(first_day, last_day))
+            .values_list('user_id', 'day', 'worked_seconds', 'break_seconds', 'overtime_seconds', 'flags')
+        )
+
+    def _refresh(self, site, user_ids, last_day, options):
+        changed = random.Random(1).sample(user_ids, max(1, int(len(user_ids) * options['changed'] / 100)))
+        moment = timezone.make_aware(datetime.combine(last_day, datetime.min.time())) + timedelta(hours=20)
+        with transaction.atomic():
+            for user_id in changed:
+                CheckIn.objects.create(
+                    user_id=user_id, site=site, kind='in', latitude=6.4281, longitude=3.4219, recorded_at=moment
+                )
+        queued = TimesheetChange.objects.filter(user_id__in=user_ids).count()
+        started = time.perf_counter()
+        done = 0
+        while True:
+            batch = refresh_timesheets()
+            if not batch:
+                break
+            done += batch
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Incremental refresh after {len(changed)} users checked in: {done} of {queued} queued user-days "
+            f"in {elapsed:.3f}s"
+        )
+
+    def _report(self, first_day, last_day, staff_id):
+        view = TimesheetReportView.as_view()
+        period = {'start': first_day.isoformat(), 'end': (last_day + timedelta(days=1)).isoformat()}
+        timings = []
+        for _ in range(3):
+            request = APIRequestFactory().get('/api/v1/geoattendance/timesheets/report/', period)
+            force_authenticate(request, user=get_user_model().objects.get(pk=staff_id))
+            started = time.perf_counter()
+            response = view(request)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'Report answered {response.status_code}')
+        self.stdout.write(f"Report over {len(response.data['results'])} users: {min(timings) * 1000:.0f} ms")
+
+    @staticmethod
+    def _cleanup(run, site, user_ids):
+        # Deleted with their users, so no timesheet changes are queued for them
+        with transaction.atomic():
+            get_user_model().objects.filter(email__startswith=f'bench-{run}-').delete()
+            site.delete()
@@ -0,0 +1,223 @@
+"""
+Management command to benchmark compact location trail storage.
+
+Simulates ``--user-days`` working days of GPS pings (one every
+``--interval`` seconds for ``--hours`` hours, walking with a few metres of
+GPS jitter), uploaded ``--batch`` pings at a time. The same pings are
+stored twice:
+
+* as trail chunks, before and after :func:`compact_trails`;
+* one row per ping in a throwaway table (user, time, latitude, longitude,
+  indexed on user and time), like a model would store them, one
+  ``executemany`` per upload.
+
+Reports the bytes each takes on disk (tables and indexes), the time to
+write them, and the time to read a day back into NumPy arrays.
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from apps.geoattendance.models import TrailChunk
+from apps.geoattendance.trails import NUMPY_AVAILABLE, append_pings, compact_trails, read_trail
+
+try:
+    import numpy as np
+except ImportError:
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark columnar trail chunks against one database row per GPS ping'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Users with trails')
+        parser.add_argument('--user-days', type=int, default=200, help='Trails, one per user per day')
+        parser.add_argument('--hours', type=float, default=10, help='Hours tracked per day')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between pings')
+        parser.add_argument('--batch', type=int, default=30, help='Pings per upload')
+        parser.add_argument('--reads', type=int, default=50, help='Days read back')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users and trails')
+
+    def handle(self, *args, **options):
+        if not NUMPY_AVAILABLE:
+            raise CommandError('NumPy is not installed')
+        if min(options['users'], options['user_days'], options['batch'], options['reads']) < 1:
+            raise CommandError('--users, --user-days, --batch and --reads must be positive')
+        if options['users'] > options['user_days']:
+            raise CommandError('--users may not exceed --user-days')
+        run = uuid.uuid4().hex[:8]
+        password = make_password(None)
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(email=f'bench-{run}-{i}@example.com', password=password) for i in range(options['users'])
+        ])
+        days_back = -(-options['user_days'] // options['users'])
+        today = timezone.localdate()
+        trails = [
+            (users[i % len(users)], today - timedelta(days=1 + i // len(users)))
+            for i in range(options['user_days'])
+        ]
+        Ping = self._ping_model(run)
+        with connection.schema_editor() as editor:
+            editor.create_model(Ping)
+        try:
+            self._run(Ping, trails, days_back, options)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.delete_model(Ping)
+            if not options['keep']:
+                with transaction.atomic():
+                    TrailChunk.objects.filter(user__in=users).delete()
+                    get_user_model().objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _run(self, Ping, trails, days_back, options):
+        rng = np.random.default_rng(0)
+        pings_per_day = int(options['hours'] * 3600 / options['interval'])
+        total = pings_per_day * len(trails)
+        self.stdout.write(
+            f"Database: {connection.vendor}; {len(trails)} trails of {pings_per_day} pings "
+            f"({total} pings) over {days_back} days, uploaded {options['batch']} at a time"
+        )
+        before = self._size([TrailChunk._meta.db_table])
+        trail_write = row_write = 0.0
+        for user, day in trails:
+            times, latitudes, longitudes = self._walk(rng, day, pings_per_day, options['interval'])
+            events = [
+                {'latitude': latitude, 'longitude': longitude, 'recorded_at': moment}
+                for moment, latitude, longitude in zip(times.tolist(), latitudes.tolist(), longitudes.tolist())
+            ]
+            started = time.perf_counter()
+            for start in range(0, len(events), options['batch']):
+                append_pings(user, events[start:start + options['batch']])
+            trail_write += time.perf_counter() - started
+            started = time.perf_counter()
+            for start in range(0, len(events), options['batch']):
+                end = start + options['batch']
+                self._insert_rows(Ping, user, times[start:end], latitudes[start:end], longitudes[start:end])
+            row_write += time.perf_counter() - started
+
+        appended = self._size([TrailChunk._meta.db_table]) - before
+        started = time.perf_counter()
+        while compact_trails(before=timezone.localdate()):
+            pass
+        compact_time = time.perf_counter() - started
+        compacted = self._size([TrailChunk._meta.db_table]) - before
+        rows = self._size([Ping._meta.db_table])
+        if rows:
+            self.stdout.write(
+                f"One row per ping: {rows / 1e6:.1f} MB ({rows / total:.1f} bytes/ping); written in {row_write:.1f}s"
+            )
+            self.stdout.write(
+                f"Trail chunks as uploaded: {appended / 1e6:.1f} MB ({appended / total:.1f} bytes/ping); "
+                f"written in {trail_write:.1f}s"
+            )
+            self.stdout.write(
+                f"Trail chunks compacted: {compacted / 1e6:.1f} MB ({compacted / total:.2f} bytes/ping, "
+                f"{rows / compacted:.0f}x smaller than rows); compaction took {compact_time:.1f}s"
+            )
+        else:
+            self.stdout.write('Table sizes are only measured on SQLite (with dbstat) and PostgreSQL')
+        self._reads(Ping, trails, options['reads'], pings_per_day)
+
+    @staticmethod
+    def _walk(rng, day, count, interval):
+        """Unix times and positions of a walk with GPS jitter, starting about 8am."""
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=8)
+        times = start.timestamp() + np.arange(count) * interval + rng.uniform(0, 0.5, count).round(3)
+        # Walking at about 1.4 m/s in a wandering direction, plus about 3 m of jitter; 1e-5 degrees is about 1.1 m
+        heading = np.cumsum(rng.normal(0, 0.3, count))
+        steps = 1.4 * interval / 1.1e5
+        latitudes = 6.45 + np.cumsum(np.cos(heading) * steps) + rng.normal(0, 3 / 1.1e5, count)
+        longitudes = 3.39 + np.cumsum(np.sin(heading) * steps) + rng.normal(0, 3 / 1.1e5, count)
+        return times, latitudes, longitudes
+
+    @staticmethod
+    def _ping_model(run):
+        class Meta:
+            app_label = 'geoattendance'
+            db_table = f'bench_ping_{run}'
+            indexes = [models.Index(fields=['user_id', 'recorded_at'], name=f'bench_ping_{run}_idx')]
+
+        return type(f'BenchPing{run}', (models.Model,), {
+            '__module__': __name__,
+            'user_id': models.UUIDField(),
+            'recorded_at': models.DateTimeField(),
+            'latitude': models.FloatField(),
+            'longitude': models.FloatField(),
+            'Meta': Meta,
+        })
+
+    @staticmethod
+    def _insert_rows(Ping, user, times, latitudes, longitudes):
+        quote = connection.ops.quote_name
+        opts = Ping._meta
+        columns = [opts.get_field(name).column for name in ('user_id', 'recorded_at', 'latitude', 'longitude')]
+        sql = 'INSERT INTO {} ({}) VALUES (%s, %s, %s, %s)'.format(
+            quote(opts.db_table), ', '.join(map(quote, columns))
+        )
+        user_id = opts.get_field('user_id').get_db_prep_value(user.pk, connection)
+        adapt = connection.ops.adapt_datetimefield_value
+        zone = timezone.get_current_timezone()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (user_id, adapt(datetime.fromtimestamp(moment, zone)), latitude, longitude)
+                for moment, latitude, longitude in zip(times.tolist(), latitudes.tolist(), longitudes.tolist())
+            ])
+
+    def _reads(self, Ping, trails, reads, pings_per_day):
+        sample = random.Random(0).sample(trails, min(reads, len(trails)))
+        started = time.perf_counter()
+        for user, day in sample:
+            trail = read_trail(user.pk, day)
+            if len(trail.times) != pings_per_day:
+                raise CommandError(f'Read {len(trail.times)} pings, expected {pings_per_day}')
+        chunk_read = (time.perf_counter() - started) / len(sample)
+
+        started = time.perf_counter()
+        for user, day in sample:
+            start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            rows = list(
+                Ping.objects.filter(user_id=user.pk, recorded_at__gte=start, recorded_at__lt=start + timedelta(days=1))
+                .order_by('recorded_at').values_list('recorded_at', 'latitude', 'longitude')
+            )
+            np.array([moment.timestamp() for moment, _, _ in rows])
+            np.array([row[1:] for row in rows])
+        row_read = (time.perf_counter() - started) / len(sample)
+        self.stdout.write(
+            f"Reading a day into NumPy: trail {chunk_read * 1000:.2f} ms, rows {row_read * 1000:.1f} ms "
+            f"({row_read / chunk_read:.0f}x)"
+        )
+
+    @staticmethod
+    def _size(tables):
+        """Bytes the tables and their indexes take, where the database can tell."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT COALESCE(SUM(pg_total_relation_size(name::regclass)), 0) FROM unnest(%s) AS name',
+                    [tables],
+                )
+                return cursor.fetchone()[0]
+            if connection.vendor != 'sqlite':
+                return 0
+            names = list(tables)
+            for table in tables:
+                names += [
+                    name for name, info in connection.introspection.get_constraints(cursor, table).items()
+                    if info['index']
+                ]
+            try:
+                cursor.execute(
+                    f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({', '.join(['%s'] * len(names))})",
+                    names,
+                )
+            except Exception:
+                return 0
+            return cursor.fetchone()[0]
@@ -0,0 +1,34 @@
+"""
+Management command to rebuild GeoAttendance timesheets over a date range.
+
+For after a shift rule changes or check-ins are restored: every user with
+check-ins in the range is recomputed, spread over ``--workers`` processes.
+Day-to-day changes are picked up by the ``refresh-timesheets`` beat task
+instead.
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.geoattendance.timesheets import recompute_range
+
+
+class Command(BaseCommand):
+    help = 'Recompute GeoAttendance daily timesheets for a range of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (default: first of last month)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day, inclusive (default: today)')
+        parser.add_argument('--workers', type=int, help='Processes (default: TIMESHEET_WORKERS, 0 = one per CPU)')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        end = options['end'] or today
+        start = options['start'] or (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        if start > end:
+            raise CommandError('--start is after --end')
+        if options['workers'] is not None and options['workers'] < 0:
+            raise CommandError('--workers must not be negative')
+        written = recompute_range(start, end, workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily timesheets from {start} to {end}'))
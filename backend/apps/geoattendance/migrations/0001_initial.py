@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, verbose_name='name')),
+                ('code', models.CharField(blank=True, max_length=32, null=True, unique=True, verbose_name='code')),
+                ('address', models.CharField(blank=True, max_length=255, verbose_name='address')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'site',
+                'verbose_name_plural': 'sites',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Geofence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('circle', 'Circle'), ('polygon', 'Polygon')], default='circle', max_length=10, verbose_name='kind')),
+                ('latitude', models.FloatField(help_text='Centre of a circle; for a polygon, set from its vertices.', verbose_name='latitude')),
+                ('longitude', models.FloatField(verbose_name='longitude')),
+                ('radius', models.FloatField(blank=True, help_text='Metres; circles only.', null=True, verbose_name='radius')),
+                ('polygon', models.JSONField(blank=True, default=list, help_text='[[latitude, longitude], ...]; polygons only.', verbose_name='polygon')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofences', to='geoattendance.site')),
+            ],
+            options={
+                'verbose_name': 'geofence',
+                'verbose_name_plural': 'geofences',
+            },
+        ),
+        migrations.CreateModel(
+            name='CheckIn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('in', 'Check in'), ('out', 'Check out')], default='in', max_length=3, verbose_name='kind')),
+                ('latitude', models.FloatField(verbose_name='latitude')),
+                ('longitude', models.FloatField(verbose_name='longitude')),
+                ('accuracy', models.FloatField(blank=True, help_text='Reported by the device, metres.', null=True, verbose_name='accuracy')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('geofence', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='check_ins', to='geoattendance.geofence')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='check_ins', to='geoattendance.site')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='check_ins', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'check-in',
+                'verbose_name_plural': 'check-ins',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='geoattendan_user_id_97ac8b_idx')],
+            },
+        ),
+    ]
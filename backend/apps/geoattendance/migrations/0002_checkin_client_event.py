@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geoattendance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='checkin',
+            options={'ordering': ['-recorded_at'], 'verbose_name': 'check-in', 'verbose_name_plural': 'check-ins'},
+        ),
+        migrations.RemoveIndex(
+            model_name='checkin',
+            name='geoattendan_user_id_97ac8b_idx',
+        ),
+        migrations.AddField(
+            model_name='checkin',
+            name='client_event_id',
+            field=models.CharField(blank=True, help_text='Set by devices syncing offline check-ins; each is stored once per user.', max_length=64, null=True, verbose_name='client event ID'),
+        ),
+        migrations.AddField(
+            model_name='checkin',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When it happened; earlier than creation for offline sync.', verbose_name='recorded at'),
+        ),
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['user', 'recorded_at'], name='geoattendan_user_id_c2f35d_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='checkin',
+            constraint=models.UniqueConstraint(fields=('user', 'client_event_id'), name='geoattendance_checkin_unique_client_event'),
+        ),
+    ]
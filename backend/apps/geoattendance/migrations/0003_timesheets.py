@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geoattendance', '0002_checkin_client_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimesheetChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'timesheet change',
+                'verbose_name_plural': 'timesheet changes',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyTimesheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('worked_seconds', models.PositiveIntegerField(default=0, help_text='Paid, after breaks.', verbose_name='worked seconds')),
+                ('break_seconds', models.PositiveIntegerField(default=0, verbose_name='break seconds')),
+                ('overtime_seconds', models.PositiveIntegerField(default=0, verbose_name='overtime seconds')),
+                ('sessions', models.PositiveSmallIntegerField(default=0, verbose_name='sessions')),
+                ('first_in', models.DateTimeField(blank=True, null=True, verbose_name='first in')),
+                ('last_out', models.DateTimeField(blank=True, null=True, verbose_name='last out')),
+                ('flags', models.JSONField(blank=True, default=list, help_text='Unpaired check-ins, for review: missing_out, missing_in, open.', verbose_name='flags')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timesheets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'daily timesheet',
+                'verbose_name_plural': 'daily timesheets',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timesheetchange',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='geoattendance_timesheet_change_unique_day'),
+        ),
+        migrations.AddIndex(
+            model_name='dailytimesheet',
+            index=models.Index(fields=['day', 'user'], name='geoattendan_day_9ef7fb_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailytimesheet',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='geoattendance_timesheet_unique_day'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geoattendance', '0003_timesheets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrailChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('count', models.PositiveIntegerField(verbose_name='pings')),
+                ('start_at', models.DateTimeField(verbose_name='first ping')),
+                ('end_at', models.DateTimeField(verbose_name='last ping')),
+                ('data', models.BinaryField(verbose_name='data')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trail_chunks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'trail chunk',
+                'verbose_name_plural': 'trail chunks',
+                'indexes': [models.Index(fields=['user', 'day'], name='geoattendan_user_id_c9b18e_idx'), models.Index(fields=['day'], name='geoattendan_day_357604_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,220 @@
+"""
+Sites, geofences and check-ins for GeoAttendance.
+
+A ``Site`` is a place staff work at; its ``Geofence`` rows describe where
+it is, as circles (centre and radius in metres) or polygons (a list of
+``[latitude, longitude]`` vertices). A ``CheckIn`` records a user checking
+in or out at the site their position resolved to, either live or synced
+later from a device that was offline (see ``apps.geoattendance.sync``).
+Fences are looked up through an in-memory spatial index; see
+``apps.geoattendance.geofence``.
+
+``DailyTimesheet`` holds each user's worked time per local day, derived
+from their check-ins; a ``TimesheetChange`` marks a user-day whose
+timesheet is stale. Both are maintained by ``apps.geoattendance.timesheets``.
+
+Location trails are not stored a row per GPS ping: each ``TrailChunk``
+packs a batch of one user's pings on one day column-wise; see
+``apps.geoattendance.trails``.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class Site(models.Model):
+    """A place staff check in at."""
+
+    name = models.CharField(_('name'), max_length=150)
+    code = models.CharField(_('code'), max_length=32, unique=True, null=True, blank=True)
+    address = models.CharField(_('address'), max_length=255, blank=True)
+    is_active = models.BooleanField(_('active'), default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('site')
+        verbose_name_plural = _('sites')
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class Geofence(models.Model):
+    """An area that counts as being at a site: a circle or a polygon."""
+
+    KIND_CIRCLE = 'circle'
+    KIND_POLYGON = 'polygon'
+    KIND_CHOICES = [
+        (KIND_CIRCLE, _('Circle')),
+        (KIND_POLYGON, _('Polygon')),
+    ]
+
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='geofences')
+    kind = models.CharField(_('kind'), max_length=10, choices=KIND_CHOICES, default=KIND_CIRCLE)
+    latitude = models.FloatField(
+        _('latitude'), help_text=_('Centre of a circle; for a polygon, set from its vertices.')
+    )
+    longitude = models.FloatField(_('longitude'))
+    radius = models.FloatField(_('radius'), null=True, blank=True, help_text=_('Metres; circles only.'))
+    polygon = models.JSONField(
+        _('polygon'), default=list, blank=True, help_text=_('[[latitude, longitude], ...]; polygons only.')
+    )
+    is_active = models.BooleanField(_('active'), default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('geofence')
+        verbose_name_plural = _('geofences')
+
+    def __str__(self):
+        return f"{self.site} ({self.get_kind_display()})"
+
+    def clean(self):
+        if self.kind == self.KIND_CIRCLE:
+            if not self.radius or self.radius <= 0:
+                raise ValidationError({'radius': _('A circle needs a positive radius.')})
+        else:
+            if not isinstance(self.polygon, list) or len(self.polygon) < 3:
+                raise ValidationError({'polygon': _('A polygon needs at least three vertices.')})
+            for vertex in self.polygon:
+                if (
+                    not isinstance(vertex, (list, tuple)) or len(vertex) != 2
+                    or not all(isinstance(value, (int, float)) for value in vertex)
+                    or not -90 <= vertex[0] <= 90 or not -180 <= vertex[1] <= 180
+                ):
+                    raise ValidationError({'polygon': _('Vertices must be [latitude, longitude] pairs.')})
+
+    def save(self, *args, **kwargs):
+        if self.kind == self.KIND_POLYGON and self.polygon:
+            # The vertex average is close enough to the centre for display and ordering
+            self.latitude = sum(vertex[0] for vertex in self.polygon) / len(self.polygon)
+            self.longitude = sum(vertex[1] for vertex in self.polygon) / len(self.polygon)
+            self.radius = None
+        super().save(*args, **kwargs)
+
+
+class CheckIn(models.Model):
+    """A user checking in or out at a site."""
+
+    KIND_IN = 'in'
+    KIND_OUT = 'out'
+    KIND_CHOICES = [
+        (KIND_IN, _('Check in')),
+        (KIND_OUT, _('Check out')),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='check_ins')
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, related_name='check_ins')
+    geofence = models.ForeignKey(
+        Geofence, on_delete=models.SET_NULL, null=True, blank=True, related_name='check_ins'
+    )
+    kind = models.CharField(_('kind'), max_length=3, choices=KIND_CHOICES, default=KIND_IN)
+    latitude = models.FloatField(_('latitude'))
+    longitude = models.FloatField(_('longitude'))
+    accuracy = models.FloatField(_('accuracy'), null=True, blank=True, help_text=_('Reported by the device, metres.'))
+    client_event_id = models.CharField(
+        _('client event ID'), max_length=64, null=True, blank=True,
+        help_text=_('Set by devices syncing offline check-ins; each is stored once per user.')
+    )
+    recorded_at = models.DateTimeField(
+        _('recorded at'), default=timezone.now, help_text=_('When it happened; earlier than creation for offline sync.')
+    )
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _('check-in')
+        verbose_name_plural = _('check-ins')
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['user', 'recorded_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_event_id'], name='geoattendance_checkin_unique_client_event'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.kind} at {self.site} ({self.recorded_at:%Y-%m-%d %H:%M})"
+
+
+class DailyTimesheet(models.Model):
+    """A user's worked time on one local day, from pairing their check-ins."""
+
+    FLAG_MISSING_OUT = 'missing_out'
+    FLAG_MISSING_IN = 'missing_in'
+    FLAG_OPEN = 'open'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timesheets')
+    day = models.DateField(_('day'))
+    worked_seconds = models.PositiveIntegerField(_('worked seconds'), default=0, help_text=_('Paid, after breaks.'))
+    break_seconds = models.PositiveIntegerField(_('break seconds'), default=0)
+    overtime_seconds = models.PositiveIntegerField(_('overtime seconds'), default=0)
+    sessions = models.PositiveSmallIntegerField(_('sessions'), default=0)
+    first_in = models.DateTimeField(_('first in'), null=True, blank=True)
+    last_out = models.DateTimeField(_('last out'), null=True, blank=True)
+    flags = models.JSONField(
+        _('flags'), default=list, blank=True,
+        help_text=_('Unpaired check-ins, for review: missing_out, missing_in, open.')
+    )
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('daily timesheet')
+        verbose_name_plural = _('daily timesheets')
+        ordering = ['-day']
+        indexes = [
+            models.Index(fields=['day', 'user']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='geoattendance_timesheet_unique_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.day}: {self.worked_seconds / 3600:.2f} h"
+
+
+class TimesheetChange(models.Model):
+    """A user-day whose check-ins changed since its timesheet was computed."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField(_('day'))
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('timesheet change')
+        verbose_name_plural = _('timesheet changes')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='geoattendance_timesheet_change_unique_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.day}"
+
+
+class TrailChunk(models.Model):
+    """A batch of a user's location pings on one local day, packed by ``apps.geoattendance.trails``."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='trail_chunks')
+    day = models.DateField(_('day'))
+    count = models.PositiveIntegerField(_('pings'))
+    start_at = models.DateTimeField(_('first ping'))
+    end_at = models.DateTimeField(_('last ping'))
+    data = models.BinaryField(_('data'))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('trail chunk')
+        verbose_name_plural = _('trail chunks')
+        indexes = [
+            models.Index(fields=['user', 'day']),
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.day}: {self.count} pings"
@@ -0,0 +1,111 @@
+"""Serializers for the GeoAttendance API."""
+
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import CheckIn, DailyTimesheet, Geofence, Site
+
+
+class GeofenceSerializer(serializers.ModelSerializer):
+    """Serializer for a site's circle or polygon geofence."""
+
+    class Meta:
+        model = Geofence
+        fields = ['id', 'site', 'kind', 'latitude', 'longitude', 'radius', 'polygon', 'is_active', 'updated_at']
+        read_only_fields = ['id', 'updated_at']
+        extra_kwargs = {
+            'latitude': {'min_value': -90, 'max_value': 90, 'required': False},
+            'longitude': {'min_value': -180, 'max_value': 180, 'required': False},
+            'radius': {'min_value': 1, 'max_value': 100000},
+        }
+
+    def validate(self, attrs):
+        fence = Geofence(**{**self._current(), **attrs})
+        if fence.kind == Geofence.KIND_CIRCLE and (fence.latitude is None or fence.longitude is None):
+            raise serializers.ValidationError({'latitude': 'A circle needs a centre.'})
+        if fence.kind == Geofence.KIND_POLYGON:
+            # Set from the vertices on save
+            attrs.setdefault('latitude', 0.0)
+            attrs.setdefault('longitude', 0.0)
+        try:
+            fence.clean()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.message_dict)
+        return attrs
+
+    def _current(self):
+        if self.instance is None:
+            return {}
+        fields = ('site', 'kind', 'latitude', 'longitude', 'radius', 'polygon')
+        return {field: getattr(self.instance, field) for field in fields}
+
+
+class SiteSerializer(serializers.ModelSerializer):
+    """Serializer for a site with its geofences."""
+    geofences = GeofenceSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Site
+        fields = ['id', 'name', 'code', 'address', 'is_active', 'geofences', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+
+class CheckInSerializer(serializers.ModelSerializer):
+    """Serializer for a recorded check-in or check-out."""
+    site_name = serializers.CharField(source='site.name', read_only=True)
+
+    class Meta:
+        model = CheckIn
+        fields = [
+            'id', 'kind', 'site', 'site_name', 'geofence', 'latitude', 'longitude', 'accuracy', 'recorded_at',
+            'client_event_id', 'created_at',
+        ]
+        read_only_fields = fields
+
+
+class CheckInCreateSerializer(serializers.Serializer):
+    """Serializer for a GPS check-in or check-out request."""
+    kind = serializers.ChoiceField(choices=CheckIn.KIND_CHOICES, default=CheckIn.KIND_IN)
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    accuracy = serializers.FloatField(min_value=0, required=False, allow_null=True, default=None)
+
+
+class DailyTimesheetSerializer(serializers.ModelSerializer):
+    """Serializer for a user's worked time on one day."""
+
+    class Meta:
+        model = DailyTimesheet
+        fields = [
+            'day', 'worked_seconds', 'break_seconds', 'overtime_seconds', 'sessions', 'first_in', 'last_out', 'flags',
+            'computed_at',
+        ]
+        read_only_fields = fields
+
+
+class TimesheetTotalSerializer(serializers.Serializer):
+    """Serializer for one user's totals over a report's period."""
+    user = serializers.UUIDField()
+    email = serializers.EmailField()
+    days = serializers.IntegerField()
+    worked_seconds = serializers.IntegerField()
+    break_seconds = serializers.IntegerField()
+    overtime_seconds = serializers.IntegerField()
+    flagged_days = serializers.IntegerField()
+
+
+class TimesheetQuerySerializer(serializers.Serializer):
+    """Query parameters for timesheets: local dates, ``end`` exclusive."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        today = timezone.localdate()
+        attrs.setdefault('start', today.replace(day=1))
+        attrs.setdefault('end', today + timedelta(days=1))
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError({'end': 'Must be after start.'})
+        return attrs
@@ -0,0 +1,37 @@
+"""Signals for the GeoAttendance app."""
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .geofence import fences_changed
+from .models import CheckIn, Geofence, Site
+from .timesheets import mark_changed
+
+
+@receiver([post_save, post_delete], sender=Site)
+@receiver([post_save, post_delete], sender=Geofence)
+def refresh_geofence_index(sender, **kwargs):
+    """Rebuild the in-memory geofence index after sites or fences change."""
+    fences_changed()
+
+
+@receiver(pre_save, sender=CheckIn)
+def remember_check_in_time(sender, instance, **kwargs):
+    """Keep an edited check-in's previous user and time, whose timesheet also changes."""
+    if not instance._state.adding and instance.pk:
+        instance._previous = CheckIn.objects.filter(pk=instance.pk).values_list('user_id', 'recorded_at').first()
+
+
+@receiver(post_save, sender=CheckIn)
+@receiver(post_delete, sender=CheckIn)
+def queue_timesheet_change(sender, instance, origin=None, **kwargs):
+    """Queue the timesheets a check-in counts towards for recomputing."""
+    User = get_user_model()
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        # Deleted along with the user, whose timesheets go too
+        return
+    mark_changed(instance.user_id, [instance.recorded_at])
+    previous = getattr(instance, '_previous', None)
+    if previous and previous != (instance.user_id, instance.recorded_at):
+        mark_changed(previous[0], [previous[1]])
@@ -0,0 +1,286 @@
+"""
+Bulk sync of check-ins queued on devices while offline.
+
+A device uploads its whole queue in one request, as JSON Lines
+(``application/x-ndjson``) or a MessagePack array (``application/msgpack``),
+optionally gzip-compressed (``Content-Encoding: gzip``). Each event is an
+object with:
+
+* ``id``: the device's event ID, unique per user. Events already stored are
+  reported as duplicates, so re-sending a queue after a dropped response is
+  harmless.
+* ``kind``: ``in`` (default) or ``out``.
+* ``latitude``, ``longitude`` and optionally ``accuracy`` (metres).
+* ``recorded_at``: when it happened, ISO 8601 or Unix seconds; at most
+  ``CHECKIN_SYNC_MAX_AGE_DAYS`` old.
+
+:func:`sync_check_ins` checks each event's fields, finds stored IDs with one
+query per 500 events, resolves every position in one
+:meth:`~apps.geoattendance.geofence.FenceIndex.locate_many` call and stores
+the accepted events with one ``executemany`` INSERT, queueing the
+timesheets they change (see :mod:`apps.geoattendance.timesheets`). Every
+event gets a result, in upload order: ``created``, ``duplicate``, or the
+reason it was refused (``invalid``, ``inaccurate_location``,
+``outside_geofence``).
+"""
+import json
+import logging
+import math
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.core.metrics import timed
+from .geofence import get_index
+from .models import CheckIn
+from .timesheets import mark_changed
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+JSONL_TYPES = ('application/x-ndjson', 'application/jsonl')
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+# Stored IDs are looked up this many at a time (SQLite allows 999 query parameters)
+LOOKUP_SIZE = 500
+CLOCK_SKEW = timedelta(minutes=5)
+KINDS = {CheckIn.KIND_IN, CheckIn.KIND_OUT}
+
+
+class SyncError(Exception):
+    """An upload that cannot be read at all; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, code, status=400):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+def decode_events(body, content_type, content_encoding='', max_events=None):
+    """Decompress and parse an upload into a list of events.
+
+    Lines of JSON Lines that do not parse are kept as ``None``, so they get
+    an ``invalid`` result in their place. At most ``max_events`` (default
+    ``CHECKIN_SYNC_MAX_EVENTS``) are accepted.
+
+    Raises:
+        SyncError: Unsupported format or encoding, too large, or unreadable
+    """
+    max_bytes = getattr(settings, 'CHECKIN_SYNC_MAX_BYTES', 20 * 1024 * 1024)
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        decompressor = zlib.decompressobj(wbits=47)  # gzip or zlib, detected from the header
+        try:
+            body = decompressor.decompress(body, max_bytes)
+        except zlib.error:
+            raise SyncError('The upload is not valid gzip.', 'invalid_encoding')
+        if decompressor.unconsumed_tail:
+            raise SyncError(f'Uploads may not exceed {max_bytes} bytes uncompressed.', 'too_large', status=413)
+    elif encoding != 'identity':
+        raise SyncError(f'Unsupported Content-Encoding {encoding}.', 'unsupported_encoding', status=415)
+    elif len(body) > max_bytes:
+        raise SyncError(f'Uploads may not exceed {max_bytes} bytes uncompressed.', 'too_large', status=413)
+
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type in JSONL_TYPES:
+        events = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                events.append(None)
+    elif media_type in MSGPACK_TYPES and MSGPACK_AVAILABLE:
+        try:
+            events = msgpack.unpackb(body, raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException):
+            raise SyncError('The upload is not valid MessagePack.', 'invalid_payload')
+        if not isinstance(events, list):
+            raise SyncError('Expected an array of events.', 'invalid_payload')
+    else:
+        accepted = JSONL_TYPES + (MSGPACK_TYPES if MSGPACK_AVAILABLE else ())
+        raise SyncError(f"Send one of: {', '.join(accepted)}.", 'unsupported_media_type', status=415)
+
+    max_events = max_events or getattr(settings, 'CHECKIN_SYNC_MAX_EVENTS', 10000)
+    if len(events) > max_events:
+        raise SyncError(f'At most {max_events} events per upload.', 'too_many_events', status=413)
+    return events
+
+
+def _parse_time(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            return None
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        moment = parse_datetime(value)
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _number(value, low, high):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        return None
+    return float(value)
+
+
+def _clean(event, earliest, latest):
+    """Return ``(event id, fields, None)`` for a usable event, or ``(event id, None, problem)``."""
+    if not isinstance(event, dict):
+        return None, None, 'Not an event object.'
+    event_id = event.get('id')
+    if isinstance(event_id, int) and not isinstance(event_id, bool):
+        event_id = str(event_id)
+    if not isinstance(event_id, str) or not 0 < len(event_id) <= 64:
+        return None, None, 'id must be a string of 1 to 64 characters.'
+    kind = event.get('kind', CheckIn.KIND_IN)
+    if not isinstance(kind, str) or kind not in KINDS:
+        return event_id, None, 'kind must be "in" or "out".'
+    latitude = _number(event.get('latitude'), -90, 90)
+    longitude = _number(event.get('longitude'), -180, 180)
+    if latitude is None or longitude is None:
+        return event_id, None, 'latitude and longitude must be numbers in range.'
+    accuracy = event.get('accuracy')
+    if accuracy is not None:
+        accuracy = _number(accuracy, 0, math.inf)
+        if accuracy is None:
+            return event_id, None, 'accuracy must be a non-negative number.'
+    try:
+        recorded_at = _parse_time(event.get('recorded_at'))
+    except (ValueError, OverflowError, OSError):
+        recorded_at = None
+    if recorded_at is None:
+        return event_id, None, 'recorded_at must be an ISO 8601 time or Unix seconds.'
+    if not earliest <= recorded_at <= latest:
+        return event_id, None, 'recorded_at is in the future or too long ago.'
+    return event_id, (kind, latitude, longitude, accuracy, recorded_at), None
+
+
+def _stored_ids(user, event_ids):
+    stored = {}
+    event_ids = list(event_ids)
+    for start in range(0, len(event_ids), LOOKUP_SIZE):
+        stored.update(
+            CheckIn.objects.filter(user=user, client_event_id__in=event_ids[start:start + LOOKUP_SIZE])
+            .values_list('client_event_id', 'pk')
+        )
+    return stored
+
+
+INSERT_FIELDS = (
+    'user', 'site', 'geofence', 'kind', 'latitude', 'longitude', 'accuracy',
+    'client_event_id', 'recorded_at', 'created_at',
+)
+
+
+def _insert(user, rows, now):
+    # One parameterized INSERT per check-in via executemany: bulk_create
+    # prepares every field of every instance through the ORM, which was most
+    # of the time of a large upload. Primary keys are looked up afterwards.
+    quote = connection.ops.quote_name
+    opts = CheckIn._meta
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(opts.db_table),
+        ', '.join(quote(opts.get_field(name).column) for name in INSERT_FIELDS),
+        ', '.join(['%s'] * len(INSERT_FIELDS)),
+    )
+    user_id = opts.get_field('user').target_field.get_db_prep_value(user.pk, connection)
+    created_at = connection.ops.adapt_datetimefield_value(now)
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (user_id, site_id, fence_id, kind, latitude, longitude, accuracy, event_id, adapt(recorded_at), created_at)
+            for event_id, site_id, fence_id, (kind, latitude, longitude, accuracy, recorded_at) in rows
+        ])
+    return _stored_ids(user, [row[0] for row in rows])
+
+
+def sync_check_ins(user, events):
+    """Store a device's queued check-ins.
+
+    Args:
+        user: The user the events belong to
+        events: Decoded events, as from :func:`decode_events`
+
+    Returns:
+        dict: ``created``, ``duplicate`` and ``rejected`` counts, and
+        ``results``, one ``{'id', 'status', 'check_in'[, 'detail']}`` per
+        event in upload order
+    """
+    with timed('checkin_sync'):
+        now = timezone.now()
+        earliest = now - timedelta(days=getattr(settings, 'CHECKIN_SYNC_MAX_AGE_DAYS', 31))
+        max_accuracy = getattr(settings, 'GEOFENCE_MAX_ACCURACY', 100)
+        results, repeats = [], []
+        accepted = {}  # Event ID -> (result, fields), first occurrence only
+        for event in events:
+            event_id, fields, problem = _clean(event, earliest, now + CLOCK_SKEW)
+            result = {'id': event_id, 'status': 'invalid', 'check_in': None}
+            results.append(result)
+            if problem:
+                result['detail'] = problem
+            elif event_id in accepted:
+                repeats.append((result, accepted[event_id][0]))
+            elif fields[3] is not None and fields[3] > max_accuracy:
+                result.update(status='inaccurate_location', detail=f'Accuracy is worse than {max_accuracy:g} m.')
+            else:
+                accepted[event_id] = (result, fields)
+
+        for attempt in range(2):
+            stored = _stored_ids(user, accepted)
+            for event_id, pk in stored.items():
+                result, _ = accepted.pop(event_id)
+                result.update(status='duplicate', check_in=pk)
+            pending = list(accepted.items())
+            matches = get_index().locate_many(
+                [fields[1] for _, (_, fields) in pending], [fields[2] for _, (_, fields) in pending]
+            ) if pending else []
+            rows = []
+            for (event_id, (result, fields)), match in zip(pending, matches):
+                if match is None:
+                    result.update(status='outside_geofence', detail='Not at any site.')
+                else:
+                    rows.append((event_id, match.site_id, match.fence_id, fields))
+            try:
+                with transaction.atomic():
+                    created = _insert(user, rows, now) if rows else {}
+                    # Raw inserts send no signals
+                    mark_changed(user.pk, [row[3][4] for row in rows])
+                break
+            except IntegrityError:
+                # Another upload of the same queue stored some of these first; look them up again
+                if attempt:
+                    raise
+                logger.info(f"Check-in sync for user {user.pk} raced another upload, retrying")
+
+        for event_id, pk in created.items():
+            result, _ = accepted[event_id]
+            result.update(status='created', check_in=pk)
+        # Repeats within the upload share the first occurrence's fate
+        for result, original in repeats:
+            result.update({key: value for key, value in original.items() if key != 'id'})
+            if original['status'] == 'created':
+                result['status'] = 'duplicate'
+
+    counts = {'created': 0, 'duplicate': 0, 'rejected': 0}
+    for result in results:
+        counts[result['status'] if result['status'] in ('created', 'duplicate') else 'rejected'] += 1
+    logger.info(
+        f"Synced {len(results)} check-ins for user {user.pk}: {counts['created']} created, "
+        f"{counts['duplicate']} duplicates, {counts['rejected']} rejected"
+    )
+    return {**counts, 'results': results}
@@ -0,0 +1,31 @@
+from celery import shared_task
+
+
+@shared_task
+def refresh_timesheets_task():
+    """
+    Recompute the timesheets of every user-day whose check-ins changed.
+    """
+    from .timesheets import refresh_timesheets
+
+    total = 0
+    while True:
+        done = refresh_timesheets()
+        total += done
+        if not done:
+            return total
+
+
+@shared_task
+def compact_trails_task():
+    """
+    Merge the location trail chunks of every finished day into one per user.
+    """
+    from .trails import compact_trails
+
+    total = 0
+    while True:
+        done = compact_trails()
+        total += done
+        if not done:
+            return total
@@ -0,0 +1,371 @@
+"""
+Tests for GeoAttendance geofences and check-ins.
+"""
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .geofence import METRES_PER_DEGREE, Fence, FenceIndex, haversine, invalidate_index, locate
+from .models import CheckIn, DailyTimesheet, Geofence, Site, TimesheetChange, TrailChunk
+from .sync import MSGPACK_AVAILABLE
+from .timesheets import get_rules, pair_events, recompute_range, refresh_timesheets, summarize_day
+from .trails import NUMPY_AVAILABLE, compact_trails, decode, encode, read_trail
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+User = get_user_model()
+
+# A square block of about 220 m a side in Lagos, and a yard inside its north-east corner
+BLOCK = [[6.4500, 3.3900], [6.4500, 3.3920], [6.4520, 3.3920], [6.4520, 3.3900]]
+YARD = [[6.4510, 3.3910], [6.4510, 3.3920], [6.4520, 3.3920], [6.4520, 3.3910]]
+
+
+class FenceIndexTestCase(TestCase):
+    """Test cases for the in-memory geofence index."""
+
+    def test_circles_and_polygons(self):
+        """Positions resolve to the fence they are in, and to nothing outside."""
+        index = FenceIndex([
+            Fence(1, 10, 'circle', 6.5244, 3.3792, 100, None),
+            Fence(2, 20, 'polygon', 0, 0, None, BLOCK),
+        ])
+        step = 90 / METRES_PER_DEGREE
+        self.assertEqual(index.locate(6.5244 + step, 3.3792), (10, 1))
+        self.assertIsNone(index.locate(6.5244 + 2 * step, 3.3792))
+        self.assertEqual(index.locate(6.4505, 3.3905), (20, 2))
+        self.assertIsNone(index.locate(6.4505, 3.3925))
+        self.assertAlmostEqual(haversine(6.5244, 3.3792, 6.5244 + step, 3.3792), 90, places=3)
+
+    def test_smallest_fence_wins(self):
+        """A position in a yard inside a block, inside a campus, resolves to the yard."""
+        index = FenceIndex([
+            Fence(1, 10, 'circle', 6.451, 3.391, 50000, None),
+            Fence(2, 20, 'polygon', 0, 0, None, BLOCK),
+            Fence(3, 30, 'polygon', 0, 0, None, YARD),
+        ], max_cells=100)
+        self.assertEqual(index.locate(6.4515, 3.3915), (30, 3))
+        self.assertEqual(index.locate(6.4505, 3.3905), (20, 2))
+        # The campus is too big for the grid and is checked everywhere
+        self.assertEqual(index.locate(6.70, 3.391), (10, 1))
+
+    def test_index_follows_changes(self):
+        """Saving or deactivating fences rebuilds the index."""
+        cache.clear()
+        invalidate_index()
+        site = Site.objects.create(name='Depot')
+        self.assertIsNone(locate(6.4505, 3.3905))
+        with self.captureOnCommitCallbacks(execute=True):
+            fence = Geofence.objects.create(
+                site=site, kind=Geofence.KIND_POLYGON, latitude=0, longitude=0, polygon=BLOCK
+            )
+        self.assertEqual(locate(6.4505, 3.3905), (site.pk, fence.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            site.is_active = False
+            site.save()
+        self.assertIsNone(locate(6.4505, 3.3905))
+
+
+class CheckInTestCase(TestCase):
+    """Test cases for the check-in endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(name='Head office')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fence = Geofence.objects.create(site=self.site, latitude=6.4281, longitude=3.4219, radius=150)
+        self.user = User.objects.create_user(email='field@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_check_in_and_out(self):
+        """Check-ins inside a fence are recorded against its site and listed for the user."""
+        response = self.client.post(
+            '/api/v1/geoattendance/check-ins/', {'latitude': 6.4285, 'longitude': 3.4220, 'accuracy': 12}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['site'], response.data['geofence']), (self.site.pk, self.fence.pk))
+        response = self.client.post(
+            '/api/v1/geoattendance/check-ins/', {'kind': 'out', 'latitude': 6.4280, 'longitude': 3.4218}, format='json'
+        )
+        self.assertEqual(response.data['kind'], CheckIn.KIND_OUT)
+        self.assertEqual(self.client.get('/api/v1/geoattendance/check-ins/').data['count'], 2)
+
+    @override_settings(GEOFENCE_MAX_ACCURACY=50)
+    def test_refused_check_ins(self):
+        """Positions outside every fence, or too imprecise, are refused and not recorded."""
+        response = self.client.post(
+            '/api/v1/geoattendance/check-ins/', {'latitude': 6.4400, 'longitude': 3.4219}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['code'], 'outside_geofence')
+        response = self.client.post(
+            '/api/v1/geoattendance/check-ins/', {'latitude': 6.4281, 'longitude': 3.4219, 'accuracy': 80}, format='json'
+        )
+        self.assertEqual(response.data['code'], 'inaccurate_location')
+        self.assertFalse(CheckIn.objects.exists())
+
+    def test_geofence_validation(self):
+        """Staff manage fences; circles need a radius and polygons three vertices."""
+        admin = User.objects.create_superuser(email='ops@example.com', password='testpass123')
+        self.client.force_authenticate(user=admin)
+        response = self.client.post('/api/v1/geoattendance/geofences/', {
+            'site': self.site.pk, 'kind': 'circle', 'latitude': 6.5, 'longitude': 3.4,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('radius', response.data)
+        response = self.client.post('/api/v1/geoattendance/geofences/', {
+            'site': self.site.pk, 'kind': 'polygon', 'polygon': BLOCK,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertAlmostEqual(response.data['latitude'], 6.451)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/api/v1/geoattendance/sites/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CheckInSyncTestCase(TestCase):
+    """Test cases for bulk sync of offline check-ins."""
+
+    url = '/api/v1/geoattendance/check-ins/sync/'
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(name='Warehouse')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fence = Geofence.objects.create(site=self.site, latitude=6.4281, longitude=3.4219, radius=150)
+        self.user = User.objects.create_user(email='driver@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        recorded_at = (timezone.now() - timedelta(hours=3)).isoformat()
+        self.events = [
+            {'id': 'a', 'latitude': 6.4282, 'longitude': 3.4219, 'accuracy': 10, 'recorded_at': recorded_at},
+            {'id': 'b', 'kind': 'out', 'latitude': 6.4280, 'longitude': 3.4220, 'recorded_at': recorded_at},
+            {'id': 'a', 'latitude': 6.4282, 'longitude': 3.4219, 'recorded_at': recorded_at},
+            {'id': 'c', 'latitude': 6.5000, 'longitude': 3.4219, 'recorded_at': recorded_at},
+            {'id': 'd', 'latitude': 6.4281, 'longitude': 3.4219, 'recorded_at': 'yesterday'},
+        ]
+
+    def upload(self, events, **extra):
+        body = gzip.compress('\n'.join(json.dumps(event) for event in events).encode() + b'\n{"id": ')
+        return self.client.generic(
+            'POST', self.url, body, content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip', **extra
+        )
+
+    def test_sync_and_resync(self):
+        """Each event gets a result in order; sending the queue again stores nothing twice."""
+        response = self.upload(self.events)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['duplicate'], response.data['rejected']), (2, 1, 3))
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'created', 'duplicate', 'outside_geofence', 'invalid', 'invalid'],
+        )
+        check_in = CheckIn.objects.get(client_event_id='b')
+        self.assertEqual((check_in.site, check_in.geofence, check_in.kind), (self.site, self.fence, 'out'))
+        self.assertLess(check_in.recorded_at, check_in.created_at)
+        self.assertEqual(response.data['results'][2]['check_in'], response.data['results'][0]['check_in'])
+
+        response = self.upload(self.events)
+        self.assertEqual((response.data['created'], response.data['duplicate']), (0, 3))
+        self.assertEqual(CheckIn.objects.filter(user=self.user).count(), 2)
+
+    def test_unreadable_uploads(self):
+        """Unsupported formats and oversized queues are refused outright."""
+        response = self.client.post(self.url, self.events, format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        response = self.client.generic(
+            'POST', self.url, b'not gzip', content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.data['code'], 'invalid_encoding')
+        with override_settings(CHECKIN_SYNC_MAX_EVENTS=3):
+            self.assertEqual(self.upload(self.events).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(CheckIn.objects.exists())
+
+    @skipUnless(MSGPACK_AVAILABLE, 'msgpack is not installed')
+    def test_msgpack_upload(self):
+        """Queues may be sent as a MessagePack array."""
+        response = self.client.generic(
+            'POST', self.url, msgpack.packb(self.events[:2]), content_type='application/msgpack'
+        )
+        self.assertEqual(response.data['created'], 2)
+
+
+def local(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=minute))
+
+
+class TimesheetTestCase(TestCase):
+    """Test cases for daily timesheets computed from check-ins."""
+
+    def setUp(self):
+        self.site = Site.objects.create(name='Plant')
+        self.user = User.objects.create_user(email='shift@example.com', password='testpass123')
+        self.day = timezone.localdate() - timedelta(days=3)
+
+    def check_in(self, kind, moment, user=None):
+        return CheckIn.objects.create(
+            user=user or self.user, site=self.site, kind=kind, latitude=6.4, longitude=3.4, recorded_at=moment
+        )
+
+    def test_shift_rules(self):
+        """Double taps are ignored, night shifts count for the evening they began, breaks and overtime apply."""
+        rules = get_rules()
+        day = date(2026, 3, 2)
+        sessions = pair_events([
+            (local(day, 8), 'in'), (local(day, 8, 1), 'in'), (local(day, 12), 'out'),
+            (local(day, 12, 10), 'in'), (local(day, 18), 'out'), (local(day, 18, 1), 'out'),
+        ], rules)
+        self.assertEqual(len(sessions), 2)
+        totals = summarize_day(sessions, rules, local(day, 20))
+        # 9h50m worked with a 10 minute gap: 20 more minutes of break, 1h30m overtime
+        self.assertEqual(totals['break_seconds'], 20 * 60)
+        self.assertEqual(totals['worked_seconds'], 9 * 3600 + 30 * 60)
+        self.assertEqual(totals['overtime_seconds'], 3600 + 30 * 60)
+        self.assertEqual(totals['flags'], [])
+
+        night = pair_events([(local(day, 21), 'in'), (local(day, 29), 'out'), (local(day, 55), 'out')], rules)
+        self.assertEqual(summarize_day(night[:1], rules, local(day, 60))['worked_seconds'], 8 * 3600 - 30 * 60)
+        self.assertEqual(summarize_day(night[1:], rules, local(day, 60))['flags'], ['missing_in'])
+        forgot = pair_events([(local(day, 8), 'in')], rules)
+        self.assertEqual(summarize_day(forgot, rules, local(day, 9))['flags'], ['open'])
+        self.assertEqual(summarize_day(forgot, rules, local(day, 30))['flags'], ['missing_out'])
+
+    def test_incremental_refresh(self):
+        """Only user-days whose check-ins changed are recomputed, and edits move time between days."""
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        self.check_in('in', local(self.day, 9))
+        out = self.check_in('out', local(self.day, 13))
+        self.check_in('in', local(self.day, 9), user=other)
+        refresh_timesheets()
+        self.assertFalse(TimesheetChange.objects.exists())
+        sheet = DailyTimesheet.objects.get(user=self.user, day=self.day)
+        self.assertEqual((sheet.worked_seconds, sheet.sessions), (4 * 3600, 1))
+
+        out.recorded_at = local(self.day, 17)
+        out.save()
+        self.assertEqual(set(TimesheetChange.objects.values_list('user', flat=True)), {self.user.pk})
+        refresh_timesheets()
+        sheet.refresh_from_db()
+        self.assertEqual(sheet.worked_seconds, 8 * 3600 - 30 * 60)
+        self.assertEqual(DailyTimesheet.objects.get(user=other).flags, ['missing_out'])
+
+        out.delete()
+        refresh_timesheets()
+        sheet.refresh_from_db()
+        self.assertEqual((sheet.worked_seconds, sheet.flags), (0, ['missing_out']))
+        other.delete()
+        self.assertFalse(TimesheetChange.objects.exists())
+
+    def test_sync_report_and_recompute(self):
+        """Synced check-ins reach the report; a range recompute rebuilds the same totals."""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Geofence.objects.create(site=self.site, latitude=6.4281, longitude=3.4219, radius=150)
+        events = [
+            {'id': str(i), 'kind': kind, 'latitude': 6.4281, 'longitude': 3.4219,
+             'recorded_at': local(self.day + timedelta(days=i // 2), 8 if kind == 'in' else 14).isoformat()}
+            for i, kind in enumerate(['in', 'out'] * 2)
+        ]
+        response = client.generic(
+            'POST', '/api/v1/geoattendance/check-ins/sync/', '\n'.join(json.dumps(event) for event in events),
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.data['created'], 4)
+        refresh_timesheets()
+        period = {'start': self.day.isoformat(), 'end': (self.day + timedelta(days=2)).isoformat()}
+        self.assertEqual(client.get('/api/v1/geoattendance/timesheets/', period).data['count'], 2)
+        self.assertEqual(
+            client.get('/api/v1/geoattendance/timesheets/report/', period).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+        admin = User.objects.create_superuser(email='payroll@example.com', password='testpass123')
+        client.force_authenticate(user=admin)
+        report = client.get('/api/v1/geoattendance/timesheets/report/', period).data
+        self.assertEqual(report['pending_changes'], 0)
+        totals = report['results']
+        self.assertEqual(len(totals), 1)
+        self.assertEqual((totals[0]['days'], totals[0]['worked_seconds']), (2, 12 * 3600))
+
+        DailyTimesheet.objects.all().delete()
+        self.assertEqual(recompute_range(self.day, self.day + timedelta(days=1), workers=1), 2)
+        self.assertEqual(client.get('/api/v1/geoattendance/timesheets/report/', period).data['results'], totals)
+
+
+@skipUnless(NUMPY_AVAILABLE, 'NumPy is not installed')
+class TrailTestCase(TestCase):
+    """Test cases for compact location trail storage."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='courier@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.day = timezone.localdate() - timedelta(days=1)
+
+    def pings(self, start, count, step=5):
+        return [
+            {'latitude': 6.45 + i * 1e-5, 'longitude': -3.39 - i * 2e-5,
+             'recorded_at': (local(self.day, 9) + timedelta(seconds=step * i)).isoformat()}
+            for i in range(start, start + count)
+        ]
+
+    def upload(self, pings):
+        body = gzip.compress('\n'.join(json.dumps(ping) for ping in pings).encode())
+        return self.client.generic(
+            'POST', '/api/v1/geoattendance/trails/', body, content_type='application/x-ndjson',
+            HTTP_CONTENT_ENCODING='gzip',
+        )
+
+    def test_round_trip(self):
+        """Columns decode exactly, extreme coordinates and large jumps included."""
+        offsets = [0, 1000, 1000, 86_399_999]
+        latitudes = [900_000_000, -900_000_000, 0, 123]
+        longitudes = [-1_800_000_000, 1_800_000_000, 5, -5]
+        columns = decode(encode(offsets, latitudes, longitudes), 4)
+        self.assertEqual(columns.tolist(), [offsets, latitudes, longitudes])
+
+    def test_append_read_and_compact(self):
+        """Uploads append chunks; reads merge them in order without repeats; compaction keeps the trail."""
+        response = self.upload(self.pings(100, 100) + [{'latitude': 95, 'longitude': 3, 'recorded_at': 0}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['stored'], response.data['rejected']), (100, 1))
+        # A re-sent batch overlapping an earlier one, uploaded out of order
+        self.upload(self.pings(0, 150))
+        self.assertEqual(TrailChunk.objects.filter(user=self.user).count(), 2)
+
+        response = self.client.get(f'/api/v1/geoattendance/trails/{self.day}/')
+        self.assertEqual(response.data['count'], 200)
+        self.assertEqual(response.data['times'], sorted(response.data['times']))
+        self.assertEqual(response.data['latitudes'][:2], [6.45, 6.45001])
+        self.assertAlmostEqual(response.data['longitudes'][199], -3.39 - 199 * 2e-5, places=7)
+        first = timezone.make_aware(datetime.fromtimestamp(response.data['times'][0] / 1000))
+        self.assertEqual(first, local(self.day, 9))
+
+        trail = read_trail(self.user.pk, self.day)
+        self.assertEqual(compact_trails(before=self.day + timedelta(days=1)), 1)
+        self.assertEqual(TrailChunk.objects.get(user=self.user).count, 200)
+        compacted = read_trail(self.user.pk, self.day)
+        self.assertTrue((compacted.times == trail.times).all() and (compacted.latitudes == trail.latitudes).all())
+
+    def test_trail_access(self):
+        """Users read their own trails; staff may read anyone's."""
+        self.upload(self.pings(0, 10))
+        other = User.objects.create_user(email='nosy@example.com', password='testpass123')
+        self.client.force_authenticate(user=other)
+        url = f'/api/v1/geoattendance/trails/{self.day}/'
+        self.assertEqual(self.client.get(url, {'user': self.user.pk}).data['count'], 0)
+        other.is_staff = True
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(url, {'user': self.user.pk}).data['count'], 10)
+        self.assertEqual(self.client.get('/api/v1/geoattendance/trails/yesterday/').status_code, 400)
@@ -0,0 +1,380 @@
+"""
+Timesheets computed from GeoAttendance check-ins.
+
+Each user's check-ins are paired in ``recorded_at`` order into sessions: an
+``in`` opens one and the next ``out`` closes it. A session belongs to the
+local day (``TIME_ZONE``) it started on, so a night shift counts towards the
+evening it began. The shift rules, from settings:
+
+* ``TIMESHEET_DEBOUNCE_SECONDS``: an ``in`` or ``out`` repeating the previous
+  event's kind within this long is a double tap and ignored.
+* ``TIMESHEET_MAX_SHIFT_HOURS``: an ``in`` not closed within this long is
+  unpaired (``missing_out``), as is an ``out`` with nothing open
+  (``missing_in``). Unpaired events count no time and are flagged for review;
+  an ``in`` still within the limit is ``open``.
+* ``TIMESHEET_BREAK_AFTER_HOURS`` and ``TIMESHEET_BREAK_MINUTES``: past that
+  many hours on a day, an unpaid break is deducted, less any gap already
+  taken between sessions.
+* ``TIMESHEET_OVERTIME_AFTER_HOURS``: paid time past this is overtime.
+
+Totals are materialized in ``DailyTimesheet`` rows, so month-end reports are
+one aggregate over an indexed table (:func:`timesheet_report`). Writing or
+deleting a check-in marks the user-days it can affect with a
+``TimesheetChange`` in the same transaction (the signal handlers and the
+bulk sync call :func:`mark_changed`); :func:`refresh_timesheets`, run by
+Celery beat, recomputes only those. :func:`recompute_range` rebuilds every
+user's timesheets over a date range across a process pool, after a rule
+change or a restore.
+
+A day's totals depend only on check-ins from ``TIMESHEET_MAX_SHIFT_HOURS``
+before it starts to as long after it ends, which is all that is read.
+"""
+import logging
+import os
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .models import CheckIn, DailyTimesheet, TimesheetChange
+
+logger = logging.getLogger(__name__)
+
+# Users whose check-ins are read per query
+USER_BATCH_SIZE = 500
+
+Rules = namedtuple('Rules', 'debounce max_shift break_after break_length overtime_after')
+# end is None for an unpaired in, start is None for an unpaired out
+Session = namedtuple('Session', 'start end')
+
+TOTAL_FIELDS = ('worked_seconds', 'break_seconds', 'overtime_seconds', 'sessions', 'first_in', 'last_out', 'flags')
+
+
+def get_rules():
+    """Return the shift rules from settings."""
+    return Rules(
+        debounce=timedelta(seconds=getattr(settings, 'TIMESHEET_DEBOUNCE_SECONDS', 120)),
+        max_shift=timedelta(hours=getattr(settings, 'TIMESHEET_MAX_SHIFT_HOURS', 16)),
+        break_after=timedelta(hours=getattr(settings, 'TIMESHEET_BREAK_AFTER_HOURS', 6)),
+        break_length=timedelta(minutes=getattr(settings, 'TIMESHEET_BREAK_MINUTES', 30)),
+        overtime_after=timedelta(hours=getattr(settings, 'TIMESHEET_OVERTIME_AFTER_HOURS', 8)),
+    )
+
+
+def local_day(moment):
+    return timezone.localtime(moment).date()
+
+
+def day_start(day):
+    """Return the aware local midnight starting ``day``."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def pair_events(events, rules):
+    """Pair one user's check-ins into sessions.
+
+    Args:
+        events: ``(recorded_at, kind)`` pairs in time order
+        rules: :class:`Rules`
+
+    Returns:
+        list: :class:`Session` tuples in time order
+    """
+    sessions = []
+    opened = last_kind = last_at = None
+    for recorded_at, kind in events:
+        if kind == last_kind and recorded_at - last_at < rules.debounce:
+            continue
+        last_kind, last_at = kind, recorded_at
+        if kind == CheckIn.KIND_IN:
+            if opened is not None:
+                sessions.append(Session(opened, None))
+            opened = recorded_at
+        elif opened is None:
+            sessions.append(Session(None, recorded_at))
+        elif recorded_at - opened > rules.max_shift:
+            sessions.extend([Session(opened, None), Session(None, recorded_at)])
+            opened = None
+        else:
+            sessions.append(Session(opened, recorded_at))
+            opened = None
+    if opened is not None:
+        sessions.append(Session(opened, None))
+    return sessions
+
+
+def summarize_day(sessions, rules, now):
+    """Total one day's sessions; returns a dict of ``DailyTimesheet`` fields, or None for an empty day."""
+    if not sessions:
+        return None
+    worked = timedelta()
+    longest_gap = timedelta()
+    flags = set()
+    previous_end = first_in = last_out = None
+    paired = 0
+    for session in sessions:
+        if session.start is None:
+            flags.add(DailyTimesheet.FLAG_MISSING_IN)
+            continue
+        if session.end is None:
+            overdue = now - session.start > rules.max_shift
+            flags.add(DailyTimesheet.FLAG_MISSING_OUT if overdue else DailyTimesheet.FLAG_OPEN)
+            first_in = first_in or session.start
+            continue
+        paired += 1
+        worked += session.end - session.start
+        if previous_end is not None:
+            longest_gap = max(longest_gap, session.start - previous_end)
+        previous_end = last_out = session.end
+        first_in = first_in or session.start
+
+    unpaid = timedelta()
+    if worked > rules.break_after and longest_gap < rules.break_length:
+        unpaid = min(rules.break_length - longest_gap, worked - rules.break_after)
+    paid = worked - unpaid
+    return {
+        'worked_seconds': int(paid.total_seconds()),
+        'break_seconds': int(unpaid.total_seconds()),
+        'overtime_seconds': int(max(paid - rules.overtime_after, timedelta()).total_seconds()),
+        'sessions': paired,
+        'first_in': first_in,
+        'last_out': last_out,
+        'flags': sorted(flags),
+    }
+
+
+def affected_days(moments, rules):
+    """Return the local days whose timesheets a check-in at any of ``moments`` can change."""
+    days = set()
+    for moment in moments:
+        day, last = local_day(moment - rules.max_shift), local_day(moment + rules.max_shift)
+        while day <= last:
+            days.add(day)
+            day += timedelta(days=1)
+    return days
+
+
+def mark_changed(user_id, moments):
+    """Queue the user's timesheets around check-ins at ``moments`` for recomputing.
+
+    Call inside the transaction that changes the check-ins, so the mark is
+    committed with them.
+    """
+    days = affected_days(moments, get_rules())
+    TimesheetChange.objects.bulk_create(
+        [TimesheetChange(user_id=user_id, day=day) for day in days], batch_size=1000, ignore_conflicts=True
+    )
+
+
+def _save_timesheets(rows, now):
+    # One parameterized upsert per row via executemany: bulk_create prepares
+    # every field of every row through the ORM, which was most of a recompute
+    db = connections[router.db_for_write(DailyTimesheet)]
+    ops = db.ops
+    quote = ops.quote_name
+    opts = DailyTimesheet._meta
+    fields = [opts.get_field(name) for name in ('user', 'day', *TOTAL_FIELDS, 'computed_at')]
+    columns = [field.column for field in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({}) {}'.format(
+        quote(opts.db_table),
+        ', '.join(map(quote, columns)),
+        ', '.join(['%s'] * len(columns)),
+        ops.on_conflict_suffix_sql(fields, OnConflict.UPDATE, columns[2:], columns[:2]),
+    )
+    prepare_user = fields[0].target_field.get_db_prep_value
+    prepare_flags = opts.get_field('flags').get_db_prep_save
+    adapt = ops.adapt_datetimefield_value
+    computed_at = adapt(now)
+    flag_values = {}
+    params = []
+    for user_id, day, totals in rows:
+        flags = tuple(totals['flags'])
+        if flags not in flag_values:
+            flag_values[flags] = prepare_flags(totals['flags'], db)
+        params.append((
+            prepare_user(user_id, db), ops.adapt_datefield_value(day),
+            totals['worked_seconds'], totals['break_seconds'], totals['overtime_seconds'], totals['sessions'],
+            adapt(totals['first_in']), adapt(totals['last_out']), flag_values[flags], computed_at,
+        ))
+    with db.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def compute_timesheets(user_days, now=None):
+    """Recompute and store the timesheets of the given user-days.
+
+    Days left with no check-ins lose their ``DailyTimesheet`` row.
+
+    Args:
+        user_days: dict of user ID -> set of local dates
+        now: Time that decides between ``open`` and ``missing_out`` (default: now)
+
+    Returns:
+        int: Timesheet rows written
+    """
+    rules = get_rules()
+    now = now or timezone.now()
+    zone = timezone.get_current_timezone()
+    user_ids = sorted(user_id for user_id, days in user_days.items() if days)
+    written = 0
+    for start in range(0, len(user_ids), USER_BATCH_SIZE):
+        batch = user_ids[start:start + USER_BATCH_SIZE]
+        first = min(min(user_days[user_id]) for user_id in batch)
+        last = max(max(user_days[user_id]) for user_id in batch)
+        events = CheckIn.objects.filter(
+            user_id__in=batch,
+            recorded_at__gte=day_start(first) - rules.max_shift,
+            recorded_at__lt=day_start(last + timedelta(days=1)) + rules.max_shift,
+        ).order_by('user_id', 'recorded_at', 'pk').values_list('user_id', 'recorded_at', 'kind')
+
+        rows = []
+        found = {user_id: list(group) for user_id, group in groupby(events.iterator(), key=lambda event: event[0])}
+        for user_id in batch:
+            by_day = defaultdict(list)
+            for session in pair_events([event[1:] for event in found.get(user_id, ())], rules):
+                by_day[(session.start or session.end).astimezone(zone).date()].append(session)
+            for day in user_days[user_id]:
+                totals = summarize_day(by_day.get(day), rules, now)
+                if totals is not None:
+                    rows.append((user_id, day, totals))
+
+        written_keys = {(user_id, day) for user_id, day, _ in rows}
+        stale = [
+            pk for pk, user_id, day in DailyTimesheet.objects.filter(
+                user_id__in=batch, day__range=(first, last)
+            ).values_list('pk', 'user_id', 'day').iterator()
+            if day in user_days[user_id] and (user_id, day) not in written_keys
+        ]
+        with transaction.atomic():
+            _save_timesheets(rows, now)
+            for offset in range(0, len(stale), USER_BATCH_SIZE):
+                DailyTimesheet.objects.filter(pk__in=stale[offset:offset + USER_BATCH_SIZE]).delete()
+        written += len(rows)
+    return written
+
+
+def _claim_changes(limit):
+    """Take up to ``limit`` queued user-days off the queue, oldest first."""
+    queue = TimesheetChange.objects.order_by('marked_at')
+    if connections[queue.db].features.has_select_for_update_skip_locked:
+        queue = queue.select_for_update(skip_locked=True)
+    with transaction.atomic():
+        changes = list(queue.values_list('pk', 'user_id', 'day')[:limit])
+        TimesheetChange.objects.filter(pk__in=[pk for pk, _, _ in changes]).delete()
+    return changes
+
+
+def refresh_timesheets(limit=None):
+    """Recompute one batch of queued user-days.
+
+    The marks are removed before the check-ins are read, so a check-in
+    committed meanwhile leaves a fresh mark for the next run. If computing
+    fails, the batch is queued again.
+
+    Returns:
+        int: User-days recomputed
+    """
+    limit = limit or getattr(settings, 'TIMESHEET_REFRESH_BATCH', 2000)
+    changes = _claim_changes(limit)
+    if not changes:
+        return 0
+    user_days = defaultdict(set)
+    for _, user_id, day in changes:
+        user_days[user_id].add(day)
+    try:
+        with timed('timesheet_refresh'):
+            compute_timesheets(user_days)
+    except Exception:
+        TimesheetChange.objects.bulk_create(
+            [TimesheetChange(user_id=user_id, day=day) for _, user_id, day in changes],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        raise
+    return len(changes)
+
+
+def _recompute_chunk(user_ids, first_day, last_day):
+    days = {first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)}
+    return compute_timesheets({user_id: days for user_id in user_ids})
+
+
+def _start_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def recompute_range(first_day, last_day, user_ids=None, workers=None):
+    """Rebuild timesheets for every day from ``first_day`` to ``last_day``.
+
+    Users are split into chunks of ``USER_BATCH_SIZE`` computed in parallel
+    by ``workers`` processes (default ``TIMESHEET_WORKERS``, 0 meaning one
+    per CPU); with one worker or one chunk it runs in this process. Each
+    worker opens its own database connections. Not for Celery prefork
+    workers, whose processes may not start children; use the
+    ``recompute_timesheets`` command.
+
+    Args:
+        user_ids: Users to rebuild (default: everyone with check-ins in the
+            range or timesheets to clear)
+
+    Returns:
+        int: Timesheet rows written
+    """
+    if first_day > last_day:
+        raise ValueError('first_day is after last_day')
+    if user_ids is None:
+        rules = get_rules()
+        checked_in = CheckIn.objects.filter(
+            recorded_at__gte=day_start(first_day) - rules.max_shift,
+            recorded_at__lt=day_start(last_day + timedelta(days=1)) + rules.max_shift,
+        ).values_list('user_id', flat=True).distinct()
+        stored = DailyTimesheet.objects.filter(day__range=(first_day, last_day)).values_list('user_id', flat=True)
+        user_ids = set(checked_in) | set(stored.distinct())
+    user_ids = sorted(user_ids)
+    chunks = [user_ids[start:start + USER_BATCH_SIZE] for start in range(0, len(user_ids), USER_BATCH_SIZE)]
+    workers = getattr(settings, 'TIMESHEET_WORKERS', 0) if workers is None else workers
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+
+    with timed('timesheet_recompute'):
+        if workers <= 1:
+            written = sum(_recompute_chunk(chunk, first_day, last_day) for chunk in chunks)
+        else:
+            # Forked workers must not share this process's connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as pool:
+                written = sum(pool.map(
+                    _recompute_chunk, chunks, [first_day] * len(chunks), [last_day] * len(chunks)
+                ))
+    logger.info(
+        f"Recomputed timesheets for {len(user_ids)} users from {first_day} to {last_day} "
+        f"with {max(workers, 1)} workers: {written} rows"
+    )
+    return written
+
+
+def timesheet_report(first_day, last_day):
+    """Per-user totals from ``first_day`` to ``last_day``, read from the stored daily timesheets.
+
+    Returns:
+        QuerySet: dicts of ``user``, ``email``, ``days``, ``worked_seconds``,
+        ``break_seconds``, ``overtime_seconds`` and ``flagged_days``, by email
+    """
+    return DailyTimesheet.objects.filter(day__range=(first_day, last_day)).values(
+        'user', email=F('user__email')
+    ).annotate(
+        days=Count('pk', filter=Q(sessions__gt=0)),
+        worked_seconds=Sum('worked_seconds'),
+        break_seconds=Sum('break_seconds'),
+        overtime_seconds=Sum('overtime_seconds'),
+        flagged_days=Count('pk', filter=~Q(flags=[])),
+    ).order_by('email')
@@ -0,0 +1,225 @@
+"""
+Compact storage for GeoAttendance location trails.
+
+A row per GPS ping would soon outgrow every other table, so pings are kept
+column-wise in ``TrailChunk`` rows instead: one per upload per user per
+local day, append-only. A chunk's ``data`` is::
+
+    b'TRL1' + zlib(shuffle(time deltas | latitude deltas | longitude deltas))
+
+* Times are int32 milliseconds since the day's local midnight; latitudes and
+  longitudes are int32 units of 1e-7 degrees (about 1 cm).
+* Each column is delta-encoded (the first value is kept as is), so a trail
+  sampled every few seconds is mostly small numbers.
+* The columns' bytes are shuffled (all first bytes, then all second bytes,
+  and so on), which puts the zero high bytes of small deltas side by side,
+  before zlib.
+
+:func:`read_trail` decodes a day straight into NumPy arrays: one
+decompression, one ``frombuffer`` and one ``cumsum`` per chunk, with no
+object per ping. Chunks are merged in time order and exact repeats (a
+device re-sending a batch) dropped. :func:`compact_trails`, run daily,
+rewrites each finished day as a single chunk.
+"""
+import logging
+import zlib
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .models import TrailChunk
+from .sync import CLOCK_SKEW, _number, _parse_time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TRL1'
+# Degrees to stored integer units
+SCALE = 10 ** 7
+COLUMNS = 3
+
+# times: datetime64[ms] (UTC); latitudes and longitudes: float64 degrees
+Trail = namedtuple('Trail', 'times latitudes longitudes')
+
+
+class TrailError(Exception):
+    """A trail that cannot be stored or read."""
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise TrailError('Location trails need NumPy; install it with "pip install numpy"')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def encode(offsets, latitudes, longitudes):
+    """Pack one chunk's columns, already in time order.
+
+    Args:
+        offsets: int milliseconds since the day's local midnight
+        latitudes, longitudes: int units of 1e-7 degrees
+
+    Returns:
+        bytes: The chunk's ``data``
+    """
+    columns = np.array([offsets, latitudes, longitudes], dtype=np.int32)
+    deltas = np.diff(columns, axis=1, prepend=np.int32(0)).astype('<i4')
+    shuffled = deltas.view(np.uint8).reshape(COLUMNS, -1, 4).transpose(0, 2, 1)
+    return MAGIC + zlib.compress(shuffled.tobytes(), 6)
+
+
+def decode(data, count):
+    """Unpack a chunk into a ``(3, count)`` int32 array of offsets, latitudes and longitudes."""
+    data = bytes(data)
+    if data[:len(MAGIC)] != MAGIC:
+        raise TrailError('Not a trail chunk')
+    raw = np.frombuffer(zlib.decompress(data[len(MAGIC):]), dtype=np.uint8)
+    if raw.size != COLUMNS * 4 * count:
+        raise TrailError('Trail chunk is truncated')
+    deltas = raw.reshape(COLUMNS, 4, count).transpose(0, 2, 1).copy().view('<i4').reshape(COLUMNS, count)
+    # Sums wrap around in int32 exactly as the differences did
+    return np.cumsum(deltas, axis=1, dtype=np.int32)
+
+
+def _merge(columns):
+    """Sort chunks' columns together by time and drop exact repeats."""
+    columns = np.concatenate(columns, axis=1)
+    if columns.shape[1] > 1:
+        order = np.lexsort((columns[2], columns[1], columns[0]))
+        columns = columns[:, order]
+        repeated = np.all(columns[:, 1:] == columns[:, :-1], axis=0)
+        if repeated.any():
+            columns = columns[:, np.concatenate(([True], ~repeated))]
+    return columns
+
+
+def parse_pings(events):
+    """Split uploaded pings into per-day integer columns.
+
+    Each ping is an object with ``latitude``, ``longitude`` and
+    ``recorded_at`` (ISO 8601 or Unix seconds), at most
+    ``CHECKIN_SYNC_MAX_AGE_DAYS`` old.
+
+    Returns:
+        tuple: ``({day: (offsets, latitudes, longitudes)}, rejected count)``,
+        columns as lists of ints
+    """
+    now = timezone.now()
+    earliest = now - timedelta(days=getattr(settings, 'CHECKIN_SYNC_MAX_AGE_DAYS', 31))
+    latest = now + CLOCK_SKEW
+    zone = timezone.get_current_timezone()
+    days = defaultdict(lambda: ([], [], []))
+    starts = {}
+    rejected = 0
+    for event in events:
+        try:
+            latitude = _number(event.get('latitude'), -90, 90)
+            longitude = _number(event.get('longitude'), -180, 180)
+            recorded_at = _parse_time(event.get('recorded_at'))
+        except (AttributeError, ValueError, OverflowError, OSError):
+            latitude = recorded_at = None
+        if latitude is None or longitude is None or recorded_at is None or not earliest <= recorded_at <= latest:
+            rejected += 1
+            continue
+        day = recorded_at.astimezone(zone).date()
+        if day not in starts:
+            starts[day] = _day_start(day)
+        offsets, latitudes, longitudes = days[day]
+        offsets.append((recorded_at - starts[day]) // timedelta(milliseconds=1))
+        latitudes.append(round(latitude * SCALE))
+        longitudes.append(round(longitude * SCALE))
+    return dict(days), rejected
+
+
+def _chunk(user_id, day, columns):
+    start = _day_start(day)
+    return TrailChunk(
+        user_id=user_id, day=day, count=columns.shape[1], data=encode(*columns),
+        start_at=start + timedelta(milliseconds=int(columns[0, 0])),
+        end_at=start + timedelta(milliseconds=int(columns[0, -1])),
+    )
+
+
+def append_pings(user, events):
+    """Store uploaded pings as one new chunk per day they fall on.
+
+    Returns:
+        dict: ``stored`` and ``rejected`` counts and the ``days`` written
+    """
+    _require_numpy()
+    with timed('trail_append'):
+        days, rejected = parse_pings(events)
+        chunks = [
+            _chunk(user.pk, day, _merge([np.array(columns, dtype=np.int32)]))
+            for day, columns in sorted(days.items())
+        ]
+        TrailChunk.objects.bulk_create(chunks)
+    return {'stored': sum(chunk.count for chunk in chunks), 'rejected': rejected, 'days': sorted(days)}
+
+
+def read_trail(user_id, day):
+    """Decode a user's trail for one local day.
+
+    Returns:
+        Trail: Arrays in time order, empty if there are no pings
+    """
+    _require_numpy()
+    with timed('trail_read'):
+        chunks = TrailChunk.objects.filter(user_id=user_id, day=day).order_by('start_at').values_list('data', 'count')
+        decoded = [decode(data, count) for data, count in chunks]
+        # Every chunk is sorted and free of repeats when it is written
+        columns = decoded[0] if len(decoded) == 1 else _merge(decoded or [np.empty((COLUMNS, 0), np.int32)])
+        base = np.datetime64(timezone.make_naive(_day_start(day), dt_timezone.utc), 'ms')
+        return Trail(
+            times=base + columns[0].astype('timedelta64[ms]'),
+            latitudes=columns[1] / SCALE,
+            longitudes=columns[2] / SCALE,
+        )
+
+
+def compact_trails(before=None, limit=None):
+    """Rewrite each user-day before ``before`` that has several chunks as one.
+
+    A chunk appended to the same day meanwhile is left alone and merged on a
+    later run.
+
+    Args:
+        before: First day to leave alone (default: today, local)
+        limit: Most user-days to compact (default ``TRAIL_COMPACT_BATCH``)
+
+    Returns:
+        int: User-days compacted
+    """
+    _require_numpy()
+    before = before or timezone.localdate()
+    limit = limit or getattr(settings, 'TRAIL_COMPACT_BATCH', 1000)
+    pending = (
+        TrailChunk.objects.filter(day__lt=before).values('user', 'day').annotate(chunks=Count('pk'))
+        .filter(chunks__gt=1).order_by('day', 'user')[:limit]
+    )
+    compacted = 0
+    for group in pending:
+        with transaction.atomic():
+            chunks = list(
+                TrailChunk.objects.filter(user=group['user'], day=group['day']).values_list('pk', 'data', 'count')
+            )
+            columns = _merge([decode(data, count) for _, data, count in chunks])
+            TrailChunk.objects.filter(pk__in=[pk for pk, _, _ in chunks]).delete()
+            _chunk(group['user'], group['day'], columns).save()
+        compacted += 1
+    if compacted:
+        logger.info(f"Compacted {compacted} trail days")
+    return compacted
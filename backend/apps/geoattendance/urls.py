@@ -1,22 +1,23 @@
 """URL routing for the GeoAttendance application."""
 
 from django.urls import path
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
-
-class GeoAttendanceAPIView(APIView):
-    """
-    A simple API view for GeoAttendance functionality.
-    """
-    def get(self, request, format=None):
-        """
-        Handle GET requests.
-        """
-        return Response({"status": "GeoAttendance API is working"}, status=status.HTTP_200_OK)
+from .views import (
+    CheckInSyncView, CheckInView, GeoAttendanceAPIView, GeofenceDetailView, GeofenceListView, SiteDetailView,
+    SiteListView, TimesheetReportView, TimesheetView, TrailView,
+)
 
 app_name = 'geoattendance'
 
 urlpatterns = [
     path('', GeoAttendanceAPIView.as_view(), name='geoattendance-api'),
+    path('sites/', SiteListView.as_view(), name='site-list'),
+    path('sites/<int:pk>/', SiteDetailView.as_view(), name='site-detail'),
+    path('geofences/', GeofenceListView.as_view(), name='geofence-list'),
+    path('geofences/<int:pk>/', GeofenceDetailView.as_view(), name='geofence-detail'),
+    path('check-ins/', CheckInView.as_view(), name='check-ins'),
+    path('check-ins/sync/', CheckInSyncView.as_view(), name='check-in-sync'),
+    path('timesheets/', TimesheetView.as_view(), name='timesheets'),
+    path('timesheets/report/', TimesheetReportView.as_view(), name='timesheet-report'),
+    path('trails/', TrailView.as_view(), name='trails'),
+    path('trails/<str:day>/', TrailView.as_view(), name='trail-day'),
 ]
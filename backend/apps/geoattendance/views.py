@@ -1,6 +1,27 @@
-from rest_framework.views import APIView
+"""Views for the GeoAttendance API."""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig, ValidationError as DjangoValidationError
+from django.utils.dateparse import parse_date
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.views import APIView
+
+from apps.core.metrics import timed
+from .geofence import locate
+from .models import CheckIn, DailyTimesheet, Geofence, Site, TimesheetChange
+from .serializers import (
+    CheckInCreateSerializer, CheckInSerializer, DailyTimesheetSerializer, GeofenceSerializer, SiteSerializer,
+    TimesheetQuerySerializer, TimesheetTotalSerializer,
+)
+from .sync import SyncError, decode_events, sync_check_ins
+from .timesheets import timesheet_report
+from .trails import TrailError, append_pings, read_trail
+
+logger = logging.getLogger(__name__)
+
 
 class GeoAttendanceAPIView(APIView):
     """
@@ -11,3 +32,199 @@ class GeoAttendanceAPIView(APIView):
         Handle GET requests.
         """
         return Response({"status": "GeoAttendance API is working"}, status=status.HTTP_200_OK)
+
+
+class SiteListView(generics.ListCreateAPIView):
+    """
+    List or add sites (staff only).
+    """
+    serializer_class = SiteSerializer
+    permission_classes = [permissions.IsAdminUser]
+    queryset = Site.objects.prefetch_related('geofences')
+
+
+class SiteDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    Show, change or remove a site (staff only).
+    """
+    serializer_class = SiteSerializer
+    permission_classes = [permissions.IsAdminUser]
+    queryset = Site.objects.prefetch_related('geofences')
+
+
+class GeofenceListView(generics.ListCreateAPIView):
+    """
+    List or add geofences (staff only); ``?site=`` filters by site.
+    """
+    serializer_class = GeofenceSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_queryset(self):
+        queryset = Geofence.objects.order_by('pk')
+        if self.request.query_params.get('site'):
+            queryset = queryset.filter(site=self.request.query_params['site'])
+        return queryset
+
+
+class GeofenceDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    Show, change or remove a geofence (staff only).
+    """
+    serializer_class = GeofenceSerializer
+    permission_classes = [permissions.IsAdminUser]
+    queryset = Geofence.objects.all()
+
+
+class CheckInView(generics.ListAPIView):
+    """
+    List the current user's check-ins, or check in or out at the site the given position is in.
+    """
+    serializer_class = CheckInSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return CheckIn.objects.filter(user=self.request.user).select_related('site')
+
+    def post(self, request):
+        """Resolve the position to a site through the geofence index and record the check-in."""
+        serializer = CheckInCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        max_accuracy = getattr(settings, 'GEOFENCE_MAX_ACCURACY', 100)
+        if data['accuracy'] is not None and data['accuracy'] > max_accuracy:
+            return Response(
+                {'detail': f'Location is too imprecise (over {max_accuracy:g} m).', 'code': 'inaccurate_location'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with timed('geofence_locate'):
+            match = locate(data['latitude'], data['longitude'])
+        if match is None:
+            return Response(
+                {'detail': 'You are not at any site.', 'code': 'outside_geofence'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        check_in = CheckIn.objects.create(
+            user=request.user, site_id=match.site_id, geofence_id=match.fence_id, **data
+        )
+        logger.info(f"User {request.user.pk} checked {check_in.kind} at site {match.site_id}")
+        return Response(CheckInSerializer(check_in).data, status=status.HTTP_201_CREATED)
+
+
+class CheckInSyncView(APIView):
+    """
+    Upload check-ins a device queued while offline, as (gzipped) JSON Lines or MessagePack.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """Store every new event in one go and report a result per event."""
+        try:
+            events = decode_events(
+                request.body, request.content_type, request.META.get('HTTP_CONTENT_ENCODING', '')
+            )
+        except RequestDataTooBig:
+            return Response(
+                {'detail': 'Upload too large; compress it or split it.', 'code': 'too_large'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        except SyncError as e:
+            return Response({'detail': str(e), 'code': e.code}, status=e.status)
+        return Response(sync_check_ins(request.user, events), status=status.HTTP_200_OK)
+
+
+class TimesheetPeriodMixin:
+    """Reads ``start`` and ``end`` (local dates, ``end`` exclusive; default this month so far) as an inclusive range."""
+
+    def get_period(self):
+        serializer = TimesheetQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['start'], serializer.validated_data['end'] - timedelta(days=1)
+
+
+class TimesheetView(TimesheetPeriodMixin, generics.ListAPIView):
+    """
+    List the current user's daily timesheets, latest first.
+    """
+    serializer_class = DailyTimesheetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return DailyTimesheet.objects.filter(user=self.request.user, day__range=self.get_period())
+
+
+class TimesheetReportView(TimesheetPeriodMixin, APIView):
+    """
+    Worked time per user over a period, for payroll (staff only).
+
+    One aggregate over the stored daily timesheets, for every user at once:
+    paging it would run the aggregate again for each page. The totals trail
+    check-ins until the ``refresh-timesheets`` beat task runs;
+    ``pending_changes`` counts user-days in the period still queued.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        start, end = self.get_period()
+        with timed('timesheet_report'):
+            totals = TimesheetTotalSerializer(timesheet_report(start, end), many=True).data
+        return Response({
+            'start': start,
+            'end': end,
+            'pending_changes': TimesheetChange.objects.filter(day__range=(start, end)).count(),
+            'results': totals,
+        })
+
+
+class TrailView(APIView):
+    """
+    Upload location pings (as for check-in sync), or read a day's trail as columns.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """Append the pings to the user's trail; each upload is stored as one compressed chunk per day."""
+        try:
+            events = decode_events(
+                request.body, request.content_type, request.META.get('HTTP_CONTENT_ENCODING', ''),
+                max_events=getattr(settings, 'TRAIL_MAX_PINGS', 50000),
+            )
+            result = append_pings(request.user, events)
+        except RequestDataTooBig:
+            return Response(
+                {'detail': 'Upload too large; compress it or split it.', 'code': 'too_large'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        except SyncError as e:
+            return Response({'detail': str(e), 'code': e.code}, status=e.status)
+        except TrailError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    def get(self, request, day):
+        """Return the trail as parallel arrays: Unix milliseconds, latitudes and longitudes.
+
+        Staff may read another user's trail with ``?user=``.
+        """
+        day = parse_date(day) if isinstance(day, str) else None
+        if day is None:
+            return Response({'detail': 'Expected a date, YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+        user_id = request.user.pk
+        if request.query_params.get('user') and request.user.is_staff:
+            user_id = request.query_params['user']
+        try:
+            trail = read_trail(user_id, day)
+        except TrailError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except DjangoValidationError:
+            return Response({'user': ['Not a valid user ID.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'user': user_id,
+            'day': day,
+            'count': len(trail.times),
+            'times': trail.times.astype('int64').tolist(),
+            'latitudes': trail.latitudes.tolist(),
+            'longitudes': trail.longitudes.tolist(),
+        })
@@ -0,0 +1,40 @@
+from django.contrib import admin
+
+from .models import Artisan, Job, JobOffer, Skill
+
+
+@admin.register(Skill)
+class SkillAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'is_active', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+
+@admin.register(Artisan)
+class ArtisanAdmin(admin.ModelAdmin):
+    list_display = ('user', 'geohash', 'rating', 'rating_count', 'is_available', 'is_active', 'last_seen_at')
+    list_filter = ('is_available', 'is_active', 'skills')
+    search_fields = ('user__email', 'geohash')
+    raw_id_fields = ('user',)
+    filter_horizontal = ('skills',)
+    readonly_fields = ('geohash', 'last_seen_at', 'created_at', 'updated_at')
+
+
+class JobOfferInline(admin.TabularInline):
+    model = JobOffer
+    extra = 0
+    fields = ('artisan', 'wave', 'status', 'distance', 'score', 'created_at', 'expires_at', 'responded_at')
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'skill', 'customer', 'status', 'wave', 'artisan', 'created_at', 'assigned_at')
+    list_filter = ('status', 'skill')
+    search_fields = ('customer__email', 'artisan__user__email', 'description')
+    raw_id_fields = ('customer', 'artisan')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('wave', 'wave_expires_at', 'created_at', 'assigned_at', 'completed_at', 'updated_at')
+    inlines = [JobOfferInline]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class HandyConnectConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.handyconnect'
+
+    def ready(self):
+        import apps.handyconnect.signals  # noqa
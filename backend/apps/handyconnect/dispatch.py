@@ -0,0 +1,361 @@
+"""
+Offering HandyConnect jobs to artisans in timed waves.
+
+A posted ``Job`` is sent out in waves. Each wave offers it to the
+``DISPATCH_WAVE_SIZE`` best-scoring available artisans with the skill (see
+:mod:`apps.handyconnect.matching`) who have not been offered it yet, each
+offer open for ``DISPATCH_OFFER_SECONDS``. When a wave times out without a
+taker the next goes out, looking further afield (``MATCHING_RADIUS_KM``
+times the wave number, up to ``MATCHING_MAX_RADIUS_KM``). After
+``DISPATCH_WAVES`` waves the job is ``unfilled``.
+
+Timeouts are kept in a :class:`TimerWheel`: one timer per job for its
+current wave, not a task or a timer per offer, and each tick only looks at
+its own slot of the wheel. The database stays the source of truth: a
+timer that fires for a job someone accepted, cancelled or advanced in the
+meantime is dropped or moved, and the wheel is rebuilt from the open jobs
+on start.
+
+Scheduling is fair both ways. Jobs are served oldest first, at most
+``DISPATCH_BATCH`` per pass, the rest carried over to the next pass.
+Artisans hold at most ``DISPATCH_MAX_PENDING_OFFERS`` open offers, counted
+as a pass hands them out, so the best-rated artisan in a busy area is not
+offered every job at once and those near them get a turn.
+
+Claims are atomic on any database. :func:`accept_offer` runs conditional
+updates (``UPDATE ... WHERE status = 'pending'``) on the offer, the
+artisan (``is_available``) and the job (``status = 'open'``), in that order,
+in one transaction. Of two artisans accepting one job, or one artisan
+accepting two jobs, exactly one wins and the other gets a
+:class:`DispatchError`. Offers are also refused once ``expires_at`` has
+passed, however far behind the dispatcher is.
+
+``manage.py run_dispatcher`` keeps a wheel for its lifetime and ticks
+every ``DISPATCH_TICK`` seconds. The ``dispatch-jobs`` beat task is the
+fallback, rebuilding the wheel from the database on each run. Both can run
+at once: job rows are locked (``SKIP LOCKED`` where supported) while a
+pass advances them, and a wave is only sent if the job is still on the
+wave the pass planned for.
+"""
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .matching import artisans_changed, find_artisans
+from .models import Artisan, Job, JobOffer
+
+logger = logging.getLogger(__name__)
+
+# Candidates fetched per offer to send, to make up for those already offered, busy or at their offer limit
+CANDIDATES_PER_OFFER = 4
+
+
+class DispatchError(Exception):
+    """An offer or job that cannot be acted on; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, code, status=409):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+class TimerWheel:
+    """Hashed timing wheel of deadlines (Unix seconds) keyed by any hashable.
+
+    Scheduling and cancelling are O(1). A deadline goes in the slot of its
+    tick; a slot holds the deadlines of every rotation that falls on it, and
+    :meth:`advance` keeps the later ones. Rescheduling a key supersedes its
+    earlier deadline, which is dropped when its slot comes round.
+
+    Args:
+        tick: Resolution in seconds; each advance looks at the slots of the ticks since the last
+        slots: Slots in the wheel; one rotation is ``tick * slots`` seconds
+        start: Unix time of the first tick (default: now)
+    """
+
+    def __init__(self, tick=0.5, slots=1024, start=None):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._deadlines = {}
+        self._next = math.floor((time.time() if start is None else start) / tick)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, deadline):
+        if self._deadlines.get(key) == deadline:
+            return
+        self._deadlines[key] = deadline
+        tick = max(math.floor(deadline / self.tick), self._next)
+        self._slots[tick % len(self._slots)].append((tick, deadline, key))
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def advance(self, now):
+        """Return the keys whose deadlines are at or before ``now``, earliest first."""
+        target = math.floor(now / self.tick)
+        if target < self._next:
+            return []
+        due = []
+        # After a pause of more than a rotation every slot is visited once
+        for tick in range(self._next, min(target + 1, self._next + len(self._slots))):
+            slot = self._slots[tick % len(self._slots)]
+            kept = []
+            for entry in slot:
+                _, deadline, key = entry
+                if self._deadlines.get(key) != deadline:
+                    continue
+                if deadline <= now:
+                    due.append((deadline, key))
+                    del self._deadlines[key]
+                else:
+                    kept.append(entry)
+            slot[:] = kept
+        # The current tick's slot is looked at again, for its deadlines later in the tick
+        self._next = target
+        due.sort(key=lambda entry: entry[0])
+        return [key for _, key in due]
+
+
+def _locked(queryset):
+    """Lock the rows for this transaction, skipping rows another dispatcher holds."""
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    return queryset
+
+
+def _chunked(ids, size=5000):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class Dispatcher:
+    """Sends open jobs' offer waves as their timers fire.
+
+    Args:
+        tick: Wheel resolution in seconds (default ``DISPATCH_TICK``)
+    """
+
+    def __init__(self, tick=None, start=None):
+        self.wheel = TimerWheel(tick or getattr(settings, 'DISPATCH_TICK', 0.5), start=start)
+
+    def recover(self):
+        """Load the deadlines of every open job's current wave into the wheel."""
+        jobs = Job.objects.filter(status=Job.STATUS_OPEN, wave__gt=0).values_list('pk', 'wave_expires_at')
+        for job_id, expires_at in jobs.iterator(chunk_size=5000):
+            self.wheel.schedule(job_id, expires_at.timestamp())
+        return len(self.wheel)
+
+    def run_once(self, now=None):
+        """Send the waves that are due: first waves of new jobs, and the next of jobs whose wave timed out.
+
+        Returns:
+            dict: Counts of ``jobs`` advanced, ``offers`` sent and jobs marked ``unfilled``
+        """
+        now = now or timezone.now()
+        batch = getattr(settings, 'DISPATCH_BATCH', 1000)
+        due = self.wheel.advance(now.timestamp())
+        for job_id in due[batch:]:
+            # Oldest deadlines first; the rest go in the next pass
+            self.wheel.schedule(job_id, now.timestamp())
+        jobs = list(Job.objects.filter(pk__in=due[:batch], status=Job.STATUS_OPEN)) if due else []
+        for job in jobs:
+            if job.wave_expires_at > now:
+                # Moved on by another dispatcher
+                self.wheel.schedule(job.pk, job.wave_expires_at.timestamp())
+        jobs = [job for job in jobs if job.wave_expires_at <= now]
+        if len(jobs) < batch:
+            jobs += Job.objects.filter(status=Job.STATUS_OPEN, wave=0).order_by('created_at', 'pk')[:batch - len(jobs)]
+        if not jobs:
+            return {'jobs': 0, 'offers': 0, 'unfilled': 0}
+        jobs.sort(key=lambda job: (job.created_at, job.pk))
+        with timed('dispatch_pass'):
+            return self._send_waves(jobs, now)
+
+    def _plan(self, jobs, now):
+        """Choose each job's next wave, oldest job first; None for jobs out of waves."""
+        wave_size = getattr(settings, 'DISPATCH_WAVE_SIZE', 3)
+        waves = getattr(settings, 'DISPATCH_WAVES', 4)
+        cap = getattr(settings, 'DISPATCH_MAX_PENDING_OFFERS', 2)
+        radius = getattr(settings, 'MATCHING_RADIUS_KM', 10.0)
+        furthest = getattr(settings, 'MATCHING_MAX_RADIUS_KM', 50.0)
+
+        offered = defaultdict(set)
+        for chunk in _chunked(job.pk for job in jobs):
+            for job_id, artisan_id in JobOffer.objects.filter(job__in=chunk).values_list('job_id', 'artisan_id'):
+                offered[job_id].add(artisan_id)
+        candidates = {}
+        for job in jobs:
+            if job.wave < waves:
+                matches = find_artisans(
+                    job.latitude, job.longitude, [job.skill_id], min(radius * (job.wave + 1), furthest) * 1000,
+                    limit=len(offered[job.pk]) + wave_size * CANDIDATES_PER_OFFER,
+                )
+                candidates[job.pk] = [match for match in matches if match.artisan_id not in offered[job.pk]]
+
+        # The index may trail the database by a poll; availability and load are read fresh
+        wanted = {match.artisan_id for matches in candidates.values() for match in matches}
+        available = set()
+        for chunk in _chunked(wanted):
+            available.update(
+                Artisan.objects.filter(pk__in=chunk, is_active=True, is_available=True).values_list('pk', flat=True)
+            )
+        load = Counter()
+        for chunk in _chunked(available):
+            load.update(dict(
+                JobOffer.objects.filter(artisan__in=chunk, status=JobOffer.STATUS_PENDING, expires_at__gt=now)
+                .values_list('artisan').annotate(offers=Count('pk')).order_by()
+            ))
+
+        plans = {}
+        for job in jobs:
+            if job.pk not in candidates:
+                plans[job.pk] = (job.wave, None)
+                continue
+            chosen = []
+            for match in candidates[job.pk]:
+                if match.artisan_id in available and load[match.artisan_id] < cap:
+                    chosen.append(match)
+                    load[match.artisan_id] += 1
+                    if len(chosen) == wave_size:
+                        break
+            plans[job.pk] = (job.wave, chosen)
+        return plans
+
+    def _send_waves(self, jobs, now):
+        plans = self._plan(jobs, now)
+        deadline = now + timedelta(seconds=getattr(settings, 'DISPATCH_OFFER_SECONDS', 45))
+        with transaction.atomic():
+            # Offers before jobs, in the same order as accept_offer
+            JobOffer.objects.filter(
+                job__in=list(plans), status=JobOffer.STATUS_PENDING, expires_at__lte=now
+            ).update(status=JobOffer.STATUS_EXPIRED)
+            current = {
+                job_id: (wave, expires_at) for job_id, wave, expires_at in _locked(
+                    Job.objects.filter(pk__in=list(plans), status=Job.STATUS_OPEN)
+                ).values_list('pk', 'wave', 'wave_expires_at')
+            }
+            advancing, unfilled = defaultdict(list), []
+            for job_id, (wave, chosen) in plans.items():
+                if job_id not in current:
+                    continue
+                if current[job_id][0] != wave:
+                    if current[job_id][1]:
+                        self.wheel.schedule(job_id, current[job_id][1].timestamp())
+                elif chosen is None:
+                    unfilled.append(job_id)
+                else:
+                    advancing[wave].append(job_id)
+
+            sent = []
+            for wave, job_ids in advancing.items():
+                moved = Job.objects.filter(pk__in=job_ids, status=Job.STATUS_OPEN, wave=wave).update(
+                    wave=F('wave') + 1, wave_expires_at=deadline, updated_at=now
+                )
+                if moved != len(job_ids):
+                    # Without row locks (SQLite) another writer got in first; keep only the jobs this pass moved
+                    job_ids = list(
+                        Job.objects.filter(pk__in=job_ids, wave=wave + 1, wave_expires_at=deadline)
+                        .values_list('pk', flat=True)
+                    )
+                sent += job_ids
+            if unfilled:
+                Job.objects.filter(pk__in=unfilled, status=Job.STATUS_OPEN).update(
+                    status=Job.STATUS_UNFILLED, wave_expires_at=None, updated_at=now
+                )
+            offers = [
+                JobOffer(
+                    job_id=job_id, artisan_id=match.artisan_id, wave=plans[job_id][0] + 1, distance=match.distance,
+                    score=match.score, expires_at=deadline,
+                )
+                for job_id in sent for match in plans[job_id][1]
+            ]
+            JobOffer.objects.bulk_create(offers, batch_size=1000, ignore_conflicts=True)
+
+        for job_id in sent:
+            self.wheel.schedule(job_id, deadline.timestamp())
+        if unfilled:
+            logger.info(f"{len(unfilled)} jobs found no taker in {getattr(settings, 'DISPATCH_WAVES', 4)} waves")
+        return {'jobs': len(sent), 'offers': len(offers), 'unfilled': len(unfilled)}
+
+
+def accept_offer(offer, artisan, now=None):
+    """Take the job an offer is for, unless it expired, the job is taken or the artisan is busy.
+
+    Returns:
+        Job: The job, now assigned to ``artisan``
+
+    Raises:
+        DispatchError: ``offer_closed``, ``artisan_busy`` or ``job_taken``
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        if not JobOffer.objects.filter(
+            pk=offer.pk, artisan=artisan, status=JobOffer.STATUS_PENDING, expires_at__gt=now
+        ).update(status=JobOffer.STATUS_ACCEPTED, responded_at=now):
+            raise DispatchError('This offer has expired or was already answered.', 'offer_closed')
+        if not Artisan.objects.filter(pk=artisan.pk, is_active=True, is_available=True).update(
+            is_available=False, updated_at=now
+        ):
+            raise DispatchError('Finish or leave your current job first.', 'artisan_busy')
+        if not Job.objects.filter(pk=offer.job_id, status=Job.STATUS_OPEN).update(
+            status=Job.STATUS_ASSIGNED, artisan=artisan, assigned_at=now, wave_expires_at=None, updated_at=now
+        ):
+            raise DispatchError('Another artisan took this job.', 'job_taken')
+        # The job's other offers, and the artisan's other offers, are off
+        JobOffer.objects.filter(status=JobOffer.STATUS_PENDING, job_id=offer.job_id).update(
+            status=JobOffer.STATUS_WITHDRAWN, responded_at=now
+        )
+        JobOffer.objects.filter(status=JobOffer.STATUS_PENDING, artisan=artisan).update(
+            status=JobOffer.STATUS_WITHDRAWN, responded_at=now
+        )
+        artisans_changed()
+    logger.info(f"Artisan {artisan.pk} took job {offer.job_id}")
+    return Job.objects.get(pk=offer.job_id)
+
+
+def decline_offer(offer, artisan, now=None):
+    """Turn an offer down; the job goes to the next wave when this one times out."""
+    now = now or timezone.now()
+    if not JobOffer.objects.filter(pk=offer.pk, artisan=artisan, status=JobOffer.STATUS_PENDING).update(
+        status=JobOffer.STATUS_DECLINED, responded_at=now
+    ):
+        raise DispatchError('This offer was already answered or withdrawn.', 'offer_closed')
+
+
+def cancel_job(job, customer, now=None):
+    """Withdraw a job that no artisan has taken yet."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        JobOffer.objects.filter(job=job, status=JobOffer.STATUS_PENDING).update(
+            status=JobOffer.STATUS_WITHDRAWN, responded_at=now
+        )
+        if not Job.objects.filter(pk=job.pk, customer=customer, status=Job.STATUS_OPEN).update(
+            status=Job.STATUS_CANCELLED, wave_expires_at=None, updated_at=now
+        ):
+            raise DispatchError('Only open jobs can be cancelled.', 'job_not_open')
+
+
+def complete_job(job, artisan, now=None):
+    """Mark an assigned job done and put the artisan back on duty."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        if not Job.objects.filter(pk=job.pk, artisan=artisan, status=Job.STATUS_ASSIGNED).update(
+            status=Job.STATUS_COMPLETED, completed_at=now, updated_at=now
+        ):
+            raise DispatchError('Only your assigned jobs can be completed.', 'job_not_assigned')
+        Artisan.objects.filter(pk=artisan.pk).update(is_available=True, last_seen_at=now, updated_at=now)
+        artisans_changed()
@@ -0,0 +1,219 @@
+"""
+Management command to benchmark HandyConnect job dispatch.
+
+Puts ``--artisans`` synthetic artisans in the database over metropolitan
+Lagos and posts ``--jobs`` jobs to them at ``--rate`` a second, on a
+simulated clock that moves one ``DISPATCH_TICK`` per dispatcher pass. Each
+offer is accepted, declined or ignored at random after a few seconds, and
+accepted jobs are completed one to five minutes later, so artisans race
+for the same jobs and go off and back on duty throughout.
+
+Reports the time each pass takes, how many jobs were filled and how fast,
+and how many accepts lost a race; then checks that no job was given to two
+artisans and no artisan was given two jobs at once.
+"""
+import heapq
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from apps.handyconnect.dispatch import DispatchError, Dispatcher, accept_offer, complete_job, decline_offer
+from apps.handyconnect.matching import EARTH_RADIUS, NUMPY_AVAILABLE, geohash, invalidate_index
+from apps.handyconnect.models import Artisan, Job, JobOffer, Skill
+
+LAGOS = (6.5244, 3.3792)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark job dispatch: offer waves, racing accepts and completions on a simulated clock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artisans', type=int, default=5000, help='Artisans in the database')
+        parser.add_argument('--jobs', type=int, default=5000, help='Jobs posted')
+        parser.add_argument('--rate', type=float, default=10.0, help='Jobs posted per simulated second')
+        parser.add_argument('--skills', type=int, default=5, help='Skills')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        if not NUMPY_AVAILABLE:
+            raise CommandError('NumPy is not installed')
+        if min(options['artisans'], options['jobs'], options['skills']) < 1 or options['rate'] <= 0:
+            raise CommandError('--artisans, --jobs, --skills and --rate must be positive')
+        self.rng = random.Random(options['seed'])
+        self.run = uuid.uuid4().hex[:8]
+        try:
+            self._setup(options['artisans'], options['skills'])
+            self._simulate(options['jobs'], options['rate'])
+            self._verify()
+        finally:
+            with transaction.atomic():
+                # Users first: their jobs protect the skills
+                get_user_model().objects.filter(email__startswith=f'bench-{self.run}-').delete()
+                Skill.objects.filter(slug__startswith=f'bench-{self.run}-').delete()
+            invalidate_index()
+
+    def _position(self, spread=8000):
+        distance, bearing = abs(self.rng.gauss(0, spread)), self.rng.uniform(0, 2 * math.pi)
+        return (
+            LAGOS[0] + math.degrees(distance * math.cos(bearing) / EARTH_RADIUS),
+            LAGOS[1] + math.degrees(distance * math.sin(bearing) / EARTH_RADIUS) / math.cos(math.radians(6.5)),
+        )
+
+    def _setup(self, count, skill_count):
+        User = get_user_model()
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(email=f'bench-{self.run}-{i}@example.com', password=password) for i in range(count + 1)
+        ], batch_size=1000)
+        self.customer = users.pop()
+        self.skills = Skill.objects.bulk_create([
+            Skill(name=f'Bench {self.run} {i}', slug=f'bench-{self.run}-{i}') for i in range(skill_count)
+        ])
+        moment = timezone.now()
+        artisans = []
+        for user in users:
+            latitude, longitude = self._position()
+            artisans.append(Artisan(
+                user=user, latitude=latitude, longitude=longitude, geohash=geohash(latitude, longitude),
+                rating=round(self.rng.uniform(2.5, 5), 1), rating_count=self.rng.randint(0, 300),
+                is_available=True, last_seen_at=moment,
+            ))
+        Artisan.objects.bulk_create(artisans, batch_size=1000)
+        # As if they had last changed an hour ago, so index polls only find the changes the simulation makes
+        Artisan.objects.filter(user__in=users).update(updated_at=moment - timedelta(hours=1))
+        Through = Artisan.skills.through
+        Through.objects.bulk_create([
+            Through(artisan=artisan, skill=skill)
+            for artisan in artisans for skill in self.rng.sample(self.skills, self.rng.randint(1, 2))
+        ], batch_size=1000)
+        self.artisans = {artisan.pk: artisan for artisan in artisans}
+        invalidate_index()
+
+    def _simulate(self, job_count, rate):
+        tick = getattr(settings, 'DISPATCH_TICK', 0.5)
+        start = timezone.now()
+        dispatcher = Dispatcher(start=start.timestamp())
+        # (simulated seconds, sequence, action, offer or job id, artisan id)
+        events, sequence = [], 0
+        posted, assigned = {}, {}
+        outcomes, conflicts = Counter(), Counter()
+        timings, offers_sent = [], 0
+        last_offer = JobOffer.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        clock, step = 0.0, 0
+        open_jobs = Job.objects.filter(customer=self.customer, status=Job.STATUS_OPEN)
+
+        while len(posted) < job_count or events or open_jobs.exists():
+            step += 1
+            clock = step * tick
+            now = start + timedelta(seconds=clock)
+            arriving = min(job_count, int(clock * rate)) - len(posted)
+            if arriving > 0:
+                jobs = []
+                for _ in range(arriving):
+                    latitude, longitude = self._position(spread=10000)
+                    jobs.append(Job(
+                        customer=self.customer, skill=self.rng.choice(self.skills), latitude=latitude,
+                        longitude=longitude,
+                    ))
+                for job in Job.objects.bulk_create(jobs, batch_size=1000):
+                    posted[job.pk] = clock
+
+            started = time.perf_counter()
+            counts = dispatcher.run_once(now)
+            if counts['jobs'] or counts['unfilled']:
+                timings.append(time.perf_counter() - started)
+            offers_sent += counts['offers']
+            if counts['offers']:
+                for offer_id, artisan_id in (
+                    JobOffer.objects.filter(pk__gt=last_offer, job__customer=self.customer).order_by('pk')
+                    .values_list('pk', 'artisan_id')
+                ):
+                    last_offer = offer_id
+                    action = self.rng.choices(('accept', 'decline', 'ignore'), (0.5, 0.2, 0.3))[0]
+                    outcomes[action] += 1
+                    if action != 'ignore':
+                        sequence += 1
+                        delay = min(self.rng.expovariate(1 / 12), 60)
+                        heapq.heappush(events, (clock + delay, sequence, action, offer_id, artisan_id))
+
+            while events and events[0][0] <= clock:
+                _, _, action, target_id, artisan_id = heapq.heappop(events)
+                artisan = self.artisans[artisan_id]
+                try:
+                    if action == 'complete':
+                        complete_job(Job(pk=target_id), artisan, now)
+                    elif action == 'decline':
+                        decline_offer(JobOffer(pk=target_id), artisan, now)
+                    else:
+                        offer = JobOffer.objects.get(pk=target_id)
+                        accept_offer(offer, artisan, now)
+                        assigned[offer.job_id] = clock
+                        sequence += 1
+                        heapq.heappush(
+                            events, (clock + self.rng.uniform(60, 300), sequence, 'complete', offer.job_id, artisan_id)
+                        )
+                except DispatchError as e:
+                    conflicts[e.code] += 1
+
+        statuses = Counter(Job.objects.filter(pk__in=list(posted)).values_list('status', flat=True))
+        waits = sorted(assigned[job_id] - posted[job_id] for job_id in assigned)
+        timings.sort()
+        self.stdout.write(
+            f"{len(posted)} jobs to {len(self.artisans)} artisans over {clock:.0f} simulated seconds "
+            f"in {step} passes of {tick:g}s"
+        )
+        if timings:
+            self.stdout.write(
+                f"  Passes sending waves: {len(timings)}, p50 {timings[len(timings) // 2] * 1e3:.1f} ms, "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1e3:.1f} ms"
+            )
+        self.stdout.write(
+            f"  Offers: {offers_sent} sent ({offers_sent / len(posted):.1f} per job), "
+            f"{outcomes['accept']} accepted, {outcomes['decline']} declined, {outcomes['ignore']} ignored"
+        )
+        self.stdout.write(
+            f"  Jobs: {statuses[Job.STATUS_COMPLETED] + statuses[Job.STATUS_ASSIGNED]} filled "
+            f"({(statuses[Job.STATUS_COMPLETED] + statuses[Job.STATUS_ASSIGNED]) / len(posted):.1%}), "
+            f"{statuses[Job.STATUS_UNFILLED]} unfilled"
+        )
+        if waits:
+            self.stdout.write(
+                f"  Time to assign: p50 {waits[len(waits) // 2]:.1f}s, p90 {waits[int(len(waits) * 0.9)]:.1f}s, "
+                f"max {waits[-1]:.1f}s"
+            )
+        self.stdout.write(
+            f"  Accepts refused: {conflicts['job_taken']} job taken, {conflicts['artisan_busy']} artisan busy, "
+            f"{conflicts['offer_closed']} offer closed"
+        )
+
+    def _verify(self):
+        jobs = Job.objects.filter(customer=self.customer)
+        doubled = JobOffer.objects.filter(job__in=jobs, status=JobOffer.STATUS_ACCEPTED).values('job').annotate(
+            accepted=Count('pk')
+        ).filter(accepted__gt=1)
+        if doubled.exists():
+            raise CommandError(f'{doubled.count()} jobs were accepted by more than one artisan')
+        mismatched = jobs.filter(status__in=[Job.STATUS_ASSIGNED, Job.STATUS_COMPLETED]).exclude(
+            offers__status=JobOffer.STATUS_ACCEPTED, offers__artisan=F('artisan')
+        )
+        if mismatched.exists():
+            raise CommandError(f'{mismatched.count()} jobs went to an artisan without an accepted offer')
+        held = {}
+        for artisan_id, assigned_at, completed_at in jobs.filter(artisan__isnull=False).order_by(
+            'artisan', 'assigned_at'
+        ).values_list('artisan', 'assigned_at', 'completed_at'):
+            if artisan_id in held and (held[artisan_id] is None or held[artisan_id] > assigned_at):
+                raise CommandError(f'Artisan {artisan_id} was given a job before finishing the last')
+            held[artisan_id] = completed_at
+        self.stdout.write('  Every job went to at most one artisan, and no artisan held two jobs at once')
@@ -0,0 +1,199 @@
+"""
+Management command to benchmark HandyConnect artisan matching.
+
+Builds an index of ``--artisans`` synthetic artisans, most of them spread
+over metropolitan Lagos and the rest over the country, each with one to
+three of ``--skills`` skills. Then measures:
+
+* top-10 searches for one or two skills within ``MATCHING_RADIUS_KM``,
+  against a vectorized scan of every artisan, which must agree;
+* incremental updates (artisans moving and going on or off duty);
+* with ``--db-artisans`` real artisans in the database, polling for a
+  per cent of them changing against rebuilding the index from scratch.
+"""
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.handyconnect import matching
+from apps.handyconnect.matching import EARTH_RADIUS, NUMPY_AVAILABLE, ArtisanIndex, Candidate, build_index, geohash
+from apps.handyconnect.models import Artisan, Skill
+
+try:
+    import numpy as np
+except ImportError:
+    pass
+
+LAGOS = (6.5244, 3.3792)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the artisan matching index: searches, incremental updates and database polling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artisans', type=int, default=200000, help='Artisans in the in-memory index')
+        parser.add_argument('--skills', type=int, default=40, help='Skills')
+        parser.add_argument('--queries', type=int, default=2000, help='Searches timed')
+        parser.add_argument('--updates', type=int, default=50000, help='Incremental updates timed')
+        parser.add_argument('--db-artisans', type=int, default=20000, help='Artisans in the database (0 to skip)')
+
+    def handle(self, *args, **options):
+        if not NUMPY_AVAILABLE:
+            raise CommandError('NumPy is not installed')
+        if min(options['artisans'], options['skills'], options['queries']) < 1:
+            raise CommandError('--artisans, --skills and --queries must be positive')
+        rng = random.Random(0)
+        now = time.time()
+        skill_ids = list(range(1, options['skills'] + 1))
+        candidates = [self._candidate(rng, artisan_id, skill_ids, now) for artisan_id in range(options['artisans'])]
+
+        started = time.perf_counter()
+        index = ArtisanIndex(skill_ids, precision=getattr(settings, 'MATCHING_GEOHASH_PRECISION', 5))
+        index.update(candidates)
+        self.stdout.write(
+            f"Index of {len(index)} artisans in {len(index._cells)} cells built in {time.perf_counter() - started:.2f}s"
+        )
+        self._searches(rng, index, skill_ids, now, options['queries'])
+        if options['updates'] > 0:
+            self._updates(rng, index, skill_ids, now, options['updates'])
+            self._searches(rng, index, skill_ids, now, options['queries'] // 4, label='After the updates')
+        if options['db_artisans'] > 0:
+            self._polling(rng, options['db_artisans'])
+
+    @staticmethod
+    def _position(rng):
+        if rng.random() < 0.8:
+            # Metropolitan Lagos, denser towards the centre
+            distance, bearing = abs(rng.gauss(0, 12000)), rng.uniform(0, 2 * math.pi)
+            return (
+                LAGOS[0] + math.degrees(distance * math.cos(bearing) / EARTH_RADIUS),
+                LAGOS[1] + math.degrees(distance * math.sin(bearing) / EARTH_RADIUS) / math.cos(math.radians(6.5)),
+            )
+        return rng.uniform(4.5, 13.5), rng.uniform(3.0, 14.0)
+
+    def _candidate(self, rng, artisan_id, skill_ids, now, available=True):
+        return Candidate(
+            artisan_id, available, *self._position(rng), round(rng.uniform(2.5, 5), 1), rng.randint(0, 300),
+            now - rng.expovariate(1 / 1800), rng.sample(skill_ids, rng.randint(1, 3)),
+        )
+
+    def _searches(self, rng, index, skill_ids, now, count, label='Searches'):
+        radius = getattr(settings, 'MATCHING_RADIUS_KM', 10.0) * 1000
+        queries = [(*self._position(rng), rng.sample(skill_ids, rng.choice((1, 1, 2)))) for _ in range(count)]
+        timings, found = [], 0
+        for latitude, longitude, skills in queries:
+            started = time.perf_counter()
+            matches = index.match(latitude, longitude, skills, radius, 10, now=now)
+            timings.append(time.perf_counter() - started)
+            found += len(matches)
+        timings.sort()
+        self.stdout.write(
+            f"{label}: {count} top-10 searches within {radius / 1000:g} km, {found / count:.1f} results each; "
+            f"p50 {timings[len(timings) // 2] * 1e3:.2f} ms, p99 {timings[int(len(timings) * 0.99)] * 1e3:.2f} ms"
+        )
+
+        scan_timings = []
+        for latitude, longitude, skills in queries[:200]:
+            started = time.perf_counter()
+            expected = self._scan(index, latitude, longitude, skills, radius, now)
+            scan_timings.append(time.perf_counter() - started)
+            got = [match.artisan_id for match in index.match(latitude, longitude, skills, radius, 10, now=now)]
+            if got != expected:
+                raise CommandError(f'Index and scan disagree at {latitude}, {longitude}: {got} != {expected}')
+        scan_timings.sort()
+        self.stdout.write(
+            f"  Scanning every artisan instead: p50 {scan_timings[len(scan_timings) // 2] * 1e3:.2f} ms, "
+            f"same results"
+        )
+
+    @staticmethod
+    def _scan(index, latitude, longitude, skills, radius, now):
+        """Top 10 by scoring every artisan in the index at once, without cells."""
+        slots = np.flatnonzero(index.ids[:index._used] >= 0)
+        mask = index.skill_mask(skills)
+        slots = slots[np.all(index.skills[slots] & mask == mask, axis=1)]
+        phi = math.radians(latitude)
+        a = (
+            np.sin((index.phi[slots] - phi) / 2) ** 2
+            + math.cos(phi) * index.cos_phi[slots] * np.sin((index.lam[slots] - math.radians(longitude)) / 2) ** 2
+        )
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        near = distance <= radius
+        slots, distance = slots[near], distance[near]
+        score = (
+            0.5 * (1 - distance / radius) + 0.3 * index.quality[slots]
+            + 0.2 * np.exp2(-np.maximum(now - index.last_seen[slots], 0) / 1800)
+        )
+        order = np.lexsort((index.ids[slots], -score))[:10]
+        return index.ids[slots[order]].tolist()
+
+    def _updates(self, rng, index, skill_ids, now, count):
+        ids = list(index.slots)
+        updates = [
+            self._candidate(rng, rng.choice(ids), skill_ids, now, available=rng.random() > 0.1) for _ in range(count)
+        ]
+        started = time.perf_counter()
+        for update in updates:
+            index.update([update])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Incremental updates: {count} moves and availability changes, one at a time, in {elapsed:.2f}s "
+            f"= {count / elapsed:.0f}/s; {len(index)} artisans now available"
+        )
+
+    def _polling(self, rng, count):
+        run = uuid.uuid4().hex[:8]
+        password = make_password(None)
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(email=f'bench-{run}-{i}@example.com', password=password) for i in range(count)
+        ], batch_size=1000)
+        skills = Skill.objects.bulk_create([
+            Skill(name=f'Bench {run} {i}', slug=f'bench-{run}-{i}') for i in range(10)
+        ])
+        try:
+            moment = timezone.now()
+            artisans = []
+            for user in users:
+                latitude, longitude = self._position(rng)
+                artisans.append(Artisan(
+                    user=user, latitude=latitude, longitude=longitude, geohash=geohash(latitude, longitude),
+                    rating=4.0, rating_count=10, is_available=True, last_seen_at=moment,
+                ))
+            Artisan.objects.bulk_create(artisans, batch_size=1000)
+            # As if they had last changed an hour ago, so a poll only finds the changes made below
+            Artisan.objects.filter(user__in=users).update(updated_at=moment - timedelta(hours=1))
+            Through = Artisan.skills.through
+            Through.objects.bulk_create([
+                Through(artisan=artisan, skill=rng.choice(skills)) for artisan in artisans
+            ], batch_size=1000)
+
+            started = time.perf_counter()
+            index = build_index()
+            rebuild = time.perf_counter() - started
+            synced = timezone.now()
+            changed = rng.sample(artisans, max(1, count // 100))
+            with transaction.atomic():
+                for artisan in changed:
+                    artisan.latitude, artisan.longitude = self._position(rng)
+                    artisan.last_seen_at = timezone.now()
+                    artisan.save(update_fields=['latitude', 'longitude', 'last_seen_at'])
+            started = time.perf_counter()
+            index.update(matching.load_artisans(since=synced - matching.LATE_COMMIT))
+            poll = time.perf_counter() - started
+            self.stdout.write(
+                f"Database of {Artisan.objects.count()} artisans: rebuilding the index takes {rebuild * 1e3:.0f} ms, "
+                f"polling after {len(changed)} changed {poll * 1e3:.1f} ms"
+            )
+        finally:
+            with transaction.atomic():
+                get_user_model().objects.filter(email__startswith=f'bench-{run}-').delete()
+                Skill.objects.filter(slug__startswith=f'bench-{run}-').delete()
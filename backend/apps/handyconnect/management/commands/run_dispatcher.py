@@ -0,0 +1,44 @@
+"""
+Management command to run the HandyConnect job dispatcher as a long-lived process.
+
+Keeps offer timeouts in a timer wheel and ticks every ``DISPATCH_TICK``
+seconds, sending new jobs' first waves and the next wave of jobs nobody
+took in time. Every ``--recover`` seconds the wheel also picks up open jobs
+advanced elsewhere (by the beat task or another dispatcher).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.handyconnect.dispatch import Dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Offer HandyConnect jobs to artisans continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recover', type=float, default=60.0, help='Seconds between reloads of open jobs')
+        parser.add_argument('--once', action='store_true', help='Run until nothing is due, then exit')
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher()
+        self.stdout.write(f'Job dispatcher started with {dispatcher.recover()} open jobs')
+        recovered = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() - recovered >= options['recover']:
+                    dispatcher.recover()
+                    recovered = time.monotonic()
+                counts = dispatcher.run_once()
+                if counts['jobs'] or counts['unfilled']:
+                    self.stdout.write(
+                        f"{counts['jobs']} jobs advanced, {counts['offers']} offers sent, {counts['unfilled']} unfilled"
+                    )
+                    continue
+                if options['once']:
+                    return
+                time.sleep(dispatcher.wheel.tick)
+        except KeyboardInterrupt:
+            self.stdout.write('Job dispatcher stopped')
@@ -0,0 +1,429 @@
+"""
+In-memory index of available HandyConnect artisans.
+
+:func:`find_artisans` answers "who can fix this, near here, best first?"
+without touching the database. Every active, available artisan with a
+known position is bucketed into its geohash cell of
+``MATCHING_GEOHASH_PRECISION`` characters (5 is about 4.9 km square).
+Cells are keyed by their row and column in the geohash grid rather than by
+the base-32 string, which is the same cell without interleaving bits on
+every lookup. Per artisan, the index keeps columns of position, rating,
+last-seen time and a bitset of skills (one bit per ``Skill``, in uint64
+words).
+
+A search gathers the cells covering the search circle, keeps the
+artisans whose skill bits include every requested skill, and scores the
+rest in one vectorized pass::
+
+    score = w_distance * (1 - distance / radius)
+          + w_rating * smoothed rating / 5
+          + w_availability * 0.5 ** (minutes since last seen / MATCHING_STALE_MINUTES)
+
+The rating is smoothed towards ``PRIOR_RATING`` as if every artisan had
+``PRIOR_REVIEWS`` more reviews, so one five-star review does not beat a
+hundred 4.8s. The best ``limit`` come from ``argpartition``, not a sort of
+every candidate.
+
+Each process builds the index on first use and then keeps it current
+incrementally: at most every ``MATCHING_INDEX_REFRESH`` seconds it reads
+the artisans whose ``updated_at`` moved and moves, re-scores or drops just
+those. Re-reading a window of ``LATE_COMMIT`` before the last poll catches
+rows committed late or stamped by a server with a slow clock; applying a
+row twice is harmless. Changes that reshape the index (skills added or
+removed, artisans deleted) bump a version in the cache instead, and every
+process rebuilds.
+
+Distances are great-circle; searches crossing the antimeridian wrap.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from apps.core.metrics import timed
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8  # Metres, mean
+VERSION_KEY = 'handyconnect:artisan_index_version'
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+LATE_COMMIT = timedelta(seconds=30)
+# Ratings are smoothed as if every artisan also had this many reviews of this score
+PRIOR_RATING = 3.5
+PRIOR_REVIEWS = 5
+
+# One artisan as the index sees it; available is False to drop them
+Candidate = namedtuple(
+    'Candidate', ['id', 'available', 'latitude', 'longitude', 'rating', 'rating_count', 'last_seen', 'skill_ids']
+)
+Match = namedtuple('Match', ['artisan_id', 'distance', 'score'])
+
+
+class MatchingError(Exception):
+    """Matching is unavailable."""
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise MatchingError('Artisan matching needs NumPy; install it with "pip install numpy"')
+
+
+def _grid(precision):
+    """Rows and columns of the geohash grid at ``precision`` characters."""
+    bits = 5 * precision
+    return 1 << (bits // 2), 1 << (bits - bits // 2)
+
+
+def cell_of(latitude, longitude, precision):
+    """Return the (row, column) of the geohash cell containing a position."""
+    rows, columns = _grid(precision)
+    row = min(int((latitude + 90) / 180 * rows), rows - 1)
+    column = int((longitude + 180) / 360 * columns) % columns
+    return row, column
+
+
+def geohash(latitude, longitude, precision=12):
+    """Geohash of a position, e.g. ``geohash(6.4541, 3.3947, 5) == 's14kt'``."""
+    row, column = cell_of(latitude, longitude, precision)
+    bits = 5 * precision
+    code = 0
+    # Bits alternate longitude, latitude, starting from the most significant longitude bit
+    column_bits, row_bits = bits - bits // 2, bits // 2
+    for i in range(bits):
+        if i % 2 == 0:
+            column_bits -= 1
+            code = code << 1 | (column >> column_bits) & 1
+        else:
+            row_bits -= 1
+            code = code << 1 | (row >> row_bits) & 1
+    return ''.join(BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+class ArtisanIndex:
+    """Available artisans bucketed by geohash cell, with vectorized scoring.
+
+    Artisans live in slots of column arrays that grow as needed; a dropped
+    artisan's slot is reused. Each cell keeps a set of slots and, between
+    changes to its membership, the same slots as an array.
+
+    Args:
+        skill_ids: Every skill id, each given a bit
+        precision: Geohash characters per cell
+    """
+
+    def __init__(self, skill_ids, precision=5, capacity=1024):
+        self.precision = precision
+        self.rows, self.columns = _grid(precision)
+        self.bits = {skill_id: position for position, skill_id in enumerate(sorted(skill_ids))}
+        self.words = max(1, -(-len(self.bits) // 64))
+        self.slots = {}
+        self._free = []
+        self._used = 0
+        self._cells = {}
+        self._cell_of_slot = [None] * capacity
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.phi = np.zeros(capacity)
+        self.lam = np.zeros(capacity)
+        self.cos_phi = np.zeros(capacity)
+        self.quality = np.zeros(capacity)
+        self.last_seen = np.zeros(capacity)
+        self.skills = np.zeros((capacity, self.words), dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def skill_mask(self, skill_ids):
+        """Bitset of ``skill_ids``, or None if the index does not know one of them."""
+        words = [0] * self.words
+        for skill_id in skill_ids:
+            if skill_id not in self.bits:
+                return None
+            position = self.bits[skill_id]
+            words[position // 64] |= 1 << position % 64
+        return np.array(words, dtype=np.uint64)
+
+    def update(self, candidates):
+        """Add, move or re-score each of ``candidates``, or drop those no longer available."""
+        with self._lock:
+            for candidate in candidates:
+                if candidate.available:
+                    self._upsert(candidate)
+                else:
+                    self._remove(candidate.id)
+
+    def remove(self, artisan_ids):
+        with self._lock:
+            for artisan_id in artisan_ids:
+                self._remove(artisan_id)
+
+    def _upsert(self, candidate):
+        slot = self.slots.get(candidate.id)
+        if slot is None:
+            slot = self._allocate()
+            self.slots[candidate.id] = slot
+            self.ids[slot] = candidate.id
+        cell = cell_of(candidate.latitude, candidate.longitude, self.precision)
+        if self._cell_of_slot[slot] != cell:
+            self._leave(slot)
+            members = self._cells.get(cell)
+            if members is None:
+                members = self._cells[cell] = [set(), None]
+            members[0].add(slot)
+            members[1] = None
+            self._cell_of_slot[slot] = cell
+        self.phi[slot] = math.radians(candidate.latitude)
+        self.lam[slot] = math.radians(candidate.longitude)
+        self.cos_phi[slot] = math.cos(self.phi[slot])
+        count = candidate.rating_count or 0
+        self.quality[slot] = (
+            ((candidate.rating or 0) * count + PRIOR_RATING * PRIOR_REVIEWS) / (count + PRIOR_REVIEWS) / 5
+        )
+        self.last_seen[slot] = candidate.last_seen if candidate.last_seen is not None else -np.inf
+        mask = self.skill_mask(skill for skill in candidate.skill_ids if skill in self.bits)
+        self.skills[slot] = mask
+
+    def _remove(self, artisan_id):
+        slot = self.slots.pop(artisan_id, None)
+        if slot is None:
+            return
+        self._leave(slot)
+        self.ids[slot] = -1
+        self._free.append(slot)
+
+    def _leave(self, slot):
+        cell = self._cell_of_slot[slot]
+        if cell is None:
+            return
+        members = self._cells[cell]
+        members[0].discard(slot)
+        members[1] = None
+        if not members[0]:
+            del self._cells[cell]
+        self._cell_of_slot[slot] = None
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if self._used == len(self.ids):
+            self._grow()
+        self._used += 1
+        return self._used - 1
+
+    def _grow(self):
+        capacity = len(self.ids)
+        for name in ('ids', 'phi', 'lam', 'cos_phi', 'quality', 'last_seen', 'skills'):
+            column = getattr(self, name)
+            grown = np.full((capacity * 2, *column.shape[1:]), -1 if name == 'ids' else 0, dtype=column.dtype)
+            grown[:capacity] = column
+            setattr(self, name, grown)
+        self._cell_of_slot.extend([None] * capacity)
+
+    def _members(self, cell):
+        members = self._cells.get(cell)
+        if members is None:
+            return None
+        if members[1] is None:
+            members[1] = np.fromiter(members[0], dtype=np.int64, count=len(members[0]))
+        return members[1]
+
+    def _covering(self, latitude, longitude, radius):
+        """Cells that may hold a point within ``radius`` metres of a position."""
+        reach = math.degrees(radius / EARTH_RADIUS)
+        south = max(int((latitude - reach + 90) / 180 * self.rows), 0)
+        north = min(int((latitude + reach + 90) / 180 * self.rows), self.rows - 1)
+        widest = math.cos(math.radians(min(abs(latitude) + reach, 90.0)))
+        wide = reach / widest if widest > 1e-9 else 360.0
+        if wide >= 180:
+            columns = range(self.columns)
+        else:
+            west = math.floor((longitude - wide + 180) / 360 * self.columns)
+            east = math.floor((longitude + wide + 180) / 360 * self.columns)
+            columns = [column % self.columns for column in range(west, east + 1)]
+        if (north - south + 1) * len(columns) > len(self._cells):
+            # A wide search over a sparse index: filter the occupied cells instead
+            wanted = set(columns)
+            return [cell for cell in self._cells if south <= cell[0] <= north and cell[1] in wanted]
+        return [(row, column) for row in range(south, north + 1) for column in columns]
+
+    def match(self, latitude, longitude, skill_ids=(), radius=10000, limit=10, now=None,
+              weights=(0.5, 0.3, 0.2), stale_after=1800):
+        """Return the best-scoring available artisans near a position.
+
+        Args:
+            latitude, longitude: Where the job is, in degrees
+            skill_ids: Skills the artisan must all have
+            radius: Furthest artisan in metres
+            limit: Most artisans returned
+            now: Unix time freshness is measured at (default: now)
+            weights: Of distance, rating and availability in the score
+            stale_after: Seconds since an artisan was last seen that halve their availability
+
+        Returns:
+            list: :class:`Match` tuples, best first; distances in metres
+        """
+        with self._lock:
+            mask = self.skill_mask(skill_ids)
+            if mask is None:
+                return []
+            groups = [members for members in map(self._members, self._covering(latitude, longitude, radius))
+                      if members is not None]
+            if not groups:
+                return []
+            slots = groups[0] if len(groups) == 1 else np.concatenate(groups)
+            if mask.any():
+                slots = slots[np.all(self.skills[slots] & mask == mask, axis=1)]
+
+            phi = math.radians(latitude)
+            a = (
+                np.sin((self.phi[slots] - phi) / 2) ** 2
+                + math.cos(phi) * self.cos_phi[slots] * np.sin((self.lam[slots] - math.radians(longitude)) / 2) ** 2
+            )
+            distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+            near = distance <= radius
+            slots, distance = slots[near], distance[near]
+            if not slots.size:
+                return []
+
+            age = np.maximum((time.time() if now is None else now) - self.last_seen[slots], 0)
+            score = (
+                weights[0] * (1 - distance / radius)
+                + weights[1] * self.quality[slots]
+                + weights[2] * np.exp2(-age / stale_after)
+            )
+            if slots.size > limit:
+                best = np.argpartition(-score, limit - 1)[:limit]
+            else:
+                best = np.arange(slots.size)
+            # Ties go to the lower artisan id, so results do not depend on slot order
+            best = best[np.lexsort((self.ids[slots[best]], -score[best]))]
+            return [
+                Match(int(artisan_id), float(metres), float(points))
+                for artisan_id, metres, points in zip(self.ids[slots[best]], distance[best], score[best])
+            ]
+
+
+_state = {'index': None, 'version': None, 'checked': 0.0, 'synced': None}
+_lock = threading.Lock()
+
+
+def load_artisans(since=None):
+    """Return :class:`Candidate` tuples for every available artisan, or for every one changed since ``since``."""
+    from .models import Artisan
+    artisans = Artisan.objects.all()
+    if since is None:
+        artisans = artisans.filter(
+            is_active=True, is_available=True, latitude__isnull=False, longitude__isnull=False
+        )
+    else:
+        artisans = artisans.filter(updated_at__gte=since)
+    skills = defaultdict(list)
+    links = Artisan.skills.through.objects.filter(artisan__in=artisans.values('pk'))
+    for artisan_id, skill_id in links.values_list('artisan_id', 'skill_id').iterator(chunk_size=10000):
+        skills[artisan_id].append(skill_id)
+    rows = artisans.values_list(
+        'pk', 'is_active', 'is_available', 'latitude', 'longitude', 'rating', 'rating_count', 'last_seen_at'
+    )
+    return [
+        Candidate(
+            pk, active and available and latitude is not None and longitude is not None, latitude, longitude,
+            rating, rating_count, last_seen.timestamp() if last_seen else None, skills.get(pk, ()),
+        )
+        for pk, active, available, latitude, longitude, rating, rating_count, last_seen in rows.iterator(
+            chunk_size=5000
+        )
+    ]
+
+
+def build_index(candidates=None, skill_ids=None):
+    """Build an :class:`ArtisanIndex` from ``candidates``, or from the database."""
+    from .models import Skill
+    _require_numpy()
+    with timed('artisan_index_build'):
+        if skill_ids is None:
+            skill_ids = list(Skill.objects.values_list('pk', flat=True))
+        index = ArtisanIndex(skill_ids, precision=getattr(settings, 'MATCHING_GEOHASH_PRECISION', 5))
+        index.update(load_artisans() if candidates is None else candidates)
+    logger.info(f"Built artisan index: {len(index)} artisans in {len(index._cells)} cells")
+    return index
+
+
+def get_index():
+    """Return this process's index, rebuilt if reshaped and with recent changes applied."""
+    state = _state
+    index = state['index']
+    if index is not None and time.monotonic() - state['checked'] < getattr(settings, 'MATCHING_INDEX_REFRESH', 5):
+        return index
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    with _lock:
+        started = timezone.now()
+        if state['index'] is None or state['version'] != version:
+            state['index'] = build_index()
+            state['version'] = version
+        else:
+            with timed('artisan_index_poll'):
+                state['index'].update(load_artisans(since=state['synced'] - LATE_COMMIT))
+        state['synced'] = started
+        state['checked'] = time.monotonic()
+        return state['index']
+
+
+def invalidate_index():
+    """Drop this process's index and tell the others to rebuild theirs."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    _state['index'] = None
+
+
+def _poll_soon():
+    _state['checked'] = 0.0
+
+
+def artisans_changed():
+    """Have this process pick up artisan changes on its next search, once they commit.
+
+    Other processes find them on their next poll.
+    """
+    transaction.on_commit(_poll_soon)
+
+
+def index_reshaped():
+    """Rebuild every process's index once the transaction commits (skills or artisans removed or added)."""
+    _state['index'] = None
+    transaction.on_commit(invalidate_index)
+
+
+def find_artisans(latitude, longitude, skill_ids=(), radius=None, limit=10):
+    """Return the best available artisans for a job, as :class:`Match` tuples.
+
+    Args:
+        radius: Metres (default ``MATCHING_RADIUS_KM``)
+    """
+    _require_numpy()
+    if radius is None:
+        radius = getattr(settings, 'MATCHING_RADIUS_KM', 10.0) * 1000
+    weights = (
+        getattr(settings, 'MATCHING_DISTANCE_WEIGHT', 0.5),
+        getattr(settings, 'MATCHING_RATING_WEIGHT', 0.3),
+        getattr(settings, 'MATCHING_AVAILABILITY_WEIGHT', 0.2),
+    )
+    stale_after = getattr(settings, 'MATCHING_STALE_MINUTES', 30) * 60
+    index = get_index()
+    with timed('artisan_match'):
+        return index.match(latitude, longitude, skill_ids, radius, limit, weights=weights, stale_after=stale_after)
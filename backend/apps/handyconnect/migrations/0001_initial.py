@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Skill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                ('slug', models.SlugField(max_length=100, unique=True, verbose_name='slug')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'skill',
+                'verbose_name_plural': 'skills',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Artisan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bio', models.TextField(blank=True, verbose_name='bio')),
+                ('latitude', models.FloatField(blank=True, null=True, verbose_name='latitude')),
+                ('longitude', models.FloatField(blank=True, null=True, verbose_name='longitude')),
+                ('geohash', models.CharField(blank=True, db_index=True, editable=False, help_text='Set from the position on save.', max_length=12, verbose_name='geohash')),
+                ('rating', models.FloatField(default=0, help_text='Mean review score, 0 to 5.', verbose_name='rating')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='reviews')),
+                ('is_available', models.BooleanField(default=False, help_text='Taking jobs right now.', verbose_name='available')),
+                ('is_active', models.BooleanField(default=True, help_text='Unset to suspend the artisan.', verbose_name='active')),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True, verbose_name='last seen')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('skills', models.ManyToManyField(blank=True, related_name='artisans', to='handyconnect.skill')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='artisan', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'artisan',
+                'verbose_name_plural': 'artisans',
+            },
+        ),
+    ]
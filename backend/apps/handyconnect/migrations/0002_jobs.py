@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('handyconnect', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField(blank=True, verbose_name='description')),
+                ('latitude', models.FloatField(verbose_name='latitude')),
+                ('longitude', models.FloatField(verbose_name='longitude')),
+                ('status', models.CharField(choices=[('open', 'Open'), ('assigned', 'Assigned'), ('completed', 'Completed'), ('unfilled', 'Unfilled'), ('cancelled', 'Cancelled')], default='open', max_length=10, verbose_name='status')),
+                ('wave', models.PositiveSmallIntegerField(default=0, help_text='Offer waves sent so far.', verbose_name='wave')),
+                ('wave_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='wave expires')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('assigned_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('artisan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='handyconnect.artisan')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='handyconnect_jobs', to=settings.AUTH_USER_MODEL)),
+                ('skill', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='jobs', to='handyconnect.skill')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JobOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wave', models.PositiveSmallIntegerField(verbose_name='wave')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('expired', 'Expired'), ('withdrawn', 'Withdrawn')], default='pending', max_length=10, verbose_name='status')),
+                ('distance', models.FloatField(help_text='Metres from the job when offered.', verbose_name='distance')),
+                ('score', models.FloatField(verbose_name='score')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(verbose_name='expires')),
+                ('responded_at', models.DateTimeField(blank=True, null=True)),
+                ('artisan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='handyconnect.artisan')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='handyconnect.job')),
+            ],
+            options={
+                'verbose_name': 'job offer',
+                'verbose_name_plural': 'job offers',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['artisan', 'status'], name='handyconnec_artisan_0bfc3d_idx'), models.Index(fields=['job', 'status'], name='handyconnec_job_id_f7f460_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='joboffer',
+            constraint=models.UniqueConstraint(fields=('job', 'artisan'), name='handyconnect_offer_unique_artisan'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'wave'], name='handyconnec_status_a0b12f_idx'),
+        ),
+    ]
@@ -0,0 +1,161 @@
+"""
+Skills and artisans for HandyConnect.
+
+A ``Skill`` is a trade customers ask for (plumbing, tiling, ...). An
+``Artisan`` is a user's tradesperson profile: the skills they offer, where
+they last reported being, their rating, and whether they are taking jobs
+right now. Customers are matched with nearby available artisans through an
+in-memory index; see ``apps.handyconnect.matching``.
+
+A customer posts a ``Job``; it is offered to artisans in waves of
+``JobOffer`` rows, each open for a limited time, until one accepts. See
+``apps.handyconnect.dispatch``.
+"""
+from django.conf import settings
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class Skill(models.Model):
+    """A trade artisans offer."""
+
+    name = models.CharField(_('name'), max_length=100)
+    slug = models.SlugField(_('slug'), max_length=100, unique=True)
+    is_active = models.BooleanField(_('active'), default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('skill')
+        verbose_name_plural = _('skills')
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class Artisan(models.Model):
+    """A tradesperson's profile: skills, position, rating and availability."""
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='artisan')
+    skills = models.ManyToManyField(Skill, related_name='artisans', blank=True)
+    bio = models.TextField(_('bio'), blank=True)
+    latitude = models.FloatField(_('latitude'), null=True, blank=True)
+    longitude = models.FloatField(_('longitude'), null=True, blank=True)
+    geohash = models.CharField(
+        _('geohash'), max_length=12, blank=True, db_index=True, editable=False,
+        help_text=_('Set from the position on save.')
+    )
+    rating = models.FloatField(_('rating'), default=0, help_text=_('Mean review score, 0 to 5.'))
+    rating_count = models.PositiveIntegerField(_('reviews'), default=0)
+    is_available = models.BooleanField(_('available'), default=False, help_text=_('Taking jobs right now.'))
+    is_active = models.BooleanField(_('active'), default=True, help_text=_('Unset to suspend the artisan.'))
+    last_seen_at = models.DateTimeField(_('last seen'), null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Polled by the matching index for changes
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = _('artisan')
+        verbose_name_plural = _('artisans')
+
+    def __str__(self):
+        return str(self.user)
+
+    @property
+    def is_matchable(self):
+        return self.is_active and self.is_available and self.latitude is not None and self.longitude is not None
+
+    def save(self, *args, **kwargs):
+        from .matching import geohash
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        if kwargs.get('update_fields') is not None:
+            # The matching index only sees changes that move updated_at
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'geohash', 'updated_at'}
+        super().save(*args, **kwargs)
+
+
+class Job(models.Model):
+    """Work a customer posted, offered to artisans until one takes it."""
+
+    STATUS_OPEN = 'open'
+    STATUS_ASSIGNED = 'assigned'
+    STATUS_COMPLETED = 'completed'
+    STATUS_UNFILLED = 'unfilled'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, _('Open')),
+        (STATUS_ASSIGNED, _('Assigned')),
+        (STATUS_COMPLETED, _('Completed')),
+        (STATUS_UNFILLED, _('Unfilled')),
+        (STATUS_CANCELLED, _('Cancelled')),
+    ]
+
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='handyconnect_jobs')
+    skill = models.ForeignKey(Skill, on_delete=models.PROTECT, related_name='jobs')
+    description = models.TextField(_('description'), blank=True)
+    latitude = models.FloatField(_('latitude'))
+    longitude = models.FloatField(_('longitude'))
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    artisan = models.ForeignKey(Artisan, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    wave = models.PositiveSmallIntegerField(_('wave'), default=0, help_text=_('Offer waves sent so far.'))
+    wave_expires_at = models.DateTimeField(_('wave expires'), null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    assigned_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('job')
+        verbose_name_plural = _('jobs')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'wave']),
+        ]
+
+    def __str__(self):
+        return f"{self.skill} for {self.customer} ({self.get_status_display()})"
+
+
+class JobOffer(models.Model):
+    """A job offered to one artisan, open until ``expires_at``."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_ACCEPTED = 'accepted'
+    STATUS_DECLINED = 'declined'
+    STATUS_EXPIRED = 'expired'
+    STATUS_WITHDRAWN = 'withdrawn'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_ACCEPTED, _('Accepted')),
+        (STATUS_DECLINED, _('Declined')),
+        (STATUS_EXPIRED, _('Expired')),
+        (STATUS_WITHDRAWN, _('Withdrawn')),
+    ]
+
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='offers')
+    artisan = models.ForeignKey(Artisan, on_delete=models.CASCADE, related_name='offers')
+    wave = models.PositiveSmallIntegerField(_('wave'))
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    distance = models.FloatField(_('distance'), help_text=_('Metres from the job when offered.'))
+    score = models.FloatField(_('score'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(_('expires'))
+    responded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('job offer')
+        verbose_name_plural = _('job offers')
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'artisan'], name='handyconnect_offer_unique_artisan'),
+        ]
+        indexes = [
+            models.Index(fields=['artisan', 'status']),
+            models.Index(fields=['job', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.job} to {self.artisan} ({self.get_status_display()})"
@@ -0,0 +1,136 @@
+"""Serializers for the HandyConnect API."""
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import Artisan, Job, JobOffer, Skill
+
+
+class SkillSerializer(serializers.ModelSerializer):
+    """Serializer for a trade artisans offer."""
+
+    class Meta:
+        model = Skill
+        fields = ['id', 'name', 'slug', 'is_active']
+        read_only_fields = ['id']
+
+
+class ArtisanSerializer(serializers.ModelSerializer):
+    """Serializer for an artisan's own profile; rating fields are kept by the platform."""
+    email = serializers.EmailField(source='user.email', read_only=True)
+    skills = serializers.SlugRelatedField(
+        slug_field='slug', many=True, required=False, queryset=Skill.objects.filter(is_active=True)
+    )
+
+    class Meta:
+        model = Artisan
+        fields = [
+            'id', 'email', 'skills', 'bio', 'latitude', 'longitude', 'geohash', 'rating', 'rating_count',
+            'is_available', 'is_active', 'last_seen_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'geohash', 'rating', 'rating_count', 'is_active', 'last_seen_at', 'updated_at']
+        extra_kwargs = {
+            'latitude': {'min_value': -90, 'max_value': 90},
+            'longitude': {'min_value': -180, 'max_value': 180},
+        }
+
+    def validate(self, attrs):
+        latitude = attrs.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = attrs.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError({'longitude': 'Give both latitude and longitude, or neither.'})
+        return attrs
+
+
+class MatchQuerySerializer(serializers.Serializer):
+    """Query parameters for a match: one of the user's jobs, or (staff only) a place and skill slugs
+    (comma-separated); and how far to look."""
+    job = serializers.IntegerField(required=False)
+    latitude = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    longitude = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    skills = serializers.CharField(required=False, default='')
+    radius_km = serializers.FloatField(min_value=0.1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def validate_radius_km(self, value):
+        furthest = getattr(settings, 'MATCHING_MAX_RADIUS_KM', 50.0)
+        if value > furthest:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {furthest:g}.')
+        return value
+
+    def validate_skills(self, value):
+        slugs = {slug.strip() for slug in value.split(',') if slug.strip()}
+        skills = dict(Skill.objects.filter(slug__in=slugs, is_active=True).values_list('slug', 'pk'))
+        unknown = sorted(slugs - set(skills))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown skills: {', '.join(unknown)}.")
+        return list(skills.values())
+
+    def validate(self, attrs):
+        if 'job' not in attrs and ('latitude' not in attrs or 'longitude' not in attrs):
+            raise serializers.ValidationError('Give a job, or a latitude and longitude.')
+        return attrs
+
+
+class MatchSerializer(serializers.Serializer):
+    """Serializer for one matched artisan.
+
+    Nothing here may pin an artisan down: no contact details, and distance
+    and score only coarsely, so repeated queries cannot locate them.
+    """
+    artisan = serializers.IntegerField(source='artisan.pk')
+    skills = serializers.SerializerMethodField()
+    rating = serializers.FloatField(source='artisan.rating')
+    rating_count = serializers.IntegerField(source='artisan.rating_count')
+    distance_km = serializers.SerializerMethodField()
+    score = serializers.SerializerMethodField()
+
+    def get_skills(self, obj):
+        return sorted(skill.slug for skill in obj['artisan'].skills.all())
+
+    def get_distance_km(self, obj):
+        return round(obj['match'].distance / 1000)
+
+    def get_score(self, obj):
+        # Finer scores would give the distance term back to within metres
+        return round(obj['match'].score, 2)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for a posted job; the customer gives the skill (by slug), place and description."""
+    skill = serializers.SlugRelatedField(slug_field='slug', queryset=Skill.objects.filter(is_active=True))
+    artisan_email = serializers.EmailField(source='artisan.user.email', read_only=True, default=None)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'skill', 'description', 'latitude', 'longitude', 'status', 'artisan', 'artisan_email', 'wave',
+            'wave_expires_at', 'created_at', 'assigned_at', 'completed_at',
+        ]
+        read_only_fields = [
+            'id', 'status', 'artisan', 'wave', 'wave_expires_at', 'created_at', 'assigned_at', 'completed_at',
+        ]
+        extra_kwargs = {
+            'latitude': {'min_value': -90, 'max_value': 90},
+            'longitude': {'min_value': -180, 'max_value': 180},
+        }
+
+
+class JobOfferSerializer(serializers.ModelSerializer):
+    """Serializer for a job offered to the current artisan."""
+    skill = serializers.SlugRelatedField(source='job.skill', slug_field='slug', read_only=True)
+    description = serializers.CharField(source='job.description', read_only=True)
+    latitude = serializers.FloatField(source='job.latitude', read_only=True)
+    longitude = serializers.FloatField(source='job.longitude', read_only=True)
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta:
+        model = JobOffer
+        fields = [
+            'id', 'job', 'skill', 'description', 'latitude', 'longitude', 'distance_km', 'wave', 'status',
+            'created_at', 'expires_at',
+        ]
+        read_only_fields = fields
+
+    def get_distance_km(self, obj):
+        return round(obj.distance / 1000, 2)
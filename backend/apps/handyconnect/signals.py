@@ -0,0 +1,38 @@
+"""Signals for the HandyConnect app."""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .matching import artisans_changed, index_reshaped
+from .models import Artisan, Skill
+
+
+@receiver(post_save, sender=Artisan)
+def refresh_artisan(sender, instance, **kwargs):
+    """Have this process's matching index pick up the change straight away."""
+    artisans_changed()
+
+
+@receiver(post_delete, sender=Artisan)
+@receiver([post_save, post_delete], sender=Skill)
+def rebuild_artisan_index(sender, created=True, **kwargs):
+    """Rebuild the matching index when skills come or go, or an artisan is deleted."""
+    if created:
+        index_reshaped()
+
+
+@receiver(m2m_changed, sender=Artisan.skills.through)
+def touch_artisan_skills(sender, instance, action, reverse, pk_set, **kwargs):
+    """Move the artisans' updated_at when their skills change, so the index polls them."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Artisan.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+        artisans_changed()
+    elif pk_set:
+        Artisan.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+        artisans_changed()
+    else:
+        # Skill.artisans.clear() does not say whose skills went
+        index_reshaped()
@@ -0,0 +1,19 @@
+from celery import shared_task
+
+
+@shared_task
+def dispatch_jobs_task():
+    """
+    Send every offer wave that is due, with a timer wheel rebuilt from the open jobs.
+    """
+    from .dispatch import Dispatcher
+
+    dispatcher = Dispatcher()
+    dispatcher.recover()
+    totals = {'jobs': 0, 'offers': 0, 'unfilled': 0}
+    while True:
+        counts = dispatcher.run_once()
+        for key, value in counts.items():
+            totals[key] += value
+        if not counts['jobs'] and not counts['unfilled']:
+            return totals
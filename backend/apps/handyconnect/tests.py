@@ -0,0 +1,297 @@
+"""
+Tests for HandyConnect artisan matching and job dispatch.
+"""
+import time
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .dispatch import Dispatcher, TimerWheel
+from .matching import NUMPY_AVAILABLE, ArtisanIndex, Candidate, geohash, invalidate_index
+from .models import Artisan, Job, JobOffer, Skill
+
+User = get_user_model()
+
+# Lagos Island, and points about 1 km and 5 km north of it
+HERE = (6.4541, 3.3947)
+KM1 = (6.4631, 3.3947)
+KM5 = (6.4991, 3.3947)
+
+
+@skipUnless(NUMPY_AVAILABLE, 'NumPy is not installed')
+class ArtisanIndexTestCase(TestCase):
+    """Test cases for the in-memory artisan index."""
+
+    def candidate(self, artisan_id, position, rating=4.5, reviews=20, seen=None, skills=(1,), available=True):
+        return Candidate(artisan_id, available, *position, rating, reviews, seen or time.time(), skills)
+
+    def test_geohash(self):
+        """Positions encode to standard geohashes."""
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash(*HERE, 5), 's14kt')
+
+    def test_ranking(self):
+        """Nearer, better-rated and more recently seen artisans rank first; skills and radius filter."""
+        index = ArtisanIndex([1, 2])
+        now = time.time()
+        index.update([
+            self.candidate(1, KM1, seen=now),
+            self.candidate(2, KM5, seen=now),
+            self.candidate(3, KM1, rating=2.0, seen=now),
+            self.candidate(4, KM1, seen=now - 7200),
+            self.candidate(5, HERE, skills=(2,), seen=now),
+            self.candidate(6, KM1, rating=5.0, reviews=1, seen=now),
+        ])
+        matches = index.match(*HERE, skill_ids=[1], radius=10000, now=now)
+        self.assertEqual([match.artisan_id for match in matches], [1, 6, 3, 4, 2])
+        self.assertAlmostEqual(matches[0].distance, 1000, delta=5)
+        self.assertEqual([match.artisan_id for match in index.match(*HERE, [1], radius=2000, limit=2, now=now)], [1, 6])
+        self.assertEqual([match.artisan_id for match in index.match(*HERE, [1, 2], now=now)], [])
+        # A skill created after the index was built matches nobody until it is rebuilt
+        self.assertEqual(index.match(*HERE, [3], now=now), [])
+
+    def test_incremental_updates(self):
+        """Artisans move between cells, drop out when unavailable and their slots are reused."""
+        index = ArtisanIndex([1], capacity=2)
+        index.update([self.candidate(artisan_id, HERE) for artisan_id in range(1, 6)])
+        self.assertEqual(len(index), 5)
+        index.update([self.candidate(1, (6.60, 3.39)), self.candidate(2, HERE, available=False)])
+        self.assertEqual(sorted(match.artisan_id for match in index.match(*HERE, [1])), [3, 4, 5])
+        self.assertEqual([match.artisan_id for match in index.match(6.60, 3.39, [1])], [1])
+        index.update([self.candidate(7, KM1)])
+        self.assertEqual(index.slots[7], 1)
+        self.assertEqual(sorted(match.artisan_id for match in index.match(*HERE, [1])), [3, 4, 5, 7])
+        # Across the antimeridian
+        index.update([self.candidate(8, (0.0, 179.999)), self.candidate(9, (0.0, -179.999))])
+        self.assertEqual(sorted(match.artisan_id for match in index.match(0.0, 180.0, [1], radius=1000)), [8, 9])
+
+
+@skipUnless(NUMPY_AVAILABLE, 'NumPy is not installed')
+@override_settings(MATCHING_INDEX_REFRESH=60)
+class MatchingTestCase(TestCase):
+    """Test cases for artisan profiles and the match endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_index()
+        self.plumbing = Skill.objects.create(name='Plumbing', slug='plumbing')
+        self.tiling = Skill.objects.create(name='Tiling', slug='tiling')
+        self.client = APIClient()
+        self.customer = User.objects.create_user(email='customer@example.com', password='testpass123')
+        self.staff = User.objects.create_user(email='staff@example.com', password='testpass123', is_staff=True)
+
+    def become_artisan(self, email, position, skills):
+        user = User.objects.create_user(email=email, password='testpass123')
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/v1/handyconnect/artisans/me/', {
+                'latitude': position[0], 'longitude': position[1], 'skills': skills, 'is_available': True,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return Artisan.objects.get(user=user).pk
+
+    def match(self, **params):
+        self.client.force_authenticate(user=self.staff)
+        return self.client.get('/api/v1/handyconnect/match/', {'latitude': HERE[0], 'longitude': HERE[1], **params})
+
+    def matched(self, response):
+        return [result['artisan'] for result in response.data['results']]
+
+    def test_profile_and_match(self):
+        """Artisans found by skill are nearest first, and drop out as soon as they go off duty."""
+        near = self.become_artisan('near@example.com', KM1, ['plumbing'])
+        far = self.become_artisan('far@example.com', KM5, ['plumbing', 'tiling'])
+        self.assertEqual(Artisan.objects.get(pk=near).geohash[:5], geohash(*KM1, 5))
+
+        response = self.match(skills='plumbing')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.matched(response), [near, far])
+        self.assertEqual(response.data['results'][0]['distance_km'], 1)
+        self.assertNotIn('email', response.data['results'][0])
+        self.assertEqual(response.data['results'][1]['skills'], ['plumbing', 'tiling'])
+        self.assertEqual(self.matched(self.match(skills='tiling')), [far])
+        self.assertEqual(len(self.match(skills='plumbing', radius_km=2).data['results']), 1)
+
+        self.client.force_authenticate(user=Artisan.objects.get(pk=near).user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/v1/handyconnect/artisans/me/', {'is_available': False}, format='json')
+        self.assertEqual(self.matched(self.match(skills='plumbing')), [far])
+
+    def test_customers_match_only_their_open_jobs(self):
+        """Customers cannot probe arbitrary positions; they match for their own open jobs."""
+        near = self.become_artisan('near@example.com', KM1, ['plumbing'])
+        job = Job.objects.create(customer=self.customer, skill=self.plumbing, latitude=HERE[0], longitude=HERE[1])
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        others = Job.objects.create(customer=other, skill=self.plumbing, latitude=HERE[0], longitude=HERE[1])
+
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.get('/api/v1/handyconnect/match/', {'latitude': HERE[0], 'longitude': HERE[1]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['code'], 'job_required')
+        response = self.client.get('/api/v1/handyconnect/match/', {'job': job.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.matched(response), [near])
+        response = self.client.get('/api/v1/handyconnect/match/', {'job': others.pk})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        Job.objects.filter(pk=job.pk).update(status=Job.STATUS_CANCELLED)
+        response = self.client.get('/api/v1/handyconnect/match/', {'job': job.pk})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_queries(self):
+        """Unknown skills, missing positions and oversized radii are refused."""
+        self.assertEqual(self.match(skills='welding').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.match(radius_km=500).status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=self.customer)
+        self.assertEqual(self.client.get('/api/v1/handyconnect/match/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get('/api/v1/handyconnect/artisans/me/').status_code, status.HTTP_404_NOT_FOUND
+        )
+        response = self.client.patch('/api/v1/handyconnect/artisans/me/', {'latitude': 6.45}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TimerWheelTestCase(TestCase):
+    """Test cases for the offer timeout wheel."""
+
+    def test_deadlines(self):
+        """Deadlines fire once they have passed, earliest first, across rotations and pauses."""
+        wheel = TimerWheel(tick=1, slots=8, start=100)
+        wheel.schedule('b', 103.5)
+        wheel.schedule('a', 102)
+        wheel.schedule('late', 120)
+        wheel.schedule('gone', 103)
+        wheel.cancel('gone')
+        wheel.schedule('moved', 103)
+        wheel.schedule('moved', 106)
+        self.assertEqual(wheel.advance(101.9), [])
+        self.assertEqual(wheel.advance(103.4), ['a'])
+        self.assertEqual(wheel.advance(103.5), ['b'])
+        # 'late' shares a slot with the ticks before it, one rotation on
+        self.assertEqual(wheel.advance(112), ['moved'])
+        self.assertIn('late', wheel)
+        self.assertEqual(wheel.advance(500), ['late'])
+        self.assertEqual(len(wheel), 0)
+        wheel.schedule('overdue', 400)
+        self.assertEqual(wheel.advance(501), ['overdue'])
+
+
+@skipUnless(NUMPY_AVAILABLE, 'NumPy is not installed')
+@override_settings(
+    MATCHING_INDEX_REFRESH=60, DISPATCH_WAVE_SIZE=2, DISPATCH_WAVES=2, DISPATCH_OFFER_SECONDS=30,
+    DISPATCH_MAX_PENDING_OFFERS=1,
+)
+class DispatchTestCase(TestCase):
+    """Test cases for offering jobs in waves and accepting offers."""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_index()
+        self.plumbing = Skill.objects.create(name='Plumbing', slug='plumbing')
+        self.artisans = []
+        with self.captureOnCommitCallbacks(execute=True):
+            # Nearest first
+            for i, latitude in enumerate((6.4551, 6.4571, 6.4601)):
+                user = User.objects.create_user(email=f'artisan{i}@example.com', password='testpass123')
+                artisan = Artisan.objects.create(
+                    user=user, latitude=latitude, longitude=HERE[1], rating=4.5, rating_count=20,
+                    is_available=True, last_seen_at=timezone.now(),
+                )
+                artisan.skills.add(self.plumbing)
+                self.artisans.append(artisan)
+        self.customer = User.objects.create_user(email='customer@example.com', password='testpass123')
+        self.client = APIClient()
+        self.now = timezone.now()
+        self.dispatcher = Dispatcher(start=self.now.timestamp())
+
+    def post_job(self):
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post('/api/v1/handyconnect/jobs/', {
+            'skill': 'plumbing', 'latitude': HERE[0], 'longitude': HERE[1], 'description': 'Leaking tap',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Job.objects.get(pk=response.data['id'])
+
+    def offered(self, job, **filters):
+        return sorted(
+            self.artisans.index(offer.artisan) for offer in JobOffer.objects.filter(job=job, **filters)
+        )
+
+    def respond(self, artisan, offer, action='accept'):
+        self.client.force_authenticate(user=artisan.user)
+        return self.client.post(f'/api/v1/handyconnect/offers/{offer.pk}/{action}/')
+
+    def test_waves(self):
+        """Each wave goes to the next-best artisans; a job nobody takes in its last wave is unfilled."""
+        job = self.post_job()
+        self.assertEqual(self.dispatcher.run_once(self.now), {'jobs': 1, 'offers': 2, 'unfilled': 0})
+        self.assertEqual(self.offered(job, wave=1), [0, 1])
+        self.assertEqual(self.dispatcher.run_once(self.now + timedelta(seconds=10))['jobs'], 0)
+        offer = JobOffer.objects.get(job=job, artisan=self.artisans[0])
+        self.assertEqual(self.respond(self.artisans[0], offer, 'decline').status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.dispatcher.run_once(self.now + timedelta(seconds=30))['offers'], 1)
+        self.assertEqual(self.offered(job, wave=2), [2])
+        self.assertEqual(self.offered(job, status=JobOffer.STATUS_EXPIRED), [1])
+        self.assertEqual(self.offered(job, status=JobOffer.STATUS_DECLINED), [0])
+        self.assertEqual(self.dispatcher.run_once(self.now + timedelta(seconds=60))['unfilled'], 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_UNFILLED)
+        self.assertEqual(len(self.dispatcher.wheel), 0)
+
+    def test_fair_offers(self):
+        """An artisan holds one open offer at a time, so a second job goes to those left."""
+        first, second = self.post_job(), self.post_job()
+        self.assertEqual(self.dispatcher.run_once(self.now)['jobs'], 2)
+        self.assertEqual(self.offered(first), [0, 1])
+        self.assertEqual(self.offered(second), [2])
+        # A fresh dispatcher picks the timers up from the database
+        dispatcher = Dispatcher(start=self.now.timestamp())
+        self.assertEqual(dispatcher.recover(), 2)
+        self.assertEqual(dispatcher.run_once(self.now + timedelta(seconds=30))['jobs'], 2)
+
+    def test_atomic_claims(self):
+        """One artisan gets the job; the others, late or busy artisans are refused."""
+        job = self.post_job()
+        self.dispatcher.run_once(self.now)
+        offers = {offer.artisan_id: offer for offer in JobOffer.objects.filter(job=job)}
+        winner, loser = self.artisans[0], self.artisans[1]
+        response = self.respond(winner, offers[winner.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['status'], response.data['artisan']), (Job.STATUS_ASSIGNED, winner.pk))
+        self.assertEqual(self.respond(loser, offers[loser.pk]).data['code'], 'offer_closed')
+
+        # Racing: the other offer is still pending when its artisan accepts
+        JobOffer.objects.filter(pk=offers[loser.pk].pk).update(status=JobOffer.STATUS_PENDING)
+        self.assertEqual(self.respond(loser, offers[loser.pk]).data['code'], 'job_taken')
+        self.assertEqual(JobOffer.objects.get(pk=offers[loser.pk].pk).status, JobOffer.STATUS_PENDING)
+
+        # A busy artisan cannot take a second job
+        other = self.post_job()
+        late = JobOffer.objects.create(
+            job=other, artisan=winner, wave=1, distance=100, score=1, expires_at=timezone.now() + timedelta(seconds=30)
+        )
+        self.assertEqual(self.respond(winner, late).data['code'], 'artisan_busy')
+        self.assertFalse(Artisan.objects.get(pk=winner.pk).is_available)
+        # Nor can anyone take an expired offer
+        expired = JobOffer.objects.create(
+            job=other, artisan=loser, wave=1, distance=100, score=1, expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.respond(loser, expired).status_code, status.HTTP_409_CONFLICT)
+
+        self.client.force_authenticate(user=winner.user)
+        response = self.client.post(f'/api/v1/handyconnect/jobs/{job.pk}/complete/')
+        self.assertEqual(response.data['status'], Job.STATUS_COMPLETED)
+        self.assertTrue(Artisan.objects.get(pk=winner.pk).is_available)
+        self.client.force_authenticate(user=self.customer)
+        self.assertEqual(
+            self.client.post(f'/api/v1/handyconnect/jobs/{other.pk}/cancel/').data['status'], Job.STATUS_CANCELLED
+        )
+        self.assertEqual(
+            self.client.post(f'/api/v1/handyconnect/jobs/{job.pk}/cancel/').status_code, status.HTTP_409_CONFLICT
+        )
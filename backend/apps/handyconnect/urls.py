@@ -1,22 +1,23 @@
 """URL routing for the HandyConnect application."""
 
 from django.urls import path
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
-
-class HandyConnectAPIView(APIView):
-    """
-    A simple API view for HandyConnect functionality.
-    """
-    def get(self, request, format=None):
-        """
-        Handle GET requests.
-        """
-        return Response({"status": "HandyConnect API is working"}, status=status.HTTP_200_OK)
+from .views import (
+    ArtisanProfileView, HandyConnectAPIView, JobCancelView, JobCompleteView, JobDetailView, JobListView, MatchView,
+    OfferListView, OfferResponseView, SkillListView,
+)
 
 app_name = 'handyconnect'
 
 urlpatterns = [
     path('', HandyConnectAPIView.as_view(), name='handyconnect-api'),
+    path('skills/', SkillListView.as_view(), name='skill-list'),
+    path('artisans/me/', ArtisanProfileView.as_view(), name='artisan-profile'),
+    path('match/', MatchView.as_view(), name='match'),
+    path('jobs/', JobListView.as_view(), name='job-list'),
+    path('jobs/<int:pk>/', JobDetailView.as_view(), name='job-detail'),
+    path('jobs/<int:pk>/cancel/', JobCancelView.as_view(), name='job-cancel'),
+    path('jobs/<int:pk>/complete/', JobCompleteView.as_view(), name='job-complete'),
+    path('offers/', OfferListView.as_view(), name='offer-list'),
+    path('offers/<int:pk>/accept/', OfferResponseView.as_view(), name='offer-accept'),
+    path('offers/<int:pk>/decline/', OfferResponseView.as_view(accept=False), name='offer-decline'),
 ]
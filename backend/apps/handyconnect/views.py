@@ -1,6 +1,23 @@
-from rest_framework.views import APIView
+"""Views for the HandyConnect API."""
+import logging
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.views import APIView
+
+from apps.users.permissions import IsAdminOrReadOnly
+from .dispatch import DispatchError, accept_offer, cancel_job, complete_job, decline_offer
+from .matching import MatchingError, find_artisans
+from .models import Artisan, Job, JobOffer, Skill
+from .serializers import (
+    ArtisanSerializer, JobOfferSerializer, JobSerializer, MatchQuerySerializer, MatchSerializer, SkillSerializer,
+)
+
+logger = logging.getLogger(__name__)
+
 
 class HandyConnectAPIView(APIView):
     """
@@ -11,3 +28,189 @@ class HandyConnectAPIView(APIView):
         Handle GET requests.
         """
         return Response({"status": "HandyConnect API is working"}, status=status.HTTP_200_OK)
+
+
+class SkillListView(generics.ListCreateAPIView):
+    """
+    List the skills artisans offer; staff add new ones.
+    """
+    serializer_class = SkillSerializer
+    permission_classes = [IsAdminOrReadOnly]
+
+    def get_queryset(self):
+        queryset = Skill.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(is_active=True)
+        return queryset
+
+
+class ArtisanProfileView(generics.RetrieveUpdateAPIView):
+    """
+    Show the current user's artisan profile, or create or change it.
+
+    Artisans send their position and availability here as they move about
+    and come on or off duty; every change is seen by matching within
+    ``MATCHING_INDEX_REFRESH`` seconds.
+    """
+    serializer_class = ArtisanSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self):
+        artisan = Artisan.objects.filter(user=self.request.user).prefetch_related('skills').first()
+        if artisan is None:
+            if self.request.method == 'GET':
+                raise Http404('No artisan profile.')
+            artisan = Artisan(user=self.request.user)
+        return artisan
+
+    def perform_update(self, serializer):
+        created = serializer.instance.pk is None
+        serializer.save(last_seen_at=timezone.now())
+        if created:
+            logger.info(f"User {self.request.user.pk} became artisan {serializer.instance.pk}")
+
+
+class MatchView(APIView):
+    """
+    Find the best available artisans for one of the current user's open jobs.
+
+    Staff may also match at any position. Customers cannot, as probing
+    arbitrary positions would let them trace where artisans are.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """Rank available artisans with every requested skill by distance, rating and how recently they were seen."""
+        query = MatchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        data = query.validated_data
+        if 'job' in data:
+            job = Job.objects.filter(pk=data['job'], customer=request.user, status=Job.STATUS_OPEN).first()
+            if job is None:
+                return Response({'detail': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+            latitude, longitude, skills = job.latitude, job.longitude, [job.skill_id]
+        elif request.user.is_staff:
+            latitude, longitude, skills = data['latitude'], data['longitude'], data['skills']
+        else:
+            return Response(
+                {'detail': 'Matching is only available for your own open jobs.', 'code': 'job_required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        radius = data['radius_km'] * 1000 if data.get('radius_km') else None
+        try:
+            matches = find_artisans(latitude, longitude, skills, radius, data['limit'])
+        except MatchingError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        artisans = Artisan.objects.select_related('user').prefetch_related('skills').in_bulk(
+            [match.artisan_id for match in matches]
+        )
+        results = [
+            {'artisan': artisans[match.artisan_id], 'match': match}
+            for match in matches if match.artisan_id in artisans
+        ]
+        return Response({'results': MatchSerializer(results, many=True).data})
+
+
+class JobListView(generics.ListCreateAPIView):
+    """
+    List the jobs the current user posted or was assigned, or post a job.
+
+    A posted job is offered to nearby artisans in waves by the dispatcher
+    (see ``apps.handyconnect.dispatch``) until one accepts it.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(
+            Q(customer=self.request.user) | Q(artisan__user=self.request.user)
+        ).select_related('skill', 'artisan__user')
+
+    def perform_create(self, serializer):
+        serializer.save(customer=self.request.user)
+
+
+class JobDetailView(generics.RetrieveAPIView):
+    """
+    Show a job the current user posted or was assigned.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(
+            Q(customer=self.request.user) | Q(artisan__user=self.request.user)
+        ).select_related('skill', 'artisan__user')
+
+
+class JobCancelView(APIView):
+    """
+    Cancel a job of the current user's that nobody has taken yet.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        job = Job.objects.filter(pk=pk, customer=request.user).first()
+        if job is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            cancel_job(job, request.user)
+        except DispatchError as e:
+            return Response({'detail': str(e), 'code': e.code}, status=e.status)
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data)
+
+
+class JobCompleteView(APIView):
+    """
+    Mark a job assigned to the current artisan as done, which puts them back on duty.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        job = Job.objects.filter(pk=pk, artisan__user=request.user).select_related('artisan').first()
+        if job is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            complete_job(job, job.artisan)
+        except DispatchError as e:
+            return Response({'detail': str(e), 'code': e.code}, status=e.status)
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data)
+
+
+class OfferListView(generics.ListAPIView):
+    """
+    List the job offers waiting for the current artisan's answer, soonest to expire first.
+    """
+    serializer_class = JobOfferSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return JobOffer.objects.filter(
+            artisan__user=self.request.user, status=JobOffer.STATUS_PENDING, expires_at__gt=timezone.now()
+        ).select_related('job__skill').order_by('expires_at')
+
+
+class OfferResponseView(APIView):
+    """
+    Accept or decline a job offer made to the current artisan.
+
+    Of several artisans accepting the same job only the first gets it; the
+    others are answered 409 with ``code`` ``job_taken``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    accept = True
+
+    def post(self, request, pk):
+        offer = JobOffer.objects.filter(pk=pk, artisan__user=request.user).select_related('artisan').first()
+        if offer is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            if not self.accept:
+                decline_offer(offer, offer.artisan)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            job = accept_offer(offer, offer.artisan)
+        except DispatchError as e:
+            return Response({'detail': str(e), 'code': e.code}, status=e.status)
+        return Response(JobSerializer(job).data)
@@ -1,3 +1,105 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import (
+    Account, BalanceSnapshot, JournalEntry, OutboxEvent, PayoutBatch, PayoutItem, Posting, ReconciliationRun,
+    WebhookDelivery, WebhookEndpoint,
+)
+from .webhooks import redeliver
+
+
+class PostingInline(admin.TabularInline):
+    model = Posting
+    extra = 0
+    can_delete = False
+    readonly_fields = ('account', 'amount', 'balance_after', 'created_at')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Account)
+class AccountAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'kind', 'currency', 'balance', 'allow_negative')
+    list_filter = ('kind', 'currency')
+    search_fields = ('name', 'owner__email')
+    raw_id_fields = ('owner',)
+    # Balances only change through apps.mazepay.ledger
+    readonly_fields = ('balance', 'created_at', 'updated_at')
+
+
+@admin.register(JournalEntry)
+class JournalEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'reference', 'description', 'created_at')
+    search_fields = ('reference', 'description')
+    readonly_fields = ('reference', 'description', 'metadata', 'created_at')
+    inlines = [PostingInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('account', 'as_of', 'balance')
+    list_filter = ('as_of',)
+    raw_id_fields = ('account',)
+    readonly_fields = ('account', 'as_of', 'balance', 'created_at')
+
+
+@admin.register(PayoutBatch)
+class PayoutBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_by', 'source_account', 'status', 'processed_items', 'total_items', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('description', 'created_by__email')
+    raw_id_fields = ('created_by', 'source_account')
+    readonly_fields = ('total_items', 'processed_items', 'total_amount', 'error', 'started_at', 'finished_at')
+
+
+@admin.register(PayoutItem)
+class PayoutItemAdmin(admin.ModelAdmin):
+    list_display = ('batch', 'line', 'destination_account', 'amount', 'entry')
+    raw_id_fields = ('batch', 'destination_account', 'entry')
+    readonly_fields = ('entry',)
+
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'account', 'start', 'end', 'status', 'matched', 'mismatched', 'unmatched_external',
+                    'unmatched_ledger', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('created_by', 'account')
+    readonly_fields = (
+        'status', 'external_rows', 'ledger_rows', 'matched', 'mismatched', 'unmatched_external', 'unmatched_ledger',
+        'report_dir', 'error', 'started_at', 'finished_at',
+    )
+
+
+@admin.register(WebhookEndpoint)
+class WebhookEndpointAdmin(admin.ModelAdmin):
+    list_display = ('url', 'owner', 'is_active', 'max_concurrency', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('url', 'owner__email')
+    raw_id_fields = ('owner',)
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'created_at', 'dispatched_at')
+    list_filter = ('event_type',)
+    readonly_fields = ('event_type', 'payload', 'owners', 'created_at', 'dispatched_at')
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'endpoint', 'status', 'attempts', 'next_attempt_at', 'last_status_code')
+    list_filter = ('status',)
+    raw_id_fields = ('event', 'endpoint')
+    readonly_fields = ('attempts', 'last_status_code', 'last_error', 'delivered_at')
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected deliveries')
+    def requeue(self, request, queryset):
+        self.message_user(request, f'{redeliver(queryset)} deliveries requeued.')
@@ -0,0 +1,275 @@
+"""
+Asynchronous webhook delivery.
+
+:func:`deliver_all` POSTs a batch of signed webhook bodies concurrently
+with asyncio. It touches no database; :func:`apps.mazepay.webhooks.dispatch_once`
+prepares the batch and records the outcome. Concurrency is bounded twice:
+``WEBHOOK_CONCURRENCY`` deliveries in flight overall, and each endpoint's
+``max_concurrency``, so a slow merchant cannot take every slot or be
+flooded.
+
+Requests go over a small HTTP/1.1 client on asyncio streams with a pool of
+keep-alive connections per host. A batch to one endpoint reuses a handful
+of connections (and TLS sessions) instead of opening one per event, and
+no HTTP library is required.
+
+Endpoint URLs come from merchants, so each new connection resolves the
+host itself and refuses it if any address is loopback, private, link-local
+or otherwise not globally routable (unless
+``WEBHOOK_ALLOW_PRIVATE_ADDRESSES`` is set), then connects to the address
+it checked. A host that re-points its DNS after registration cannot turn
+the dispatcher against internal services.
+"""
+import asyncio
+import ipaddress
+import logging
+import socket
+import ssl
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'RippleFox-Webhooks/1.0'
+# Response bodies are read (to keep the connection reusable) but not kept beyond this
+MAX_RESPONSE_BODY = 64 * 1024
+
+
+class DeliveryError(Exception):
+    """Raised when a webhook request fails before a status code is received."""
+
+
+class BlockedAddress(DeliveryError):
+    """Raised when a webhook host resolves to an address that must not be contacted."""
+
+
+def is_allowed_address(address):
+    """Return True if webhooks may be sent to this IP address.
+
+    Only globally routable unicast addresses are allowed, unless
+    ``WEBHOOK_ALLOW_PRIVATE_ADDRESSES`` is set (local development).
+    """
+    if getattr(settings, 'WEBHOOK_ALLOW_PRIVATE_ADDRESSES', False):
+        return True
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_addresses(host, addresses):
+    """Return the first of a host's resolved addresses, if all of them are allowed.
+
+    Raises:
+        BlockedAddress: If the host has no address or any address is not allowed
+    """
+    if not addresses:
+        raise BlockedAddress(f'{host} did not resolve')
+    for address in addresses:
+        if not is_allowed_address(address):
+            raise BlockedAddress(f'{host} resolves to a non-public address')
+    return addresses[0]
+
+
+def resolve_host(host, port):
+    """Resolve a webhook host and check its addresses (blocking; for validation)."""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        raise BlockedAddress(f'{host} did not resolve')
+    return check_addresses(host, [info[4][0] for info in infos])
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per ``(scheme, host, port)``."""
+
+    def __init__(self, max_idle_per_host=32):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = defaultdict(list)
+        self._ssl_context = None
+        self.opened = 0
+
+    async def acquire(self, scheme, host, port, timeout):
+        idle = self._idle[(scheme, host, port)]
+        while idle:
+            connection = idle.pop()
+            if not connection.reader.at_eof():
+                connection.reused = True
+                return connection
+            connection.close()
+        if scheme == 'https' and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout
+            )
+        except UnicodeError:
+            raise BlockedAddress(f'{host} did not resolve')
+        # Connect to the address that was checked, not whatever the name resolves to next
+        address = check_addresses(host, [info[4][0] for info in infos])
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                address, port,
+                ssl=self._ssl_context if scheme == 'https' else None,
+                server_hostname=host if scheme == 'https' else None,
+            ),
+            timeout,
+        )
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    def release(self, scheme, host, port, connection, keep_alive):
+        idle = self._idle[(scheme, host, port)]
+        if keep_alive and len(idle) < self.max_idle_per_host:
+            idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.close()
+        self._idle.clear()
+
+
+async def _read_response(reader):
+    """Read one response; returns ``(status code, keep-alive)``."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise DeliveryError('Connection closed before a response')
+    try:
+        version, status_code = status_line.decode('latin-1').split(None, 2)[:2]
+        status_code = int(status_code)
+    except ValueError:
+        raise DeliveryError(f'Malformed status line: {status_line[:80]!r}')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    connection_header = headers.get('connection', '').lower()
+    keep_alive = connection_header != 'close' and (version == 'HTTP/1.1' or connection_header == 'keep-alive')
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        received = 0
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                await reader.readline()  # Trailer section ends with an empty line
+                break
+            received += size
+            if received > MAX_RESPONSE_BODY:
+                return status_code, False
+            await reader.readexactly(size + 2)
+    elif 'content-length' in headers:
+        length = int(headers['content-length'])
+        if length > MAX_RESPONSE_BODY:
+            return status_code, False
+        await reader.readexactly(length)
+    elif status_code not in (204, 304):
+        # Body runs to the end of the connection
+        return status_code, False
+    return status_code, keep_alive
+
+
+async def _exchange(connection, request):
+    connection.writer.write(request)
+    await connection.writer.drain()
+    return await _read_response(connection.reader)
+
+
+async def post(pool, url, body, headers, timeout):
+    """POST ``body`` to ``url`` over a pooled connection; returns the status code.
+
+    Sending the request and reading the response share one ``timeout``, so a
+    server that stops reading cannot hold a delivery slot either. A reused
+    connection that turns out to have been closed by the server is retried
+    once on a fresh one.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https') or not parts.hostname:
+        raise DeliveryError(f'Unsupported URL: {url}')
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    host_header = parts.hostname if parts.port is None else f'{parts.hostname}:{parts.port}'
+    request = ''.join(
+        [f'POST {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: {USER_AGENT}\r\n'
+         f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n']
+        + [f'{name}: {value}\r\n' for name, value in headers.items()]
+        + ['\r\n']
+    ).encode('latin-1') + body
+
+    for attempt in range(2):
+        connection = await pool.acquire(scheme, parts.hostname, port, timeout)
+        try:
+            status_code, keep_alive = await asyncio.wait_for(_exchange(connection, request), timeout)
+        except (ConnectionError, asyncio.IncompleteReadError, DeliveryError, ValueError) as e:
+            connection.close()
+            if connection.reused and attempt == 0:
+                continue
+            raise DeliveryError(str(e) or type(e).__name__)
+        except BaseException:
+            connection.close()
+            raise
+        pool.release(scheme, parts.hostname, port, connection, keep_alive)
+        return status_code
+
+
+async def deliver_all(requests, pool=None, start_by=None):
+    """Deliver webhook requests concurrently.
+
+    Args:
+        requests: Iterable of ``(delivery, url, body bytes, headers)``;
+            ``delivery.endpoint`` supplies the per-endpoint limit
+        pool: Optional ``ConnectionPool`` to reuse across calls
+        start_by: Optional ``time.monotonic()`` deadline; requests still
+            waiting for a slot then are not sent
+
+    Returns:
+        list: ``(delivery, status code or None, error text)`` per request;
+        the error is None for requests skipped because of ``start_by``
+    """
+    timeout = getattr(settings, 'WEBHOOK_TIMEOUT', 10)
+    overall = asyncio.Semaphore(getattr(settings, 'WEBHOOK_CONCURRENCY', 100))
+    per_endpoint = {}
+    own_pool = pool is None
+    pool = pool or ConnectionPool()
+
+    async def deliver(delivery, url, body, headers):
+        endpoint = delivery.endpoint
+        if endpoint.pk not in per_endpoint:
+            per_endpoint[endpoint.pk] = asyncio.Semaphore(max(1, endpoint.max_concurrency))
+        async with per_endpoint[endpoint.pk], overall:
+            if start_by is not None and time.monotonic() > start_by:
+                return delivery, None, None
+            try:
+                status_code = await post(pool, url, body, headers, timeout)
+            except asyncio.TimeoutError:
+                return delivery, None, f'Timed out after {timeout}s'
+            except (OSError, DeliveryError) as e:
+                return delivery, None, str(e) or type(e).__name__
+        error = '' if 200 <= status_code < 300 else f'HTTP {status_code}'
+        return delivery, status_code, error
+
+    try:
+        return await asyncio.gather(*(deliver(*request) for request in requests))
+    finally:
+        if own_pool:
+            pool.close()
@@ -0,0 +1,311 @@
+"""
+MazePay double-entry ledger engine.
+
+Every movement of money goes through :func:`post_entry` (or
+:func:`post_legs` for large entries such as payroll), which in one database
+transaction:
+
+1. locks the affected accounts with ``SELECT ... FOR UPDATE`` in primary-key
+   order, so two transfers touching the same accounts always queue in the
+   same order and can never deadlock each other;
+2. checks the entry balances to zero, all legs share a currency and no
+   account without ``allow_negative`` would go below zero;
+3. writes the journal entry and its postings, each carrying the account's
+   running ``balance_after``, and updates the materialized ``Account.balance``;
+4. records an ``entry.posted`` webhook event in the outbox
+   (see :mod:`apps.mazepay.webhooks`).
+
+Reading a balance is a single-row lookup. :func:`check_ledger` re-derives
+every balance from the postings and verifies the books still sum to zero.
+
+SQLite has no row locks, so there the transaction starts with a write to the
+same accounts, which takes the database write lock up front. Lock contention
+that still surfaces as an error (SQLite's ``database is locked``, PostgreSQL
+deadlock or serialization failures) is retried with jittered backoff, unless
+the caller already holds an outer transaction.
+"""
+import logging
+import random
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .models import Account, JournalEntry, Posting
+from .webhooks import emit_event
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL SQLSTATEs worth retrying: serialization_failure, deadlock_detected
+RETRYABLE_PGCODES = {'40001', '40P01'}
+
+
+class LedgerError(Exception):
+    """Base class for entries the ledger refuses to post."""
+
+
+class UnbalancedEntry(LedgerError):
+    """Raised when postings do not sum to zero or have fewer than two accounts."""
+
+
+class CurrencyMismatch(LedgerError):
+    """Raised when an entry mixes currencies."""
+
+
+class ReferenceConflict(LedgerError):
+    """Raised when a reference is reposted with different legs."""
+
+
+class InsufficientFunds(LedgerError):
+    """Raised when a posting would take an account below zero."""
+
+    def __init__(self, account_id, balance, amount):
+        super().__init__(f'Account {account_id} has {balance}, cannot post {amount}')
+        self.account_id = account_id
+        self.balance = balance
+        self.amount = amount
+
+
+def _is_retryable(exc):
+    cause = exc.__cause__
+    if getattr(cause, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    return 'locked' in str(exc).lower()
+
+
+def retry_on_contention(func, *args, **kwargs):
+    """Run ``func`` and retry it on lock contention, unless nested in a transaction."""
+    if connection.in_atomic_block:
+        return func(*args, **kwargs)
+    attempts = getattr(settings, 'LEDGER_MAX_RETRIES', 5)
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt == attempts - 1 or not _is_retryable(exc):
+                raise
+            logger.debug("Retrying ledger post after %s (attempt %d)", exc, attempt + 1)
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+
+def _check_amount(amount):
+    if not isinstance(amount, int) or isinstance(amount, bool):
+        raise LedgerError(f'Amounts must be integers in minor units, got {amount!r}')
+
+
+def _normalize_legs(postings):
+    """Merge legs per account and drop zero amounts; returns [(account_id, amount)]."""
+    legs = defaultdict(int)
+    for account, amount in postings:
+        _check_amount(amount)
+        legs[getattr(account, 'pk', account)] += amount
+    return [(account_id, amount) for account_id, amount in legs.items() if amount]
+
+
+def _save_balances(accounts, now):
+    # One parameterized UPDATE per account via executemany: bulk_update would
+    # build a CASE expression over every row, which dominates large entries
+    quote = connection.ops.quote_name
+    opts = Account._meta
+    sql = 'UPDATE {} SET {} = %s, {} = %s WHERE {} = %s'.format(
+        quote(opts.db_table),
+        quote(opts.get_field('balance').column),
+        quote(opts.get_field('updated_at').column),
+        quote(opts.pk.column),
+    )
+    updated_at = connection.ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(account.balance, updated_at, account.pk) for account in accounts])
+    for account in accounts:
+        account.updated_at = now
+
+
+def post_legs(legs, description='', reference=None, metadata=None, scope=''):
+    """Post one entry from legs in the given order, without merging them.
+
+    An account may appear in several legs (a payroll entry paying the same
+    wallet twice); each posting records the running balance after it. Runs
+    inside the caller's transaction if there is one.
+
+    Args:
+        legs: Sequence of ``(account id, amount)``; amounts are non-zero integers
+
+    Returns:
+        tuple: ``(entry, postings)``, postings in the order of ``legs``
+
+    Raises:
+        UnbalancedEntry, CurrencyMismatch, InsufficientFunds, LedgerError
+    """
+    for _, amount in legs:
+        _check_amount(amount)
+        if amount == 0:
+            raise LedgerError('Posting amounts must not be zero')
+    account_ids = {account_id for account_id, _ in legs}
+    if len(account_ids) < 2:
+        raise UnbalancedEntry('An entry needs postings to at least two accounts')
+    total = sum(amount for _, amount in legs)
+    if total != 0:
+        raise UnbalancedEntry(f'Postings sum to {total}, not zero')
+
+    now = timezone.now()
+    with transaction.atomic():
+        if not connection.features.has_select_for_update:
+            # SQLite has no row locks. Writing first takes the database write lock
+            # (waiting out busy_timeout) before any read, instead of failing when a
+            # read snapshot is later upgraded to a write.
+            Account.objects.filter(pk__in=account_ids).update(updated_at=now)
+        # Lock in primary-key order: concurrent entries over overlapping accounts
+        # wait on each other instead of deadlocking.
+        accounts = {
+            account.pk: account
+            for account in Account.objects.select_for_update().filter(pk__in=account_ids).order_by('pk')
+        }
+        if len(accounts) != len(account_ids):
+            raise LedgerError(f'Unknown accounts: {sorted(account_ids - set(accounts))}')
+        if len({account.currency for account in accounts.values()}) > 1:
+            raise CurrencyMismatch('All postings in an entry must share a currency')
+
+        net = defaultdict(int)
+        for account_id, amount in legs:
+            net[account_id] += amount
+        for account_id, amount in net.items():
+            account = accounts[account_id]
+            if not account.allow_negative and account.balance + amount < 0:
+                raise InsufficientFunds(account_id, account.balance, amount)
+
+        entry = JournalEntry.objects.create(
+            scope=scope, reference=reference, description=description, metadata=metadata or {}, created_at=now
+        )
+        postings = []
+        for account_id, amount in legs:
+            account = accounts[account_id]
+            account.balance += amount
+            postings.append(Posting(
+                entry=entry, account_id=account_id, amount=amount, balance_after=account.balance, created_at=now,
+            ))
+        Posting.objects.bulk_create(postings, batch_size=1000)
+        _save_balances(accounts.values(), now)
+        emit_event('entry.posted', {
+            'entry': entry.pk,
+            'reference': reference,
+            'description': description,
+            'created_at': now,
+            'currency': next(iter(accounts.values())).currency,
+            'postings': [
+                {'account': posting.account_id, 'owner': accounts[posting.account_id].owner_id,
+                 'amount': posting.amount, 'balance_after': posting.balance_after}
+                for posting in postings
+            ],
+        }, owners={account.owner_id for account in accounts.values()})
+    return entry, postings
+
+
+def _existing_entry(scope, reference, legs):
+    """Return the entry already posted under ``reference`` if it has the same legs, else raise."""
+    existing = JournalEntry.objects.filter(scope=scope, reference=reference).first()
+    if existing is not None:
+        posted = sorted(existing.postings.values_list('account_id', 'amount'))
+        if posted != sorted(legs):
+            raise ReferenceConflict(f'Reference {reference!r} was already used for a different entry')
+    return existing
+
+
+@timed('ledger_post')
+def post_entry(postings, description='', reference=None, metadata=None, scope=''):
+    """Post a balanced journal entry.
+
+    Args:
+        postings: Iterable of ``(account or account id, amount)``; amounts are
+            integers in minor units, positive to increase a balance. Legs for
+            the same account are merged.
+        description: Free text shown on statements
+        reference: Optional key, unique within ``scope``; reposting it with the
+            same legs returns the original entry
+        metadata: JSON-serializable extra data
+        scope: Namespace for ``reference``, so callers cannot collide with each
+            other's references
+
+    Returns:
+        JournalEntry: The posted (or previously posted) entry
+
+    Raises:
+        UnbalancedEntry: If the amounts do not sum to zero
+        CurrencyMismatch: If the accounts use different currencies
+        InsufficientFunds: If an account would go negative
+        ReferenceConflict: If the reference was used for different legs
+        LedgerError: If an account does not exist
+    """
+    legs = _normalize_legs(postings)
+    if reference is not None:
+        existing = _existing_entry(scope, reference, legs)
+        if existing is not None:
+            return existing
+    try:
+        entry, _ = retry_on_contention(post_legs, legs, description, reference, metadata, scope)
+        return entry
+    except IntegrityError:
+        # Lost a race with a concurrent post of the same reference
+        if reference is not None:
+            existing = _existing_entry(scope, reference, legs)
+            if existing is not None:
+                return existing
+        raise
+
+
+def transfer(source, destination, amount, description='', reference=None, metadata=None, scope=''):
+    """Move ``amount`` minor units from ``source`` to ``destination``.
+
+    Returns:
+        JournalEntry: The posted entry
+    """
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        raise LedgerError(f'Transfer amount must be a positive integer, got {amount!r}')
+    return post_entry(
+        [(source, -amount), (destination, amount)],
+        description=description, reference=reference, metadata=metadata, scope=scope,
+    )
+
+
+def get_balance(account):
+    """Return an account's balance in minor units (one single-row query)."""
+    account_id = getattr(account, 'pk', account)
+    return Account.objects.values_list('balance', flat=True).get(pk=account_id)
+
+
+def check_ledger(accounts=None):
+    """Verify the ledger's invariants.
+
+    Args:
+        accounts: Optional queryset restricting the per-account check
+
+    Returns:
+        list: Human-readable problems; empty when the books are consistent
+    """
+    problems = []
+    queryset = accounts if accounts is not None else Account.objects.all()
+    derived = dict(
+        Posting.objects.filter(account__in=queryset).values('account')
+        .annotate(total=Sum('amount')).values_list('account', 'total')
+    )
+    for account_id, balance in queryset.values_list('pk', 'balance'):
+        if derived.get(account_id, 0) != balance:
+            problems.append(
+                f'Account {account_id}: balance {balance} but postings sum to {derived.get(account_id, 0)}'
+            )
+
+    for currency, total in Account.objects.values('currency').annotate(total=Sum('balance')).values_list(
+        'currency', 'total'
+    ):
+        if total:
+            problems.append(f'{currency} balances sum to {total}, not zero')
+
+    unbalanced = (
+        Posting.objects.values('entry').annotate(total=Sum('amount')).exclude(total=0).values_list('entry', flat=True)
+    )
+    for entry_id in unbalanced[:10]:
+        problems.append(f'Entry {entry_id} does not balance')
+    return problems
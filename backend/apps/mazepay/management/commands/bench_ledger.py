@@ -0,0 +1,140 @@
+"""
+Management command to load-test the MazePay ledger.
+
+Creates a set of funded accounts, then runs concurrent random transfers
+between them from several threads (each with its own database connection)
+and reports throughput and latency. Afterwards it verifies the books: every
+balance equals the sum of its postings and no money was created or lost.
+Fewer accounts means more transfers contend for the same row locks.
+"""
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.mazepay.ledger import InsufficientFunds, check_ledger, post_entry, transfer
+from apps.mazepay.models import Account, JournalEntry, OutboxEvent, Posting
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent ledger transfers and verify balances afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=50, help='Accounts transfers move between')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent workers')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load')
+        parser.add_argument('--initial-balance', type=int, default=100000, help='Minor units per account')
+        parser.add_argument('--max-amount', type=int, default=5000, help='Largest transfer in minor units')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts and entries')
+
+    def handle(self, *args, **options):
+        if options['accounts'] < 2:
+            raise CommandError('--accounts must be at least 2')
+        run = uuid.uuid4().hex[:8]
+        account_ids = self._setup(run, options)
+        accounts = Account.objects.filter(pk__in=account_ids)
+        self.stdout.write(
+            f"Database: {connection.vendor}; {options['accounts']} accounts, {options['threads']} threads, "
+            f"{options['duration']:.0f}s"
+        )
+        try:
+            results = self._load(run, account_ids, options)
+            self._report(results, options)
+            self._verify(accounts, options)
+        finally:
+            if not options['keep']:
+                self._cleanup(run)
+
+    def _setup(self, run, options):
+        funding = Account.objects.create(
+            name=f'bench-{run}-funding', kind=Account.KIND_SYSTEM, allow_negative=True
+        )
+        Account.objects.bulk_create([Account(name=f'bench-{run}-{i}') for i in range(options['accounts'])])
+        accounts = Account.objects.filter(name__startswith=f'bench-{run}-', kind=Account.KIND_USER)
+        account_ids = list(accounts.values_list('pk', flat=True))
+        post_entry(
+            [(funding, -options['initial_balance'] * len(account_ids))]
+            + [(account_id, options['initial_balance']) for account_id in account_ids],
+            description='Benchmark funding',
+            metadata={'benchmark': run},
+        )
+        return account_ids
+
+    def _load(self, run, account_ids, options):
+        stop = time.monotonic() + options['duration']
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            rng = random.Random()
+            latencies, insufficient, errors = [], 0, 0
+            try:
+                while time.monotonic() < stop:
+                    source, destination = rng.sample(account_ids, 2)
+                    started = time.perf_counter()
+                    try:
+                        transfer(
+                            source, destination, rng.randint(1, options['max_amount']), metadata={'benchmark': run}
+                        )
+                        latencies.append(time.perf_counter() - started)
+                    except InsufficientFunds:
+                        insufficient += 1
+                    except Exception as e:
+                        errors += 1
+                        if errors == 1:
+                            self.stderr.write(f'Transfer failed: {e}')
+            finally:
+                connection.close()
+            with lock:
+                results.append((latencies, insufficient, errors))
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _report(self, results, options):
+        latencies = sorted(latency for result in results for latency in result[0])
+        insufficient = sum(result[1] for result in results)
+        errors = sum(result[2] for result in results)
+        if not latencies:
+            raise CommandError('No transfer succeeded')
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f"{len(latencies)} transfers in {options['duration']:.1f}s = "
+            f"{len(latencies) / options['duration']:.0f} transfers/s"
+        )
+        self.stdout.write(
+            f"latency p50 {percentile(0.5):.2f} ms, p99 {percentile(0.99):.2f} ms; "
+            f"{insufficient} rejected for insufficient funds, {errors} errors"
+        )
+
+    def _verify(self, accounts, options):
+        problems = check_ledger(accounts)
+        total = sum(accounts.values_list('balance', flat=True))
+        expected = options['initial_balance'] * accounts.count()
+        if total != expected:
+            problems.append(f'Accounts hold {total}, expected {expected}')
+        if accounts.filter(balance__lt=0).exists():
+            problems.append('An account went negative')
+        if problems:
+            raise CommandError('Ledger check failed:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Ledger check passed: balances match postings and sum is conserved'))
+
+    @staticmethod
+    def _cleanup(run):
+        with transaction.atomic():
+            accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+            entries = JournalEntry.objects.filter(metadata__benchmark=run)
+            OutboxEvent.objects.filter(payload__entry__in=list(entries.values_list('pk', flat=True))).delete()
+            Posting.objects.filter(account__in=accounts).delete()
+            entries.delete()
+            accounts.delete()
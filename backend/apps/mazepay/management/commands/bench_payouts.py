@@ -0,0 +1,128 @@
+"""
+Management command to benchmark MazePay batch payouts.
+
+Pays ``--items`` payouts from one funded account to a pool of destination
+accounts twice: once through a payout batch (validation, storage and
+chunked posting, one transaction per chunk) and once as individual
+transfers, one transaction each. Posting every payout individually takes
+long at 100k, so the individual run is limited to ``--sample`` payouts and
+extrapolated. Both runs are checked with :func:`check_ledger` afterwards.
+"""
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.mazepay.ledger import check_ledger, post_entry, transfer
+from apps.mazepay.models import Account, JournalEntry, OutboxEvent, PayoutBatch, Posting
+from apps.mazepay.payouts import create_batch, parse_payout_list, process_batch, validate_payouts
+
+
+class Command(BaseCommand):
+    help = 'Benchmark chunked batch payouts against posting each payout on its own'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000, help='Payouts in the batch')
+        parser.add_argument('--accounts', type=int, default=1000, help='Destination accounts paid in rotation')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Items per transaction (default: setting)')
+        parser.add_argument('--sample', type=int, default=2000, help='Payouts posted one at a time for comparison')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts, batch and entries')
+
+    def handle(self, *args, **options):
+        if options['items'] < 1 or options['accounts'] < 1:
+            raise CommandError('--items and --accounts must be positive')
+        run = uuid.uuid4().hex[:8]
+        user, source, destination_ids = self._setup(run, options)
+        accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+        self.stdout.write(
+            f"Database: {connection.vendor}; {options['items']} payouts to {options['accounts']} accounts"
+        )
+        try:
+            batched = self._batched(user, source, destination_ids, options)
+            single = self._single(run, source, destination_ids, options)
+            self._report(batched, single, options)
+            problems = check_ledger(accounts)
+            if problems:
+                raise CommandError('Ledger check failed:\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS('Ledger check passed'))
+        finally:
+            if not options['keep']:
+                self._cleanup(run, user)
+
+    def _setup(self, run, options):
+        user = get_user_model().objects.create_user(email=f'bench-{run}@example.com', password=None)
+        funding = Account.objects.create(name=f'bench-{run}-funding', kind=Account.KIND_SYSTEM, allow_negative=True)
+        source = Account.objects.create(name=f'bench-{run}-source', owner=user)
+        Account.objects.bulk_create([Account(name=f'bench-{run}-{i}') for i in range(options['accounts'])])
+        destination_ids = list(
+            Account.objects.filter(name__startswith=f'bench-{run}-', kind=Account.KIND_USER)
+            .exclude(pk=source.pk).values_list('pk', flat=True)
+        )
+        post_entry(
+            [(funding, -(options['items'] + options['sample'])), (source, options['items'] + options['sample'])],
+            description='Benchmark funding',
+            metadata={'benchmark': run},
+        )
+        source.refresh_from_db()
+        return user, source, destination_ids
+
+    def _batched(self, user, source, destination_ids, options):
+        rows = parse_payout_list([
+            {'account': destination_ids[i % len(destination_ids)], 'amount': 1} for i in range(options['items'])
+        ])
+        started = time.perf_counter()
+        items = validate_payouts(source, rows)
+        batch = create_batch(user, source, items, description='Benchmark payouts', chunk_size=options['chunk_size'])
+        stored = time.perf_counter()
+        batch = process_batch(batch.pk)
+        finished = time.perf_counter()
+        if batch.status != PayoutBatch.STATUS_COMPLETED:
+            raise CommandError(f'Batch ended {batch.status}: {batch.error}')
+        return {
+            'chunk_size': batch.chunk_size,
+            'validate': stored - started,
+            'post': finished - stored,
+            'total': finished - started,
+        }
+
+    def _single(self, run, source, destination_ids, options):
+        count = min(options['sample'], options['items'])
+        started = time.perf_counter()
+        for i in range(count):
+            transfer(source, destination_ids[i % len(destination_ids)], 1, metadata={'benchmark': run})
+        return {'count': count, 'total': time.perf_counter() - started}
+
+    def _report(self, batched, single, options):
+        items = options['items']
+        self.stdout.write(
+            f"Batched (chunks of {batched['chunk_size']}): {batched['total']:.2f}s = "
+            f"{items / batched['total']:.0f} payouts/s "
+            f"(validate and store {batched['validate']:.2f}s, post {batched['post']:.2f}s)"
+        )
+        if not single['count']:
+            return
+        per_payout = single['total'] / single['count']
+        self.stdout.write(
+            f"One at a time: {single['count']} payouts in {single['total']:.2f}s = {1 / per_payout:.0f} payouts/s; "
+            f"{items} would take about {per_payout * items:.0f}s"
+        )
+        self.stdout.write(f"Speed-up: {per_payout * items / batched['total']:.1f}x")
+
+    @staticmethod
+    def _cleanup(run, user):
+        with transaction.atomic():
+            accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+            batches = PayoutBatch.objects.filter(created_by=user)
+            entry_ids = list(
+                JournalEntry.objects.filter(metadata__benchmark=run).values_list('pk', flat=True)
+            ) + list(batches.values_list('items__entry', flat=True).distinct())
+            entry_ids = [pk for pk in entry_ids if pk is not None]
+            OutboxEvent.objects.filter(payload__entry__in=entry_ids).delete()
+            OutboxEvent.objects.filter(payload__batch__in=list(batches.values_list('pk', flat=True))).delete()
+            batches.delete()
+            Posting.objects.filter(account__in=accounts).delete()
+            JournalEntry.objects.filter(pk__in=entry_ids).delete()
+            accounts.delete()
+            user.delete()
@@ -0,0 +1,177 @@
+"""
+Management command to benchmark settlement reconciliation.
+
+Builds a settlement account with ``--rows`` referenced entries spread over
+``--days`` days (inserted in bulk, with matching legs on a wallet so the
+books balance) and a settlement CSV describing them, with a few per cent
+each of wrong amounts, late dates, rows unknown to the ledger and entries
+missing from the file. It then times :func:`reconcile` (vectorized hash
+join, file read in chunks), checks its counts against what was planted,
+and measures peak memory in a second pass. For comparison, ``--sample``
+rows are reconciled the obvious way, one entry lookup per row, and
+extrapolated.
+"""
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.mazepay.models import Account, JournalEntry, Posting
+from apps.mazepay.reconciliation import NUMPY_AVAILABLE, parse_amount, parse_day, reconcile
+from apps.mazepay.statements import day_start
+
+
+class Command(BaseCommand):
+    help = 'Benchmark vectorized settlement reconciliation against per-row lookups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Ledger entries and settlement rows')
+        parser.add_argument('--days', type=int, default=30, help='Days the entries are spread over')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Settlement rows per chunk')
+        parser.add_argument('--sample', type=int, default=2000, help='Rows reconciled one lookup at a time')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts and entries')
+
+    def handle(self, *args, **options):
+        if not NUMPY_AVAILABLE:
+            raise CommandError('NumPy is not installed')
+        if options['rows'] < 100 or options['days'] < 1:
+            raise CommandError('--rows must be at least 100 and --days positive')
+        run = uuid.uuid4().hex[:8]
+        workdir = tempfile.mkdtemp(prefix='bench-reconciliation-')
+        self.stdout.write(f"Database: {connection.vendor}; {options['rows']} rows over {options['days']} days")
+        try:
+            started = time.perf_counter()
+            account, first_day, expected = self._setup(run, workdir, options)
+            self.stdout.write(f"Setup: {time.perf_counter() - started:.1f}s")
+            elapsed, rows = self._vectorized(account, first_day, workdir, expected, options)
+            self._per_row(account, workdir, elapsed, rows, options)
+        finally:
+            shutil.rmtree(workdir)
+            if not options['keep']:
+                self._cleanup(run)
+
+    def _setup(self, run, workdir, options):
+        rng = random.Random(0)
+        settlement = Account.objects.create(
+            name=f'bench-{run}-settlement', kind=Account.KIND_SYSTEM, allow_negative=True
+        )
+        wallet = Account.objects.create(name=f'bench-{run}-wallet')
+        first_day = timezone.localdate() - timedelta(days=options['days'] + 7)
+        rows, per_day = options['rows'], -(-options['rows'] // options['days'])
+        expected = {'matched': 0, 'mismatched': 0, 'unmatched_external': 0, 'unmatched_ledger': 0}
+        total = 0
+
+        with transaction.atomic(), open(os.path.join(workdir, 'settlement.csv'), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['reference', 'amount', 'date', 'currency'])
+            for start in range(0, rows, 5000):
+                numbers = range(start, min(start + 5000, rows))
+                times = [
+                    day_start(first_day + timedelta(days=i // per_day)) + timedelta(seconds=rng.randrange(86400))
+                    for i in numbers
+                ]
+                amounts = [rng.randint(100, 500000) for _ in numbers]
+                entries = JournalEntry.objects.bulk_create([
+                    JournalEntry(reference=f'bench-{run}-{i}', metadata={'benchmark': run}, created_at=when)
+                    for i, when in zip(numbers, times)
+                ])
+                postings = []
+                for entry, amount, when in zip(entries, amounts, times):
+                    total += amount
+                    postings.append(Posting(
+                        entry=entry, account=settlement, amount=-amount, balance_after=-total, created_at=when
+                    ))
+                    postings.append(Posting(
+                        entry=entry, account=wallet, amount=amount, balance_after=total, created_at=when
+                    ))
+                Posting.objects.bulk_create(postings, batch_size=5000)
+
+                for i, amount, when in zip(numbers, amounts, times):
+                    roll = rng.random()
+                    settled = timezone.localdate(when) + timedelta(days=rng.randint(0, 1))
+                    if roll < 0.01:
+                        expected['unmatched_ledger'] += 1
+                        continue
+                    if roll < 0.02:
+                        amount += 1
+                    elif roll < 0.03:
+                        settled += timedelta(days=5)
+                    writer.writerow([f'bench-{run}-{i}', f'{amount // 100}.{amount % 100:02d}', settled, 'USD'])
+                    expected['mismatched' if roll < 0.03 else 'matched'] += 1
+                    if roll > 0.99:
+                        writer.writerow([f'bench-{run}-unknown-{i}', '1.00', settled, 'USD'])
+                        expected['unmatched_external'] += 1
+            Account.objects.filter(pk=settlement.pk).update(balance=-total)
+            Account.objects.filter(pk=wallet.pk).update(balance=total)
+        return settlement, first_day, expected
+
+    def _vectorized(self, account, first_day, workdir, expected, options):
+        path = os.path.join(workdir, 'settlement.csv')
+        end = first_day + timedelta(days=options['days'])
+        size = os.path.getsize(path)
+
+        def run():
+            with open(path, newline='') as settlement:
+                return reconcile(
+                    account, settlement, first_day, end, os.path.join(workdir, 'reports'),
+                    invert_ledger_amounts=True, chunk_size=options['chunk_size'],
+                )
+
+        started = time.perf_counter()
+        counts = run()
+        elapsed = time.perf_counter() - started
+        if {key: counts[key] for key in expected} != expected:
+            raise CommandError(f'Counts {counts} differ from the planted {expected}')
+        # Second pass for memory: tracing every allocation slows the first one down
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stdout.write(
+            f"Vectorized: {counts['external_rows']} settlement rows ({size / 1e6:.0f} MB) against "
+            f"{counts['ledger_rows']} postings in {elapsed:.2f}s = {counts['external_rows'] / elapsed:.0f} rows/s, "
+            f"peak memory {peak / 1e6:.0f} MB"
+        )
+        self.stdout.write(
+            f"  {counts['matched']} matched, {counts['mismatched']} mismatched, "
+            f"{counts['unmatched_external']} unmatched in the file, {counts['unmatched_ledger']} in the ledger"
+        )
+        return elapsed, counts['external_rows']
+
+    def _per_row(self, account, workdir, elapsed, rows, options):
+        count = matched = 0
+        started = time.perf_counter()
+        with open(os.path.join(workdir, 'settlement.csv'), newline='') as settlement:
+            for row in csv.DictReader(settlement):
+                posting = (
+                    Posting.objects.filter(account=account, entry__reference=row['reference'])
+                    .values_list('amount', 'created_at').first()
+                )
+                matched += posting is not None and -posting[0] == parse_amount(row['amount']) and abs(
+                    timezone.localdate(posting[1]).toordinal() - parse_day(row['date'])
+                ) <= 2
+                count += 1
+                if count == options['sample']:
+                    break
+        per_row = (time.perf_counter() - started) / count
+        self.stdout.write(
+            f"One lookup per row: {count} rows ({matched} matched) in {per_row * count:.2f}s = "
+            f"{1 / per_row:.0f} rows/s; {rows} would take about {per_row * rows:.0f}s ({per_row * rows / elapsed:.0f}x)"
+        )
+
+    @staticmethod
+    def _cleanup(run):
+        with transaction.atomic():
+            accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+            Posting.objects.filter(account__in=accounts).delete()
+            JournalEntry.objects.filter(metadata__benchmark=run).delete()
+            accounts.delete()
@@ -0,0 +1,123 @@
+"""
+Management command to benchmark MazePay transfer risk scoring.
+
+Replays ``--transfers`` synthetic transfers spread over ``--hours`` hours
+through :func:`assess`, in time order, on the configured velocity store
+(Redis when CACHE_URL is set, this process otherwise). Ordinary traffic
+comes from ``--users`` users, busy ones far more often than the rest, each
+with a device or two and a home IP. Mixed in are ``--attacks`` bursts of
+the kind velocity limits are for: one user draining an account in quick
+transfers, one device cycling through stolen logins, and one IP behind many
+users and devices. Reports the latency per assessment against the 2 ms
+budget, and how often each kind of traffic was flagged or blocked.
+"""
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mazepay.risk import ALLOW, BLOCK, REVIEW, TransferContext, assess, get_store, reset_store
+
+BUDGET_MS = 2.0
+
+
+def _ip(number):
+    return f'10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}'
+
+
+class Command(BaseCommand):
+    help = 'Replay synthetic transfers through the risk checks and report latency and decisions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transfers', type=int, default=200000, help='Ordinary transfers replayed')
+        parser.add_argument('--users', type=int, default=20000, help='Users making ordinary transfers')
+        parser.add_argument('--hours', type=float, default=24.0, help='Simulated time the traffic spans')
+        parser.add_argument('--attacks', type=int, default=60, help='Bursts of abusive transfers mixed in')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        if min(options['transfers'], options['users']) < 1 or options['hours'] <= 0 or options['attacks'] < 0:
+            raise CommandError('--transfers, --users and --hours must be positive')
+        run = uuid.uuid4().hex[:8]
+        traffic = self._traffic(run, options)
+        store = type(get_store()).__name__
+        self.stdout.write(
+            f"Store: {store}; {len(traffic)} transfers ({options['attacks']} bursts) over {options['hours']:g}h"
+        )
+        reset_store()
+        try:
+            timings, decisions = self._replay(traffic)
+        finally:
+            reset_store()
+        self._report(timings, decisions)
+
+    def _traffic(self, run, options):
+        rng = random.Random(options['seed'])
+        span = options['hours'] * 3600
+        start = time.time() - span
+        users = [
+            (f'{run}-u{i}', [f'{run}-d{i}-{j}' for j in range(rng.randint(1, 2))], _ip(i))
+            for i in range(options['users'])
+        ]
+        # Heavy-tailed activity, capped so the busiest users make a few dozen transfers a day, not thousands
+        weights = [min(rng.paretovariate(1.2), 20) for _ in users]
+        traffic = []
+        for user, at in zip(
+            rng.choices(users, weights=weights, k=options['transfers']),
+            (start + rng.random() * span for _ in range(options['transfers'])),
+        ):
+            name, devices, ip = user
+            traffic.append((at, 'ordinary', TransferContext(
+                user=name, device=rng.choice(devices), ip=ip, amount=rng.randint(500, 50000),
+                source_account=None, destination_account=None, at=at,
+            )))
+
+        for attack in range(options['attacks']):
+            at = start + rng.random() * span
+            kind = ('drain', 'device', 'ip')[attack % 3]
+            for i in range(rng.randint(15, 40)):
+                user = f'{run}-a{attack}' if kind == 'drain' else f'{run}-a{attack}-{i}'
+                device = f'{run}-ad{attack}' if kind != 'ip' else f'{run}-ad{attack}-{i}'
+                ip = '172.31.0.1' if kind == 'ip' else f'172.16.{attack % 256}.{i % 4}'
+                at += rng.uniform(0.5, 3)
+                traffic.append((at, kind, TransferContext(
+                    user=user, device=device, ip=ip, amount=rng.randint(20000, 200000),
+                    source_account=None, destination_account=None, at=at,
+                )))
+        traffic.sort(key=lambda item: item[0])
+        return traffic
+
+    @staticmethod
+    def _replay(traffic):
+        timings = []
+        decisions = {}
+        clock = time.perf_counter_ns
+        for _, kind, context in traffic:
+            started = clock()
+            decision = assess(context).decision
+            timings.append(clock() - started)
+            counts = decisions.setdefault(kind, {ALLOW: 0, REVIEW: 0, BLOCK: 0})
+            counts[decision] += 1
+        return timings, decisions
+
+    def _report(self, timings, decisions):
+        timings.sort()
+        total = sum(timings) / 1e9
+
+        def percentile(share):
+            return timings[min(len(timings) - 1, int(len(timings) * share))] / 1e6
+
+        p99 = percentile(0.99)
+        self.stdout.write(
+            f"Latency: p50 {percentile(0.5):.3f} ms, p99 {p99:.3f} ms, p99.9 {percentile(0.999):.3f} ms, "
+            f"max {timings[-1] / 1e6:.3f} ms; {len(timings) / total:.0f} assessments/s"
+        )
+        for kind, counts in decisions.items():
+            seen = sum(counts.values())
+            self.stdout.write(
+                f"  {kind}: {seen} transfers, {counts[REVIEW] / seen:.1%} flagged, {counts[BLOCK] / seen:.1%} blocked"
+            )
+        if p99 > BUDGET_MS:
+            raise CommandError(f'p99 {p99:.3f} ms is over the {BUDGET_MS} ms budget')
+        self.stdout.write(self.style.SUCCESS(f'p99 within the {BUDGET_MS} ms budget'))
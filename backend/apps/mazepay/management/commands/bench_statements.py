@@ -0,0 +1,146 @@
+"""
+Management command to benchmark historical balances and statements.
+
+Builds one account with ``--postings`` deposits spread over ``--days`` days
+(inserted in bulk, with matching legs on a funding account so the books
+balance), then compares a historical balance summed from every posting
+against :func:`balance_at` reading a snapshot, and measures streaming a
+month's and the full history's statement as CSV and PDF.
+"""
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.mazepay.ledger import check_ledger
+from apps.mazepay.models import Account, BalanceSnapshot, JournalEntry, Posting
+from apps.mazepay.statements import (
+    Statement, balance_at, day_start, iter_statement_csv, iter_statement_pdf, take_snapshots,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark snapshot-based historical balances and streamed statements'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--postings', type=int, default=200000, help='Deposits into the benchmark account')
+        parser.add_argument('--days', type=int, default=365, help='Days the deposits are spread over')
+        parser.add_argument('--lookups', type=int, default=50, help='Historical balances to time')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts and entries')
+
+    def handle(self, *args, **options):
+        if options['postings'] < 1 or options['days'] < 1:
+            raise CommandError('--postings and --days must be positive')
+        run = uuid.uuid4().hex[:8]
+        self.stdout.write(
+            f"Database: {connection.vendor}; {options['postings']} postings over {options['days']} days"
+        )
+        started = time.perf_counter()
+        account, first_day, last_day = self._setup(run, options)
+        self.stdout.write(f"Setup: {time.perf_counter() - started:.1f}s")
+        accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+        try:
+            self._balances(account, first_day, last_day, options)
+            self._statements(account, last_day, first_day)
+            problems = check_ledger(accounts)
+            if problems:
+                raise CommandError('Ledger check failed:\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS('Ledger check passed'))
+        finally:
+            if not options['keep']:
+                self._cleanup(run)
+
+    def _setup(self, run, options):
+        funding = Account.objects.create(name=f'bench-{run}-funding', kind=Account.KIND_SYSTEM, allow_negative=True)
+        account = Account.objects.create(name=f'bench-{run}-account')
+        last_day = day_start(timezone.now()) - timedelta(days=1)
+        first_day = last_day - timedelta(days=options['days'] - 1)
+        per_day, extra = divmod(options['postings'], options['days'])
+        balance = 0
+        with transaction.atomic():
+            for day in range(options['days']):
+                count = per_day + (1 if day < extra else 0)
+                if not count:
+                    continue
+                start = first_day + timedelta(days=day)
+                entry = JournalEntry.objects.create(
+                    description='Benchmark deposits', metadata={'benchmark': run}, created_at=start
+                )
+                postings = []
+                for i in range(count):
+                    amount = random.randint(1, 10000)
+                    created_at = start + timedelta(seconds=86399 * i // count)
+                    balance += amount
+                    postings.append(Posting(
+                        entry=entry, account=account, amount=amount, balance_after=balance, created_at=created_at
+                    ))
+                    postings.append(Posting(
+                        entry=entry, account=funding, amount=-amount, balance_after=-balance, created_at=created_at
+                    ))
+                Posting.objects.bulk_create(postings, batch_size=5000)
+            Account.objects.filter(pk=account.pk).update(balance=balance)
+            Account.objects.filter(pk=funding.pk).update(balance=-balance)
+        return account, first_day, last_day + timedelta(days=1)
+
+    def _balances(self, account, first_day, last_day, options):
+        rng = random.Random(0)
+        span = (last_day - first_day).total_seconds()
+        moments = [first_day + timedelta(seconds=rng.uniform(0, span)) for _ in range(options['lookups'])]
+
+        started = time.perf_counter()
+        expected = [
+            Posting.objects.filter(account=account, created_at__lt=at).aggregate(total=Sum('amount'))['total'] or 0
+            for at in moments
+        ]
+        scan = (time.perf_counter() - started) / len(moments)
+
+        started = time.perf_counter()
+        written = take_snapshots(until=last_day)
+        self.stdout.write(f"Snapshots: {written} written in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        actual = [balance_at(account, at) for at in moments]
+        snapshot = (time.perf_counter() - started) / len(moments)
+        if actual != expected:
+            raise CommandError('balance_at disagrees with summing the postings')
+        self.stdout.write(
+            f"Historical balance: full scan {scan * 1000:.2f} ms, from snapshot {snapshot * 1000:.2f} ms "
+            f"({scan / snapshot:.0f}x)"
+        )
+
+    def _statements(self, account, last_day, first_day):
+        for label, start in (('last 30 days', last_day - timedelta(days=30)), ('full history', first_day)):
+            for name, render in (('CSV', iter_statement_csv), ('PDF', iter_statement_pdf)):
+                started = time.perf_counter()
+                first_chunk = None
+                size = 0
+                for chunk in render(Statement(account, start, last_day)):
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                    size += len(chunk)
+                elapsed = time.perf_counter() - started
+                # Second pass for memory: tracing every allocation slows the first one down
+                tracemalloc.start()
+                for chunk in render(Statement(account, start, last_day)):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"{name} statement, {label}: {size / 1e6:.1f} MB in {elapsed:.2f}s, "
+                    f"first bytes after {first_chunk * 1000:.0f} ms, peak memory {peak / 1e6:.1f} MB"
+                )
+
+    @staticmethod
+    def _cleanup(run):
+        with transaction.atomic():
+            accounts = Account.objects.filter(name__startswith=f'bench-{run}-')
+            BalanceSnapshot.objects.filter(account__in=accounts).delete()
+            Posting.objects.filter(account__in=accounts).delete()
+            JournalEntry.objects.filter(metadata__benchmark=run).delete()
+            accounts.delete()
@@ -0,0 +1,166 @@
+"""
+Management command to benchmark webhook delivery.
+
+Starts a stand-in receiver on localhost (an asyncio HTTP server in a
+background thread, answering 200 after ``--latency`` ms), registers
+``--endpoints`` endpoints for it and queues ``--events`` events. It then
+reports:
+
+* raw HTTP throughput of :func:`deliver_all` with pooled keep-alive
+  connections against a new connection per request;
+* end-to-end throughput of :func:`dispatch_once` draining the outbox
+  (fan-out, leasing, signing, delivery and recording results).
+"""
+import asyncio
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from apps.mazepay.dispatcher import ConnectionPool, deliver_all
+from apps.mazepay.models import OutboxEvent, WebhookDelivery, WebhookEndpoint
+from apps.mazepay.webhooks import dispatch_once, sign_payload
+
+EVENT_TYPE = 'benchmark.ping'
+
+
+class _Receiver:
+    """Minimal keep-alive HTTP server that accepts every POST."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _shutdown(self):
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                await reader.readexactly(length)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.requests += 1
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        self.thread.join()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark webhook delivery throughput against a local stand-in receiver'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2000, help='Events queued for the end-to-end run')
+        parser.add_argument('--endpoints', type=int, default=4, help='Endpoints each event fans out to')
+        parser.add_argument('--concurrency', type=int, default=8, help='Max concurrency per endpoint')
+        parser.add_argument('--latency', type=float, default=5.0, help='Receiver response time in ms')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests for the raw HTTP comparison')
+
+    def handle(self, *args, **options):
+        if min(options['events'], options['endpoints'], options['concurrency'], options['requests']) < 1:
+            raise CommandError('Counts must be positive')
+        receiver = _Receiver(options['latency'] / 1000)
+        url = f'http://127.0.0.1:{receiver.port}/hook'
+        endpoints = WebhookEndpoint.objects.bulk_create([
+            WebhookEndpoint(url=f'{url}/{i}', event_types=[EVENT_TYPE], max_concurrency=options['concurrency'])
+            for i in range(options['endpoints'])
+        ])
+        self.stdout.write(
+            f"Database: {connection.vendor}; receiver latency {options['latency']:.0f} ms, "
+            f"{options['endpoints']} endpoints x {options['concurrency']} concurrent"
+        )
+        try:
+            # The receiver is on loopback, which the dispatcher otherwise refuses
+            with override_settings(WEBHOOK_ALLOW_PRIVATE_ADDRESSES=True):
+                self._raw(receiver, endpoints, options)
+                self._end_to_end(receiver, options)
+        finally:
+            OutboxEvent.objects.filter(event_type=EVENT_TYPE).delete()
+            WebhookEndpoint.objects.filter(pk__in=[endpoint.pk for endpoint in endpoints]).delete()
+            receiver.stop()
+
+    def _raw(self, receiver, endpoints, options):
+        body = b'{"type":"benchmark.ping"}'
+        requests = []
+        for i in range(options['requests']):
+            endpoint = endpoints[i % len(endpoints)]
+            delivery = WebhookDelivery(pk=i, endpoint=endpoint)
+            requests.append((delivery, endpoint.url, body, {
+                'Content-Type': 'application/json', 'RippleFox-Signature': sign_payload(endpoint.secret, body),
+            }))
+
+        async def run(pool):
+            try:
+                return await deliver_all(requests, pool=pool)
+            finally:
+                pool.close()
+
+        for label, max_idle in (('pooled keep-alive', 32), ('new connection each', 0)):
+            receiver.connections = 0
+            started = time.perf_counter()
+            results = asyncio.run(run(ConnectionPool(max_idle_per_host=max_idle)))
+            elapsed = time.perf_counter() - started
+            failed = sum(1 for _, status_code, _ in results if status_code != 200)
+            self.stdout.write(
+                f"HTTP, {label}: {len(requests) / elapsed:.0f} requests/s, "
+                f"{receiver.connections} connections, {failed} failed"
+            )
+
+    def _end_to_end(self, receiver, options):
+        OutboxEvent.objects.bulk_create(
+            [OutboxEvent(event_type=EVENT_TYPE, payload={'n': i}) for i in range(options['events'])],
+            batch_size=1000,
+        )
+        expected = options['events'] * options['endpoints']
+        receiver.requests = 0
+        totals = {'events': 0, 'delivered': 0, 'failed': 0}
+        started = time.perf_counter()
+        with override_settings(WEBHOOK_BATCH_SIZE=1000):
+            while totals['delivered'] + totals['failed'] < expected:
+                counts = dispatch_once()
+                if not any(counts.values()):
+                    break
+                for key, value in counts.items():
+                    totals[key] += value
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"End to end: {totals['events']} events, {totals['delivered']} delivered, {totals['failed']} failed "
+            f"in {elapsed:.2f}s = {totals['delivered'] / elapsed:.0f} deliveries/s"
+        )
+        if totals['delivered'] != expected:
+            raise CommandError(f"Expected {expected} deliveries")
@@ -0,0 +1,38 @@
+"""
+Management command to run the webhook dispatcher as a long-lived process.
+
+Polls the outbox and delivery queue every ``--interval`` seconds, or straight
+away while there is work. Several copies can run side by side: deliveries
+are leased, so each is sent by one dispatcher at a time.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.mazepay.webhooks import dispatch_once
+
+
+class Command(BaseCommand):
+    help = 'Deliver MazePay webhooks continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--once', action='store_true', help='Run until the queue is empty, then exit')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Webhook dispatcher started')
+        try:
+            while True:
+                close_old_connections()
+                counts = dispatch_once()
+                if counts['delivered'] or counts['failed']:
+                    self.stdout.write(
+                        f"{counts['events']} events, {counts['delivered']} delivered, {counts['failed']} failed"
+                    )
+                if not counts['events'] and not counts['delivered'] + counts['failed']:
+                    if options['once']:
+                        return
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Webhook dispatcher stopped')
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('system', 'System')], default='user', max_length=10, verbose_name='kind')),
+                ('currency', models.CharField(default='USD', max_length=3, verbose_name='currency')),
+                ('balance', models.BigIntegerField(default=0, help_text='In minor units; maintained by the ledger.', verbose_name='balance')),
+                ('allow_negative', models.BooleanField(default=False, help_text='System accounts that fund or settle with the outside world may go negative.', verbose_name='allow negative balance')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'account',
+                'verbose_name_plural': 'accounts',
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(blank=True, help_text='Caller-supplied key; posting the same reference twice returns the first entry.', max_length=64, null=True, unique=True, verbose_name='reference')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='description')),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'journal entry',
+                'verbose_name_plural': 'journal entries',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField(help_text='Minor units; positive increases the balance.', verbose_name='amount')),
+                ('balance_after', models.BigIntegerField(verbose_name='balance after')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='mazepay.account')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='mazepay.journalentry')),
+            ],
+            options={
+                'verbose_name': 'posting',
+                'verbose_name_plural': 'postings',
+                'indexes': [models.Index(fields=['account', 'created_at'], name='mazepay_posting_account_time')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='posting',
+            constraint=models.CheckConstraint(check=models.Q(('amount', 0), _negated=True), name='mazepay_posting_amount_non_zero'),
+        ),
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.CheckConstraint(check=models.Q(('allow_negative', True), ('balance__gte', 0), _connector='OR'), name='mazepay_account_balance_non_negative'),
+        ),
+    ]
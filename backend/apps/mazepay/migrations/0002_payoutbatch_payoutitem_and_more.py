@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mazepay', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='description')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=12, verbose_name='status')),
+                ('chunk_size', models.PositiveIntegerField(default=500, verbose_name='chunk size')),
+                ('total_items', models.PositiveIntegerField(default=0, verbose_name='total items')),
+                ('processed_items', models.PositiveIntegerField(default=0, verbose_name='processed items')),
+                ('total_amount', models.BigIntegerField(default=0, verbose_name='total amount')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payout_batches', to=settings.AUTH_USER_MODEL)),
+                ('source_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payout_batches', to='mazepay.account')),
+            ],
+            options={
+                'verbose_name': 'payout batch',
+                'verbose_name_plural': 'payout batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayoutItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line', models.PositiveIntegerField(verbose_name='line')),
+                ('amount', models.BigIntegerField(verbose_name='amount')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='description')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='mazepay.payoutbatch')),
+                ('destination_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payout_items', to='mazepay.account')),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='payout_items', to='mazepay.journalentry')),
+            ],
+            options={
+                'verbose_name': 'payout item',
+                'verbose_name_plural': 'payout items',
+                'ordering': ['batch', 'line'],
+                'indexes': [models.Index(fields=['batch', 'entry', 'line'], name='mazepay_payout_item_pending')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='payoutitem',
+            constraint=models.UniqueConstraint(fields=('batch', 'line'), name='mazepay_payout_item_line_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='payoutitem',
+            constraint=models.CheckConstraint(check=models.Q(('amount__gt', 0)), name='mazepay_payout_item_amount_positive'),
+        ),
+    ]
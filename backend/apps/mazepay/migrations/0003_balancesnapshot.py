@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mazepay', '0002_payoutbatch_payoutitem_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField(verbose_name='as of')),
+                ('balance', models.BigIntegerField(verbose_name='balance')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'balance snapshot',
+                'verbose_name_plural': 'balance snapshots',
+                'ordering': ['account', '-as_of'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='posting',
+            index=models.Index(fields=['created_at'], name='mazepay_posting_time'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='mazepay.account'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(fields=('account', 'as_of'), name='mazepay_snapshot_account_as_of_unique'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mazepay', '0004_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('settlement_file', models.FileField(upload_to='reconciliation/settlements/', verbose_name='settlement file')),
+                ('start', models.DateField(verbose_name='start')),
+                ('end', models.DateField(help_text='Exclusive.', verbose_name='end')),
+                ('date_tolerance', models.PositiveSmallIntegerField(default=2, help_text='Days a settlement date may differ from the posting date.', verbose_name='date tolerance')),
+                ('invert_ledger_amounts', models.BooleanField(default=False, help_text='Compare against the negated postings, for accounts that are debited when money comes in.', verbose_name='invert ledger amounts')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='status')),
+                ('external_rows', models.PositiveIntegerField(default=0, verbose_name='settlement rows')),
+                ('ledger_rows', models.PositiveIntegerField(default=0, verbose_name='ledger rows')),
+                ('matched', models.PositiveIntegerField(default=0, verbose_name='matched')),
+                ('mismatched', models.PositiveIntegerField(default=0, verbose_name='mismatched')),
+                ('unmatched_external', models.PositiveIntegerField(default=0, verbose_name='unmatched settlement rows')),
+                ('unmatched_ledger', models.PositiveIntegerField(default=0, verbose_name='unmatched ledger rows')),
+                ('report_dir', models.CharField(blank=True, max_length=255, verbose_name='report directory')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reconciliation_runs', to='mazepay.account')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reconciliation_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'reconciliation run',
+                'verbose_name_plural': 'reconciliation runs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
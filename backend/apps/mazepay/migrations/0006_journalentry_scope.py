@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mazepay', '0005_reconciliationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='scope',
+            field=models.CharField(blank=True, default='', help_text='Namespace of the reference, such as the account a user transfer was made from.', max_length=64, verbose_name='scope'),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='reference',
+            field=models.CharField(blank=True, help_text='Caller-supplied key, unique within the scope; reposting the same legs returns the first entry.', max_length=64, null=True, verbose_name='reference'),
+        ),
+        migrations.AddConstraint(
+            model_name='journalentry',
+            constraint=models.UniqueConstraint(fields=('scope', 'reference'), name='mazepay_entry_scope_reference'),
+        ),
+    ]
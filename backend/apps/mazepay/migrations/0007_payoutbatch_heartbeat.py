@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mazepay', '0006_journalentry_scope'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payoutbatch',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text='Last sign of life from the run processing the batch.', null=True),
+        ),
+    ]
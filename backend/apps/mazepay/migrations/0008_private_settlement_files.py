@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:45
+
+import os
+import shutil
+
+import apps.core.storage
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _under(path, root):
+    path, root = os.path.abspath(path), os.path.abspath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def move_out_of_media(apps, schema_editor):
+    """Move settlement uploads and reports written under MEDIA_ROOT to PRIVATE_ROOT."""
+    ReconciliationRun = apps.get_model('mazepay', 'ReconciliationRun')
+    for run in ReconciliationRun.objects.exclude(settlement_file='').only('settlement_file'):
+        source = os.path.join(settings.MEDIA_ROOT, run.settlement_file.name)
+        target = os.path.join(settings.PRIVATE_ROOT, run.settlement_file.name)
+        if os.path.isfile(source) and not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), mode=0o700, exist_ok=True)
+            shutil.move(source, target)
+    reports = os.path.join(settings.PRIVATE_ROOT, 'reconciliation', 'reports')
+    for run in ReconciliationRun.objects.exclude(report_dir='').only('report_dir'):
+        if not _under(run.report_dir, settings.MEDIA_ROOT) or not os.path.isdir(run.report_dir):
+            continue
+        target = os.path.join(reports, str(run.pk))
+        if not os.path.exists(target):
+            os.makedirs(reports, mode=0o700, exist_ok=True)
+            shutil.move(run.report_dir, target)
+            ReconciliationRun.objects.filter(pk=run.pk).update(report_dir=target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mazepay', '0007_payoutbatch_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reconciliationrun',
+            name='settlement_file',
+            field=models.FileField(storage=apps.core.storage.private_storage, upload_to='reconciliation/settlements/', verbose_name='settlement file'),
+        ),
+        migrations.RunPython(move_out_of_media, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,390 @@
+"""
+Double-entry ledger models for MazePay.
+
+Money moves only as a ``JournalEntry`` whose ``Posting`` amounts sum to
+zero. Amounts are integers in the currency's minor unit (cents). Each
+``Account`` keeps a materialized ``balance`` that is updated in the same
+transaction as its postings, so reading a balance is a single-row lookup.
+Postings are never updated or deleted. See ``apps.mazepay.ledger``.
+
+``BalanceSnapshot`` rows checkpoint each account's balance at the end of
+every day it moved, so a historical balance or a statement's opening
+balance needs one snapshot plus at most a day of postings. See
+``apps.mazepay.statements``.
+
+Events for webhooks are written to ``OutboxEvent`` in the same transaction
+as the ledger change, then fanned out to one ``WebhookDelivery`` per
+subscribed endpoint. See ``apps.mazepay.webhooks``.
+
+A ``ReconciliationRun`` records one settlement file checked against an
+account's postings and where its reports were written. See
+``apps.mazepay.reconciliation``.
+"""
+import secrets
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from apps.core.storage import private_storage
+
+
+class Account(models.Model):
+    """A ledger account: a user's wallet or a system account such as settlement or fees."""
+
+    KIND_USER = 'user'
+    KIND_SYSTEM = 'system'
+    KIND_CHOICES = [
+        (KIND_USER, _('User')),
+        (KIND_SYSTEM, _('System')),
+    ]
+
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='ledger_accounts'
+    )
+    name = models.CharField(_('name'), max_length=100)
+    kind = models.CharField(_('kind'), max_length=10, choices=KIND_CHOICES, default=KIND_USER)
+    currency = models.CharField(_('currency'), max_length=3, default='USD')
+    balance = models.BigIntegerField(_('balance'), default=0, help_text=_('In minor units; maintained by the ledger.'))
+    allow_negative = models.BooleanField(
+        _('allow negative balance'),
+        default=False,
+        help_text=_('System accounts that fund or settle with the outside world may go negative.')
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('account')
+        verbose_name_plural = _('accounts')
+        constraints = [
+            models.CheckConstraint(
+                check=Q(allow_negative=True) | Q(balance__gte=0),
+                name='mazepay_account_balance_non_negative',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.currency})"
+
+
+class JournalEntry(models.Model):
+    """One balanced movement of money between accounts."""
+
+    scope = models.CharField(
+        _('scope'),
+        max_length=64,
+        blank=True,
+        default='',
+        help_text=_('Namespace of the reference, such as the account a user transfer was made from.')
+    )
+    reference = models.CharField(
+        _('reference'),
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text=_('Caller-supplied key, unique within the scope; reposting the same legs returns the first entry.')
+    )
+    description = models.CharField(_('description'), max_length=255, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = _('journal entry')
+        verbose_name_plural = _('journal entries')
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'reference'], name='mazepay_entry_scope_reference'),
+        ]
+
+    def __str__(self):
+        return f"Entry {self.pk}: {self.description or self.reference or ''}".strip()
+
+
+class Posting(models.Model):
+    """One leg of a journal entry: a signed amount against one account."""
+
+    entry = models.ForeignKey(JournalEntry, on_delete=models.PROTECT, related_name='postings')
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='postings')
+    amount = models.BigIntegerField(_('amount'), help_text=_('Minor units; positive increases the balance.'))
+    balance_after = models.BigIntegerField(_('balance after'))
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('posting')
+        verbose_name_plural = _('postings')
+        constraints = [
+            models.CheckConstraint(check=~Q(amount=0), name='mazepay_posting_amount_non_zero'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'created_at'], name='mazepay_posting_account_time'),
+            # Day-by-day scans across all accounts when taking balance snapshots
+            models.Index(fields=['created_at'], name='mazepay_posting_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}: {self.amount:+d}"
+
+
+class BalanceSnapshot(models.Model):
+    """An account's balance at a day boundary: the sum of its postings created before ``as_of``."""
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='snapshots')
+    as_of = models.DateTimeField(_('as of'))
+    balance = models.BigIntegerField(_('balance'))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('balance snapshot')
+        verbose_name_plural = _('balance snapshots')
+        ordering = ['account', '-as_of']
+        constraints = [
+            # Also the index behind "latest snapshot of an account before a time"
+            models.UniqueConstraint(fields=['account', 'as_of'], name='mazepay_snapshot_account_as_of_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} @ {self.as_of:%Y-%m-%d %H:%M}: {self.balance}"
+
+
+class PayoutBatch(models.Model):
+    """A list of payouts from one source account, posted in chunks by a background job."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_PROCESSING, _('Processing')),
+        (STATUS_COMPLETED, _('Completed')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name='payout_batches'
+    )
+    source_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='payout_batches')
+    description = models.CharField(_('description'), max_length=255, blank=True)
+    status = models.CharField(_('status'), max_length=12, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    chunk_size = models.PositiveIntegerField(_('chunk size'), default=500)
+    total_items = models.PositiveIntegerField(_('total items'), default=0)
+    processed_items = models.PositiveIntegerField(_('processed items'), default=0)
+    total_amount = models.BigIntegerField(_('total amount'), default=0)
+    error = models.TextField(_('error'), blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        null=True, blank=True, help_text=_('Last sign of life from the run processing the batch.')
+    )
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('payout batch')
+        verbose_name_plural = _('payout batches')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Payout batch {self.pk} ({self.processed_items}/{self.total_items})"
+
+    @property
+    def progress(self):
+        """Fraction of items posted, from 0.0 to 1.0."""
+        return self.processed_items / self.total_items if self.total_items else 1.0
+
+
+class PayoutItem(models.Model):
+    """One payout line; posted as a leg of its chunk's journal entry."""
+
+    batch = models.ForeignKey(PayoutBatch, on_delete=models.CASCADE, related_name='items')
+    line = models.PositiveIntegerField(_('line'))
+    destination_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='payout_items')
+    amount = models.BigIntegerField(_('amount'))
+    description = models.CharField(_('description'), max_length=255, blank=True)
+    entry = models.ForeignKey(
+        JournalEntry,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='payout_items'
+    )
+
+    class Meta:
+        verbose_name = _('payout item')
+        verbose_name_plural = _('payout items')
+        ordering = ['batch', 'line']
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'line'], name='mazepay_payout_item_line_unique'),
+            models.CheckConstraint(check=Q(amount__gt=0), name='mazepay_payout_item_amount_positive'),
+        ]
+        indexes = [
+            # Pending items of a batch, in order: the resume query
+            models.Index(fields=['batch', 'entry', 'line'], name='mazepay_payout_item_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.batch_id}#{self.line}: {self.amount} to {self.destination_account_id}"
+
+
+def _webhook_secret():
+    return secrets.token_urlsafe(32)
+
+
+class WebhookEndpoint(models.Model):
+    """A URL that receives signed MazePay events: a merchant's, or one of our own apps'."""
+
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='webhook_endpoints',
+        help_text=_("Receives events for this user's accounts; leave empty for internal apps, which get all events.")
+    )
+    url = models.URLField(_('URL'), max_length=500)
+    secret = models.CharField(_('signing secret'), max_length=64, default=_webhook_secret)
+    event_types = models.JSONField(
+        _('event types'), default=list, blank=True, help_text=_('Event types to send; empty for all.')
+    )
+    max_concurrency = models.PositiveSmallIntegerField(
+        _('max concurrency'), default=4, help_text=_('Deliveries in flight to this endpoint at once.')
+    )
+    is_active = models.BooleanField(_('active'), default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('webhook endpoint')
+        verbose_name_plural = _('webhook endpoints')
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.url
+
+    def wants(self, event_type):
+        """Return True if this endpoint subscribes to ``event_type``."""
+        return not self.event_types or event_type in self.event_types
+
+
+class OutboxEvent(models.Model):
+    """An event written in the same transaction as the change it describes, awaiting fan-out."""
+
+    event_type = models.CharField(_('event type'), max_length=64)
+    payload = models.JSONField(default=dict)
+    owners = models.JSONField(
+        _('owners'), default=list, blank=True, help_text=_('IDs of the users whose accounts the event concerns.')
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('outbox event')
+        verbose_name_plural = _('outbox events')
+        ordering = ['pk']
+        indexes = [
+            models.Index(
+                fields=['id'], name='mazepay_outbox_pending', condition=Q(dispatched_at__isnull=True)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.pk}"
+
+
+class WebhookDelivery(models.Model):
+    """One event on its way to one endpoint; ``dead`` deliveries form the dead-letter queue."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_DELIVERED, _('Delivered')),
+        (STATUS_DEAD, _('Dead')),
+    ]
+
+    event = models.ForeignKey(OutboxEvent, on_delete=models.CASCADE, related_name='deliveries')
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name='deliveries')
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    next_attempt_at = models.DateTimeField(_('next attempt at'), default=timezone.now)
+    last_status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('webhook delivery')
+        verbose_name_plural = _('webhook deliveries')
+        ordering = ['-pk']
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'endpoint'], name='mazepay_delivery_event_endpoint_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='mazepay_delivery_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} to {self.endpoint_id}: {self.status}"
+
+
+class ReconciliationRun(models.Model):
+    """A processor's settlement file matched against one account's ledger postings for a period."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_COMPLETED, _('Completed')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+    REPORTS = ('matched', 'mismatched', 'unmatched_external', 'unmatched_ledger')
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name='reconciliation_runs'
+    )
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='reconciliation_runs')
+    settlement_file = models.FileField(
+        _('settlement file'), upload_to='reconciliation/settlements/', storage=private_storage
+    )
+    start = models.DateField(_('start'))
+    end = models.DateField(_('end'), help_text=_('Exclusive.'))
+    date_tolerance = models.PositiveSmallIntegerField(
+        _('date tolerance'), default=2, help_text=_('Days a settlement date may differ from the posting date.')
+    )
+    invert_ledger_amounts = models.BooleanField(
+        _('invert ledger amounts'),
+        default=False,
+        help_text=_('Compare against the negated postings, for accounts that are debited when money comes in.')
+    )
+    status = models.CharField(_('status'), max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    external_rows = models.PositiveIntegerField(_('settlement rows'), default=0)
+    ledger_rows = models.PositiveIntegerField(_('ledger rows'), default=0)
+    matched = models.PositiveIntegerField(_('matched'), default=0)
+    mismatched = models.PositiveIntegerField(_('mismatched'), default=0)
+    unmatched_external = models.PositiveIntegerField(_('unmatched settlement rows'), default=0)
+    unmatched_ledger = models.PositiveIntegerField(_('unmatched ledger rows'), default=0)
+    report_dir = models.CharField(_('report directory'), max_length=255, blank=True)
+    error = models.TextField(_('error'), blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('reconciliation run')
+        verbose_name_plural = _('reconciliation runs')
+        ordering = ['-created_at']
 
-# Create your models here.
+    def __str__(self):
+        return f"Reconciliation {self.pk} of {self.account_id} ({self.start} to {self.end})"
@@ -0,0 +1,324 @@
+"""
+MazePay batch payouts.
+
+A batch pays many destination accounts from one source account, typically
+payroll uploaded as a CSV file. Everything that can be checked up front is
+checked before anything is stored (:func:`validate_payouts`), so a file with
+a typo is rejected as a whole with line-numbered errors instead of being half
+paid.
+
+:func:`process_batch` then posts the items in chunks of ``chunk_size``. Each
+chunk is one database transaction holding a single journal entry (the source
+leg plus one leg per item, see :func:`apps.mazepay.ledger.post_legs`) and
+the items' link to that entry, so progress is exactly the set of items that
+have an entry. A failure (a worker crash, the source running dry) loses at
+most the chunk in flight; processing the batch again resumes from the first
+unposted item. Each chunk's entry reference is derived from its first item
+and lives in the ledger's ``payout`` scope, which no user request can post
+to, so a chunk can never be posted twice nor be blocked by someone else.
+
+A running batch renews its lease (``heartbeat_at``) with every chunk. If
+the worker dies, the batch stays ``processing`` until the lease is
+``PAYOUT_LEASE_SECONDS`` old; it then counts as stalled and can be resumed
+like a failed one.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .ledger import post_legs, retry_on_contention
+from .models import Account, PayoutBatch, PayoutItem
+from .webhooks import emit_event
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ('account', 'amount', 'description')
+# Lines reported back when validation fails; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# Accounts looked up per query when validating destinations
+LOOKUP_BATCH_SIZE = 500
+# Ledger scope of chunk references, apart from the ones users choose
+PAYOUT_SCOPE = 'payout'
+
+
+class PayoutValidationError(Exception):
+    """Raised when a payout list is rejected; ``errors`` is a list of ``{'line', 'error'}``."""
+
+    def __init__(self, errors, total_errors=None):
+        self.errors = errors[:MAX_REPORTED_ERRORS]
+        self.total_errors = total_errors if total_errors is not None else len(errors)
+        super().__init__(f'{self.total_errors} invalid payout lines')
+
+
+def parse_payout_file(upload):
+    """Read payout rows from an uploaded CSV or JSON file.
+
+    CSV files need a header with ``account`` and ``amount`` columns and may
+    have a ``description`` column. JSON files hold a list of objects with the
+    same keys. Rows are numbered by their line in the file.
+
+    Returns:
+        list: ``(line, row dict)`` tuples
+
+    Raises:
+        PayoutValidationError: If the file cannot be read
+    """
+    name = (getattr(upload, 'name', '') or '').lower()
+    content_type = getattr(upload, 'content_type', '') or ''
+    if name.endswith('.json') or content_type == 'application/json':
+        try:
+            rows = json.load(io.TextIOWrapper(upload, encoding='utf-8-sig'))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise PayoutValidationError([{'line': None, 'error': f'Invalid JSON: {e}'}])
+        return parse_payout_list(rows)
+
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+        header = [field.strip().lower() for field in reader.fieldnames or []]
+        missing = [field for field in CSV_FIELDS[:2] if field not in header]
+        if missing:
+            raise PayoutValidationError([{'line': 1, 'error': f'Missing columns: {", ".join(missing)}'}])
+        reader.fieldnames = header
+        return [(reader.line_num, row) for row in reader]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise PayoutValidationError([{'line': None, 'error': f'Invalid CSV: {e}'}])
+
+
+def parse_payout_list(rows):
+    """Number the rows of a JSON payout list from 1.
+
+    Raises:
+        PayoutValidationError: If ``rows`` is not a list
+    """
+    if not isinstance(rows, list):
+        raise PayoutValidationError([{'line': None, 'error': 'Expected a list of payouts.'}])
+    return list(enumerate(rows, start=1))
+
+
+def _parse_int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value.strip())
+    raise ValueError
+
+
+def validate_payouts(source_account, rows):
+    """Check every payout row before anything is stored.
+
+    Args:
+        source_account: The paying ``Account``
+        rows: ``(line, row dict)`` tuples from :func:`parse_payout_file` or
+            :func:`parse_payout_list`
+
+    Returns:
+        list: Unsaved ``PayoutItem`` objects, in order
+
+    Raises:
+        PayoutValidationError: Listing every invalid line
+    """
+    max_items = getattr(settings, 'PAYOUT_MAX_ITEMS', 100000)
+    if not rows:
+        raise PayoutValidationError([{'line': None, 'error': 'The payout list is empty.'}])
+    if len(rows) > max_items:
+        raise PayoutValidationError([{'line': None, 'error': f'At most {max_items} payouts per batch.'}])
+
+    errors = []
+    items = []
+    for line, row in rows:
+        if not isinstance(row, dict):
+            errors.append({'line': line, 'error': 'Expected an object with account and amount.'})
+            continue
+        try:
+            account_id = _parse_int(row.get('account'))
+        except ValueError:
+            errors.append({'line': line, 'error': 'account must be an account id.'})
+            continue
+        try:
+            amount = _parse_int(row.get('amount'))
+        except ValueError:
+            errors.append({'line': line, 'error': 'amount must be a whole number of minor units (cents).'})
+            continue
+        if amount <= 0:
+            errors.append({'line': line, 'error': 'amount must be positive.'})
+            continue
+        description = str(row.get('description') or '').strip()
+        if len(description) > 255:
+            errors.append({'line': line, 'error': 'description is longer than 255 characters.'})
+            continue
+        items.append(PayoutItem(line=line, destination_account_id=account_id, amount=amount, description=description))
+
+    destination_ids = sorted({item.destination_account_id for item in items})
+    currencies = {}
+    for start in range(0, len(destination_ids), LOOKUP_BATCH_SIZE):
+        currencies.update(
+            Account.objects.filter(pk__in=destination_ids[start:start + LOOKUP_BATCH_SIZE], kind=Account.KIND_USER)
+            .values_list('pk', 'currency')
+        )
+    for item in items:
+        account_id = item.destination_account_id
+        if account_id == source_account.pk:
+            errors.append({'line': item.line, 'error': 'Cannot pay the source account.'})
+        elif account_id not in currencies:
+            errors.append({'line': item.line, 'error': f'Account {account_id} not found.'})
+        elif currencies[account_id] != source_account.currency:
+            errors.append({'line': item.line, 'error': f'Account {account_id} is not in {source_account.currency}.'})
+
+    total = sum(item.amount for item in items)
+    if not errors and not source_account.allow_negative and total > source_account.balance:
+        errors.append({
+            'line': None,
+            'error': f'The batch pays out {total} but the source account holds {source_account.balance}.',
+        })
+    if errors:
+        errors.sort(key=lambda error: (error['line'] is not None, error['line'] or 0))
+        raise PayoutValidationError(errors)
+    return items
+
+
+def create_batch(user, source_account, items, description='', chunk_size=None):
+    """Store a validated batch and its items; nothing is posted yet.
+
+    Returns:
+        PayoutBatch: The new batch, ``pending``
+    """
+    with transaction.atomic():
+        batch = PayoutBatch.objects.create(
+            created_by=user,
+            source_account=source_account,
+            description=description,
+            chunk_size=chunk_size or getattr(settings, 'PAYOUT_CHUNK_SIZE', 500),
+            total_items=len(items),
+            total_amount=sum(item.amount for item in items),
+        )
+        for item in items:
+            item.batch = batch
+        PayoutItem.objects.bulk_create(items, batch_size=1000)
+    return batch
+
+
+def _post_chunk(batch):
+    """Post the next chunk of unposted items in one transaction; returns how many."""
+    with transaction.atomic():
+        items = list(
+            PayoutItem.objects.filter(batch=batch, entry__isnull=True)
+            .order_by('line').only('pk', 'line', 'destination_account_id', 'amount')[:batch.chunk_size]
+        )
+        if not items:
+            return 0
+        total = sum(item.amount for item in items)
+        legs = [(batch.source_account_id, -total)] + [(item.destination_account_id, item.amount) for item in items]
+        entry, _ = post_legs(
+            legs,
+            description=batch.description or f'Payout batch {batch.pk}',
+            reference=f'payout-{batch.pk}-{items[0].line}',
+            metadata={'payout_batch': batch.pk, 'lines': [items[0].line, items[-1].line]},
+            scope=PAYOUT_SCOPE,
+        )
+        PayoutItem.objects.filter(pk__in=[item.pk for item in items]).update(entry=entry)
+        PayoutBatch.objects.filter(pk=batch.pk).update(
+            processed_items=F('processed_items') + len(items), heartbeat_at=timezone.now()
+        )
+    return len(items)
+
+
+def _lease_expiry(now=None):
+    return (now or timezone.now()) - timedelta(seconds=getattr(settings, 'PAYOUT_LEASE_SECONDS', 300))
+
+
+def is_stalled(batch, now=None):
+    """Return True if a ``processing`` batch has not renewed its lease in time (its worker died)."""
+    return (
+        batch.status == PayoutBatch.STATUS_PROCESSING
+        and (batch.heartbeat_at is None or batch.heartbeat_at < _lease_expiry(now))
+    )
+
+
+def process_batch(batch_id, on_progress=None):
+    """Post a batch's unposted items chunk by chunk.
+
+    Picks up where an earlier run stopped. Only one run processes a batch at
+    a time: a ``completed`` batch, or one ``processing`` under a live lease,
+    is left alone.
+
+    Args:
+        batch_id: The ``PayoutBatch`` primary key
+        on_progress: Optional callable receiving ``(processed_items, total_items)``
+            after each chunk
+
+    Returns:
+        PayoutBatch: The batch after processing
+
+    Raises:
+        LedgerError: If a chunk is rejected (e.g. the source ran out of
+            funds); the batch is marked ``failed`` and can be resumed
+    """
+    now = timezone.now()
+    claimed = PayoutBatch.objects.filter(
+        Q(status__in=[PayoutBatch.STATUS_PENDING, PayoutBatch.STATUS_FAILED])
+        | Q(status=PayoutBatch.STATUS_PROCESSING, heartbeat_at__lt=_lease_expiry(now))
+        | Q(status=PayoutBatch.STATUS_PROCESSING, heartbeat_at__isnull=True),
+        pk=batch_id,
+    ).update(status=PayoutBatch.STATUS_PROCESSING, error='', started_at=now, heartbeat_at=now, finished_at=None)
+    batch = PayoutBatch.objects.get(pk=batch_id)
+    if not claimed:
+        logger.info(f"Payout batch {batch_id} is {batch.status}, not processing it")
+        return batch
+
+    try:
+        conflicts = 0
+        while True:
+            try:
+                with timed('payout_chunk'):
+                    posted = retry_on_contention(_post_chunk, batch)
+                conflicts = 0
+            except IntegrityError:
+                # Another run posted this chunk first, so its items now have an
+                # entry; a second conflict in a row is a real error
+                conflicts += 1
+                if conflicts > 1:
+                    raise
+                logger.warning(f"Payout batch {batch_id}: chunk already posted, continuing")
+                continue
+            if not posted:
+                break
+            if on_progress is not None:
+                batch.refresh_from_db(fields=['processed_items'])
+                on_progress(batch.processed_items, batch.total_items)
+    except Exception as e:
+        logger.error(f"Payout batch {batch_id} failed: {str(e)}")
+        with transaction.atomic():
+            PayoutBatch.objects.filter(pk=batch_id).update(
+                status=PayoutBatch.STATUS_FAILED, error=str(e)[:1000], finished_at=timezone.now()
+            )
+            batch.refresh_from_db()
+            _emit_batch_event(batch)
+        raise
+
+    with transaction.atomic():
+        PayoutBatch.objects.filter(pk=batch_id).update(status=PayoutBatch.STATUS_COMPLETED, finished_at=timezone.now())
+        batch.refresh_from_db()
+        _emit_batch_event(batch)
+    logger.info(f"Payout batch {batch_id} completed: {batch.processed_items} payouts, {batch.total_amount} total")
+    return batch
+
+
+def _emit_batch_event(batch):
+    emit_event(f'payout_batch.{batch.status}', {
+        'batch': batch.pk,
+        'source_account': batch.source_account_id,
+        'total_items': batch.total_items,
+        'processed_items': batch.processed_items,
+        'total_amount': batch.total_amount,
+        'error': batch.error,
+    }, owners=[batch.created_by_id])
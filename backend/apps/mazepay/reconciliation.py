@@ -0,0 +1,404 @@
+"""
+MazePay reconciliation against processors' settlement files.
+
+A settlement file is the processor's view of what moved through one of our
+accounts (usually a system settlement account): a CSV with a row per
+transaction and at least ``reference``, ``amount`` (major units, e.g.
+``12.50``) and ``date`` columns. :func:`reconcile` checks it against the
+account's postings for a period and writes four CSV reports, with amounts in
+minor units as in statements:
+
+* ``matched``: same reference, same amount, dates within the tolerance.
+* ``mismatched``: same reference, but a different amount, a date outside
+  the tolerance, or a reference the file already used (``duplicate``).
+* ``unmatched_external``: settlement rows with no ledger entry, and rows
+  that could not be read.
+* ``unmatched_ledger``: postings in the period that the file does not
+  mention.
+
+Both sides are held as NumPy columns and joined on the reference. The
+ledger side is sorted by reference once; each chunk of the file is then
+looked up with a single ``searchsorted`` and compared column-wise, so no
+work is done per pair of rows. The file is read
+``RECONCILIATION_CHUNK_SIZE`` rows at a time and the only state kept for
+the whole run is the ledger's columns, under 100 bytes per posting, so
+memory follows the length of the period rather than the size of the file.
+
+Postings are compared per journal entry (legs of one entry on the account
+are summed), dated by the local day they were posted. The ledger is read
+``date_tolerance`` days either side of the period, so a payment settled on
+the first day of the period can still match a posting from the day before.
+"""
+import csv
+import io
+import logging
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+from itertools import islice, repeat
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from apps.core.db_routers import use_replica
+from apps.core.metrics import timed
+from .models import Posting, ReconciliationRun
+from .statements import day_start
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_COLUMNS = ('reference', 'amount', 'date')
+REPORT_FIELDS = {
+    'matched': ['line', 'reference', 'amount', 'date', 'entry', 'ledger_date'],
+    'mismatched': ['line', 'reference', 'amount', 'date', 'entry', 'ledger_amount', 'ledger_date', 'reason'],
+    'unmatched_external': ['line', 'reference', 'amount', 'date', 'reason'],
+    'unmatched_ledger': ['entry', 'reference', 'amount', 'date'],
+}
+# Postings fetched per round trip when loading the ledger side
+LEDGER_FETCH_SIZE = 10000
+
+
+class ReconciliationError(Exception):
+    """Raised when a settlement file cannot be reconciled at all, e.g. it lacks a required column."""
+
+
+def report_root():
+    """Directory under which each run's reports are written, one subdirectory per run.
+
+    Defaults to ``PRIVATE_ROOT/reconciliation/reports``: reports list account
+    activity, so they are only served by the permission-checked report view.
+    """
+    configured = getattr(settings, 'RECONCILIATION_REPORT_DIR', None)
+    return configured or os.path.join(settings.PRIVATE_ROOT, 'reconciliation', 'reports')
+
+
+def report_path(run, kind):
+    """Path of one of a completed run's reports (``kind`` is a key of ``REPORT_FIELDS``)."""
+    return os.path.join(run.report_dir, f'{kind}.csv')
+
+
+def parse_amount(value):
+    """Convert a major-unit amount such as ``-1,234.5`` to minor units (``-123450``) without rounding.
+
+    Raises:
+        ValueError: If the value is not a number with at most two significant decimals
+    """
+    whole, _, fraction = value.partition('.')
+    if len(fraction) == 2 and whole.isdigit() and fraction.isdigit():
+        return int(whole + fraction)  # The usual form, e.g. 12.34
+    text = value.strip().replace(',', '')
+    sign = -1 if text.startswith('-') else 1
+    whole, _, fraction = (text[1:] if text[:1] in '+-' else text).partition('.')
+    if not (whole or fraction) or not (whole or '0').isdigit() or not (fraction or '0').isdigit() \
+            or len(fraction.rstrip('0')) > 2:
+        raise ValueError(f'Invalid amount: {value!r}')
+    return sign * (int(whole or 0) * 100 + int(fraction[:2].ljust(2, '0')))
+
+
+@lru_cache(maxsize=4096)
+def parse_day(value):
+    """Convert an ISO date, or the date part of an ISO timestamp, to a day ordinal.
+
+    Cached: a settlement file repeats a handful of dates.
+    """
+    return date.fromisoformat(value.strip()[:10]).toordinal()
+
+
+def reference_keys(references):
+    """References as a NumPy array of UTF-8 byte strings: the join key for both sides.
+
+    Fixed-width bytes sort and compare in C, and unlike a hash they cannot
+    make two different references match.
+    """
+    try:
+        return np.array(references, dtype=np.bytes_)
+    except UnicodeEncodeError:
+        return np.array([reference.encode() for reference in references], dtype=np.bytes_)
+
+
+@lru_cache(maxsize=4096)
+def _iso_day(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+def _field(row, index):
+    return row[index] if index < len(row) else ''
+
+
+def read_settlement(lines, chunk_size=None):
+    """Read a settlement CSV in chunks.
+
+    Args:
+        lines: A text file (or any iterable of lines) with a header row
+        chunk_size: Rows per chunk (default: ``RECONCILIATION_CHUNK_SIZE``)
+
+    Yields:
+        tuple: ``(line numbers, references, amounts, day ordinals, invalid)``;
+        the first four are parallel lists of the readable rows, and
+        ``invalid`` lists ``(line, reference, amount, date, error)`` for the rest
+
+    Raises:
+        ReconciliationError: If the header lacks a required column
+    """
+    chunk_size = chunk_size or getattr(settings, 'RECONCILIATION_CHUNK_SIZE', 100000)
+    reader = csv.reader(lines)
+    header = [field.strip().lower() for field in next(reader, [])]
+    missing = [column for column in SETTLEMENT_COLUMNS if column not in header]
+    if missing:
+        raise ReconciliationError(f'Missing columns: {", ".join(missing)}')
+    ref_col, amount_col, date_col = (header.index(column) for column in SETTLEMENT_COLUMNS)
+
+    while True:
+        line_numbers, references, amounts, days, invalid = [], [], [], [], []
+        read = 0
+        for row in islice(reader, chunk_size):
+            read += 1
+            line = reader.line_num
+            if not row:
+                continue
+            try:
+                reference = row[ref_col].strip()
+                if not reference:
+                    raise ValueError('Missing reference')
+                amount = parse_amount(row[amount_col])
+                day = parse_day(row[date_col])
+            except (IndexError, ValueError) as e:
+                # The row may be short, whichever field failed
+                error = 'Missing fields' if isinstance(e, IndexError) else str(e)
+                invalid.append((
+                    line, _field(row, ref_col).strip(), _field(row, amount_col), _field(row, date_col), error
+                ))
+                continue
+            line_numbers.append(line)
+            references.append(reference)
+            amounts.append(amount)
+            days.append(day)
+        if not read:
+            return
+        yield line_numbers, references, amounts, days, invalid
+
+
+class LedgerIndex:
+    """One account's referenced entries over a window of local days, as NumPy columns sorted by key.
+
+    ``amounts`` are the entries' summed legs on the account (negated when
+    ``invert`` is set), ``days`` the local day each was posted, and ``seen``
+    marks entries claimed by a settlement row. Only unscoped entries are
+    indexed: scoped references belong to users and payouts, not to the bank.
+    """
+
+    def __init__(self, account, first_day, last_day, invert=False, using=None):
+        boundaries = [day_start(first_day + timedelta(days=i)) for i in range((last_day - first_day).days + 1)]
+        postings = (
+            Posting.objects.using(using)
+            .filter(account=account, entry__scope='')
+            .exclude(entry__reference__isnull=True).exclude(entry__reference='')
+            .values_list('entry_id', 'entry__reference', 'amount')
+        )
+        # A query per local day dates each row by the day it was fetched for, which is
+        # far cheaper than converting a million timestamps; each uses the (account, created_at) index
+        blocks = []
+        for ordinal, (lower, upper) in enumerate(zip(boundaries, boundaries[1:]), start=first_day.toordinal()):
+            rows = postings.filter(created_at__gte=lower, created_at__lt=upper).iterator(chunk_size=LEDGER_FETCH_SIZE)
+            while True:
+                block = list(islice(rows, LEDGER_FETCH_SIZE))
+                if not block:
+                    break
+                entry_ids, references, amounts = zip(*block)
+                blocks.append((
+                    np.array(entry_ids, dtype=np.int64),
+                    reference_keys(references),
+                    np.array(amounts, dtype=np.int64),
+                    np.full(len(block), ordinal, dtype=np.int64),
+                ))
+        if not blocks:
+            self.keys = reference_keys([])
+            self.entry_ids = self.amounts = self.days = np.empty(0, dtype=np.int64)
+            self.seen = np.empty(0, dtype=bool)
+            return
+
+        entry_ids, keys, amounts, days = (np.concatenate(column) for column in zip(*blocks))
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        # References are unique per entry within a scope, so a repeated reference means several legs of one entry
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        self.keys = keys[starts]
+        self.entry_ids = entry_ids[order][starts]
+        self.amounts = np.add.reduceat(amounts[order], starts) * (-1 if invert else 1)
+        self.days = np.minimum.reduceat(days[order], starts)
+        self.seen = np.zeros(len(self.keys), dtype=bool)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """Return ``(positions, found)`` for an array of keys."""
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return positions, self.keys[positions] == keys
+
+
+def _match_chunk(index, chunk, tolerance, writers, counts):
+    line_numbers, references, amounts, days, invalid = chunk
+    keys = reference_keys(references)
+    line_numbers = np.array(line_numbers, dtype=np.int64)
+    amounts = np.array(amounts, dtype=np.int64)
+    days = np.array(days, dtype=np.int64)
+    positions, found = index.lookup(keys)
+
+    hits = np.flatnonzero(found)
+    ledger = positions[hits]
+    # Only the first row to claim an entry is compared; later ones are duplicates
+    duplicate = np.ones(len(hits), dtype=bool)
+    duplicate[np.unique(ledger, return_index=True)[1]] = False
+    duplicate |= index.seen[ledger]
+    index.seen[ledger] = True
+    amount_off = index.amounts[ledger] != amounts[hits]
+    date_off = np.abs(index.days[ledger] - days[hits]) > tolerance
+    good = ~(duplicate | amount_off | date_off)
+
+    def columns(rows):
+        return (
+            line_numbers[rows].tolist(), [references[i] for i in rows.tolist()], amounts[rows].tolist(),
+            map(_iso_day, days[rows].tolist()),
+        )
+
+    rows, entries = hits[good], ledger[good]
+    writers['matched'].writerows(zip(
+        *columns(rows), index.entry_ids[entries].tolist(), map(_iso_day, index.days[entries].tolist()),
+    ))
+
+    bad = ~good
+    rows, entries = hits[bad], ledger[bad]
+    reasons = np.where(
+        duplicate[bad], 'duplicate',
+        np.where(amount_off[bad] & date_off[bad], 'amount,date', np.where(amount_off[bad], 'amount', 'date'))
+    )
+    writers['mismatched'].writerows(zip(
+        *columns(rows), index.entry_ids[entries].tolist(), index.amounts[entries].tolist(),
+        map(_iso_day, index.days[entries].tolist()), reasons.tolist(),
+    ))
+
+    missing = np.flatnonzero(~found)
+    writers['unmatched_external'].writerows(zip(*columns(missing), repeat('no ledger entry')))
+    writers['unmatched_external'].writerows(invalid)
+
+    counts['external_rows'] += len(keys) + len(invalid)
+    counts['matched'] += int(good.sum())
+    counts['mismatched'] += len(hits) - int(good.sum())
+    counts['unmatched_external'] += len(missing) + len(invalid)
+
+
+def _write_unmatched_ledger(index, start, end, writer, counts):
+    in_period = (index.days >= start.toordinal()) & (index.days < end.toordinal())
+    unmatched = np.flatnonzero(in_period & ~index.seen)
+    writer.writerows(zip(
+        index.entry_ids[unmatched].tolist(), [key.decode() for key in index.keys[unmatched].tolist()],
+        index.amounts[unmatched].tolist(), map(_iso_day, index.days[unmatched].tolist()),
+    ))
+    counts['ledger_rows'] = int(in_period.sum())
+    counts['unmatched_ledger'] = len(unmatched)
+
+
+def reconcile(account, settlement, start, end, report_dir, date_tolerance=None, invert_ledger_amounts=False,
+              chunk_size=None, using=None):
+    """Reconcile a settlement file against ``account``'s postings over ``[start, end)``.
+
+    Args:
+        account: The ``Account`` the processor settles through
+        settlement: Text file of the settlement CSV
+        start: First local date of the period
+        end: Local date after the period
+        report_dir: Directory the four reports are written to
+        date_tolerance: Days a settlement date may differ from the posting
+            date (default: ``RECONCILIATION_DATE_TOLERANCE``)
+        invert_ledger_amounts: Compare the file with the negated postings
+        chunk_size: Settlement rows per chunk
+        using: Database alias for the ledger (default: the replica if fresh)
+
+    Returns:
+        dict: ``external_rows``, ``ledger_rows``, ``matched``, ``mismatched``,
+        ``unmatched_external`` and ``unmatched_ledger`` counts
+
+    Raises:
+        ReconciliationError: If NumPy is missing or the file lacks a required column
+    """
+    if not NUMPY_AVAILABLE:
+        raise ReconciliationError('Reconciliation needs NumPy; install it with "pip install numpy"')
+    if date_tolerance is None:
+        date_tolerance = getattr(settings, 'RECONCILIATION_DATE_TOLERANCE', 2)
+    if using is None:
+        with use_replica():
+            using = router.db_for_read(Posting)
+
+    with timed('reconciliation_load'):
+        index = LedgerIndex(
+            account, start - timedelta(days=date_tolerance), end + timedelta(days=date_tolerance),
+            invert=invert_ledger_amounts, using=using,
+        )
+    counts = dict.fromkeys(
+        ('external_rows', 'ledger_rows', 'matched', 'mismatched', 'unmatched_external', 'unmatched_ledger'), 0
+    )
+    os.makedirs(report_dir, mode=0o700, exist_ok=True)
+    files = {kind: open(os.path.join(report_dir, f'{kind}.csv'), 'w', newline='') for kind in REPORT_FIELDS}
+    try:
+        writers = {kind: csv.writer(file) for kind, file in files.items()}
+        for kind, fields in REPORT_FIELDS.items():
+            writers[kind].writerow(fields)
+        with timed('reconciliation_match'):
+            for chunk in read_settlement(settlement, chunk_size):
+                _match_chunk(index, chunk, date_tolerance, writers, counts)
+            _write_unmatched_ledger(index, start, end, writers['unmatched_ledger'], counts)
+    finally:
+        for file in files.values():
+            file.close()
+    return counts
+
+
+def run_reconciliation(run_id):
+    """Run a stored ``ReconciliationRun`` and record its counts.
+
+    Only pending or failed runs are started, so a duplicate task is a no-op.
+    A run that raises is marked failed and the exception is re-raised.
+
+    Returns:
+        ReconciliationRun: The run, reloaded
+    """
+    claimed = ReconciliationRun.objects.filter(
+        pk=run_id, status__in=[ReconciliationRun.STATUS_PENDING, ReconciliationRun.STATUS_FAILED]
+    ).update(status=ReconciliationRun.STATUS_RUNNING, started_at=timezone.now(), error='')
+    run = ReconciliationRun.objects.select_related('account').get(pk=run_id)
+    if not claimed:
+        return run
+
+    report_dir = os.path.join(report_root(), str(run.pk))
+    try:
+        with run.settlement_file.open('rb') as upload:
+            counts = reconcile(
+                run.account, io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''), run.start, run.end,
+                report_dir, date_tolerance=run.date_tolerance, invert_ledger_amounts=run.invert_ledger_amounts,
+            )
+    except Exception as e:
+        logger.error(f"Reconciliation {run.pk} failed: {str(e)}")
+        ReconciliationRun.objects.filter(pk=run.pk).update(
+            status=ReconciliationRun.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+        raise
+
+    ReconciliationRun.objects.filter(pk=run.pk).update(
+        status=ReconciliationRun.STATUS_COMPLETED, report_dir=report_dir, finished_at=timezone.now(), **counts
+    )
+    logger.info(
+        f"Reconciliation {run.pk}: {counts['matched']} matched, {counts['mismatched']} mismatched, "
+        f"{counts['unmatched_external']} unmatched in the file, {counts['unmatched_ledger']} in the ledger"
+    )
+    run.refresh_from_db()
+    return run
@@ -0,0 +1,330 @@
+"""
+Risk checks for MazePay transfers.
+
+:func:`assess` runs every check in ``RISK_CHECKS`` before a transfer is
+posted. A check is a callable taking a :class:`TransferContext` and
+returning ``(score, reasons)``. Scores are percentages of what is
+acceptable: above 100 the transfer is blocked, and from
+``RISK_REVIEW_SCORE`` it goes through but its entry is flagged for review.
+The highest score of all checks decides.
+
+The built-in :func:`velocity_check` counts transfers and sums their amounts
+per user, device and IP address over sliding windows (1 minute, 1 hour and
+24 hours by default) against ``RISK_VELOCITY_LIMITS``. Each window is a ring
+of ``RISK_WINDOW_BUCKETS`` buckets with running totals: recording a transfer
+touches one bucket, and sliding forward clears only the buckets that
+expired, so both are O(1) however busy a key is. The window moves in steps
+of one bucket (5 seconds of a 1-minute window by default).
+
+When the default cache is Redis the rings are Redis hashes, checked and
+updated by one Lua script per transfer, so every worker shares the counts.
+Otherwise each process keeps its own, at most ``RISK_LOCAL_MAX_KEYS`` keys
+with the least recently used dropped first.
+
+The user is authenticated and the IP address is the peer's (or the hop the
+outermost of ``TRUSTED_PROXY_COUNT`` proxies recorded), but the device is
+whatever ``X-Device-Id`` the client sends. Device limits are advisory only:
+they slow down an honest client's runaway retries, not someone who changes
+the header on every request.
+
+A transfer is counted when it passes the limits, in the same atomic step
+that checks them, so concurrent requests cannot all slip under a limit.
+Transfers the ledger then rejects still count: repeated failing attempts
+are a signal too. A check that raises (Redis down, say) is skipped when
+``RISK_FAIL_OPEN`` is set and blocks the transfer otherwise.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from apps.core.cache_utils import redis_client
+from apps.core.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+ALLOW = 'allow'
+REVIEW = 'review'
+BLOCK = 'block'
+# Scores are percentages of a limit; anything above this is blocked
+BLOCK_ABOVE = 100
+DIMENSIONS = ('user', 'device', 'ip')
+KEY_PREFIX = 'risk:velocity'
+
+TransferContext = namedtuple(
+    'TransferContext', ['user', 'device', 'ip', 'amount', 'source_account', 'destination_account', 'at'],
+    defaults=[None],
+)
+TransferContext.__doc__ = 'A transfer about to be posted; ``at`` is a Unix time, defaulting to now.'
+
+Assessment = namedtuple('Assessment', ['score', 'decision', 'reasons'])
+VelocityHit = namedtuple('VelocityHit', ['totals', 'recorded'])
+VelocityHit.__doc__ = 'Window totals including a transfer, and whether it was within every limit and so counted.'
+
+
+class _Ring:
+    """One window of one key: ``buckets`` buckets of ``window / buckets`` seconds and their totals."""
+
+    __slots__ = ('width', 'counts', 'amounts', 'head', 'count', 'amount')
+
+    def __init__(self, window, buckets):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.amounts = [0] * buckets
+        self.head = None  # Number of the newest bucket, counted from the epoch
+        self.count = 0
+        self.amount = 0
+
+    def advance(self, now):
+        """Slide the window to ``now``, dropping the buckets that fell out of it."""
+        bucket = int(now // self.width)
+        size = len(self.counts)
+        if self.head is None or bucket - self.head >= size:
+            if self.count:
+                self.counts = [0] * size
+                self.amounts = [0] * size
+                self.count = self.amount = 0
+        elif bucket > self.head:
+            for number in range(self.head + 1, bucket + 1):
+                slot = number % size
+                self.count -= self.counts[slot]
+                self.amount -= self.amounts[slot]
+                self.counts[slot] = self.amounts[slot] = 0
+        else:
+            return  # Same bucket, or the clock stepped back: keep counting into the newest one
+        self.head = bucket
+
+    def add(self, amount):
+        slot = self.head % len(self.counts)
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+        self.count += 1
+        self.amount += amount
+
+
+class LocalVelocityStore:
+    """Rings held in this process, at most ``max_keys`` keys, least recently used dropped first."""
+
+    def __init__(self, buckets, max_keys):
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self._rings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, limits, amount, now):
+        """Check a transfer against ``limits`` and record it if it stays within them.
+
+        Args:
+            limits: ``{key: {window seconds: (max count, max amount)}}``;
+                either maximum may be None
+            amount: Transfer amount in minor units
+            now: Unix time
+
+        Returns:
+            VelocityHit: ``totals`` as ``{key: {window: (count, amount)}}``
+            including this transfer whether or not it was recorded, and
+            ``recorded``
+        """
+        with self._lock:
+            rings = {}
+            for key, windows in limits.items():
+                per_window = self._rings.get(key)
+                if per_window is None:
+                    per_window = self._rings[key] = {}
+                    if len(self._rings) > self.max_keys:
+                        self._rings.popitem(last=False)
+                else:
+                    self._rings.move_to_end(key)
+                for window in windows:
+                    ring = per_window.get(window)
+                    if ring is None:
+                        ring = per_window[window] = _Ring(window, self.buckets)
+                    ring.advance(now)
+                    rings[key, window] = ring
+
+            totals = {key: {} for key in limits}
+            within = True
+            for (key, window), ring in rings.items():
+                count, total = ring.count + 1, ring.amount + amount
+                totals[key][window] = (count, total)
+                max_count, max_amount = limits[key][window]
+                if (max_count is not None and count > max_count) or (max_amount is not None and total > max_amount):
+                    within = False
+            if within:
+                for ring in rings.values():
+                    ring.add(amount)
+            return VelocityHit(totals, within)
+
+
+# Each key is a hash of one ring; fields are slots and values "bucket:count:amount".
+# ARGV: now, amount, buckets, then window, max count, max amount (-1 for none) per key.
+# Returns the count and amount per key including this transfer, then 1 if it was recorded.
+VELOCITY_SCRIPT = """
+local now, amount, size = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local result, heads, within = {}, {}, true
+for i, key in ipairs(KEYS) do
+    local window = tonumber(ARGV[1 + i * 3])
+    local max_count, max_amount = tonumber(ARGV[2 + i * 3]), tonumber(ARGV[3 + i * 3])
+    local bucket = math.floor(now / (window / size))
+    local slots = redis.call('HGETALL', key)
+    local count, total, current = 1, amount, nil
+    for j = 1, #slots, 2 do
+        local stamp, c, a = string.match(slots[j + 1], '^(-?%d+):(%d+):(-?%d+)$')
+        stamp = tonumber(stamp)
+        if stamp > bucket - size then
+            count = count + tonumber(c)
+            total = total + tonumber(a)
+        end
+        if stamp == bucket then
+            current = slots[j + 1]
+        end
+    end
+    if (max_count >= 0 and count > max_count) or (max_amount >= 0 and total > max_amount) then
+        within = false
+    end
+    heads[i] = {bucket, current, window}
+    result[#result + 1] = count
+    result[#result + 1] = string.format('%.0f', total)
+end
+if within then
+    for i, key in ipairs(KEYS) do
+        local bucket, current, window = heads[i][1], heads[i][2], heads[i][3]
+        local c, a = 1, amount
+        if current then
+            local _, pc, pa = string.match(current, '^(-?%d+):(%d+):(-?%d+)$')
+            c, a = c + tonumber(pc), a + tonumber(pa)
+        end
+        redis.call('HSET', key, bucket % size, string.format('%d:%d:%.0f', bucket, c, a))
+        redis.call('PEXPIRE', key, math.ceil(window * 1000 * (size + 1) / size))
+    end
+end
+result[#result + 1] = within and 1 or 0
+return result
+"""
+
+
+class RedisVelocityStore:
+    """Rings in Redis hashes, shared by every worker; one script call per transfer."""
+
+    def __init__(self, client, buckets):
+        self.buckets = buckets
+        self.script = client.register_script(VELOCITY_SCRIPT)
+
+    def hit(self, limits, amount, now):
+        """Same as :meth:`LocalVelocityStore.hit`, atomically in Redis."""
+        keys, args, order = [], [now, amount, self.buckets], []
+        for key, windows in limits.items():
+            for window, (max_count, max_amount) in windows.items():
+                keys.append(cache.make_key(f'{KEY_PREFIX}:{key}:{window}'))
+                args += [window, -1 if max_count is None else max_count, -1 if max_amount is None else max_amount]
+                order.append((key, window))
+        result = self.script(keys=keys, args=args)
+        totals = {key: {} for key in limits}
+        for i, (key, window) in enumerate(order):
+            totals[key][window] = (int(result[2 * i]), int(result[2 * i + 1]))
+        return VelocityHit(totals, bool(int(result[-1])))
+
+
+_store = {'local': None}
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the velocity store: Redis when the default cache is Redis, else this process's."""
+    buckets = getattr(settings, 'RISK_WINDOW_BUCKETS', 12)
+    client = redis_client()
+    if client is not None:
+        return RedisVelocityStore(client, buckets)
+    if _store['local'] is None:
+        with _store_lock:
+            if _store['local'] is None:
+                _store['local'] = LocalVelocityStore(buckets, getattr(settings, 'RISK_LOCAL_MAX_KEYS', 20000))
+    return _store['local']
+
+
+def reset_store():
+    """Forget this process's counts (the Redis ones expire on their own)."""
+    _store['local'] = None
+
+
+def _window_label(seconds):
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds % size == 0:
+            return f'{seconds // size}{unit}'
+    return f'{seconds}s'
+
+
+def velocity_check(context):
+    """Score a transfer by how close it takes its user, device and IP to their velocity limits.
+
+    The score is the highest share of any limit used, in percent. A
+    transfer the store did not record, because it went over a limit by any
+    amount, is blocked even when that rounds down to 100. Reasons name every
+    limit used to ``RISK_REVIEW_SCORE`` or more.
+    """
+    configured = getattr(settings, 'RISK_VELOCITY_LIMITS', {})
+    limits = {}
+    for dimension in DIMENSIONS:
+        value = getattr(context, dimension)
+        if value and configured.get(dimension):
+            limits[f'{dimension}:{value}'] = configured[dimension]
+    if not limits:
+        return 0, []
+
+    now = time.time() if context.at is None else context.at
+    hit = get_store().hit(limits, context.amount, now)
+    review = getattr(settings, 'RISK_REVIEW_SCORE', 80)
+    score, reasons = 0, []
+    for key, windows in hit.totals.items():
+        dimension = key.split(':', 1)[0]
+        for window, used in windows.items():
+            for metric, value, limit in zip(('count', 'amount'), used, limits[key][window]):
+                if not limit:
+                    continue
+                share = value * 100 // limit
+                score = max(score, share)
+                if share >= review:
+                    reasons.append(f'{dimension} {metric} over {_window_label(window)}: {value} of {limit}')
+    if not hit.recorded:
+        # Not counted, so letting it through would let the next one past the limit too
+        score = max(score, BLOCK_ABOVE + 1)
+    return score, reasons
+
+
+@lru_cache(maxsize=8)
+def _checks(paths):
+    return tuple(import_string(path) for path in paths)
+
+
+def assess(context):
+    """Run the configured risk checks on a transfer.
+
+    Returns:
+        Assessment: ``(score, decision, reasons)``; the decision is
+        ``allow``, ``review`` or ``block``
+    """
+    score, reasons = 0, []
+    with timed('risk_assess'):
+        for check in _checks(tuple(getattr(settings, 'RISK_CHECKS', ()))):
+            try:
+                check_score, check_reasons = check(context)
+            except Exception as e:
+                if not getattr(settings, 'RISK_FAIL_OPEN', True):
+                    logger.error(f"Risk check {check.__name__} failed, blocking transfer: {str(e)}")
+                    return Assessment(BLOCK_ABOVE + 1, BLOCK, [f'{check.__name__} unavailable'])
+                logger.warning(f"Risk check {check.__name__} failed, skipped: {str(e)}")
+                continue
+            score = max(score, check_score)
+            reasons.extend(check_reasons)
+    if score > BLOCK_ABOVE:
+        decision = BLOCK
+    elif score >= getattr(settings, 'RISK_REVIEW_SCORE', 80):
+        decision = REVIEW
+    else:
+        decision = ALLOW
+    return Assessment(score, decision, reasons)
@@ -0,0 +1,158 @@
+"""Serializers for the MazePay API."""
+
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .dispatcher import BlockedAddress, resolve_host
+from .models import (
+    Account, JournalEntry, PayoutBatch, Posting, ReconciliationRun, WebhookDelivery, WebhookEndpoint
+)
+
+
+class AccountSerializer(serializers.ModelSerializer):
+    """Serializer for a ledger account and its materialized balance."""
+
+    class Meta:
+        model = Account
+        fields = ['id', 'name', 'kind', 'currency', 'balance', 'created_at']
+        read_only_fields = fields
+
+
+class PostingSerializer(serializers.ModelSerializer):
+    """Serializer for one leg of a journal entry."""
+
+    class Meta:
+        model = Posting
+        fields = ['account', 'amount', 'balance_after']
+        read_only_fields = fields
+
+
+class JournalEntrySerializer(serializers.ModelSerializer):
+    """Serializer for a journal entry with its postings."""
+    postings = PostingSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = JournalEntry
+        fields = ['id', 'reference', 'description', 'created_at', 'postings']
+        read_only_fields = fields
+
+
+class TransferSerializer(serializers.Serializer):
+    """Serializer for a transfer request between two accounts."""
+    source_account = serializers.IntegerField()
+    destination_account = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1, help_text='Minor units (cents)')
+    description = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+    reference = serializers.CharField(max_length=64, required=False, allow_null=True, default=None)
+
+    def validate(self, attrs):
+        if attrs['source_account'] == attrs['destination_account']:
+            raise serializers.ValidationError({'destination_account': 'Cannot transfer to the same account.'})
+        return attrs
+
+
+class PayoutBatchSerializer(serializers.ModelSerializer):
+    """Serializer for a payout batch and its progress."""
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = PayoutBatch
+        fields = [
+            'id', 'source_account', 'description', 'status', 'chunk_size', 'total_items', 'processed_items',
+            'progress', 'total_amount', 'error', 'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
+class PayoutBatchCreateSerializer(serializers.Serializer):
+    """Serializer for a payout batch request: a JSON ``items`` list or an uploaded ``file``."""
+    source_account = serializers.IntegerField()
+    description = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+    chunk_size = serializers.IntegerField(min_value=1, max_value=5000, required=False)
+    items = serializers.ListField(child=serializers.JSONField(), required=False, allow_empty=False)
+    file = serializers.FileField(required=False)
+
+    def validate(self, attrs):
+        if ('items' in attrs) == ('file' in attrs):
+            raise serializers.ValidationError('Provide either items or a file.')
+        return attrs
+
+
+class StatementQuerySerializer(serializers.Serializer):
+    """Query parameters for a statement: local dates, ``end`` exclusive."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+
+class BalanceAtQuerySerializer(serializers.Serializer):
+    """Query parameters for a historical balance."""
+    at = serializers.DateTimeField()
+
+
+class ReconciliationRunSerializer(serializers.ModelSerializer):
+    """Serializer for a reconciliation run and its counts."""
+
+    class Meta:
+        model = ReconciliationRun
+        fields = [
+            'id', 'account', 'start', 'end', 'date_tolerance', 'invert_ledger_amounts', 'status', 'external_rows',
+            'ledger_rows', 'matched', 'mismatched', 'unmatched_external', 'unmatched_ledger', 'error',
+            'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
+class ReconciliationRunCreateSerializer(serializers.Serializer):
+    """Serializer for a reconciliation request: a settlement CSV and the period it covers (``end`` exclusive)."""
+    account = serializers.IntegerField()
+    file = serializers.FileField()
+    start = serializers.DateField()
+    end = serializers.DateField()
+    date_tolerance = serializers.IntegerField(min_value=0, max_value=31, required=False)
+    invert_ledger_amounts = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        if attrs['end'] <= attrs['start']:
+            raise serializers.ValidationError('end must be after start.')
+        return attrs
+
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    """Serializer for a merchant's webhook endpoint; the signing secret is read-only."""
+
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['id', 'url', 'secret', 'event_types', 'max_concurrency', 'is_active', 'created_at']
+        read_only_fields = ['id', 'secret', 'created_at']
+        extra_kwargs = {'max_concurrency': {'min_value': 1, 'max_value': 20}}
+
+    def validate_url(self, value):
+        if not value.lower().startswith('https://') and not getattr(settings, 'WEBHOOK_ALLOW_HTTP', False):
+            raise serializers.ValidationError('Webhook URLs must use https.')
+        parts = urlsplit(value)
+        try:
+            resolve_host(parts.hostname, parts.port or (443 if parts.scheme.lower() == 'https' else 80))
+        except (BlockedAddress, ValueError):
+            # The dispatcher checks again on every connection, in case DNS changes
+            raise serializers.ValidationError('Webhook URLs must point to a public internet address.')
+        return value
+
+    def validate_event_types(self, value):
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise serializers.ValidationError('Expected a list of event types.')
+        return value
+
+
+class WebhookDeliverySerializer(serializers.ModelSerializer):
+    """Serializer for a delivery attempt record."""
+    event_type = serializers.CharField(source='event.event_type', read_only=True)
+
+    class Meta:
+        model = WebhookDelivery
+        fields = [
+            'id', 'event', 'event_type', 'status', 'attempts', 'next_attempt_at', 'last_status_code', 'last_error',
+            'delivered_at',
+        ]
+        read_only_fields = fields
@@ -0,0 +1,277 @@
+"""
+MazePay balance snapshots and account statements.
+
+Historical balances would otherwise need a scan of every posting since the
+account opened. :func:`take_snapshots` (run daily by Celery beat) stores
+each active account's balance at the day boundary, in the local
+``TIME_ZONE``, as a ``BalanceSnapshot``. :func:`balance_at` then reads the
+latest snapshot before the requested time and sums the postings after it
+(at most about a day's worth) using the ``(account, created_at)`` index.
+
+Statements use that as their opening balance and stream the period's
+postings in ``created_at`` order with a running balance, as CSV or as a
+plain PDF written page by page, so memory stays flat however many
+postings an account has.
+
+Days are only snapshotted ``LEDGER_SNAPSHOT_DELAY`` seconds after they end,
+so every transaction stamped before the boundary has committed by then.
+"""
+import csv
+import logging
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from apps.core.db_routers import use_replica
+from apps.core.metrics import timed
+from .models import Account, BalanceSnapshot, Posting
+
+logger = logging.getLogger(__name__)
+
+# Accounts whose previous snapshot is looked up per query
+LOOKUP_BATCH_SIZE = 500
+# Postings fetched per round trip while streaming a statement
+STREAM_CHUNK_SIZE = 2000
+
+
+def day_start(value):
+    """Return the local midnight at or before ``value`` (an aware datetime or a date)."""
+    day = timezone.localtime(value).date() if isinstance(value, datetime) else value
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _next_day(boundary):
+    return day_start(timezone.localtime(boundary).date() + timedelta(days=1))
+
+
+def _snapshot_day(boundary, previous):
+    """Snapshot every account with postings in ``[previous, boundary)``; returns how many."""
+    postings = Posting.objects.filter(created_at__lt=boundary)
+    if previous is not None:
+        postings = postings.filter(created_at__gte=previous)
+    moved = dict(postings.values('account').annotate(total=Sum('amount')).values_list('account', 'total'))
+    account_ids = sorted(moved)
+
+    snapshots = []
+    for start in range(0, len(account_ids), LOOKUP_BATCH_SIZE):
+        latest = BalanceSnapshot.objects.filter(account=OuterRef('pk'), as_of__lt=boundary).order_by('-as_of')
+        opening = Account.objects.filter(pk__in=account_ids[start:start + LOOKUP_BATCH_SIZE]).annotate(
+            opening=Subquery(latest.values('balance')[:1])
+        ).values_list('pk', 'opening')
+        snapshots.extend(
+            BalanceSnapshot(account_id=account_id, as_of=boundary, balance=(balance or 0) + moved[account_id])
+            for account_id, balance in opening
+        )
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000, ignore_conflicts=True)
+    return len(snapshots)
+
+
+def take_snapshots(until=None):
+    """Snapshot balances at every day boundary not yet covered, up to ``until``.
+
+    Safe to run repeatedly: each day is written in one transaction and the
+    next run continues after the latest snapshotted day.
+
+    Args:
+        until: Latest moment to snapshot (default: now minus
+            ``LEDGER_SNAPSHOT_DELAY``)
+
+    Returns:
+        int: Snapshots written
+    """
+    if until is None:
+        until = timezone.now() - timedelta(seconds=getattr(settings, 'LEDGER_SNAPSHOT_DELAY', 300))
+    last_boundary = day_start(until)
+
+    previous = BalanceSnapshot.objects.aggregate(latest=Max('as_of'))['latest']
+    if previous is None:
+        first = Posting.objects.aggregate(first=Min('created_at'))['first']
+        if first is None:
+            return 0
+        boundary = _next_day(first)
+    else:
+        boundary = _next_day(previous)
+
+    written = 0
+    while boundary <= last_boundary:
+        with timed('ledger_snapshot_day'), transaction.atomic():
+            written += _snapshot_day(boundary, previous)
+        previous, boundary = boundary, _next_day(boundary)
+    if written:
+        logger.info(f"Wrote {written} balance snapshots up to {previous}")
+    return written
+
+
+def balance_at(account, at, using=None):
+    """Return an account's balance just before ``at``: the sum of its postings created earlier.
+
+    Reads the latest snapshot before ``at`` and the postings after it: two
+    indexed queries whatever the account's history.
+    """
+    account_id = getattr(account, 'pk', account)
+    snapshot = (
+        BalanceSnapshot.objects.using(using).filter(account_id=account_id, as_of__lte=at)
+        .order_by('-as_of').values_list('as_of', 'balance').first()
+    )
+    postings = Posting.objects.using(using).filter(account_id=account_id, created_at__lt=at)
+    balance = 0
+    if snapshot is not None:
+        as_of, balance = snapshot
+        postings = postings.filter(created_at__gte=as_of)
+    return balance + (postings.aggregate(total=Sum('amount'))['total'] or 0)
+
+
+class Statement:
+    """An account's postings over ``[start, end)`` with opening and running balances.
+
+    Reads go to the replica when one is fresh enough (see
+    :func:`apps.core.db_routers.use_replica`); the database is chosen once,
+    up front, because the rows are read lazily while the response streams.
+    """
+
+    def __init__(self, account, start, end):
+        self.account = account
+        self.start = start
+        self.end = end
+        with use_replica():
+            self.using = router.db_for_read(Posting)
+        self.opening_balance = balance_at(account, start, using=self.using)
+        self.closing_balance = None
+
+    def lines(self):
+        """Yield ``(created_at, entry id, description, amount, balance)`` in posting order."""
+        balance = self.opening_balance
+        rows = (
+            Posting.objects.using(self.using)
+            .filter(account=self.account, created_at__gte=self.start, created_at__lt=self.end)
+            .order_by('created_at', 'pk')
+            .values_list('created_at', 'entry_id', 'entry__description', 'amount')
+            .iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        for created_at, entry_id, description, amount in rows:
+            balance += amount
+            yield created_at, entry_id, description, amount, balance
+        self.closing_balance = balance
+
+
+class _Echo:
+    """File-like object whose write() returns the row, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def iter_statement_csv(statement):
+    """Yield a statement as CSV text; amounts are in minor units."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['date', 'entry', 'description', 'amount', 'balance'])
+    yield writer.writerow([statement.start.isoformat(), '', 'Opening balance', '', statement.opening_balance])
+    for created_at, entry_id, description, amount, balance in statement.lines():
+        yield writer.writerow([timezone.localtime(created_at).isoformat(), entry_id, description, amount, balance])
+    yield writer.writerow([statement.end.isoformat(), '', 'Closing balance', '', statement.closing_balance])
+
+
+def format_amount(value):
+    """Format minor units as major units with two decimals, e.g. ``-1234567`` as ``-12,345.67``."""
+    sign = '-' if value < 0 else ''
+    major, minor = divmod(abs(value), 100)
+    return f'{sign}{major:,}.{minor:02d}'
+
+
+class _PdfWriter:
+    """Minimal PDF writer that emits each page as soon as it is full.
+
+    Text only, in Courier so columns line up; enough for a statement
+    without pulling in a PDF library or holding the document in memory.
+    """
+
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+    MARGIN = 40
+    FONT_SIZE = 8
+    LEADING = 11
+    LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+    # Object numbers: 1 catalog, 2 page tree (written last), 3 font
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 4
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, number, body):
+        self.offsets[number] = self.offset
+        return self._emit(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+
+    def start(self):
+        return (
+            self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+            + self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+            + self._object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>')
+        )
+
+    @staticmethod
+    def _escape(text):
+        text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        return text.encode('cp1252', errors='replace')
+
+    def page(self, lines):
+        content = b''.join(b'(' + self._escape(line) + b') Tj T* ' for line in lines)
+        content = (
+            f'BT /F1 {self.FONT_SIZE} Tf {self.LEADING} TL {self.MARGIN} {self.PAGE_HEIGHT - self.MARGIN} Td '.encode()
+            + content + b'ET'
+        )
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        return (
+            self._object(content_id, f'<< /Length {len(content)} >>\nstream\n'.encode() + content + b'\nendstream')
+            + self._object(page_id, (
+                f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] '
+                f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+            ).encode())
+        )
+
+    def finish(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        data = self._object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode())
+        xref_offset = self.offset
+        xref = [f'xref\n0 {self.next_id}\n', '0000000000 65535 f \n']
+        xref.extend(f'{self.offsets[number]:010d} 00000 n \n' for number in range(1, self.next_id))
+        xref.append(f'trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n')
+        return data + ''.join(xref).encode()
+
+
+def iter_statement_pdf(statement, title=''):
+    """Yield a statement as PDF bytes, one page at a time."""
+    pdf = _PdfWriter()
+    yield pdf.start()
+
+    def row(date, description, amount, balance):
+        return f'{date:<17} {description[:44]:<44} {amount:>15} {balance:>15}'
+
+    header = [
+        title or f'Statement for {statement.account}',
+        f'{timezone.localtime(statement.start):%Y-%m-%d} to {timezone.localtime(statement.end):%Y-%m-%d}',
+        '',
+        row('Date', 'Description', 'Amount', 'Balance'),
+        '-' * 94,
+    ]
+    lines = header + [row('', 'Opening balance', '', format_amount(statement.opening_balance))]
+    for created_at, entry_id, description, amount, balance in statement.lines():
+        lines.append(row(
+            f'{timezone.localtime(created_at):%Y-%m-%d %H:%M}', description or f'Entry {entry_id}',
+            format_amount(amount), format_amount(balance),
+        ))
+        if len(lines) == pdf.LINES_PER_PAGE:
+            yield pdf.page(lines)
+            lines = []
+    lines.append(row('', 'Closing balance', '', format_amount(statement.closing_balance)))
+    yield pdf.page(lines)
+    yield pdf.finish()
@@ -0,0 +1,79 @@
+from celery import shared_task
+import logging
+
+from .ledger import LedgerError
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3)
+def process_payout_batch_task(self, batch_id):
+    """
+    Post a payout batch chunk by chunk, reporting progress as task state.
+    
+    Args:
+        batch_id: PayoutBatch ID
+    """
+    from .payouts import process_batch
+
+    def report(processed, total):
+        self.update_state(state='PROGRESS', meta={'processed_items': processed, 'total_items': total})
+
+    try:
+        batch = process_batch(batch_id, on_progress=report)
+    except LedgerError as e:
+        # Rejected by the ledger (e.g. insufficient funds): retrying will not help
+        logger.error(f"Payout batch {batch_id} rejected: {str(e)}")
+        return False
+    except Exception as e:
+        # The batch is marked failed with its progress kept; a retry resumes it
+        raise self.retry(exc=e, countdown=60)
+    return batch.status
+
+
+@shared_task
+def take_balance_snapshots_task():
+    """
+    Snapshot account balances for every day that has ended since the last run.
+    """
+    from .statements import take_snapshots
+
+    return take_snapshots()
+
+
+@shared_task
+def dispatch_webhooks_task():
+    """
+    Fan out new webhook events and deliver everything that is due.
+    """
+    from .webhooks import dispatch_once
+
+    totals = {'events': 0, 'delivered': 0, 'failed': 0}
+    while True:
+        counts = dispatch_once()
+        for key, value in counts.items():
+            totals[key] += value
+        if not counts['events'] and not counts['delivered'] + counts['failed']:
+            return totals
+
+
+@shared_task(bind=True, max_retries=3)
+def reconcile_settlement_task(self, run_id):
+    """
+    Reconcile a stored settlement file against the ledger and write its reports.
+
+    Args:
+        run_id: ReconciliationRun ID
+    """
+    from .reconciliation import ReconciliationError, run_reconciliation
+
+    try:
+        run = run_reconciliation(run_id)
+    except ReconciliationError as e:
+        # Unreadable file: retrying will not help
+        logger.error(f"Reconciliation {run_id} rejected: {str(e)}")
+        return False
+    except Exception as e:
+        # The run is marked failed; a retry starts it over
+        raise self.retry(exc=e, countdown=60)
+    return run.status
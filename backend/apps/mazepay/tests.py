@@ -1,3 +1,761 @@
-from django.test import TestCase
+"""
+Tests for the MazePay ledger, batch payouts, statements, webhooks and reconciliation.
+"""
+import asyncio
+import csv
+import io
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .ledger import (
+    CurrencyMismatch, InsufficientFunds, ReferenceConflict, UnbalancedEntry, check_ledger, get_balance, post_entry,
+    transfer,
+)
+from .models import (
+    Account, BalanceSnapshot, JournalEntry, OutboxEvent, PayoutBatch, PayoutItem, Posting, ReconciliationRun,
+    WebhookDelivery, WebhookEndpoint,
+)
+from .payouts import PayoutValidationError, create_batch, parse_payout_list, process_batch, validate_payouts
+from .reconciliation import NUMPY_AVAILABLE, ReconciliationError, parse_amount, read_settlement, reconcile
+from .risk import BLOCK, REVIEW, LocalVelocityStore, RedisVelocityStore, TransferContext, assess, reset_store
+from .statements import Statement, balance_at, day_start, iter_statement_pdf, take_snapshots
+from .tasks import process_payout_batch_task, reconcile_settlement_task
+from .dispatcher import deliver_all, is_allowed_address
+from .webhooks import SIGNATURE_HEADER, dispatch_once, verify_signature
+
+User = get_user_model()
+
+
+def _funded_accounts(count, balance):
+    funding = Account.objects.create(name='funding', kind=Account.KIND_SYSTEM, allow_negative=True)
+    accounts = [Account.objects.create(name=f'wallet-{i}') for i in range(count)]
+    post_entry([(funding, -balance * count)] + [(account, balance) for account in accounts])
+    return funding, accounts
+
+
+class LedgerTestCase(TestCase):
+    """Test cases for posting rules and invariants."""
+
+    def setUp(self):
+        self.funding, (self.alice, self.bob) = _funded_accounts(2, 1000)
+
+    def test_transfer_updates_balances_and_postings(self):
+        """A transfer moves money, records running balances and keeps the books at zero."""
+        entry = transfer(self.alice, self.bob, 250, description='Lunch')
+        self.assertEqual(get_balance(self.alice), 750)
+        self.assertEqual(get_balance(self.bob), 1250)
+        self.assertEqual(
+            sorted(entry.postings.values_list('amount', 'balance_after')), [(-250, 750), (250, 1250)]
+        )
+        self.assertEqual(check_ledger(), [])
+
+    def test_balance_read_is_one_query(self):
+        """Balances are materialized, not summed from postings."""
+        with self.assertNumQueries(1):
+            get_balance(self.alice.pk)
+
+    def test_rejected_entries_change_nothing(self):
+        """Overdrafts, unbalanced and mixed-currency entries are refused."""
+        with self.assertRaises(InsufficientFunds):
+            transfer(self.alice, self.bob, 1001)
+        with self.assertRaises(UnbalancedEntry):
+            post_entry([(self.alice, -10), (self.bob, 5)])
+        euro = Account.objects.create(name='euro', currency='EUR')
+        with self.assertRaises(CurrencyMismatch):
+            post_entry([(self.funding, -10), (euro, 10)])
+        self.assertEqual(get_balance(self.alice), 1000)
+        self.assertEqual(check_ledger(), [])
+
+    def test_reference_posts_once(self):
+        """Reposting a reference returns the original entry."""
+        first = transfer(self.alice, self.bob, 100, reference='order-1')
+        second = transfer(self.alice, self.bob, 100, reference='order-1')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(get_balance(self.alice), 900)
+        self.assertEqual(JournalEntry.objects.filter(reference='order-1').count(), 1)
+        with self.assertRaises(ReferenceConflict):
+            transfer(self.alice, self.bob, 101, reference='order-1')
+        # Another scope has its own references
+        third = transfer(self.bob, self.alice, 50, reference='order-1', scope='other')
+        self.assertNotEqual(third.pk, first.pk)
+
+    def test_transfer_endpoint(self):
+        """Users can move money out of their own accounts only."""
+        cache.clear()
+        user = User.objects.create_user(email='payer@example.com', password='testpass123')
+        Account.objects.filter(pk=self.alice.pk).update(owner=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.alice.pk, 'destination_account': self.bob.pk, 'amount': 300,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.bob.pk, 'destination_account': self.alice.pk, 'amount': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.alice.pk, 'destination_account': self.bob.pk, 'amount': 10 ** 6,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = client.get('/api/v1/mazepay/accounts/')
+        self.assertEqual(response.data['results'][0]['balance'], 700)
+
+    def test_transfer_references_are_per_account(self):
+        """A reference another user chose neither reveals their entry nor stops the caller's own transfer."""
+        cache.clear()
+        payer = User.objects.create_user(email='payer@example.com', password='testpass123')
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        Account.objects.filter(pk=self.alice.pk).update(owner=payer)
+        Account.objects.filter(pk=self.bob.pk).update(owner=other)
+        client = APIClient()
+        client.force_authenticate(user=payer)
+        first = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.alice.pk, 'destination_account': self.bob.pk, 'amount': 300, 'reference': 'inv-1',
+        }, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        client.force_authenticate(user=other)
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.bob.pk, 'destination_account': self.alice.pk, 'amount': 5, 'reference': 'inv-1',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data['id'], first.data['id'])
+        self.assertEqual(get_balance(self.bob), 1295)
+
+        client.force_authenticate(user=payer)
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.alice.pk, 'destination_account': self.bob.pk, 'amount': 300, 'reference': 'inv-1',
+        }, format='json')
+        self.assertEqual(response.data['id'], first.data['id'])
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.alice.pk, 'destination_account': self.bob.pk, 'amount': 400, 'reference': 'inv-1',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['code'], 'reference_conflict')
+        self.assertEqual(get_balance(self.alice), 705)
+
+
+# The SQLite test database is shared-cache in-memory, where a busy writer fails
+# at once instead of waiting; run bench_ledger against a file database there.
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentLedgerTestCase(TransactionTestCase):
+    """Test cases for transfers racing from several threads."""
+
+    def test_concurrent_transfers_conserve_money(self):
+        """Random concurrent transfers never overdraw, lose or create money."""
+        _, accounts = _funded_accounts(4, 500)
+        ids = [account.pk for account in accounts]
+        failures = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(25):
+                    source, destination = rng.sample(ids, 2)
+                    try:
+                        transfer(source, destination, rng.randint(1, 200))
+                    except InsufficientFunds:
+                        pass
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        balances = list(Account.objects.filter(pk__in=ids).values_list('balance', flat=True))
+        self.assertEqual(sum(balances), 2000)
+        self.assertTrue(all(balance >= 0 for balance in balances))
+        self.assertEqual(check_ledger(), [])
+
+
+class PayoutBatchTestCase(TestCase):
+    """Test cases for chunked batch payouts."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='payroll@example.com', password='testpass123')
+        self.funding, accounts = _funded_accounts(1, 10000)
+        self.source = accounts[0]
+        self.source.owner = self.user
+        self.source.save(update_fields=['owner'])
+        self.source.refresh_from_db()
+        self.workers = [Account.objects.create(name=f'worker-{i}') for i in range(5)]
+
+    def _items(self, amount=100):
+        return validate_payouts(
+            self.source, parse_payout_list([{'account': worker.pk, 'amount': amount} for worker in self.workers])
+        )
+
+    def test_chunks_post_one_entry_each(self):
+        """Items are posted in chunk-sized entries and the books stay balanced."""
+        batch = create_batch(self.user, self.source, self._items(), chunk_size=2)
+        progress = []
+        batch = process_batch(batch.pk, on_progress=lambda done, total: progress.append(done))
+        self.assertEqual(batch.status, PayoutBatch.STATUS_COMPLETED)
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(JournalEntry.objects.filter(metadata__payout_batch=batch.pk).count(), 3)
+        self.assertEqual(get_balance(self.source), 9500)
+        self.assertTrue(all(get_balance(worker) == 100 for worker in self.workers))
+        self.assertEqual(check_ledger(), [])
+
+    def test_validation_reports_every_bad_line(self):
+        """Nothing is stored when any line is invalid."""
+        rows = parse_payout_list([
+            {'account': self.workers[0].pk, 'amount': 100},
+            {'account': self.workers[1].pk, 'amount': '1.50'},
+            {'account': 999999, 'amount': 100},
+            {'account': self.source.pk, 'amount': 100},
+        ])
+        with self.assertRaises(PayoutValidationError) as raised:
+            validate_payouts(self.source, rows)
+        self.assertEqual([error['line'] for error in raised.exception.errors], [2, 3, 4])
+
+    def test_failed_batch_resumes_without_double_paying(self):
+        """A batch that runs out of funds keeps its progress and finishes once funded."""
+        batch = create_batch(self.user, self.source, self._items(amount=2000), chunk_size=2)
+        transfer(self.source, self.funding, 3000)
+        with self.assertRaises(InsufficientFunds):
+            process_batch(batch.pk)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.processed_items), (PayoutBatch.STATUS_FAILED, 2))
+
+        transfer(self.funding, self.source, 3000)
+        batch = process_batch(batch.pk)
+        self.assertEqual((batch.status, batch.processed_items), (PayoutBatch.STATUS_COMPLETED, 5))
+        self.assertEqual(get_balance(self.source), 0)
+        self.assertFalse(PayoutItem.objects.filter(batch=batch, entry__isnull=True).exists())
+        self.assertEqual(check_ledger(), [])
+
+    def test_stalled_batch_can_be_resumed(self):
+        """A batch left processing by a dead worker is resumable once its lease runs out, not before."""
+        batch = create_batch(self.user, self.source, self._items(), chunk_size=2)
+        PayoutBatch.objects.filter(pk=batch.pk).update(
+            status=PayoutBatch.STATUS_PROCESSING, heartbeat_at=timezone.now()
+        )
+        self.assertEqual(process_batch(batch.pk).processed_items, 0)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/api/v1/mazepay/payouts/{batch.pk}/resume/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        PayoutBatch.objects.filter(pk=batch.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=10))
+        with mock.patch.object(process_payout_batch_task, 'delay') as delay:
+            response = client.post(f'/api/v1/mazepay/payouts/{batch.pk}/resume/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        delay.assert_called_once_with(batch.pk)
+        batch = process_batch(batch.pk)
+        self.assertEqual((batch.status, batch.processed_items), (PayoutBatch.STATUS_COMPLETED, 5))
+
+    def test_users_cannot_take_chunk_references(self):
+        """A transfer quoting a chunk's reference does not block the batch."""
+        batch = create_batch(self.user, self.source, self._items(), chunk_size=2)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/v1/mazepay/transfers/', {
+            'source_account': self.source.pk, 'destination_account': self.workers[0].pk, 'amount': 1,
+            'reference': f'payout-{batch.pk}-1',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        batch = process_batch(batch.pk)
+        self.assertEqual((batch.status, batch.processed_items), (PayoutBatch.STATUS_COMPLETED, 5))
+        self.assertEqual(check_ledger(), [])
+
+    def test_payout_endpoints(self):
+        """A CSV upload is validated, queued and reported; bad files are rejected by line."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        csv_lines = ['account,amount,description'] + [f'{worker.pk},250,Wages' for worker in self.workers]
+        upload = SimpleUploadedFile('payroll.csv', '\n'.join(csv_lines).encode(), content_type='text/csv')
+        with mock.patch.object(process_payout_batch_task, 'delay') as delay:
+            response = client.post(
+                '/api/v1/mazepay/payouts/', {'source_account': self.source.pk, 'file': upload}, format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual((response.data['status'], response.data['total_items']), ('pending', 5))
+        delay.assert_called_once_with(response.data['id'])
+
+        process_payout_batch_task.apply(args=[response.data['id']])
+        response = client.get(f"/api/v1/mazepay/payouts/{response.data['id']}/")
+        self.assertEqual((response.data['status'], response.data['progress']), ('completed', 1.0))
+
+        response = client.post('/api/v1/mazepay/payouts/', {
+            'source_account': self.source.pk,
+            'items': [{'account': self.workers[0].pk, 'amount': 100}, {'account': 'x', 'amount': 100}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+        self.assertEqual(PayoutBatch.objects.count(), 1)
+
+
+class StatementTestCase(TestCase):
+    """Test cases for balance snapshots and statements."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='saver@example.com', password='testpass123')
+        self.funding = Account.objects.create(name='funding', kind=Account.KIND_SYSTEM, allow_negative=True)
+        self.account = Account.objects.create(name='Savings', owner=self.user)
+        self.day = date(2024, 3, 1)
+        # Deposits of 100 at noon on each of five days, and two on the third
+        for offset in (0, 1, 2, 2, 3, 4):
+            self._deposit(100, day_start(self.day + timedelta(days=offset)) + timedelta(hours=12))
+
+    def _deposit(self, amount, when):
+        entry = transfer(self.funding, self.account, amount, description='Deposit')
+        JournalEntry.objects.filter(pk=entry.pk).update(created_at=when)
+        Posting.objects.filter(entry=entry).update(created_at=when)
+
+    def test_snapshots_answer_historical_balances(self):
+        """Snapshots land on day boundaries and balance_at needs two queries."""
+        self.assertEqual(take_snapshots(until=day_start(self.day + timedelta(days=3))), 6)
+        self.assertEqual(take_snapshots(until=day_start(self.day + timedelta(days=3))), 0)
+        self.assertEqual(
+            BalanceSnapshot.objects.get(account=self.account, as_of=day_start(self.day + timedelta(days=3))).balance,
+            400
+        )
+        at = day_start(self.day + timedelta(days=3)) + timedelta(hours=13)
+        with self.assertNumQueries(2):
+            self.assertEqual(balance_at(self.account, at), 500)
+        self.assertEqual(balance_at(self.account, day_start(self.day)), 0)
+        self.assertEqual(balance_at(self.account, day_start(self.day + timedelta(days=10))), 600)
+
+    def test_statement_streams_running_balances(self):
+        """The CSV has opening and closing rows around the period's postings."""
+        take_snapshots(until=day_start(self.day + timedelta(days=5)))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(
+            f'/api/v1/mazepay/accounts/{self.account.pk}/statement.csv', {'start': '2024-03-02', 'end': '2024-03-04'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [line.split(',') for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row[2] for row in rows[1:]], ['Opening balance'] + ['Deposit'] * 3 + ['Closing balance'])
+        self.assertEqual([row[4] for row in rows[1:]], ['100', '200', '300', '400', '400'])
+
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        client.force_authenticate(other)
+        response = client.get(f'/api/v1/mazepay/accounts/{self.account.pk}/statement.csv')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pdf_statement_is_well_formed(self):
+        """The PDF has one page per screenful of postings and a valid trailer."""
+        for i in range(100):
+            self._deposit(1, day_start(self.day + timedelta(days=5)) + timedelta(minutes=i))
+        statement = Statement(self.account, day_start(self.day), day_start(self.day + timedelta(days=6)))
+        pdf = b''.join(iter_statement_pdf(statement))
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 2', pdf)
+        self.assertIn(b'(                  Closing balance', pdf)
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        self.assertTrue(pdf[xref:].startswith(b'xref'))
+        self.assertEqual(statement.closing_balance, 700)
+
+
+class _Receiver(BaseHTTPRequestHandler):
+    """Stand-in webhook receiver: records requests and answers with the status set for its path."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+            server.received.append((self.path, dict(self.headers), body, self.client_address[1]))
+        self.send_response(server.statuses.get(self.path, 200))
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOK_ALLOW_HTTP=True, WEBHOOK_ALLOW_PRIVATE_ADDRESSES=True)
+class WebhookTestCase(TestCase):
+    """Test cases for the webhook outbox and dispatcher against a local HTTP server."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Receiver)
+        self.server.lock = threading.Lock()
+        self.server.received, self.server.statuses = [], {}
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+        self.merchant = User.objects.create_user(email='merchant@example.com', password='testpass123')
+        self.funding, (self.shop, self.customer) = _funded_accounts(2, 1000)
+        Account.objects.filter(pk=self.shop.pk).update(owner=self.merchant)
+        self.internal = WebhookEndpoint.objects.create(url=f'{self.base_url}/internal')
+        OutboxEvent.objects.all().delete()
+
+    def test_events_delivered_signed_and_scoped(self):
+        """Both endpoints get a signed event; the merchant only sees its own posting."""
+        endpoint = WebhookEndpoint.objects.create(owner=self.merchant, url=f'{self.base_url}/shop')
+        transfer(self.customer, self.shop, 250)
+        self.assertEqual(dispatch_once(), {'events': 1, 'delivered': 2, 'failed': 0})
+
+        received = {path: (headers, body) for path, headers, body, _ in self.server.received}
+        headers, body = received['/shop']
+        self.assertTrue(verify_signature(endpoint.secret, headers[SIGNATURE_HEADER], body))
+        self.assertFalse(verify_signature(self.internal.secret, headers[SIGNATURE_HEADER], body))
+        self.assertEqual(body.count(b'"account"'), 1)
+        self.assertEqual(received['/internal'][1].count(b'"account"'), 2)
+
+        for _ in range(5):
+            transfer(self.customer, self.funding, 1)
+        dispatch_once()
+        ports = {port for path, _, _, port in self.server.received if path == '/internal'}
+        self.assertLess(len(ports), 6, 'keep-alive connections should be reused')
+
+    def test_event_rolls_back_with_entry(self):
+        """A rejected entry leaves nothing in the outbox."""
+        with self.assertRaises(InsufficientFunds):
+            transfer(self.customer, self.shop, 10 ** 6)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_dead_letter(self):
+        """Failed deliveries are retried later, dead-lettered, and can be requeued."""
+        self.server.statuses['/internal'] = 503
+        transfer(self.customer, self.shop, 1)
+        self.assertEqual(dispatch_once()['failed'], 1)
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.last_status_code), (WebhookDelivery.STATUS_PENDING, 503))
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+        self.assertEqual(dispatch_once()['failed'], 0)
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        dispatch_once()
+        self.assertEqual(WebhookDelivery.objects.get().status, WebhookDelivery.STATUS_DEAD)
+
+        self.internal.owner = self.merchant
+        self.internal.save()
+        client = APIClient()
+        client.force_authenticate(self.merchant)
+        response = client.post(f'/api/v1/mazepay/webhooks/{self.internal.pk}/redeliver/', {}, format='json')
+        self.assertEqual(response.data, {'requeued': 1})
+        self.server.statuses['/internal'] = 204
+        self.assertEqual(dispatch_once()['delivered'], 1)
+
+    def test_per_endpoint_concurrency_limit(self):
+        """No more requests are in flight to an endpoint than it allows."""
+        WebhookEndpoint.objects.filter(pk=self.internal.pk).update(max_concurrency=2)
+        self.server.delay = 0.02
+        for _ in range(8):
+            transfer(self.customer, self.funding, 1)
+        self.assertEqual(dispatch_once()['delivered'], 8)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_ADDRESSES=False)
+    def test_internal_addresses_refused(self):
+        """Loopback, private, link-local and mapped addresses are refused at registration and when connecting."""
+        client = APIClient()
+        client.force_authenticate(self.merchant)
+        for url in (
+            f'{self.base_url}/shop', 'https://localhost/hook', 'https://10.0.0.5/hook',
+            'https://169.254.169.254/latest/meta-data', 'https://[::1]/hook', 'https://[::ffff:192.168.1.1]/hook',
+        ):
+            response = client.post('/api/v1/mazepay/webhooks/', {'url': url}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+        self.assertTrue(is_allowed_address('93.184.216.34'))
+        self.assertFalse(is_allowed_address('100.64.0.1'))
+
+        # An endpoint stored (or re-pointed) earlier is refused by the dispatcher itself
+        transfer(self.customer, self.funding, 1)
+        self.assertEqual(dispatch_once()['delivered'], 0)
+        self.assertEqual(self.server.received, [])
+        delivery = WebhookDelivery.objects.get(endpoint=self.internal)
+        self.assertIn('non-public address', delivery.last_error)
+
+    @override_settings(WEBHOOK_TIMEOUT=0.5)
+    def test_stalled_receiver_times_out(self):
+        """A server that accepts the connection but never reads cannot hold a delivery past the timeout."""
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        self.addCleanup(listener.close)
+        accepted = []
+        threading.Thread(target=lambda: accepted.append(listener.accept()[0]), daemon=True).start()
+        self.addCleanup(lambda: [sock.close() for sock in accepted])
+
+        url = f'http://127.0.0.1:{listener.getsockname()[1]}/hook'
+        delivery = WebhookDelivery(pk=1, endpoint=self.internal)
+        started = time.monotonic()
+        [(_, status_code, error)] = asyncio.run(deliver_all([(delivery, url, b'x' * (32 << 20), {})]))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual((status_code, error), (None, 'Timed out after 0.5s'))
+
+
+SETTLEMENT_CSV = """reference,amount,date,fee
+pay-1,10.00,2024-03-02,0.10
+pay-2,20.50,2024-03-02,0.20
+pay-3,30,2024-03-08T09:00:00+01:00,0.30
+pay-4,40.00,2024-03-03,0.40
+pay-9,1.00,2024-03-03,0.01
+pay-10,abc,2024-03-03,0.00
+pay-4,40.00,2024-03-03,0.40
+"""
+
+
+@skipUnless(NUMPY_AVAILABLE, 'NumPy is not installed')
+class ReconciliationTestCase(TestCase):
+    """Test cases for reconciling settlement files against the ledger."""
+
+    def setUp(self):
+        self.settlement = Account.objects.create(name='card settlement', kind=Account.KIND_SYSTEM, allow_negative=True)
+        self.wallet = Account.objects.create(name='wallet')
+        self.day = date(2024, 3, 1)
+        # Card top-ups: the settlement account is debited as the wallet is credited
+        for number, offset in ((1, 0), (2, 1), (3, 1), (4, 2), (5, 3), (6, -1)):
+            entry = transfer(self.settlement, self.wallet, number * 1000, reference=f'pay-{number}')
+            when = day_start(self.day + timedelta(days=offset)) + timedelta(hours=12)
+            JournalEntry.objects.filter(pk=entry.pk).update(created_at=when)
+            Posting.objects.filter(entry=entry).update(created_at=when)
+        self.reports = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.reports)
+
+    def _report(self, kind, directory=None):
+        with open(os.path.join(directory or self.reports, f'{kind}.csv'), newline='') as report:
+            return list(csv.DictReader(report))
+
+    def test_reports_classify_every_row(self):
+        """Rows are matched, mismatched or unmatched across chunks; postings outside the period are ignored."""
+        counts = reconcile(
+            self.settlement, io.StringIO(SETTLEMENT_CSV), self.day, self.day + timedelta(days=4), self.reports,
+            date_tolerance=2, invert_ledger_amounts=True, chunk_size=3,
+        )
+        self.assertEqual(counts, {
+            'external_rows': 7, 'ledger_rows': 5, 'matched': 2, 'mismatched': 3,
+            'unmatched_external': 2, 'unmatched_ledger': 1,
+        })
+        matched = self._report('matched')
+        self.assertEqual([(row['reference'], row['date'], row['ledger_date']) for row in matched], [
+            ('pay-1', '2024-03-02', '2024-03-01'), ('pay-4', '2024-03-03', '2024-03-03'),
+        ])
+        self.assertEqual(
+            [(row['line'], row['reference'], row['reason']) for row in self._report('mismatched')],
+            [('3', 'pay-2', 'amount'), ('4', 'pay-3', 'date'), ('8', 'pay-4', 'duplicate')]
+        )
+        self.assertEqual(
+            [(row['reference'], row['reason']) for row in self._report('unmatched_external')],
+            [('pay-9', 'no ledger entry'), ('pay-10', "Invalid amount: 'abc'")]
+        )
+        self.assertEqual(
+            [(row['reference'], row['amount']) for row in self._report('unmatched_ledger')], [('pay-5', '5000')]
+        )
+
+    def test_ledger_sign_and_missing_columns(self):
+        """Without inverting, the settlement account's debits do not match; a file without amounts is rejected."""
+        counts = reconcile(
+            self.settlement, io.StringIO(SETTLEMENT_CSV), self.day, self.day + timedelta(days=4), self.reports
+        )
+        self.assertEqual((counts['matched'], counts['mismatched']), (0, 5))
+        with self.assertRaises(ReconciliationError):
+            reconcile(self.settlement, io.StringIO('reference,date\npay-1,2024-03-01\n'), self.day, self.day,
+                      self.reports)
+
+    def test_truncated_rows(self):
+        """Short rows are reported as invalid with whatever fields they have, not raised."""
+        chunks = list(read_settlement(io.StringIO('reference,amount,date\nR1,abc\nR2\nR3,1.00,2024-03-01\n')))
+        self.assertEqual(len(chunks), 1)
+        line_numbers, references, amounts, days, invalid = chunks[0]
+        self.assertEqual((line_numbers, references, amounts), ([4], ['R3'], [100]))
+        self.assertEqual(invalid, [
+            (2, 'R1', 'abc', '', "Invalid amount: 'abc'"), (3, 'R2', '', '', 'Missing fields'),
+        ])
+
+    def test_parse_amount(self):
+        """Major units convert to minor units exactly."""
+        self.assertEqual(
+            [parse_amount(value) for value in ('12.34', '-1,234.5', '7', '.5', '+0.10', '3.000')],
+            [1234, -123450, 700, 50, 10, 300]
+        )
+        for value in ('', '1.234', '1e3', '--1', 'abc'):
+            with self.assertRaises(ValueError):
+                parse_amount(value)
+
+    def test_reconciliation_endpoints(self):
+        """Staff upload a file, the run is queued, and its reports can be downloaded."""
+        admin = User.objects.create_superuser(email='finance@example.com', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile('settlement.csv', SETTLEMENT_CSV.encode(), content_type='text/csv')
+        private, media = os.path.join(self.reports, 'private'), os.path.join(self.reports, 'media')
+        with override_settings(PRIVATE_ROOT=private, MEDIA_ROOT=media), \
+                mock.patch.object(reconcile_settlement_task, 'delay') as delay:
+            response = client.post('/api/v1/mazepay/reconciliations/', {
+                'account': self.settlement.pk, 'file': upload, 'start': '2024-03-01', 'end': '2024-03-05',
+                'invert_ledger_amounts': True,
+            }, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            delay.assert_called_once_with(response.data['id'])
+
+            reconcile_settlement_task.apply(args=[response.data['id']])
+            run_url = f"/api/v1/mazepay/reconciliations/{response.data['id']}/"
+            response = client.get(run_url)
+            self.assertEqual((response.data['status'], response.data['matched']), ('completed', 2))
+            response = client.get(run_url + 'mismatched.csv')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(b'pay-2', b''.join(response.streaming_content))
+            self.assertEqual(client.get(run_url + 'everything.csv').status_code, status.HTTP_404_NOT_FOUND)
+
+            # Neither the upload nor the reports are anywhere the web server serves
+            run = ReconciliationRun.objects.get()
+            self.assertTrue(run.settlement_file.path.startswith(private + os.sep))
+            self.assertTrue(run.report_dir.startswith(private + os.sep))
+            self.assertFalse(os.path.exists(media))
+
+        client.force_authenticate(User.objects.create_user(email='user@example.com', password='testpass123'))
+        self.assertEqual(client.get('/api/v1/mazepay/reconciliations/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(ReconciliationRun.objects.count(), 1)
+
+
+def _broken_check(context):
+    raise ConnectionError('store unavailable')
+
+
+class RiskTestCase(TestCase):
+    """Test cases for velocity scoring of transfers."""
+
+    def setUp(self):
+        reset_store()
+        self.addCleanup(reset_store)
+
+    def test_window_slides(self):
+        """Transfers over a limit are refused and not counted; expired buckets free the window."""
+        store = LocalVelocityStore(buckets=6, max_keys=10)
+        limits = {'user:1': {60: (2, 500)}}
+        self.assertEqual(store.hit(limits, 100, now=1000), ({'user:1': {60: (1, 100)}}, True))
+        self.assertEqual(store.hit(limits, 100, now=1020).totals['user:1'][60], (2, 200))
+        self.assertEqual(store.hit(limits, 100, now=1030), ({'user:1': {60: (3, 300)}}, False))  # Over, not recorded
+        # The first transfer's bucket expires after 60s, the second's stays
+        self.assertEqual(store.hit(limits, 100, now=1065).totals['user:1'][60], (2, 200))
+        self.assertEqual(store.hit(limits, 450, now=1200).totals['user:1'][60], (1, 450))
+
+    def test_least_recently_used_keys_dropped(self):
+        """The local store keeps at most max_keys keys."""
+        store = LocalVelocityStore(buckets=6, max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            store.hit({key: {60: (None, None)}}, 1, now=0)
+        self.assertEqual(list(store._rings), ['a', 'c'])
+
+    @override_settings(RISK_VELOCITY_LIMITS={'user': {60: (3, None)}, 'device': {3600: (None, 1000)}})
+    def test_scores_and_decisions(self):
+        """Scores are the share of the nearest limit; review from RISK_REVIEW_SCORE, block above 100."""
+        def context(user, device, amount):
+            return TransferContext(user, device, '10.0.0.1', amount, 1, 2, at=5000)
+
+        self.assertEqual(assess(context(1, 'phone', 100)).score, 33)
+        self.assertEqual(assess(context(2, 'phone', 700)).decision, REVIEW)  # Device amount 800 of 1000
+        blocked = assess(context(3, 'phone', 300))
+        self.assertEqual(blocked.decision, BLOCK)
+        self.assertEqual(blocked.reasons, ['device amount over 1h: 1100 of 1000'])
+        assess(context(1, None, 1))
+        self.assertEqual(assess(context(1, None, 1)).decision, REVIEW)
+        self.assertEqual(assess(context(1, None, 1)).decision, BLOCK)
+
+    @override_settings(RISK_VELOCITY_LIMITS={'user': {86400: (None, 1000000)}})
+    def test_limit_cannot_be_crept_past(self):
+        """Once a cap is used up, transfers under 1% of it are blocked too, however many are tried."""
+        def context(amount):
+            return TransferContext(1, None, None, amount, 1, 2, at=5000)
+
+        self.assertEqual(assess(context(1000000)).decision, REVIEW)
+        for _ in range(5):
+            blocked = assess(context(9999))
+            self.assertEqual(blocked.decision, BLOCK)
+            self.assertEqual(blocked.reasons, ['user amount over 1d: 1009999 of 1000000'])
+
+    def test_redis_store_reports_whether_recorded(self):
+        """The Redis store passes on the script's verdict on whether the transfer was counted."""
+        client = mock.Mock()
+        client.register_script.return_value = mock.Mock(return_value=[1, b'1009999', 0])
+        hit = RedisVelocityStore(client, buckets=12).hit({'user:1': {86400: (None, 1000000)}}, 9999, now=5000)
+        self.assertEqual(hit, ({'user:1': {86400: (1, 1009999)}}, False))
+
+    @override_settings(RISK_CHECKS=['apps.mazepay.tests._broken_check'])
+    def test_failing_check(self):
+        """A check that raises is skipped, unless the checks fail closed."""
+        context = TransferContext(1, None, None, 100, 1, 2)
+        self.assertEqual(assess(context).decision, 'allow')
+        with override_settings(RISK_FAIL_OPEN=False):
+            self.assertEqual(assess(context).decision, BLOCK)
+
+    @override_settings(RISK_VELOCITY_LIMITS={'user': {60: (2, None)}})
+    def test_transfer_endpoint_applies_velocity_limits(self):
+        """Flagged transfers carry their reasons; blocked ones are declined before posting."""
+        cache.clear()
+        funding, (wallet, other) = _funded_accounts(2, 1000)
+        user = User.objects.create_user(email='fast@example.com', password='testpass123')
+        Account.objects.filter(pk=wallet.pk).update(owner=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        payload = {'source_account': wallet.pk, 'destination_account': other.pk, 'amount': 10}
+
+        first = client.post('/api/v1/mazepay/transfers/', payload, format='json', HTTP_X_DEVICE_ID='phone')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('risk_review', JournalEntry.objects.get(pk=first.data['id']).metadata)
+        second = client.post('/api/v1/mazepay/transfers/', payload, format='json')
+        self.assertEqual(
+            JournalEntry.objects.get(pk=second.data['id']).metadata['risk_review'], ['user count over 1m: 2 of 2']
+        )
+        third = client.post('/api/v1/mazepay/transfers/', payload, format='json')
+        self.assertEqual(third.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(third.data['code'], 'transfer_declined')
+        self.assertEqual(get_balance(wallet), 980)
+
+    @override_settings(RISK_VELOCITY_LIMITS={'ip': {60: (1, None)}})
+    def test_forwarded_for_cannot_reset_ip_limits(self):
+        """Client-written X-Forwarded-For entries do not give a fresh IP window."""
+        cache.clear()
+        funding, (wallet, other) = _funded_accounts(2, 1000)
+        user = User.objects.create_user(email='rotating@example.com', password='testpass123')
+        Account.objects.filter(pk=wallet.pk).update(owner=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        payload = {'source_account': wallet.pk, 'destination_account': other.pk, 'amount': 10}
+
+        def post(forwarded_for):
+            return client.post(
+                '/api/v1/mazepay/transfers/', payload, format='json', HTTP_X_FORWARDED_FOR=forwarded_for
+            ).status_code
+
+        self.assertEqual(post('198.51.100.1'), status.HTTP_201_CREATED)
+        self.assertEqual(post('198.51.100.2'), status.HTTP_403_FORBIDDEN)
+        with override_settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(post('198.51.100.3, 203.0.113.5'), status.HTTP_201_CREATED)
+            self.assertEqual(post('198.51.100.4, 203.0.113.5'), status.HTTP_403_FORBIDDEN)
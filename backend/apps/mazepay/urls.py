@@ -1,10 +1,30 @@
 """URL routing for the MazePay application."""
 
 from django.urls import path
-from .views import MazePayAPIView
+from .views import (
+    AccountBalanceView, AccountListView, MazePayAPIView, PayoutBatchDetailView, PayoutBatchResumeView,
+    PayoutBatchView, ReconciliationReportView, ReconciliationRunDetailView, ReconciliationRunView, StatementView,
+    TransferView, WebhookDeliveryListView, WebhookEndpointDetailView, WebhookEndpointListView, WebhookRedeliverView
+)
 
 app_name = 'mazepay'
 
 urlpatterns = [
     path('', MazePayAPIView.as_view(), name='mazepay-api'),
+    path('accounts/', AccountListView.as_view(), name='account-list'),
+    path('accounts/<int:pk>/balance/', AccountBalanceView.as_view(), name='account-balance'),
+    path('accounts/<int:pk>/statement.<str:file_type>', StatementView.as_view(), name='account-statement'),
+    path('transfers/', TransferView.as_view(), name='transfer'),
+    path('payouts/', PayoutBatchView.as_view(), name='payout-batches'),
+    path('payouts/<int:pk>/', PayoutBatchDetailView.as_view(), name='payout-batch-detail'),
+    path('payouts/<int:pk>/resume/', PayoutBatchResumeView.as_view(), name='payout-batch-resume'),
+    path('reconciliations/', ReconciliationRunView.as_view(), name='reconciliation-runs'),
+    path('reconciliations/<int:pk>/', ReconciliationRunDetailView.as_view(), name='reconciliation-run-detail'),
+    path(
+        'reconciliations/<int:pk>/<str:kind>.csv', ReconciliationReportView.as_view(), name='reconciliation-report'
+    ),
+    path('webhooks/', WebhookEndpointListView.as_view(), name='webhook-endpoints'),
+    path('webhooks/<int:pk>/', WebhookEndpointDetailView.as_view(), name='webhook-endpoint-detail'),
+    path('webhooks/<int:pk>/deliveries/', WebhookDeliveryListView.as_view(), name='webhook-deliveries'),
+    path('webhooks/<int:pk>/redeliver/', WebhookRedeliverView.as_view(), name='webhook-redeliver'),
 ]
@@ -1,6 +1,31 @@
-from rest_framework.views import APIView
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.views import APIView
+
+from apps.core.idempotency import idempotent
+from apps.users.utils import get_client_ip
+from .ledger import CurrencyMismatch, InsufficientFunds, LedgerError, ReferenceConflict, transfer
+from .models import Account, PayoutBatch, ReconciliationRun, WebhookDelivery, WebhookEndpoint
+from .payouts import (
+    PayoutValidationError, create_batch, is_stalled, parse_payout_file, parse_payout_list, validate_payouts,
+)
+from .risk import ALLOW, BLOCK, TransferContext, assess
+from .serializers import (
+    AccountSerializer, BalanceAtQuerySerializer, JournalEntrySerializer, PayoutBatchCreateSerializer,
+    PayoutBatchSerializer, ReconciliationRunCreateSerializer, ReconciliationRunSerializer, StatementQuerySerializer,
+    TransferSerializer, WebhookDeliverySerializer, WebhookEndpointSerializer
+)
+from .statements import Statement, balance_at, day_start, iter_statement_csv, iter_statement_pdf
+from .webhooks import redeliver
+
+logger = logging.getLogger(__name__)
+
 
 class MazePayAPIView(APIView):
     """
@@ -11,3 +36,370 @@ class MazePayAPIView(APIView):
         Handle GET requests.
         """
         return Response({"status": "MazePay API is working"}, status=status.HTTP_200_OK)
+
+
+class AccountListView(generics.ListAPIView):
+    """
+    List the current user's ledger accounts with their balances.
+    """
+    serializer_class = AccountSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Account.objects.filter(owner=self.request.user).order_by('pk')
+
+
+class AccountBalanceView(APIView):
+    """
+    Show one of the current user's account balances at a past moment.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        """Answer from the latest snapshot plus the postings after it."""
+        account = Account.objects.filter(pk=pk, owner=request.user).first()
+        if account is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = BalanceAtQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        at = serializer.validated_data['at']
+        return Response({'account': account.pk, 'at': at, 'balance': balance_at(account, at)})
+
+
+class StatementView(APIView):
+    """
+    Stream a statement for one of the current user's accounts as CSV or PDF.
+
+    ``start`` and ``end`` are local dates, ``end`` exclusive; by default the
+    current month so far.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    CONTENT_TYPES = {'csv': 'text/csv', 'pdf': 'application/pdf'}
+
+    def get(self, request, pk, file_type):
+        """Stream the statement; memory use does not grow with the number of postings."""
+        if file_type not in self.CONTENT_TYPES:
+            return Response({'detail': 'Statements are available as csv or pdf.'}, status=status.HTTP_404_NOT_FOUND)
+        account = Account.objects.filter(pk=pk, owner=request.user).first()
+        if account is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = StatementQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        today = timezone.localdate()
+        start = serializer.validated_data.get('start', today.replace(day=1))
+        end = serializer.validated_data.get('end', today + timedelta(days=1))
+        if start >= end:
+            return Response({'end': ['Must be after start.']}, status=status.HTTP_400_BAD_REQUEST)
+        statement = Statement(account, day_start(start), day_start(end))
+
+        if file_type == 'pdf':
+            content = iter_statement_pdf(statement, title=f'{account.name} ({account.currency})')
+        else:
+            content = iter_statement_csv(statement)
+        response = StreamingHttpResponse(content, content_type=self.CONTENT_TYPES[file_type])
+        response['Content-Disposition'] = (
+            f'attachment; filename="statement-{account.pk}-{start:%Y%m%d}-{end:%Y%m%d}.{file_type}"'
+        )
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+
+class TransferView(APIView):
+    """
+    Move money from one of the current user's accounts to another account.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        """Post a transfer as a balanced journal entry."""
+        serializer = TransferSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        if not Account.objects.filter(pk=data['source_account'], owner=request.user).exists():
+            return Response({'source_account': ['Account not found.']}, status=status.HTTP_404_NOT_FOUND)
+        if not Account.objects.filter(pk=data['destination_account'], kind=Account.KIND_USER).exists():
+            return Response({'destination_account': ['Account not found.']}, status=status.HTTP_404_NOT_FOUND)
+
+        # The device ID is the client's to choose, so only the user and IP limits are enforceable
+        assessment = assess(TransferContext(
+            user=request.user.pk, device=request.META.get('HTTP_X_DEVICE_ID', '')[:128], ip=get_client_ip(request),
+            amount=data['amount'], source_account=data['source_account'],
+            destination_account=data['destination_account'],
+        ))
+        if assessment.decision == BLOCK:
+            # Which limit was hit stays in the logs; telling the caller would help anyone probing for them
+            logger.warning(f"Blocked transfer for user {request.user.pk}: {'; '.join(assessment.reasons)}")
+            return Response(
+                {'detail': 'Transfer declined.', 'code': 'transfer_declined'}, status=status.HTTP_403_FORBIDDEN
+            )
+        metadata = {'initiated_by': str(request.user.pk), 'risk_score': assessment.score}
+        if assessment.decision != ALLOW:
+            metadata['risk_review'] = assessment.reasons
+
+        try:
+            # References are the caller's own: scoped to the source account, which only they can debit
+            entry = transfer(
+                data['source_account'], data['destination_account'], data['amount'],
+                description=data['description'], reference=data['reference'], metadata=metadata,
+                scope=f"account:{data['source_account']}",
+            )
+        except ReferenceConflict:
+            return Response(
+                {'detail': 'This reference was already used for a different transfer.', 'code': 'reference_conflict'},
+                status=status.HTTP_409_CONFLICT
+            )
+        except InsufficientFunds:
+            return Response(
+                {'detail': 'Insufficient funds.', 'code': 'insufficient_funds'},
+                status=status.HTTP_409_CONFLICT
+            )
+        except CurrencyMismatch:
+            return Response(
+                {'detail': 'Accounts use different currencies.', 'code': 'currency_mismatch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except LedgerError as e:
+            logger.warning(f"Rejected transfer for user {request.user.pk}: {str(e)}")
+            return Response({'detail': 'Transfer rejected.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(JournalEntrySerializer(entry).data, status=status.HTTP_201_CREATED)
+
+
+def _queue_batch(batch):
+    """Queue a payout batch for processing, or process it here when no broker is available."""
+    from .payouts import process_batch
+    from .tasks import process_payout_batch_task
+    try:
+        process_payout_batch_task.delay(batch.pk)
+    except Exception as e:
+        # No broker (e.g. local development): post the batch in this request instead
+        logger.warning(f"Could not queue payout batch {batch.pk}, processing inline: {str(e)}")
+        try:
+            process_batch(batch.pk)
+        except LedgerError:
+            pass  # Recorded on the batch as failed
+    batch.refresh_from_db()
+    return batch
+
+
+class PayoutBatchView(APIView):
+    """
+    List the current user's payout batches, or submit a new one.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """List batches, newest first."""
+        batches = PayoutBatch.objects.filter(created_by=request.user)[:50]
+        return Response(PayoutBatchSerializer(batches, many=True).data)
+
+    @idempotent
+    def post(self, request):
+        """Validate a payout list up front, store it and queue it for posting."""
+        serializer = PayoutBatchCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        source = Account.objects.filter(pk=data['source_account'], owner=request.user).first()
+        if source is None:
+            return Response({'source_account': ['Account not found.']}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            rows = parse_payout_file(data['file']) if 'file' in data else parse_payout_list(data['items'])
+            items = validate_payouts(source, rows)
+        except PayoutValidationError as e:
+            return Response(
+                {'detail': 'Payout list rejected.', 'errors': e.errors, 'total_errors': e.total_errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        batch = create_batch(
+            request.user, source, items, description=data['description'], chunk_size=data.get('chunk_size')
+        )
+        batch = _queue_batch(batch)
+        return Response(PayoutBatchSerializer(batch).data, status=status.HTTP_202_ACCEPTED)
+
+
+class PayoutBatchDetailView(generics.RetrieveAPIView):
+    """
+    Show a payout batch's status and progress.
+    """
+    serializer_class = PayoutBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return PayoutBatch.objects.filter(created_by=self.request.user)
+
+
+class PayoutBatchResumeView(APIView):
+    """
+    Resume a failed or stalled payout batch from its first unposted item.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        """Queue the batch again; posted chunks are not repeated."""
+        batch = PayoutBatch.objects.filter(pk=pk, created_by=request.user).first()
+        if batch is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if batch.status != PayoutBatch.STATUS_FAILED and not is_stalled(batch):
+            return Response(
+                {'detail': f'Only failed or stalled batches can be resumed; this one is {batch.status}.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        batch = _queue_batch(batch)
+        return Response(PayoutBatchSerializer(batch).data, status=status.HTTP_202_ACCEPTED)
+
+
+def _queue_reconciliation(run):
+    """Queue a reconciliation run, or run it here when no broker is available."""
+    from .reconciliation import ReconciliationError, run_reconciliation
+    from .tasks import reconcile_settlement_task
+    try:
+        reconcile_settlement_task.delay(run.pk)
+    except Exception as e:
+        # No broker (e.g. local development): reconcile in this request instead
+        logger.warning(f"Could not queue reconciliation {run.pk}, running inline: {str(e)}")
+        try:
+            run_reconciliation(run.pk)
+        except ReconciliationError:
+            pass  # Recorded on the run as failed
+    run.refresh_from_db()
+    return run
+
+
+class ReconciliationRunView(APIView):
+    """
+    List reconciliation runs, or reconcile a processor's settlement file against an account.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """List runs, newest first."""
+        runs = ReconciliationRun.objects.all()[:50]
+        return Response(ReconciliationRunSerializer(runs, many=True).data)
+
+    @idempotent
+    def post(self, request):
+        """Store the settlement file and queue the run."""
+        serializer = ReconciliationRunCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        account = Account.objects.filter(pk=data['account']).first()
+        if account is None:
+            return Response({'account': ['Account not found.']}, status=status.HTTP_404_NOT_FOUND)
+
+        run = ReconciliationRun.objects.create(
+            created_by=request.user,
+            account=account,
+            settlement_file=data['file'],
+            start=data['start'],
+            end=data['end'],
+            date_tolerance=data.get('date_tolerance', getattr(settings, 'RECONCILIATION_DATE_TOLERANCE', 2)),
+            invert_ledger_amounts=data['invert_ledger_amounts'],
+        )
+        run = _queue_reconciliation(run)
+        return Response(ReconciliationRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ReconciliationRunDetailView(generics.RetrieveAPIView):
+    """
+    Show a reconciliation run's status and counts.
+    """
+    serializer_class = ReconciliationRunSerializer
+    permission_classes = [permissions.IsAdminUser]
+    queryset = ReconciliationRun.objects.all()
+
+
+class ReconciliationReportView(APIView):
+    """
+    Download one of a completed run's reports: matched, mismatched, unmatched_external or unmatched_ledger.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, pk, kind):
+        """Send the report as a CSV attachment."""
+        from .reconciliation import report_path
+
+        run = ReconciliationRun.objects.filter(pk=pk, status=ReconciliationRun.STATUS_COMPLETED).first()
+        if run is None or kind not in ReconciliationRun.REPORTS:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            report = open(report_path(run, kind), 'rb')
+        except FileNotFoundError:
+            return Response({'detail': 'Report no longer available.'}, status=status.HTTP_410_GONE)
+        return FileResponse(
+            report, as_attachment=True, filename=f'reconciliation-{run.pk}-{kind}.csv', content_type='text/csv'
+        )
+
+
+class WebhookEndpointListView(generics.ListCreateAPIView):
+    """
+    List or register the current user's webhook endpoints.
+    """
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return WebhookEndpoint.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+class WebhookEndpointDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    Show, change or remove one of the current user's webhook endpoints.
+    """
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return WebhookEndpoint.objects.filter(owner=self.request.user)
+
+
+class WebhookDeliveryListView(generics.ListAPIView):
+    """
+    List deliveries to one of the current user's endpoints; ``?status=dead`` shows the dead-letter queue.
+    """
+    serializer_class = WebhookDeliverySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = WebhookDelivery.objects.filter(
+            endpoint__pk=self.kwargs['pk'], endpoint__owner=self.request.user
+        ).select_related('event')
+        if self.request.query_params.get('status'):
+            queryset = queryset.filter(status=self.request.query_params['status'])
+        return queryset[:100]
+
+
+class WebhookRedeliverView(APIView):
+    """
+    Requeue dead deliveries to one of the current user's endpoints.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        """Requeue all dead deliveries, or those listed in ``deliveries``."""
+        endpoint = WebhookEndpoint.objects.filter(pk=pk, owner=request.user).first()
+        if endpoint is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        deliveries = endpoint.deliveries.filter(status=WebhookDelivery.STATUS_DEAD)
+        ids = request.data.get('deliveries')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(item, int) for item in ids):
+                return Response(
+                    {'deliveries': ['Expected a list of delivery IDs.']}, status=status.HTTP_400_BAD_REQUEST
+                )
+            deliveries = deliveries.filter(pk__in=ids)
+        return Response({'requeued': redeliver(deliveries)})
@@ -0,0 +1,259 @@
+"""
+MazePay outbound webhooks.
+
+Events follow the transactional outbox pattern. :func:`emit_event` writes an
+``OutboxEvent`` row inside the caller's transaction, so an event exists if
+and only if the ledger change it describes was committed. The ledger emits
+``entry.posted`` for every entry, and payout batches emit
+``payout_batch.completed`` and ``payout_batch.failed``.
+
+:func:`dispatch_once` runs one pass of the dispatcher:
+
+1. fan out new events into one ``WebhookDelivery`` per subscribed endpoint.
+   Merchants' endpoints only get events for their own accounts; internal
+   endpoints, with no owner, get everything.
+2. claim due deliveries with a lease, so parallel dispatchers do not send
+   the same delivery twice.
+3. deliver them concurrently over pooled keep-alive connections (see
+   :mod:`apps.mazepay.dispatcher`), signed with the endpoint's secret.
+4. record the results. Failures are retried with exponential backoff and
+   jitter. After ``WEBHOOK_MAX_ATTEMPTS`` a delivery is ``dead``: the
+   dead-letter queue, which can be requeued with :func:`redeliver`.
+
+Delivery is at least once; receivers should deduplicate on the
+``RippleFox-Delivery`` header and check ``RippleFox-Signature`` with
+:func:`verify_signature`.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.core.metrics import timed
+from .models import OutboxEvent, WebhookDelivery, WebhookEndpoint
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'RippleFox-Signature'
+EVENT_HEADER = 'RippleFox-Event'
+DELIVERY_HEADER = 'RippleFox-Delivery'
+# Seconds a signature stays acceptable to verify_signature
+SIGNATURE_TOLERANCE = 300
+
+
+def emit_event(event_type, payload, owners=()):
+    """Record an event in the outbox, inside the caller's transaction.
+
+    Args:
+        event_type: Dotted name such as ``entry.posted``
+        payload: JSON-serializable data
+        owners: IDs of the users whose accounts the event concerns; their
+            endpoints receive it
+    """
+    return OutboxEvent.objects.create(
+        event_type=event_type,
+        payload=json.loads(json.dumps(payload, cls=DjangoJSONEncoder)),
+        owners=sorted({str(owner) for owner in owners if owner is not None}),
+    )
+
+
+def sign_payload(secret, body, timestamp=None):
+    """Return the signature header value for ``body`` (bytes): ``t=<unix time>,v1=<hex HMAC-SHA256>``."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def verify_signature(secret, header, body, tolerance=SIGNATURE_TOLERANCE):
+    """Check a ``RippleFox-Signature`` header against the raw request body.
+
+    Returns:
+        bool: True if the signature matches and is at most ``tolerance`` seconds old
+    """
+    try:
+        parts = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(parts['t'])
+    except (AttributeError, KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = sign_payload(secret, body, timestamp).split('v1=', 1)[1]
+    return hmac.compare_digest(expected, parts.get('v1', ''))
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retrying after ``attempts`` failures: doubling, capped, with jitter."""
+    base = getattr(settings, 'WEBHOOK_BACKOFF_BASE', 30)
+    cap = getattr(settings, 'WEBHOOK_BACKOFF_MAX', 6 * 3600)
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** (attempts - 1))
+
+
+def _locked(queryset):
+    """Lock the rows for this transaction, skipping rows another dispatcher holds."""
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    return queryset
+
+
+def fan_out(limit=None):
+    """Create deliveries for events not yet fanned out; returns how many events were handled."""
+    limit = limit or getattr(settings, 'WEBHOOK_BATCH_SIZE', 500)
+    with transaction.atomic():
+        events = list(_locked(OutboxEvent.objects.filter(dispatched_at__isnull=True).order_by('pk'))[:limit])
+        if not events:
+            return 0
+        endpoints = list(WebhookEndpoint.objects.filter(is_active=True))
+        deliveries = []
+        for event in events:
+            owners = set(event.owners)
+            for endpoint in endpoints:
+                if endpoint.wants(event.event_type) and (
+                    endpoint.owner_id is None or str(endpoint.owner_id) in owners
+                ):
+                    deliveries.append(WebhookDelivery(event=event, endpoint=endpoint))
+        WebhookDelivery.objects.bulk_create(deliveries, batch_size=1000, ignore_conflicts=True)
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_at=timezone.now())
+    return len(events)
+
+
+def _body(event, endpoint):
+    """Serialize an event for one endpoint.
+
+    Merchants only see their own accounts' legs of an entry: postings owned
+    by anyone else are dropped, so a payroll entry does not reveal every
+    payee's pay and balance.
+    """
+    data = event.payload
+    if 'postings' in data:
+        owner = None if endpoint.owner_id is None else str(endpoint.owner_id)
+        data = dict(data, postings=[
+            {key: value for key, value in posting.items() if key != 'owner'}
+            for posting in data['postings']
+            if owner is None or str(posting.get('owner')) == owner
+        ])
+    return json.dumps({
+        'id': event.pk,
+        'type': event.event_type,
+        'created_at': event.created_at.isoformat(),
+        'data': data,
+    }, separators=(',', ':')).encode()
+
+
+def claim_due(limit=None):
+    """Lease due deliveries to this dispatcher.
+
+    The lease pushes ``next_attempt_at`` forward by ``WEBHOOK_LEASE_SECONDS``,
+    so if this process dies, the deliveries become due again.
+
+    Returns:
+        list: ``WebhookDelivery`` objects with ``event`` and ``endpoint`` loaded
+    """
+    limit = limit or getattr(settings, 'WEBHOOK_BATCH_SIZE', 500)
+    now = timezone.now()
+    lease = now + timedelta(seconds=getattr(settings, 'WEBHOOK_LEASE_SECONDS', 120))
+    with transaction.atomic():
+        due = _locked(
+            WebhookDelivery.objects.filter(status=WebhookDelivery.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+        )
+        ids = list(due.values_list('pk', flat=True)[:limit])
+        # Conditional on still being due, in case another dispatcher got there first
+        WebhookDelivery.objects.filter(pk__in=ids, next_attempt_at__lte=now).update(next_attempt_at=lease)
+    return list(
+        WebhookDelivery.objects.filter(pk__in=ids, next_attempt_at=lease).select_related('event', 'endpoint')
+    )
+
+
+def record_results(results):
+    """Store delivery outcomes: delivered, scheduled for a retry, or dead-lettered.
+
+    Args:
+        results: Iterable of ``(delivery, status code or None, error text)``;
+            no status code and no error means the request was never sent
+
+    Returns:
+        tuple: ``(delivered, failed)`` counts
+    """
+    now = timezone.now()
+    max_attempts = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+    delivered = defaultdict(list)
+    failed = []
+    skipped = []
+    for delivery, status_code, error in results:
+        if status_code is not None and 200 <= status_code < 300:
+            delivered[status_code].append(delivery.pk)
+            continue
+        if status_code is None and error is None:
+            skipped.append(delivery.pk)
+            continue
+        delivery.attempts += 1
+        delivery.last_status_code = status_code
+        delivery.last_error = (error or '')[:255]
+        if delivery.attempts >= max_attempts:
+            delivery.status = WebhookDelivery.STATUS_DEAD
+            logger.warning(f"Webhook delivery {delivery.pk} to {delivery.endpoint.url} dead-lettered: {error}")
+        else:
+            delivery.next_attempt_at = now + timedelta(seconds=backoff_delay(delivery.attempts))
+        failed.append(delivery)
+
+    # Successes share their new values, so one UPDATE per status code covers them
+    for status_code, ids in delivered.items():
+        WebhookDelivery.objects.filter(pk__in=ids).update(
+            status=WebhookDelivery.STATUS_DELIVERED, delivered_at=now, attempts=F('attempts') + 1,
+            last_status_code=status_code, last_error='',
+        )
+    WebhookDelivery.objects.bulk_update(
+        failed, ['status', 'attempts', 'next_attempt_at', 'last_status_code', 'last_error'], batch_size=500
+    )
+    # Not attempted before the lease ran short: due again straight away
+    WebhookDelivery.objects.filter(pk__in=skipped).update(next_attempt_at=now)
+    return sum(len(ids) for ids in delivered.values()), len(failed)
+
+
+def redeliver(deliveries):
+    """Requeue deliveries (typically dead ones) for an immediate attempt with a fresh retry budget."""
+    return deliveries.update(
+        status=WebhookDelivery.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), last_error=''
+    )
+
+
+def dispatch_once(limit=None):
+    """Fan out new events and deliver one batch of due deliveries.
+
+    Returns:
+        dict: Counts of ``events`` fanned out, deliveries ``delivered`` and ``failed``
+    """
+    from .dispatcher import deliver_all
+
+    started = time.monotonic()
+    events = fan_out(limit)
+    deliveries = claim_due(limit)
+    if not deliveries:
+        return {'events': events, 'delivered': 0, 'failed': 0}
+    requests = []
+    for delivery in deliveries:
+        body = _body(delivery.event, delivery.endpoint)
+        requests.append((delivery, delivery.endpoint.url, body, {
+            'Content-Type': 'application/json',
+            EVENT_HEADER: delivery.event.event_type,
+            DELIVERY_HEADER: str(delivery.pk),
+            SIGNATURE_HEADER: sign_payload(delivery.endpoint.secret, body),
+        }))
+    # Stop starting requests while there is still time to finish them inside the lease
+    start_by = started + getattr(settings, 'WEBHOOK_LEASE_SECONDS', 120) - getattr(settings, 'WEBHOOK_TIMEOUT', 10) * 2
+    with timed('webhook_dispatch'):
+        results = asyncio.run(deliver_all(requests, start_by=start_by))
+    delivered, failed = record_results(results)
+    return {'events': events, 'delivered': delivered, 'failed': failed}
+
@@ -2,7 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from .availability import email_registered
 from .models import User, UserProfile
+from .tokens import MAX_TOKEN_LENGTH, MFA_PENDING, make_token
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
@@ -95,18 +97,32 @@ class ResendVerificationSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, value):
-        if not User.objects.filter(email=value).exists():
+        if not email_registered(value):
             raise serializers.ValidationError("User with this email does not exist.")
         return value
 
 
 class VerifyEmailSerializer(serializers.Serializer):
-    token = serializers.CharField()
+    token = serializers.CharField(max_length=MAX_TOKEN_LENGTH)
+
+
+class MagicLinkRequestSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+
+
+class MagicLinkLoginSerializer(serializers.Serializer):
+    token = serializers.CharField(max_length=MAX_TOKEN_LENGTH)
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
+        if self.user.mfa_enabled:
+            return {
+                'mfa_required': True,
+                'mfa_token': make_token(self.user, MFA_PENDING),
+                'message': 'MFA verification required',
+            }
         refresh = self.get_token(self.user)
         data['refresh'] = str(refresh)
         data['access'] = str(refresh.access_token)
@@ -119,13 +135,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 
 class CheckAvailabilitySerializer(serializers.Serializer):
-    email = serializers.EmailField(required=False)
-    username = serializers.CharField(required=False)
-
-    def validate(self, data):
-        if not data.get('email') and not data.get('username'):
-            raise serializers.ValidationError("At least one of email or username must be provided")
-        return data
+    email = serializers.EmailField()
 
 
 class UserLoginSerializer(serializers.Serializer):
@@ -6,16 +6,22 @@ from django.conf import settings
 from django.utils import timezone
 from rest_framework import status, permissions
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import authenticate
 
+from apps.core.idempotency import idempotent
+from apps.core.metrics import timed
+from .availability import is_email_available
 from .models import User, UserProfile, UserActivity
 from .auth_serializers import (
     UserRegistrationSerializer,
     ResendVerificationSerializer,
     VerifyEmailSerializer,
+    MagicLinkRequestSerializer,
+    MagicLinkLoginSerializer,
     CustomTokenObtainPairSerializer,
     CheckAvailabilitySerializer,
     UserLoginSerializer
@@ -24,17 +30,33 @@ from .serializers import UserProfileSerializer, UserSerializer
 from .utils import (
     get_client_ip, get_user_agent,
     generate_verification_token, send_verification_email,
-    send_password_reset_email, verify_password_reset_token
+    generate_magic_link_token, send_magic_link_email,
+    confirm_email_verification, confirm_magic_link,
 )
+from .tokens import MFA_PENDING, InvalidToken, make_token
 
 logger = logging.getLogger(__name__)
 
+
+def mfa_challenge(user):
+    """Response asking for the second factor once the first has passed.
+
+    Only the signed ``mfa_token`` returned here is accepted by the MFA login
+    step, so no JWTs are issued until both factors check out.
+    """
+    return Response({
+        'mfa_required': True,
+        'mfa_token': make_token(user, MFA_PENDING),
+        'message': 'MFA verification required',
+    }, status=status.HTTP_200_OK)
+
 class UserRegistrationView(APIView):
     """
     View for user registration with email verification.
     """
     permission_classes = [permissions.AllowAny]
     
+    @idempotent
     def post(self, request):
         """Handle user registration with email verification."""
         logger.info(f"Registration attempt with data: {request.data}")
@@ -72,6 +94,7 @@ class UserLoginView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
+    @timed('login')
     def post(self, request):
         """Handle user login."""
         logger.info(f"Login attempt with data: {request.data}")
@@ -164,8 +187,14 @@ class UserLoginView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
+            if user.mfa_enabled:
+                return mfa_challenge(user)
+            
             # Generate tokens
-            refresh = RefreshToken.for_user(user)
+            with timed('jwt_issue'):
+                refresh = RefreshToken.for_user(user)
+                access_token = str(refresh.access_token)
+                refresh_token = str(refresh)
             
             # Update last login
             user.last_login = timezone.now()
@@ -186,8 +215,8 @@ class UserLoginView(APIView):
             }
             
             return Response({
-                'access': str(refresh.access_token),
-                'refresh': str(refresh),
+                'access': access_token,
+                'refresh': refresh_token,
                 'user': user_data
             }, status=status.HTTP_200_OK)
             
@@ -205,6 +234,7 @@ class ResendVerificationView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
+    @idempotent
     def post(self, request):
         """Handle resend verification email request."""
         serializer = ResendVerificationSerializer(data=request.data)
@@ -233,52 +263,97 @@ class VerifyEmailView(APIView):
         """Handle email verification."""
         serializer = VerifyEmailSerializer(data=request.data)
         if serializer.is_valid():
-            token = serializer.validated_data['token']
             try:
-                # Try to get the user by the token
-                from django.contrib.auth import get_user_model
-                User = get_user_model()
-                user = User.objects.get(verification_token=token)
-                if not user.is_email_verified:
-                    user.is_email_verified = True
-                    user.save()
-                    return Response(
-                        {"detail": "Email verified successfully."}, 
-                        status=status.HTTP_200_OK
-                    )
-                return Response(
-                    {"detail": "Email already verified."},
-                    status=status.HTTP_200_OK
-                )
-            except User.DoesNotExist:
+                confirm_email_verification(serializer.validated_data['token'])
+            except InvalidToken as e:
+                logger.info(f"Rejected verification token: {str(e)}")
                 return Response(
                     {"detail": "Invalid or expired verification token."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            return Response(
+                {"detail": "Email verified successfully."}, 
+                status=status.HTTP_200_OK
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MagicLinkRequestView(APIView):
+    """
+    View for requesting a passwordless sign-in link.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    @idempotent
+    def post(self, request):
+        """Email a single-use sign-in link if the account exists."""
+        serializer = MagicLinkRequestSerializer(data=request.data)
+        if serializer.is_valid():
+            email = serializer.validated_data['email']
+            user = User.objects.filter(email=email, is_active=True).first()
+            if user is not None:
+                send_magic_link_email(user, generate_magic_link_token(user), request)
+            else:
+                # Same response either way, so the endpoint cannot be used to probe for accounts
+                logger.warning(f"Magic link requested for unknown email: {email}")
+            return Response(
+                {"detail": "If this email exists in our system, you will receive a sign-in link."},
+                status=status.HTTP_200_OK
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MagicLinkLoginView(APIView):
+    """
+    View for signing in with a magic link token.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def post(self, request):
+        """Exchange a magic link token for JWTs, or hand over to MFA."""
+        serializer = MagicLinkLoginSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user = confirm_magic_link(serializer.validated_data['token'])
+        except InvalidToken as e:
+            logger.info(f"Rejected magic link token: {str(e)}")
+            return Response(
+                {"detail": "Invalid or expired sign-in link."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # The link replaces the password, not the second factor
+        if user.mfa_enabled:
+            return mfa_challenge(user)
+        
+        with timed('jwt_issue'):
+            refresh = RefreshToken.for_user(user)
+        
+        logger.info(f"User logged in with magic link: {user.email}")
+        return Response({
+            'access': str(refresh.access_token),
+            'refresh': str(refresh),
+            'user': UserSerializer(user).data,
+            'mfa_required': False,
+        }, status=status.HTTP_200_OK)
+
+
 class CheckAvailabilityView(APIView):
     """
-    View for checking email/username availability.
+    View for checking email availability.
     """
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'availability'
     
     def post(self, request):
-        """Check if email or username is available."""
+        """Check if an email is available."""
         serializer = CheckAvailabilitySerializer(data=request.data)
         if serializer.is_valid():
-            email = serializer.validated_data.get('email')
-            username = serializer.validated_data.get('username')
-            
-            response = {}
-            if email is not None:
-                response['email_available'] = not User.objects.filter(email=email).exists()
-            if username is not None:
-                response['username_available'] = not User.objects.filter(username=username).exists()
-                
-            return Response(response, status=status.HTTP_200_OK)
+            with timed('availability_check'):
+                available = is_email_available(serializer.validated_data['email'])
+            return Response({'email_available': available}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -290,7 +365,7 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     
     def post(self, request, *args, **kwargs):
         response = super().post(request, *args, **kwargs)
-        if response.status_code == 200:
+        if response.status_code == 200 and not response.data.get('mfa_required'):
             # Get the user from the validated data
             user = User.objects.get(email=request.data.get('email'))
             
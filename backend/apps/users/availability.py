@@ -0,0 +1,271 @@
+"""
+Email availability checks backed by a Bloom filter.
+
+The signup form checks availability as the user types, so most lookups are
+for addresses nobody has registered. A Bloom filter of normalized registered
+emails answers "probably not registered" without a query; only a probable
+hit (a registered email, or a false positive at roughly
+``AVAILABILITY_BLOOM_ERROR_RATE``) is confirmed against the database.
+
+The filter can also miss: a process only sees the signals it sends itself,
+and ``bulk_create`` or ``update`` send none. So a miss is only trusted by
+:func:`is_email_available`, where a wrong "available" is caught by the
+unique constraint at signup. :func:`email_registered`, for flows that act
+on the answer, always asks the database.
+
+When the default cache is Redis the bits live there, so every worker shares
+one filter; it expires after twice ``AVAILABILITY_BLOOM_REFRESH`` seconds,
+and the ``refresh_email_availability_task`` beat task rebuilds it every
+``AVAILABILITY_BLOOM_REFRESH`` seconds before that happens. Otherwise each
+process keeps its own and rebuilds it on the same schedule.
+
+Signals add emails as users are saved. A Bloom filter cannot forget, so a
+deleted user's bits stay set and only cost a confirming query; the filter is
+rebuilt once deletions reach a twentieth of its capacity.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.core.cache_utils import redis_client
+from apps.core.metrics import record_cache_lookup, timed
+
+logger = logging.getLogger(__name__)
+
+BLOOM_KEY = 'availability:bloom'
+STALE_KEY = 'availability:bloom:stale'
+BUILD_LOCK_KEY = 'availability:bloom:build-lock'
+BUILD_LOCK_SECONDS = 300
+STALE_REBUILD_RATIO = 0.05
+# Accounts created while the filter was being built are added again afterwards
+BUILD_OVERLAP = timedelta(minutes=5)
+
+
+def normalize_email(email):
+    """Return the form emails are compared in: trimmed and lowercased."""
+    return str(email).strip().lower()
+
+
+class BloomFilter:
+    """A Bloom filter over strings, held in a local bytearray.
+
+    Args:
+        capacity: Number of items the filter is sized for
+        error_rate: False-positive rate at ``capacity`` items
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        """Return the bit positions for an item (Kirsch-Mitzenmacher double hashing)."""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+
+class RedisBloomFilter(BloomFilter):
+    """The same filter with its bits in a Redis string, shared by all workers."""
+
+    def __init__(self, client, key, capacity, error_rate):
+        super().__init__(capacity, error_rate)
+        self.bits = None
+        self.client = client
+        self.key = key
+
+    def add(self, item):
+        self.add_many([item])
+
+    def add_many(self, items):
+        pipe = self.client.pipeline(transaction=False)
+        for count, item in enumerate(items, 1):
+            for position in self.positions(item):
+                pipe.setbit(self.key, position, 1)
+            if count % 1000 == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def __contains__(self, item):
+        pipe = self.client.pipeline(transaction=False)
+        for position in self.positions(item):
+            pipe.getbit(self.key, position)
+        return all(pipe.execute())
+
+
+_local_state = {'filter': None, 'built_at': 0.0, 'stale': 0}
+_local_lock = threading.Lock()
+
+
+def _capacity():
+    return getattr(settings, 'AVAILABILITY_BLOOM_CAPACITY', 100000)
+
+
+def _error_rate():
+    return getattr(settings, 'AVAILABILITY_BLOOM_ERROR_RATE', 0.001)
+
+
+def _refresh():
+    return getattr(settings, 'AVAILABILITY_BLOOM_REFRESH', 300)
+
+
+def _registered_emails(since=None):
+    queryset = get_user_model()._default_manager.all()
+    if since is not None:
+        queryset = queryset.filter(date_joined__gte=since)
+    for email in queryset.values_list('email', flat=True).iterator(chunk_size=2000):
+        yield normalize_email(email)
+
+
+def _build_local():
+    started = timezone.now()
+    bloom = BloomFilter(_capacity(), _error_rate())
+    with timed('availability_bloom_build'):
+        bloom.add_many(_registered_emails())
+        bloom.add_many(_registered_emails(since=started - BUILD_OVERLAP))
+    _local_state.update(filter=bloom, built_at=time.monotonic(), stale=0)
+    return bloom
+
+
+def _build_redis(client):
+    """Build into a scratch key and swap it in, so readers never see a half-built filter.
+
+    Returns:
+        bool: False if another worker holds the build lock
+    """
+    lock_key = cache.make_key(BUILD_LOCK_KEY)
+    if not client.set(lock_key, 1, nx=True, ex=BUILD_LOCK_SECONDS):
+        return False
+    try:
+        started = timezone.now()
+        scratch = f'{cache.make_key(BLOOM_KEY)}:{uuid.uuid4().hex}'
+        bloom = RedisBloomFilter(client, scratch, _capacity(), _error_rate())
+        with timed('availability_bloom_build'):
+            bloom.add_many(_registered_emails())
+            bloom.add_many(_registered_emails(since=started - BUILD_OVERLAP))
+        # Pre-size the string so an empty table still produces a key
+        client.setbit(scratch, bloom.size - 1, 0)
+        # Expires if the refresh task stops running, so a stale filter is never kept for long
+        client.rename(scratch, cache.make_key(BLOOM_KEY))
+        client.expire(cache.make_key(BLOOM_KEY), 2 * _refresh())
+        client.delete(cache.make_key(STALE_KEY))
+    finally:
+        client.delete(lock_key)
+    return True
+
+
+def get_filter():
+    """Return the current filter, building it if needed.
+
+    Returns:
+        BloomFilter or None: None while another worker is building the shared filter
+    """
+    client = redis_client()
+    if client is not None:
+        key = cache.make_key(BLOOM_KEY)
+        if not client.exists(key) and not _build_redis(client):
+            return None
+        return RedisBloomFilter(client, key, _capacity(), _error_rate())
+
+    bloom = _local_state['filter']
+    if bloom is None or time.monotonic() - _local_state['built_at'] > _refresh():
+        with _local_lock:
+            if _local_state['filter'] is bloom:
+                bloom = _build_local()
+            else:
+                bloom = _local_state['filter']
+    return bloom
+
+
+def refresh_filter():
+    """Rebuild the shared filter in place, for the periodic task.
+
+    Readers keep using the old filter until the new one is swapped in.
+    Without Redis each process refreshes its own filter as it is used.
+
+    Returns:
+        bool: False if there was nothing to do or another worker is building
+    """
+    client = redis_client()
+    if client is None:
+        return False
+    return _build_redis(client)
+
+
+def rebuild_filter():
+    """Drop the filter so the next check rebuilds it from the database."""
+    client = redis_client()
+    if client is not None:
+        client.delete(cache.make_key(BLOOM_KEY), cache.make_key(STALE_KEY))
+    else:
+        _local_state.update(filter=None, built_at=0.0, stale=0)
+
+
+def remember_email(email):
+    """Add an email to a filter that has already been built."""
+    client = redis_client()
+    if client is not None:
+        key = cache.make_key(BLOOM_KEY)
+        if client.exists(key):
+            RedisBloomFilter(client, key, _capacity(), _error_rate()).add(normalize_email(email))
+    elif _local_state['filter'] is not None:
+        _local_state['filter'].add(normalize_email(email))
+
+
+def forget_email(email):
+    """Count a removed email; the filter is rebuilt when too many have piled up."""
+    client = redis_client()
+    if client is not None:
+        stale = client.incr(cache.make_key(STALE_KEY))
+    else:
+        _local_state['stale'] += 1
+        stale = _local_state['stale']
+    if stale >= _capacity() * STALE_REBUILD_RATIO:
+        logger.info("Rebuilding email availability filter after %d deletions", stale)
+        rebuild_filter()
+
+
+def email_registered(email):
+    """Return True if an account uses this email (case-insensitively).
+
+    Always answered by the database, for flows that act on the result.
+    """
+    return get_user_model()._default_manager.filter(email__iexact=normalize_email(email)).exists()
+
+
+def is_email_available(email):
+    """Return True if no account appears to use this email.
+
+    A filter miss answers without touching the database. It may rarely be
+    wrong for an account the filter has not seen yet, which signup's unique
+    constraint catches, so only use this for hints.
+    """
+    normalized = normalize_email(email)
+    bloom = get_filter()
+    if bloom is not None and normalized not in bloom:
+        record_cache_lookup('email_availability', hit=True)
+        return True
+    record_cache_lookup('email_availability', hit=False)
+    return not email_registered(normalized)
@@ -0,0 +1,304 @@
+"""
+TOTP verification engine for multi-factor authentication.
+
+Verification keeps its state in the cache, not the database:
+
+* the last accepted time-step per user, so a code cannot be replayed, even by
+  two requests racing within the same window (the step is claimed with an
+  atomic ``cache.add``);
+* a per-user failed-attempt counter, incremented atomically, that locks MFA
+  verification for ``MFA_LOCKOUT_SECONDS`` after ``MFA_MAX_ATTEMPTS`` misses.
+
+A successful verification therefore costs no database write. Point
+``CACHE_URL`` at Redis in production so every worker shares this state.
+
+Backup codes are stored as keyed hashes in ``MFABackupCode``. Using one is a
+single ``DELETE`` on the unique hash, so two devices racing with the same
+code cannot both succeed.
+
+Provisioning QR codes are memoized per (secret, email). SVG is the default
+because it renders much faster than PNG and is smaller; PNGs are rendered
+by a Celery task and served from the cache. A pending marker makes the
+clients polling for one PNG queue a single render between them.
+"""
+import hashlib
+import logging
+import secrets
+import time
+from functools import lru_cache
+from io import BytesIO
+
+import pyotp
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from apps.core.metrics import timed
+from .models import MFABackupCode
+
+logger = logging.getLogger(__name__)
+
+TOTP_INTERVAL = 30
+
+BACKUP_CODE_COUNT = 10
+BACKUP_CODE_LENGTH = 10
+# No 0/O, 1/I/L: codes are read off paper and typed by hand
+BACKUP_CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+BACKUP_CODE_SALT = 'ripplefox.mfa.backup-code'
+
+TOTP_ISSUER = 'Volt Conglomerate'
+QR_FORMATS = {'svg': 'image/svg+xml', 'png': 'image/png'}
+QR_PNG_CACHE_TIMEOUT = 3600
+# A render not done by then is queued again
+QR_PNG_PENDING_TIMEOUT = 30
+
+
+class MFAAttemptsExceeded(Exception):
+    """Raised when a user has used up their MFA attempts."""
+
+    def __init__(self, retry_after):
+        super().__init__('Too many MFA attempts')
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=4096)
+def get_totp(secret):
+    """Return a (cached) TOTP generator for a base32 secret."""
+    return pyotp.TOTP(secret, interval=TOTP_INTERVAL)
+
+
+def _attempts_key(user):
+    return f'mfa:attempts:{user.pk}'
+
+
+def _last_step_key(user):
+    return f'mfa:last-step:{user.pk}'
+
+
+def _step_key(user, step):
+    return f'mfa:step:{user.pk}:{step}'
+
+
+def _max_attempts():
+    return getattr(settings, 'MFA_MAX_ATTEMPTS', 5)
+
+
+def _lockout_seconds():
+    return getattr(settings, 'MFA_LOCKOUT_SECONDS', 300)
+
+
+def check_attempts(user):
+    """Raise MFAAttemptsExceeded if the user is locked out of MFA verification."""
+    if (cache.get(_attempts_key(user)) or 0) >= _max_attempts():
+        raise MFAAttemptsExceeded(retry_after=_lockout_seconds())
+
+
+def record_failure(user):
+    """Count a failed attempt; the counter expires ``MFA_LOCKOUT_SECONDS`` after the first miss."""
+    key = _attempts_key(user)
+    cache.add(key, 0, timeout=_lockout_seconds())
+    try:
+        attempts = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(key, 1, timeout=_lockout_seconds())
+        attempts = 1
+    if attempts >= _max_attempts():
+        logger.warning("MFA locked for user %s after %d failed attempts", user.pk, attempts)
+    return attempts
+
+
+def reset_attempts(user):
+    """Clear the failed-attempt counter after a successful verification."""
+    cache.delete(_attempts_key(user))
+
+
+def match_step(secret, code, for_time=None, valid_window=None):
+    """Return the time-step a code is valid for, or None.
+
+    Args:
+        secret: The user's base32 TOTP secret
+        code: The submitted code
+        for_time: Unix time to verify at (default: now)
+        valid_window: Steps of clock drift accepted either side (default: ``MFA_VALID_WINDOW``)
+
+    Returns:
+        int or None: The matching time-step counter
+    """
+    if not code or not code.isdigit():
+        return None
+    if valid_window is None:
+        valid_window = getattr(settings, 'MFA_VALID_WINDOW', 1)
+    totp = get_totp(secret)
+    now = int(for_time if for_time is not None else time.time())
+    current = now // totp.interval
+    # Check the current step first; drift either side is the rare case
+    for offset in sorted(range(-valid_window, valid_window + 1), key=abs):
+        step = current + offset
+        if constant_time_compare(code, totp.generate_otp(step)):
+            return step
+    return None
+
+
+@timed('mfa_verify')
+def verify_totp(user, code, for_time=None):
+    """Verify a TOTP code for a user with replay and brute-force protection.
+
+    Args:
+        user: User whose ``mfa_secret`` the code was generated from
+        code: The submitted code
+        for_time: Unix time to verify at (default: now)
+
+    Returns:
+        bool: True if the code is valid and has not been used before
+
+    Raises:
+        MFAAttemptsExceeded: If the user is locked out
+    """
+    check_attempts(user)
+    if not user.mfa_secret:
+        record_failure(user)
+        return False
+
+    step = match_step(user.mfa_secret, code, for_time=for_time)
+    if step is None:
+        record_failure(user)
+        return False
+
+    # Codes for a step at or before the last accepted one are replays, and so is
+    # losing the race to claim this step.
+    ttl = TOTP_INTERVAL * (2 * getattr(settings, 'MFA_VALID_WINDOW', 1) + 2)
+    last_step = cache.get(_last_step_key(user))
+    if (last_step is not None and step <= last_step) or not cache.add(_step_key(user, step), 1, timeout=ttl):
+        logger.warning("Rejected replayed MFA code for user %s (step %s)", user.pk, step)
+        record_failure(user)
+        return False
+
+    cache.set(_last_step_key(user), step, timeout=ttl)
+    reset_attempts(user)
+    return True
+
+
+def normalize_backup_code(code):
+    """Strip whitespace and dashes and uppercase a typed backup code."""
+    return ''.join(str(code).split()).replace('-', '').upper()
+
+
+def hash_backup_code(user, code):
+    """Return the keyed hash stored for a user's backup code.
+
+    The key is ``MFA_BACKUP_CODE_KEY`` (default ``SECRET_KEY``) and the user id
+    is mixed in, so equal codes for different users never collide.
+    """
+    key = getattr(settings, 'MFA_BACKUP_CODE_KEY', None) or settings.SECRET_KEY
+    return salted_hmac(
+        BACKUP_CODE_SALT, f'{user.pk}:{normalize_backup_code(code)}', secret=key, algorithm='sha256'
+    ).hexdigest()
+
+
+def generate_backup_codes(user, count=BACKUP_CODE_COUNT):
+    """Replace a user's backup codes with a fresh set.
+
+    Returns:
+        list: The plaintext codes, formatted ``XXXXX-XXXXX``; they cannot be recovered later
+    """
+    half = BACKUP_CODE_LENGTH // 2
+    codes = set()
+    while len(codes) < count:
+        raw = ''.join(secrets.choice(BACKUP_CODE_ALPHABET) for _ in range(BACKUP_CODE_LENGTH))
+        codes.add(f'{raw[:half]}-{raw[half:]}')
+    codes = sorted(codes)
+    with transaction.atomic():
+        MFABackupCode.objects.filter(user=user).delete()
+        MFABackupCode.objects.bulk_create(
+            [MFABackupCode(user=user, code_hash=hash_backup_code(user, code)) for code in codes]
+        )
+    return codes
+
+
+@timed('mfa_backup_verify')
+def verify_backup_code(user, code):
+    """Consume a backup code.
+
+    Args:
+        user: User the code belongs to
+        code: The code as typed
+
+    Returns:
+        bool: True if the code existed and has now been used up
+
+    Raises:
+        MFAAttemptsExceeded: If the user is locked out
+    """
+    check_attempts(user)
+    deleted, _ = MFABackupCode.objects.filter(code_hash=hash_backup_code(user, code)).delete()
+    if not deleted:
+        record_failure(user)
+        return False
+    reset_attempts(user)
+    return True
+
+
+def remaining_backup_codes(user):
+    """Return how many unused backup codes a user has."""
+    return user.mfa_backup_codes.count()
+
+
+def provisioning_uri(secret, email):
+    """Return the otpauth:// URI an authenticator app enrolls from."""
+    return get_totp(secret).provisioning_uri(name=email, issuer_name=TOTP_ISSUER)
+
+
+def _qr_digest(secret, email, fmt):
+    return hashlib.sha256(f'{fmt}:{provisioning_uri(secret, email)}'.encode()).hexdigest()[:32]
+
+
+def qr_etag(secret, email, fmt='svg'):
+    """Return a strong ETag for a provisioning QR code.
+
+    Derived from a hash of the URI, so the secret never appears in headers.
+    """
+    return f'"{_qr_digest(secret, email, fmt)}"'
+
+
+@lru_cache(maxsize=1024)
+def render_qr(secret, email, fmt='svg'):
+    """Render the provisioning QR code, memoized per (secret, email, format).
+
+    Returns:
+        bytes: SVG markup or PNG data
+    """
+    # qrcode (and PIL for PNG) are only needed here, so import on first use
+    import qrcode
+
+    uri = provisioning_uri(secret, email)
+    buffer = BytesIO()
+    with timed(f'mfa_qr_{fmt}'):
+        if fmt == 'svg':
+            from qrcode.image.svg import SvgPathImage
+            qrcode.make(uri, image_factory=SvgPathImage).save(buffer)
+        else:
+            qrcode.make(uri).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _png_cache_key(secret, email):
+    return f"mfa:qr-png:{_qr_digest(secret, email, 'png')}"
+
+
+def claim_qr_png_render(secret, email):
+    """Return True if the caller should queue a PNG render, False if one is already pending."""
+    return cache.add(f"{_png_cache_key(secret, email)}:pending", 1, timeout=QR_PNG_PENDING_TIMEOUT)
+
+
+def cached_qr_png(secret, email):
+    """Return a PNG rendered by the background task, or None if not ready yet."""
+    return cache.get(_png_cache_key(secret, email))
+
+
+def store_qr_png(secret, email):
+    """Render a PNG and publish it for :func:`cached_qr_png`."""
+    png = render_qr(secret, email, 'png')
+    cache.set(_png_cache_key(secret, email), png, timeout=QR_PNG_CACHE_TIMEOUT)
+    return png
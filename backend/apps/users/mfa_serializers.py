@@ -2,31 +2,22 @@
 Serializers for Multi-Factor Authentication (MFA) functionality.
 """
 from rest_framework import serializers
-import pyotp
-import qrcode
 import base64
-from io import BytesIO
+
+from .mfa import render_qr
 
 
 class MFASetupSerializer(serializers.Serializer):
     """Serializer for MFA setup."""
     
-    def generate_qr_code(self, user):
-        """Generate QR code for MFA setup."""
+    def generate_qr_code(self, user, fmt='svg'):
+        """Generate the QR code for MFA setup, base64-encoded.
+        
+        Rendering is memoized per (secret, email), so repeat calls are free.
+        """
         if not user.mfa_secret:
             raise serializers.ValidationError("MFA secret not found")
-            
-        # Create TOTP URI
-        totp_uri = pyotp.totp.TOTP(user.mfa_secret).provisioning_uri(
-            name=user.email,
-            issuer_name="Volt Conglomerate"
-        )
-        
-        # Generate QR code
-        img = qrcode.make(totp_uri)
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+        return base64.b64encode(render_qr(user.mfa_secret, user.email, fmt)).decode('utf-8')
 
 
 class MFAVerifySerializer(serializers.Serializer):
@@ -41,4 +32,4 @@ class MFAVerifySerializer(serializers.Serializer):
 
 class MFABackupCodeSerializer(serializers.Serializer):
     """Serializer for MFA backup codes."""
-    code = serializers.CharField(required=True, max_length=10, min_length=8)
+    code = serializers.CharField(required=True, max_length=16, min_length=8)
@@ -1,14 +1,37 @@
 """
 Views for Multi-Factor Authentication (MFA) functionality.
 """
+import logging
+
 import pyotp
-import secrets
+from django.http import HttpResponse
+from django.urls import reverse
+from django.db import transaction
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User
+from .mfa import (
+    QR_FORMATS, MFAAttemptsExceeded, cached_qr_png, claim_qr_png_render, generate_backup_codes, qr_etag,
+    render_qr, store_qr_png, verify_backup_code, verify_totp,
+)
 from .mfa_serializers import MFASetupSerializer, MFAVerifySerializer, MFABackupCodeSerializer
+from .serializers import UserSerializer
+from .tokens import MFA_PENDING, InvalidToken, claim_token, read_token, token_user
+
+logger = logging.getLogger(__name__)
+
+
+def _locked_response(error):
+    """429 response for a user who has used up their MFA attempts."""
+    response = Response(
+        {'error': 'Too many attempts. Try again later.'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(error.retry_after)
+    return response
 
 
 class MFASetupView(APIView):
@@ -21,25 +44,68 @@ class MFASetupView(APIView):
             request.user.mfa_secret = pyotp.random_base32()
             request.user.save(update_fields=['mfa_secret'])
         
-        # Generate QR code and backup codes
+        # Generate QR code; backup codes are issued once the first code is confirmed
         serializer = MFASetupSerializer()
-        qr_code = serializer.generate_qr_code(request.user)
-        
-        # Generate backup codes if not exists
-        if not request.user.backup_codes:
-            backup_codes = [secrets.token_urlsafe(8).upper() for _ in range(10)]
-            request.user.backup_codes = backup_codes
-            request.user.save(update_fields=['backup_codes'])
-        else:
-            backup_codes = request.user.backup_codes
+        qr_code = serializer.generate_qr_code(request.user, 'svg')
         
         return Response({
             'mfa_secret': request.user.mfa_secret,
             'qr_code': qr_code,
-            'backup_codes': backup_codes if not request.user.mfa_enabled else None,
+            'qr_code_format': 'svg',
+            'qr_code_data_uri': f"data:{QR_FORMATS['svg']};base64,{qr_code}",
+            'qr_code_url': request.build_absolute_uri(reverse(f'{request.resolver_match.namespace}:mfa-qr')),
         })
 
 
+class MFAQRCodeView(APIView):
+    """
+    Serve the MFA provisioning QR code as an image.
+    
+    ``?type=svg`` (default) renders inline from a per-process memo.
+    ``?type=png`` is rendered by a Celery task; until it is ready the view
+    answers 202 and the client retries. Both honour ``If-None-Match``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        user = request.user
+        fmt = request.query_params.get('type', 'svg').lower()
+        if fmt not in QR_FORMATS:
+            return Response({'error': 'type must be svg or png'}, status=status.HTTP_400_BAD_REQUEST)
+        if not user.mfa_secret:
+            return Response({'error': 'MFA setup has not been started'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = qr_etag(user.mfa_secret, user.email, fmt)
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif fmt == 'svg':
+            response = HttpResponse(render_qr(user.mfa_secret, user.email, 'svg'), content_type=QR_FORMATS['svg'])
+        else:
+            png = cached_qr_png(user.mfa_secret, user.email) or self._queue_png(user)
+            if png is None:
+                response = Response({'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
+                response['Retry-After'] = '1'
+                return response
+            response = HttpResponse(png, content_type=QR_FORMATS['png'])
+        response['ETag'] = etag
+        # The image encodes the TOTP secret: revalidate, never store in shared caches
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    def _queue_png(self, user):
+        """Queue PNG rendering unless already queued; returns the PNG only if it had to be rendered here."""
+        from .tasks import render_mfa_qr_png_task
+        if not claim_qr_png_render(user.mfa_secret, user.email):
+            return None
+        try:
+            render_mfa_qr_png_task.delay(str(user.pk))
+        except Exception as e:
+            # No broker (e.g. local development): render in this request instead
+            logger.warning(f"Could not queue QR rendering, rendering inline: {str(e)}")
+            return store_qr_png(user.mfa_secret, user.email)
+        return None
+
+
 class MFAVerifyView(APIView):
     """View for verifying MFA setup."""
     permission_classes = [permissions.IsAuthenticated]
@@ -50,22 +116,31 @@ class MFAVerifyView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         token = serializer.validated_data['token']
-        totp = pyotp.TOTP(request.user.mfa_secret)
+        try:
+            verified = verify_totp(request.user, token)
+        except MFAAttemptsExceeded as e:
+            return _locked_response(e)
         
-        if totp.verify(token, valid_window=1):
-            # Enable MFA for the user
+        if verified:
+            # Enable MFA for the user, with backup codes shown this once: only their hashes are stored
+            backup_codes = None
             if not request.user.mfa_enabled:
-                request.user.mfa_enabled = True
-                request.user.save(update_fields=['mfa_enabled'])
+                with transaction.atomic():
+                    request.user.mfa_enabled = True
+                    request.user.save(update_fields=['mfa_enabled'])
+                    backup_codes = generate_backup_codes(request.user)
             
             # Generate tokens
             refresh = RefreshToken.for_user(request.user)
-            return Response({
+            data = {
                 'access': str(refresh.access_token),
                 'refresh': str(refresh),
                 'mfa_required': False,
                 'message': 'MFA verified successfully',
-            })
+            }
+            if backup_codes:
+                data['backup_codes'] = backup_codes
+            return Response(data)
         
         return Response(
             {'error': 'Invalid token'}, 
@@ -74,45 +149,62 @@ class MFAVerifyView(APIView):
 
 
 class MFALoginView(APIView):
-    """View for MFA verification during login."""
+    """
+    Second step of a login for users with MFA enabled.
+    
+    Takes the ``mfa_token`` that password or magic-link login returned and a
+    TOTP or backup code. Every failure gets the same answer, so the endpoint
+    tells nothing about which accounts exist or have MFA.
+    """
     permission_classes = [permissions.AllowAny]
     
     def post(self, request):
-        if 'email' not in request.data or 'token' not in request.data:
+        if 'mfa_token' not in request.data or 'token' not in request.data:
             return Response(
-                {'error': 'Email and token are required'}, 
+                {'error': 'mfa_token and token are required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         try:
-            user = User.objects.get(email=request.data['email'])
-        except User.DoesNotExist:
-            return Response(
-                {'error': 'User not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+            pending = read_token(str(request.data['mfa_token']), MFA_PENDING)
+            user = token_user(pending, User.objects.filter(is_active=True, mfa_enabled=True))
+        except InvalidToken as e:
+            logger.info(f"Rejected MFA login token: {str(e)}")
+            return self._invalid()
         
         # Check if token is valid
-        token = request.data['token']
-        totp = pyotp.TOTP(user.mfa_secret)
-        
-        if totp.verify(token, valid_window=1) or token in (user.backup_codes or []):
-            # If backup code was used, remove it
-            if token in (user.backup_codes or []):
-                user.backup_codes.remove(token)
-                user.save(update_fields=['backup_codes'])
-            
-            # Generate tokens
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'access': str(refresh.access_token),
-                'refresh': str(refresh),
-                'mfa_required': False,
-                'message': 'MFA verified successfully',
-            })
+        token = str(request.data['token'])
+        is_backup = str(request.data.get('is_backup', '')).lower() in ('true', '1') or not (
+            len(token) == 6 and token.isdigit()
+        )
+        try:
+            verified = verify_backup_code(user, token) if is_backup else verify_totp(user, token)
+        except MFAAttemptsExceeded as e:
+            return _locked_response(e)
+        if not verified:
+            return self._invalid()
+        try:
+            # One login per password or magic-link step
+            claim_token(pending)
+        except InvalidToken:
+            return self._invalid()
         
+        # Generate tokens
+        refresh = RefreshToken.for_user(user)
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        return Response({
+            'access': str(refresh.access_token),
+            'refresh': str(refresh),
+            'user': UserSerializer(user).data,
+            'mfa_required': False,
+            'message': 'MFA verified successfully',
+        })
+    
+    @staticmethod
+    def _invalid():
         return Response(
-            {'error': 'Invalid token'}, 
+            {'error': 'Invalid or expired verification code'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
 
@@ -122,10 +214,10 @@ class MFABackupCodesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
+        if not request.user.mfa_enabled:
+            return Response({'error': 'MFA is not enabled'}, status=status.HTTP_400_BAD_REQUEST)
         # Generate new backup codes
-        backup_codes = [secrets.token_urlsafe(8).upper() for _ in range(10)]
-        request.user.backup_codes = backup_codes
-        request.user.save(update_fields=['backup_codes'])
+        backup_codes = generate_backup_codes(request.user)
         
         return Response({
             'backup_codes': backup_codes,
@@ -139,11 +231,11 @@ class MFABackupCodesView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         code = serializer.validated_data['code']
-        if code in (request.user.backup_codes or []):
-            # Remove used code
-            request.user.backup_codes.remove(code)
-            request.user.save(update_fields=['backup_codes'])
-            
+        try:
+            verified = verify_backup_code(request.user, code)
+        except MFAAttemptsExceeded as e:
+            return _locked_response(e)
+        if verified:
             # Generate tokens
             refresh = RefreshToken.for_user(request.user)
             return Response({
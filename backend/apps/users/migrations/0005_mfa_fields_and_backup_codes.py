@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_usersettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='mfa_enabled',
+            field=models.BooleanField(default=False, help_text='Whether multi-factor authentication is enabled for this user.'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='mfa_secret',
+            field=models.CharField(blank=True, help_text='Secret key for generating MFA tokens.', max_length=32, null=True),
+        ),
+        migrations.CreateModel(
+            name='MFABackupCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mfa_backup_codes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'MFA backup code',
+                'verbose_name_plural': 'MFA backup codes',
+            },
+        ),
+    ]
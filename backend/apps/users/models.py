@@ -89,6 +89,18 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Security
     failed_login_attempts = models.PositiveIntegerField(default=0)
     account_locked_until = models.DateTimeField(null=True, blank=True)
+
+    # Multi-factor authentication
+    mfa_enabled = models.BooleanField(
+        default=False,
+        help_text=_('Whether multi-factor authentication is enabled for this user.'),
+    )
+    mfa_secret = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        help_text=_('Secret key for generating MFA tokens.'),
+    )
     
     # Relationships
     groups = models.ManyToManyField(
@@ -212,3 +224,23 @@ class UserActivity(models.Model):
         self.is_active = False
         self.save()
         return self
+
+
+class MFABackupCode(models.Model):
+    """
+    A single-use MFA backup code.
+
+    Only a keyed hash of the code is stored (see ``apps.users.mfa``). The
+    unique index on ``code_hash`` makes verification one indexed
+    ``DELETE``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mfa_backup_codes')
+    code_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('MFA backup code')
+        verbose_name_plural = _('MFA backup codes')
+
+    def __str__(self):
+        return f"Backup code for {self.user.email}"
@@ -6,6 +6,7 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from .models import User, UserProfile, UserActivity
+from .tokens import MAX_TOKEN_LENGTH
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -191,7 +192,10 @@ class PasswordResetSerializer(serializers.Serializer):
 class PasswordResetConfirmSerializer(serializers.Serializer):
     """
     Serializer for confirming a password reset.
+    
+    The token may come from the URL instead of the body.
     """
+    token = serializers.CharField(required=False, max_length=MAX_TOKEN_LENGTH)
     new_password = serializers.CharField(required=True, style={'input_type': 'password'})
     confirm_new_password = serializers.CharField(required=True, style={'input_type': 'password'})
     
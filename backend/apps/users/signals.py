@@ -3,10 +3,11 @@
 import logging
 
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
+from .availability import forget_email, remember_email
 from .models import UserProfile, UserActivity
 
 User = get_user_model()
@@ -105,3 +106,29 @@ def check_account_lock(sender, instance, **kwargs):
         instance.account_locked_until = None
         instance.failed_login_attempts = 0
         logger.info("Automatically unlocked account for user: %s", instance.email)
+
+@receiver(post_save, sender=User)
+def update_email_availability(sender, instance, created, update_fields=None, **kwargs):
+    """Add the user's email to the availability filter.
+    
+    Args:
+        sender: The model class.
+        instance: The actual instance being saved.
+        created (bool): Whether this is a new record.
+        update_fields: The fields passed to save(), if any.
+        **kwargs: Additional keyword arguments.
+    """
+    # Most saves (last_login, lockout counters) cannot have changed the email
+    if created or update_fields is None or 'email' in update_fields:
+        remember_email(instance.email)
+
+@receiver(post_delete, sender=User)
+def expire_email_availability(sender, instance, **kwargs):
+    """Count the deleted user's email as stale in the availability filter.
+    
+    Args:
+        sender: The model class.
+        instance: The deleted instance.
+        **kwargs: Additional keyword arguments.
+    """
+    forget_email(instance.email)
@@ -5,6 +5,8 @@ from django.utils.html import strip_tags
 from django.conf import settings
 import logging
 
+from apps.core.metrics import timed
+
 logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, max_retries=3)
@@ -24,14 +26,15 @@ def send_email_task(self, subject, message, recipient_list, html_message=None, *
             html_message = message
             message = strip_tags(html_message)
             
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=recipient_list,
-            html_message=html_message,
-            **kwargs
-        )
+        with timed('email_send'):
+            send_mail(
+                subject=subject,
+                message=message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=recipient_list,
+                html_message=html_message,
+                **kwargs
+            )
         logger.info(f"Email sent to {', '.join(recipient_list)}")
         return True
     except Exception as e:
@@ -74,3 +77,37 @@ def send_verification_email_task(user_id, verification_url):
     except Exception as e:
         logger.error(f"Error sending verification email: {str(e)}")
         raise
+
+
+@shared_task
+def render_mfa_qr_png_task(user_id):
+    """
+    Render a user's MFA provisioning QR code as PNG into the cache.
+    
+    Args:
+        user_id: User ID
+    """
+    from .mfa import store_qr_png
+    from .models import User
+    
+    try:
+        user = User.objects.only('email', 'mfa_secret').get(id=user_id)
+    except User.DoesNotExist:
+        logger.error(f"User with ID {user_id} does not exist")
+        return False
+    if not user.mfa_secret:
+        return False
+    store_qr_png(user.mfa_secret, user.email)
+    return True
+
+
+@shared_task
+def refresh_email_availability_task():
+    """
+    Rebuild the shared email availability filter from the database.
+    
+    Picks up accounts no signal announced, such as bulk-created users.
+    """
+    from .availability import refresh_filter
+    
+    return refresh_filter()
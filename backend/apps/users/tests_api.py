@@ -3,6 +3,8 @@ Tests for the users API endpoints.
 """
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models_settings import UserSettings
@@ -91,3 +93,23 @@ class UsersAPITestCase(TestCase):
         response = self.client.get('/api/settings/system_settings/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('system_name', response.data)
+
+
+class RegistrationIdempotencyTestCase(TestCase):
+    """Test cases for double-submitted registrations."""
+
+    def setUp(self):
+        """Start with an empty idempotency cache."""
+        cache.clear()
+        self.client = APIClient()
+
+    def test_double_submit_registers_once(self):
+        """A repeated Idempotency-Key replays the response: one user, one email."""
+        data = {'email': 'new@example.com', 'password': 'S3cure-passphrase', 'password2': 'S3cure-passphrase'}
+        first = self.client.post('/auth/register/', data, format='json', HTTP_IDEMPOTENCY_KEY='signup-1')
+        second = self.client.post('/auth/register/', data, format='json', HTTP_IDEMPOTENCY_KEY='signup-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(User.objects.filter(email='new@example.com').count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
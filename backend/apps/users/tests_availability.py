@@ -0,0 +1,69 @@
+"""
+Tests for Bloom-filter-backed email availability checks.
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework.throttling import ScopedRateThrottle
+
+from .availability import BloomFilter, email_registered, get_filter, is_email_available, rebuild_filter
+
+User = get_user_model()
+
+
+class EmailAvailabilityTestCase(TestCase):
+    """Test cases for the availability service and endpoint."""
+
+    def setUp(self):
+        """Start from an empty filter and throttle history."""
+        cache.clear()
+        rebuild_filter()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='Taken@Example.com', password='testpass123')
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Every added item is reported present; few others are."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        bloom.add_many(f'user{i}@example.com' for i in range(1000))
+        self.assertTrue(all(f'user{i}@example.com' in bloom for i in range(1000)))
+        false_positives = sum(f'other{i}@example.com' in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_miss_needs_no_query(self):
+        """Unregistered emails are answered from the filter once it is built."""
+        get_filter()
+        with self.assertNumQueries(0):
+            self.assertTrue(is_email_available('free@example.com'))
+        with self.assertNumQueries(1):
+            self.assertFalse(is_email_available('  taken@example.COM '))
+
+    def test_signals_keep_filter_current(self):
+        """Users created after the build are found; deleted ones are confirmed free."""
+        get_filter()
+        User.objects.create_user(email='late@example.com', password='testpass123')
+        self.assertFalse(is_email_available('late@example.com'))
+        self.user.delete()
+        self.assertTrue(is_email_available('taken@example.com'))
+
+    def test_unseen_accounts_are_confirmed_by_the_database(self):
+        """An account the filter missed is still found by email_registered and resend verification."""
+        get_filter()
+        User.objects.bulk_create([User(email='bulk@example.com', password='!')])
+        self.assertTrue(is_email_available('bulk@example.com'))
+        self.assertTrue(email_registered('bulk@example.com'))
+        response = self.client.post('/verify-email/resend/', {'email': 'bulk@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_endpoint_and_rate_limit(self):
+        """The endpoint answers by email and has its own throttle scope."""
+        with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'availability': '2/minute'}):
+            response = self.client.post('/check-availability/', {'email': 'taken@example.com'})
+            self.assertEqual(response.data, {'email_available': False})
+            response = self.client.post('/check-availability/', {'email': 'free@example.com'})
+            self.assertEqual(response.data, {'email_available': True})
+            response = self.client.post('/check-availability/', {'email': 'free@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
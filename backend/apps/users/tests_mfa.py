@@ -0,0 +1,216 @@
+"""
+Tests for MFA verification.
+"""
+from unittest import mock
+
+import pyotp
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .mfa import (
+    MFAAttemptsExceeded, generate_backup_codes, get_totp, render_qr, verify_backup_code, verify_totp,
+)
+from .models import MFABackupCode
+from .tokens import MAGIC_LINK, MFA_PENDING, make_token
+
+User = get_user_model()
+
+
+@override_settings(MFA_MAX_ATTEMPTS=3, MFA_VALID_WINDOW=1)
+class MFAVerificationTestCase(TestCase):
+    """Test cases for TOTP replay and brute-force protection."""
+
+    def setUp(self):
+        """Create a user with MFA enabled and a clean cache."""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='mfa@example.com',
+            password='testpass123',
+            mfa_secret=pyotp.random_base32(),
+            mfa_enabled=True,
+        )
+
+    def _code(self):
+        return get_totp(self.user.mfa_secret).now()
+
+    def test_valid_code_needs_no_database_write(self):
+        """A valid code is accepted using only the cache."""
+        code = self._code()
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_totp(self.user, code))
+
+    def test_code_cannot_be_replayed(self):
+        """The same code is rejected the second time."""
+        code = self._code()
+        self.assertTrue(verify_totp(self.user, code))
+        self.assertFalse(verify_totp(self.user, code))
+
+    def test_older_step_rejected_after_newer_code(self):
+        """A code from an earlier step is rejected once a later one was used."""
+        totp = get_totp(self.user.mfa_secret)
+        now = 1_700_000_000
+        self.assertTrue(verify_totp(self.user, totp.at(now), for_time=now))
+        self.assertFalse(verify_totp(self.user, totp.at(now - 30), for_time=now))
+
+    def test_lockout_after_failed_attempts(self):
+        """Too many wrong codes lock verification, even for a correct code."""
+        for _ in range(3):
+            self.assertFalse(verify_totp(self.user, '000000'))
+        with self.assertRaises(MFAAttemptsExceeded):
+            verify_totp(self.user, self._code())
+
+    def _mfa_token(self):
+        response = self.client.post('/auth/login/', {'email': self.user.email, 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['mfa_required'])
+        self.assertNotIn('access', response.data)
+        return response.data['mfa_token']
+
+    def test_login_view(self):
+        """The password step yields an MFA token, exchanged once for JWTs; wrong codes are then rate limited."""
+        mfa_token = self._mfa_token()
+        response = self.client.post('/login/mfa/verify/', {'mfa_token': mfa_token, 'token': self._code()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        # The MFA token is used up
+        response = self.client.post('/login/mfa/verify/', {'mfa_token': mfa_token, 'token': '123456'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        mfa_token = self._mfa_token()
+        for _ in range(3):
+            response = self.client.post('/login/mfa/verify/', {'mfa_token': mfa_token, 'token': '000000'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/login/mfa/verify/', {'mfa_token': mfa_token, 'token': '000000'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    def test_second_factor_alone_is_refused(self):
+        """Without a valid MFA token a correct code gets nothing, with the same answer as a wrong one."""
+        other = User.objects.create_user(email='plain@example.com', password='testpass123')
+        attempts = [
+            {'email': self.user.email, 'token': self._code()},
+            {'mfa_token': 'forged', 'token': self._code()},
+            {'mfa_token': make_token(self.user, MAGIC_LINK), 'token': self._code()},
+            # A user who never enabled MFA cannot log in with a code alone
+            {'mfa_token': make_token(other, MFA_PENDING), 'token': '000000'},
+        ]
+        bodies = []
+        for data in attempts:
+            response = self.client.post('/login/mfa/verify/', data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertNotIn('access', response.data)
+            bodies.append(response.data)
+        self.assertEqual(bodies[1], bodies[2])
+        self.assertEqual(bodies[2], bodies[3])
+
+    def test_token_endpoint_requires_second_factor(self):
+        """The JWT pair endpoint also stops at the MFA step for MFA users."""
+        response = self.client.post('/token/', {'email': self.user.email, 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['mfa_required'])
+        self.assertNotIn('access', response.data)
+
+
+class MFASetupTestCase(TestCase):
+    """Test cases for enabling MFA."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='setup@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def test_backup_codes_issued_on_confirmation(self):
+        """Loading the setup page issues no codes; confirming the first TOTP enables MFA and issues them once."""
+        for _ in range(2):
+            response = self.client.get('/mfa/setup/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('backup_codes', response.data)
+        self.assertFalse(MFABackupCode.objects.filter(user=self.user).exists())
+        self.assertEqual(self.client.get('/mfa/backup-codes/').status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.user.refresh_from_db()
+        response = self.client.post('/mfa/verify/', {'token': get_totp(self.user.mfa_secret).now()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['backup_codes']), 10)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.mfa_enabled)
+        self.assertTrue(verify_backup_code(self.user, response.data['backup_codes'][0]))
+
+
+class MFABackupCodeTestCase(TestCase):
+    """Test cases for hashed, single-use backup codes."""
+
+    def setUp(self):
+        """Create a user with a fresh set of backup codes."""
+        cache.clear()
+        self.user = User.objects.create_user(email='backup@example.com', password='testpass123')
+        self.codes = generate_backup_codes(self.user)
+
+    def test_codes_are_stored_hashed(self):
+        """Only keyed hashes of the codes reach the database."""
+        stored = set(MFABackupCode.objects.filter(user=self.user).values_list('code_hash', flat=True))
+        self.assertEqual(len(stored), 10)
+        self.assertFalse(stored & set(self.codes))
+
+    def test_code_is_single_use(self):
+        """A code verifies once, in one query, and is then gone."""
+        with self.assertNumQueries(1):
+            self.assertTrue(verify_backup_code(self.user, self.codes[0]))
+        self.assertFalse(verify_backup_code(self.user, self.codes[0]))
+        self.assertEqual(self.user.mfa_backup_codes.count(), 9)
+
+    def test_typed_code_is_normalized(self):
+        """Lowercase input without the dash is accepted."""
+        self.assertTrue(verify_backup_code(self.user, self.codes[1].replace('-', '').lower()))
+
+    def test_regenerating_invalidates_old_codes(self):
+        """A new set replaces the previous one."""
+        generate_backup_codes(self.user)
+        self.assertFalse(verify_backup_code(self.user, self.codes[0]))
+
+
+class MFAQRCodeTestCase(TestCase):
+    """Test cases for memoized, conditional QR code delivery."""
+
+    def setUp(self):
+        """Log in a user who has started MFA setup."""
+        cache.clear()
+        render_qr.cache_clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='qr@example.com', password='testpass123', mfa_secret=pyotp.random_base32()
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_svg_is_memoized_and_revalidated(self):
+        """SVG renders once; a matching If-None-Match gets 304."""
+        response = self.client.get('/mfa/qr/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+        response = self.client.get('/mfa/qr/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.get('/mfa/setup/')
+        self.assertEqual(render_qr.cache_info().misses, 1)
+
+    def test_png_is_rendered_off_the_request(self):
+        """PNG is queued (202) and then served from the cache."""
+        from .tasks import render_mfa_qr_png_task
+
+        with mock.patch.object(render_mfa_qr_png_task, 'delay') as delay:
+            response = self.client.get('/mfa/qr/?type=png')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            # Polling while the render is pending does not queue it again
+            self.assertEqual(self.client.get('/mfa/qr/?type=png').status_code, status.HTTP_202_ACCEPTED)
+        delay.assert_called_once_with(str(self.user.pk))
+
+        render_mfa_qr_png_task(str(self.user.pk))
+        response = self.client.get('/mfa/qr/?type=png')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
@@ -0,0 +1,142 @@
+"""
+Tests for single-use email verification, password reset and magic link tokens.
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .tokens import (
+    MAGIC_LINK, PASSWORD_RESET, VERIFY_EMAIL, InvalidToken, consume_token, make_token, read_token,
+)
+from .utils import confirm_email_verification, confirm_magic_link, confirm_password_reset
+
+User = get_user_model()
+
+
+class OneTimeTokenTestCase(TestCase):
+    """Test cases for the token subsystem itself."""
+
+    def setUp(self):
+        """Create a user and a clean ledger."""
+        cache.clear()
+        self.user = User.objects.create_user(email='tokens@example.com', password='testpass123')
+
+    def test_bad_tokens_rejected_without_queries(self):
+        """Forged, truncated, oversized and wrong-purpose tokens never reach the database."""
+        token = make_token(self.user, PASSWORD_RESET)
+        with self.assertNumQueries(0):
+            for bad in ('', 'garbage', token[:-2], token + 'x', 'a' * 1000):
+                with self.assertRaises(InvalidToken):
+                    read_token(bad, PASSWORD_RESET)
+            with self.assertRaises(InvalidToken):
+                read_token(token, MAGIC_LINK)
+            self.assertEqual(read_token(token, PASSWORD_RESET).user_id, str(self.user.pk))
+
+    def test_expired_token_rejected(self):
+        """A token past its max age is rejected."""
+        token = make_token(self.user, MAGIC_LINK)
+        with self.settings(MAGIC_LINK_TIMEOUT=60), mock.patch('time.time', return_value=10 ** 10):
+            with self.assertRaises(InvalidToken):
+                read_token(token, MAGIC_LINK)
+
+    def test_token_is_single_use(self):
+        """A consumed token cannot be used again."""
+        token = make_token(self.user, VERIFY_EMAIL)
+        self.assertEqual(consume_token(token, VERIFY_EMAIL), self.user)
+        with self.assertNumQueries(0), self.assertRaises(InvalidToken):
+            consume_token(token, VERIFY_EMAIL)
+
+    def test_password_change_revokes_tokens(self):
+        """A new password kills outstanding reset and magic link tokens."""
+        tokens = [(make_token(self.user, purpose), purpose) for purpose in (PASSWORD_RESET, MAGIC_LINK)]
+        self.user.set_password('newpass456')
+        self.user.save()
+        for token, purpose in tokens:
+            with self.assertRaises(InvalidToken):
+                consume_token(token, purpose)
+
+    def test_used_tokens_stay_dead_without_the_ledger(self):
+        """Once used, tokens are rejected even by a worker whose cache never saw them."""
+        verify = make_token(self.user, VERIFY_EMAIL)
+        confirm_email_verification(verify)
+        reset = make_token(self.user, PASSWORD_RESET)
+        confirm_password_reset(reset, 'newpass456')
+        self.user.refresh_from_db()
+        link = make_token(self.user, MAGIC_LINK)
+        confirm_magic_link(link)
+        cache.clear()
+        for token, purpose in ((reset, PASSWORD_RESET), (link, MAGIC_LINK), (verify, VERIFY_EMAIL)):
+            with self.assertRaises(InvalidToken):
+                consume_token(token, purpose)
+
+
+class OneTimeTokenViewTestCase(TestCase):
+    """Test cases for the endpoints backed by one-time tokens."""
+
+    def setUp(self):
+        """Create an unverified user."""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='links@example.com', password='testpass123')
+        self.uid = urlsafe_base64_encode(force_bytes(self.user.pk))
+
+    def test_verify_email(self):
+        """Verification marks the user verified and burns the token."""
+        token = make_token(self.user, VERIFY_EMAIL)
+        response = self.client.post('/verify-email/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_verified)
+
+        response = self.client.get(f'/verify-email/{self.uid}/{token}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_verify_link_uid_must_match(self):
+        """A token pasted under another user's uid is rejected."""
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        token = make_token(other, VERIFY_EMAIL)
+        response = self.client.get(f'/verify-email/{self.uid}/{token}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_password_reset(self):
+        """A rejected password keeps the link usable; a good one resets it once."""
+        token = make_token(self.user, PASSWORD_RESET)
+        url = f'/password/reset/confirm/{self.uid}/{token}/'
+        weak = {'new_password': '123', 'confirm_new_password': '123'}
+        response = self.client.post(url, weak)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        strong = {'new_password': 'N3w-passphrase!', 'confirm_new_password': 'N3w-passphrase!'}
+        response = self.client.post(url, strong)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-passphrase!'))
+
+        response = self.client.post('/password/reset/confirm/', {'token': token, **strong})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_magic_link(self):
+        """A requested link signs the user in exactly once."""
+        response = self.client.post('/auth/magic-link/', {'email': self.user.email})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 1)
+        token = mail.outbox[0].body.split('/magic-link/')[1].split('/')[0]
+
+        response = self.client.post('/auth/magic-link/login/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        response = self.client.post('/auth/magic-link/login/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_magic_link_unknown_email(self):
+        """Unknown addresses get the same answer and no email."""
+        response = self.client.post('/auth/magic-link/', {'email': 'nobody@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
@@ -1,91 +1,168 @@
-"""Token generation for email verification and password reset."""
-
-from django.contrib.auth.tokens import PasswordResetTokenGenerator
-import six
-from django.utils.crypto import constant_time_compare
-from django.utils.http import base36_to_int, int_to_base36
-
-class TokenGenerator(PasswordResetTokenGenerator):
-    """Strategy object used to generate and check tokens for user-related actions.
-    
-    This class extends Django's PasswordResetTokenGenerator to provide token generation
-    and validation for various user-related actions like email verification and
-    password reset.
+"""
+One-time tokens for email verification, password reset, magic links and
+the second step of an MFA login.
+
+A token is a signed, timestamped payload (``django.core.signing``) carrying
+its purpose, the user id, a random nonce and a fingerprint of the user's
+state. Everything needed to reject a malformed, forged, expired or
+wrong-purpose token is in the token itself, so those are turned away
+without touching the database.
+
+The fingerprint, like Django's ``PasswordResetTokenGenerator``, is a keyed
+hash of what using the token changes: the password hash and ``last_login``
+(with the email) for password resets, magic links and MFA logins, and the
+email and its verification state for verification links. Resetting the
+password, signing in or verifying the address therefore revokes every
+outstanding token of that kind, in every process, and for good.
+
+On top of that, consuming a token claims its nonce in a ledger kept in the
+cache with an atomic ``cache.add``, which stops two concurrent requests
+from both using it. The entry expires with the token, after which the
+signature check rejects it anyway.
+"""
+import secrets
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+VERIFY_EMAIL = 'verify-email'
+PASSWORD_RESET = 'password-reset'
+MAGIC_LINK = 'magic-link'
+# Proves the password or magic-link step passed; exchanged with a TOTP or backup code for JWTs
+MFA_PENDING = 'mfa-pending'
+
+TOKEN_SALT = 'ripplefox.one-time-token'
+NONCE_BYTES = 12
+# Comfortably above the ~190 characters a token takes; longer input is not worth verifying
+MAX_TOKEN_LENGTH = 256
+
+OneTimeToken = namedtuple('OneTimeToken', ['purpose', 'user_id', 'nonce', 'fingerprint'])
+
+
+class InvalidToken(Exception):
+    """Raised for a token that is malformed, forged, expired, for another purpose or already used."""
+
+
+def token_max_age(purpose):
+    """Return how long, in seconds, a token for ``purpose`` stays valid."""
+    if purpose == VERIFY_EMAIL:
+        return getattr(settings, 'EMAIL_VERIFICATION_LINK_EXPIRE_DAYS', 3) * 86400
+    if purpose == PASSWORD_RESET:
+        return settings.PASSWORD_RESET_TIMEOUT
+    if purpose == MAGIC_LINK:
+        return getattr(settings, 'MAGIC_LINK_TIMEOUT', 900)
+    if purpose == MFA_PENDING:
+        return getattr(settings, 'MFA_LOGIN_TIMEOUT', 300)
+    raise ValueError(f'Unknown token purpose {purpose!r}')
+
+
+def _ledger_key(nonce):
+    return f'ott:used:{nonce}'
+
+
+def _fingerprint(user, purpose):
+    """Keyed hash of the user state a token for ``purpose`` is bound to."""
+    if purpose == VERIFY_EMAIL:
+        state = f'{user.email}:{getattr(user, "is_verified", False)}'
+    else:
+        # Microseconds and time zone dropped, as some databases do not keep them
+        login = '' if user.last_login is None else user.last_login.replace(microsecond=0, tzinfo=None)
+        state = f'{user.password}:{login}:{user.email}'
+    return salted_hmac(f'{TOKEN_SALT}.{purpose}', f'{user.pk}:{state}', algorithm='sha256').hexdigest()[:24]
+
+
+def make_token(user, purpose):
+    """Issue a one-time token for a user.
+
+    Args:
+        user: The user the token acts for
+        purpose: One of ``VERIFY_EMAIL``, ``PASSWORD_RESET``, ``MAGIC_LINK`` or ``MFA_PENDING``
+
+    Returns:
+        str: A URL-safe token
     """
-    
-    def _make_hash_value(self, user, timestamp):
-        """Hash the user's primary key, some user state, and a timestamp.
-        
-        Args:
-            user: The user instance for which the token is being generated.
-            timestamp: The timestamp for the token generation.
-            
-        Returns:
-            str: A string containing the hashed values.
-        """
-        # Ensure the user has a last_login field
-        login_timestamp = ''
-        if user.last_login is not None:
-            login_timestamp = user.last_login.replace(microsecond=0, tzinfo=None)
-            
-        return (
-            six.text_type(user.pk) + user.password +
-            six.text_type(login_timestamp) + six.text_type(timestamp)
-        )
-    
-    def check_token(self, user, token):
-        """Check that the token is valid for the given user.
-        
-        Args:
-            user: The user instance to validate the token against.
-            token: The token to validate.
-            
-        Returns:
-            bool: True if the token is valid, False otherwise.
-        """
-        if not (user and token):
-            return False
-            
-        # Parse the token
-        try:
-            ts_b36, _ = token.split("-")
-        except ValueError:
-            return False
-            
-        try:
-            ts = base36_to_int(ts_b36)
-        except ValueError:
-            return False
-            
-        # Check that the timestamp/uid has not been tampered with
-        if not constant_time_compare(
-            self._make_token_with_timestamp(user, ts),
-            token
-        ):
-            return False
-            
-        # Check the timestamp is within the timeout period
-        if (self._num_seconds(self._now()) - ts) > self.timeout:
-            return False
-            
-        return True
-
-class AccountActivationTokenGenerator(TokenGenerator):
-    """Token generator for email verification.
-    
-    This generator creates tokens that are valid for 7 days.
+    token_max_age(purpose)
+    payload = [purpose, str(user.pk), secrets.token_urlsafe(NONCE_BYTES), _fingerprint(user, purpose)]
+    return signing.dumps(payload, salt=TOKEN_SALT)
+
+
+def read_token(token, purpose):
+    """Check a token without using it up; no database access.
+
+    Args:
+        token: The token as received
+        purpose: The purpose the caller expects
+
+    Returns:
+        OneTimeToken: The decoded token
+
+    Raises:
+        InvalidToken: If the token is malformed, forged, expired, for another purpose or already used
+    """
+    if not isinstance(token, str) or not token or len(token) > MAX_TOKEN_LENGTH:
+        raise InvalidToken('Malformed token')
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=token_max_age(purpose))
+    except signing.SignatureExpired:
+        raise InvalidToken('Token has expired')
+    except signing.BadSignature:
+        raise InvalidToken('Invalid token')
+
+    if not (isinstance(payload, list) and len(payload) == 4 and all(isinstance(p, str) for p in payload)):
+        raise InvalidToken('Malformed token')
+    parsed = OneTimeToken(*payload)
+    if parsed.purpose != purpose:
+        raise InvalidToken('Token was issued for another purpose')
+    if cache.get(_ledger_key(parsed.nonce)) is not None:
+        raise InvalidToken('Token has already been used')
+    return parsed
+
+
+def claim_token(parsed):
+    """Record a token as used.
+
+    Raises:
+        InvalidToken: If it was used already, including by a concurrent request
     """
-    
-    timeout = 60 * 60 * 24 * 7  # 7 days
+    if not cache.add(_ledger_key(parsed.nonce), 1, timeout=token_max_age(parsed.purpose)):
+        raise InvalidToken('Token has already been used')
+
+
+def token_user(parsed, queryset=None):
+    """Load the user a token was issued for.
+
+    Args:
+        parsed: A token returned by :func:`read_token`
+        queryset: Users the token may resolve to (default: active users)
 
-class PasswordResetTokenGenerator(TokenGenerator):
-    """Token generator for password reset.
-    
-    This generator creates tokens that are valid for 24 hours.
+    Raises:
+        InvalidToken: If the user no longer exists, is not in ``queryset``, or has changed in a way that
+            revokes the token (new password, a sign-in, a verified or changed email)
     """
-    
-    timeout = 60 * 60 * 24  # 24 hours
+    if queryset is None:
+        queryset = get_user_model()._default_manager.filter(is_active=True)
+    user = queryset.filter(pk=parsed.user_id).first()
+    if user is None:
+        raise InvalidToken('Invalid token')
+    if not constant_time_compare(_fingerprint(user, parsed.purpose), parsed.fingerprint):
+        raise InvalidToken('Token is no longer valid')
+    return user
 
-# Create token generator instances
-account_activation_token = AccountActivationTokenGenerator()
-password_reset_token = PasswordResetTokenGenerator()
+
+def consume_token(token, purpose, queryset=None):
+    """Check a token, load its user and use the token up.
+
+    Returns:
+        User: The user the token was issued for
+
+    Raises:
+        InvalidToken: If the token cannot be used
+    """
+    parsed = read_token(token, purpose)
+    user = token_user(parsed, queryset)
+    claim_token(parsed)
+    return user
@@ -16,10 +16,13 @@ from .auth_views import (
     UserLoginView,
     ResendVerificationView,
     VerifyEmailView,
+    MagicLinkRequestView,
+    MagicLinkLoginView,
     CheckAvailabilityView,
     CustomTokenObtainPairView,
     UserProfileView
 )
+from .mfa_views import MFASetupView, MFAVerifyView, MFALoginView, MFABackupCodesView, MFAQRCodeView
 from .views_api import UserViewSet, ReportViewSet, SettingsViewSet
 from .views_pages import reports_view, manage_users_view, settings_view
 
@@ -51,8 +54,19 @@ urlpatterns = [
         path('register/', UserRegistrationView.as_view(), name='register'),
         path('login/', UserLoginView.as_view(), name='login'),
         path('logout/', views.UserLogoutView.as_view(), name='logout'),
+        path('magic-link/', MagicLinkRequestView.as_view(), name='magic-link'),
+        path('magic-link/login/', MagicLinkLoginView.as_view(), name='magic-link-login'),
     ])),
     
+    # Multi-factor authentication
+    path('mfa/', include([
+        path('setup/', MFASetupView.as_view(), name='mfa-setup'),
+        path('qr/', MFAQRCodeView.as_view(), name='mfa-qr'),
+        path('verify/', MFAVerifyView.as_view(), name='mfa-verify'),
+        path('backup-codes/', MFABackupCodesView.as_view(), name='mfa-backup-codes'),
+    ])),
+    path('login/mfa/verify/', MFALoginView.as_view(), name='mfa-login'),
+    
     # User profile
     path('profile/', include([
         path('me/', UserProfileView.as_view(), name='user-profile'),
@@ -88,6 +102,7 @@ urlpatterns = [
     # Password management
     path('password/', include([
         path('reset/', views.PasswordResetView.as_view(), name='password_reset'),
+        path('reset/confirm/', views.PasswordResetConfirmView.as_view(), name='password_reset_confirm_token'),
         path('reset/confirm/<uidb64>/<token>/', views.PasswordResetConfirmView.as_view(), 
             name='password_reset_confirm'),
     ]))
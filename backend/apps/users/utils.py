@@ -9,32 +9,41 @@ import uuid
 from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.contrib.auth.password_validation import validate_password
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 
+from apps.core.metrics import timed
 from .models import User
-from .tokens import account_activation_token, password_reset_token
+from .tokens import (
+    MAGIC_LINK, PASSWORD_RESET, VERIFY_EMAIL, InvalidToken,
+    claim_token, consume_token, make_token, read_token, token_max_age, token_user,
+)
 
 logger = logging.getLogger(__name__)
 
 def get_client_ip(request):
     """Get the client's IP address from the request.
     
+    X-Forwarded-For is only trusted as far as ``TRUSTED_PROXY_COUNT``
+    proxies wrote it: entries further left are whatever the client sent.
+    
     Args:
         request: The HTTP request object.
         
     Returns:
         str: The client's IP address.
     """
+    proxies = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    if proxies > 0 and x_forwarded_for:
+        hops = [hop.strip() for hop in x_forwarded_for.split(',')]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR')
 
 def get_user_agent(request):
     """Get the user agent from the request.
@@ -47,6 +56,40 @@ def get_user_agent(request):
     """
     return request.META.get('HTTP_USER_AGENT', '')
 
+def _decode_uid(uidb64):
+    """Decode a base64 user id from a link, or return None if it is garbled."""
+    try:
+        return force_str(urlsafe_base64_decode(uidb64))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _read_link_token(uidb64, token, purpose):
+    """Read a token from a ``<uidb64>/<token>/`` link; the uid must name the token's user."""
+    parsed = read_token(token, purpose)
+    if uidb64 is not None and _decode_uid(uidb64) != parsed.user_id:
+        raise InvalidToken('Token does not belong to this user')
+    return parsed
+
+def _send_templated_email(user, subject, template_name, context):
+    """Render ``emails/<template_name>.txt``/``.html`` and send them to the user."""
+    context = {
+        'user': user,
+        'site_name': settings.SITE_NAME,
+        'support_email': settings.DEFAULT_FROM_EMAIL,
+        **context,
+    }
+    message = render_to_string(f'emails/{template_name}.txt', context)
+    html_message = render_to_string(f'emails/{template_name}.html', context)
+    with timed('email_send'):
+        send_mail(
+            subject=subject,
+            message=message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[user.email],
+            html_message=html_message,
+            fail_silently=False,
+        )
+
 def generate_verification_token(user):
     """Generate a verification token for the user.
     
@@ -54,9 +97,9 @@ def generate_verification_token(user):
         user: The user instance.
         
     Returns:
-        str: A verification token.
+        str: A single-use, signed verification token.
     """
-    return account_activation_token.make_token(user)
+    return make_token(user, VERIFY_EMAIL)
 
 def send_verification_email(user, token, request=None):
     """Send a verification email to the user.
@@ -70,33 +113,14 @@ def send_verification_email(user, token, request=None):
         bool: True if the email was sent successfully, False otherwise.
     """
     try:
-        # Create verification URL
         uid = urlsafe_base64_encode(force_bytes(user.pk))
         verification_url = f"{settings.FRONTEND_URL}/verify-email/{uid}/{token}/"
-        
-        # Prepare email context
-        context = {
-            'user': user,
-            'verification_url': verification_url,
-            'site_name': settings.SITE_NAME,
-            'support_email': settings.DEFAULT_FROM_EMAIL,
-        }
-        
-        # Render email templates
-        subject = f'Verify your email address - {settings.SITE_NAME}'
-        message = render_to_string('emails/verification_email.txt', context)
-        html_message = render_to_string('emails/verification_email.html', context)
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        _send_templated_email(
+            user,
+            f'Verify your email address - {settings.SITE_NAME}',
+            'verification_email',
+            {'verification_url': verification_url},
         )
-        
         logger.info(f"Verification email sent to {user.email}")
         return True
     except Exception as e:
@@ -110,9 +134,9 @@ def generate_password_reset_token(user):
         user: The user instance.
         
     Returns:
-        str: A password reset token.
+        str: A single-use, signed password reset token.
     """
-    return password_reset_token.make_token(user)
+    return make_token(user, PASSWORD_RESET)
 
 def send_password_reset_email(user, token, request=None):
     """Send a password reset email to the user.
@@ -126,42 +150,64 @@ def send_password_reset_email(user, token, request=None):
         bool: True if the email was sent successfully, False otherwise.
     """
     try:
-        # Create password reset URL
         uid = urlsafe_base64_encode(force_bytes(user.pk))
         reset_url = f"{settings.FRONTEND_URL}/reset-password/{uid}/{token}/"
-        
-        # Prepare email context
-        context = {
-            'user': user,
-            'reset_url': reset_url,
-            'site_name': settings.SITE_NAME,
-            'support_email': settings.DEFAULT_FROM_EMAIL,
-            'expiry_hours': settings.PASSWORD_RESET_TIMEOUT // 3600,  # Convert seconds to hours
-        }
-        
-        # Render email templates
-        subject = f'Password Reset Request - {settings.SITE_NAME}'
-        message = render_to_string('emails/password_reset_email.txt', context)
-        html_message = render_to_string('emails/password_reset_email.html', context)
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        _send_templated_email(
+            user,
+            f'Password Reset Request - {settings.SITE_NAME}',
+            'password_reset_email',
+            {
+                'reset_url': reset_url,
+                'expiry_hours': token_max_age(PASSWORD_RESET) // 3600,
+            },
         )
-        
         logger.info(f"Password reset email sent to {user.email}")
         return True
     except Exception as e:
         logger.error(f"Error sending password reset email to {user.email}: {str(e)}")
         return False
 
+def generate_magic_link_token(user):
+    """Generate a magic link (passwordless login) token for the user.
+    
+    Args:
+        user: The user instance.
+        
+    Returns:
+        str: A single-use, signed login token.
+    """
+    return make_token(user, MAGIC_LINK)
+
+def send_magic_link_email(user, token, request=None):
+    """Send a passwordless login link to the user.
+    
+    Args:
+        user: The user instance.
+        token: The magic link token.
+        request: Optional HTTP request object for building absolute URLs.
+        
+    Returns:
+        bool: True if the email was sent successfully, False otherwise.
+    """
+    try:
+        login_url = f"{settings.FRONTEND_URL}/magic-link/{token}/"
+        _send_templated_email(
+            user,
+            f'Your sign-in link - {settings.SITE_NAME}',
+            'magic_link_email',
+            {
+                'login_url': login_url,
+                'expiry_minutes': token_max_age(MAGIC_LINK) // 60,
+            },
+        )
+        logger.info(f"Magic link email sent to {user.email}")
+        return True
+    except Exception as e:
+        logger.error(f"Error sending magic link email to {user.email}: {str(e)}")
+        return False
+
 def validate_verification_token(uidb64, token):
-    """Validate a verification token.
+    """Validate a verification token without using it up.
     
     Args:
         uidb64: The base64-encoded user ID.
@@ -171,18 +217,12 @@ def validate_verification_token(uidb64, token):
         User: The user if the token is valid, None otherwise.
     """
     try:
-        # Decode the uid
-        uid = force_str(urlsafe_base64_decode(uidb64))
-        user = User._default_manager.get(pk=uid)
-    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
-        user = None
-    
-    if user is not None and account_activation_token.check_token(user, token):
-        return user
-    return None
+        return token_user(_read_link_token(uidb64, token, VERIFY_EMAIL), User._default_manager.all())
+    except InvalidToken:
+        return None
 
 def validate_password_reset_token(uidb64, token):
-    """Validate a password reset token.
+    """Validate a password reset token without using it up.
     
     Args:
         uidb64: The base64-encoded user ID.
@@ -192,19 +232,82 @@ def validate_password_reset_token(uidb64, token):
         User: The active user if the token is valid, None otherwise.
     """
     try:
-        # Decode the uid
-        uid = force_str(urlsafe_base64_decode(uidb64))
-        user = User._default_manager.get(pk=uid, is_active=True)
-    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
-        user = None
-    
-    if user is not None and password_reset_token.check_token(user, token):
-        return user
-    return None
+        return token_user(_read_link_token(uidb64, token, PASSWORD_RESET))
+    except InvalidToken:
+        return None
 
 # Alias for backward compatibility
 verify_password_reset_token = validate_password_reset_token
 
+def confirm_email_verification(token, uidb64=None):
+    """Use up a verification token and mark the user's email as verified.
+    
+    Args:
+        token: The verification token.
+        uidb64: The base64-encoded user ID, when the token came from a link.
+        
+    Returns:
+        User: The verified user.
+        
+    Raises:
+        InvalidToken: If the token cannot be used.
+    """
+    parsed = _read_link_token(uidb64, token, VERIFY_EMAIL)
+    user = token_user(parsed, User._default_manager.all())
+    claim_token(parsed)
+    if not user.is_verified:
+        user.is_verified = True
+        user.save(update_fields=['is_verified'])
+    return user
+
+def confirm_password_reset(token, new_password, uidb64=None):
+    """Use up a password reset token and set the new password.
+    
+    The password is validated before the token is claimed, so a rejected
+    password does not burn the link.
+    
+    Args:
+        token: The password reset token.
+        new_password: The new password.
+        uidb64: The base64-encoded user ID, when the token came from a link.
+        
+    Returns:
+        User: The user whose password was reset.
+        
+    Raises:
+        InvalidToken: If the token cannot be used.
+        django.core.exceptions.ValidationError: If the password is rejected.
+    """
+    parsed = _read_link_token(uidb64, token, PASSWORD_RESET)
+    user = token_user(parsed)
+    validate_password(new_password, user)
+    claim_token(parsed)
+    user.set_password(new_password)
+    user.save(update_fields=['password'])
+    return user
+
+def confirm_magic_link(token):
+    """Use up a magic link token and record the sign-in.
+    
+    Opening the link proves control of the mailbox, so the email is marked
+    as verified too. ``last_login`` is set here, even for users who still
+    have to pass MFA, so the link is dead everywhere once used.
+    
+    Args:
+        token: The magic link token.
+        
+    Returns:
+        User: The active user to sign in.
+        
+    Raises:
+        InvalidToken: If the token cannot be used.
+    """
+    user = consume_token(token, MAGIC_LINK)
+    user.is_verified = True
+    user.last_login = timezone.now()
+    user.save(update_fields=['is_verified', 'last_login'])
+    return user
+
 def check_password_strength(password):
     """Check the strength of a password.
     
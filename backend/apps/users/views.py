@@ -4,6 +4,7 @@ Views for the users app.
 import logging
 from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate, login
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils import timezone
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
@@ -16,6 +17,7 @@ from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenRefreshView
 
+from apps.core.idempotency import idempotent
 from .models import User, UserActivity, UserProfile
 from .serializers import (
     UserSerializer, LoginSerializer, 
@@ -25,8 +27,11 @@ from .serializers import (
 from .utils import (
     get_client_ip, get_user_agent,
     generate_verification_token, send_verification_email,
-    generate_password_reset_token, send_password_reset_email
+    generate_password_reset_token, send_password_reset_email,
+    confirm_email_verification, confirm_password_reset,
 )
+from .auth_views import mfa_challenge
+from .tokens import InvalidToken
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -37,6 +42,7 @@ class UserRegistrationView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
+    @idempotent
     def post(self, request):
         """
         Handle user registration.
@@ -97,13 +103,7 @@ class UserLoginView(APIView):
         
         # If MFA is enabled, require verification
         if user.mfa_enabled:
-            # Generate a temporary token for MFA verification
-            temp_token = RefreshToken.for_user(user)
-            return Response({
-                'mfa_required': True,
-                'temp_token': str(temp_token.access_token),
-                'message': 'MFA verification required',
-            }, status=status.HTTP_200_OK)
+            return mfa_challenge(user)
         
         # Generate final tokens if MFA is not required
         refresh = RefreshToken.for_user(user)
@@ -191,6 +191,7 @@ class PasswordResetView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
+    @idempotent
     def post(self, request):
         """
         Handle password reset request.
@@ -223,13 +224,28 @@ class PasswordResetConfirmView(APIView):
     """
     permission_classes = [permissions.AllowAny]
     
-    def post(self, request, uidb64, token):
+    def post(self, request, uidb64=None, token=None):
         """
         Handle password reset confirmation.
         """
-        # This would be implemented to validate the token and reset the password
-        # Implementation would verify the token and update the password
-        pass
+        serializer = PasswordResetConfirmSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        token = token or serializer.validated_data.get('token')
+        try:
+            user = confirm_password_reset(token, serializer.validated_data['new_password'], uidb64)
+        except InvalidToken as e:
+            logger.info(f"Rejected password reset token: {str(e)}")
+            return Response(
+                {"detail": "Invalid or expired password reset link."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except DjangoValidationError as e:
+            return Response({"new_password": list(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        logger.info(f"Password reset completed for: {user.email}")
+        return Response({"detail": "Password has been reset."}, status=status.HTTP_200_OK)
 
 class EmailVerificationView(APIView):
     """
@@ -241,9 +257,17 @@ class EmailVerificationView(APIView):
         """
         Handle email verification.
         """
-        # This would be implemented to verify the email
-        # Implementation would verify the token and mark the email as verified
-        pass
+        try:
+            confirm_email_verification(token, uidb64)
+        except InvalidToken as e:
+            logger.info(f"Rejected verification token: {str(e)}")
+            return Response(
+                {"detail": "Invalid or expired verification link."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({"detail": "Email verified successfully."}, status=status.HTTP_200_OK)
+    
+    post = get
 
 class UserActivityView(generics.ListAPIView):
     """
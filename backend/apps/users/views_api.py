@@ -8,6 +8,8 @@ from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
 
+from apps.core.db_routers import use_replica
+
 User = get_user_model()
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -51,12 +53,14 @@ class ReportViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def list(self, request):
-        # Generate sample report data
-        total_users = User.objects.count()
-        active_users = User.objects.filter(is_active=True).count()
-        new_users_last_30_days = User.objects.filter(
-            date_joined__gte=timezone.now() - timedelta(days=30)
-        ).count()
+        # Report aggregations are read-only, so they can run on the replica
+        with use_replica():
+            total_users = User.objects.count()
+            active_users = User.objects.filter(is_active=True).count()
+            new_users_last_30_days = User.objects.filter(
+                date_joined__gte=timezone.now() - timedelta(days=30)
+            ).count()
+            user_growth = self._get_user_growth_data()
         
         return Response({
             "message": "Reports data",
@@ -65,15 +69,17 @@ class ReportViewSet(viewsets.ViewSet):
                 "active_users": active_users,
                 "inactive_users": total_users - active_users,
                 "new_users_last_30_days": new_users_last_30_days,
-                "user_growth": self._get_user_growth_data(),
+                "user_growth": user_growth,
                 "user_activity": self._get_user_activity_data()
             }
         })
 
     @action(detail=False, methods=['get'])
     def user_growth(self, request):
+        with use_replica():
+            data = self._get_user_growth_data()
         return Response({
-            "data": self._get_user_growth_data()
+            "data": data
         })
 
     @action(detail=False, methods=['get'])
@@ -7,11 +7,14 @@ from django.contrib.auth import get_user_model
 from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
+
+from apps.core.db_routers import use_replica
 from .permissions import has_permission, CAN_VIEW_REPORTS, CAN_MANAGE_USERS, CAN_MANAGE_SETTINGS
 
 User = get_user_model()
 
 @login_required
+@use_replica()
 def reports_view(request):
     """View for reports page."""
     if not has_permission(request.user, CAN_VIEW_REPORTS):
@@ -70,6 +73,7 @@ def reports_view(request):
     return render(request, 'users/reports.html', context)
 
 @login_required
+@use_replica()
 def manage_users_view(request):
     """View for managing users."""
     if not has_permission(request.user, CAN_MANAGE_USERS):
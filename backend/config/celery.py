@@ -20,6 +20,30 @@ app.conf.beat_schedule = {
         'task': 'django.contrib.sessions.clearsessions',
         'schedule': 3600.0,  # Run every hour
     },
+    'take-balance-snapshots': {
+        'task': 'apps.mazepay.tasks.take_balance_snapshots_task',
+        'schedule': 900.0,  # Picks up each day shortly after it ends
+    },
+    'dispatch-webhooks': {
+        'task': 'apps.mazepay.tasks.dispatch_webhooks_task',
+        'schedule': 5.0,  # Or run `manage.py run_webhooks` for lower latency
+    },
+    'refresh-timesheets': {
+        'task': 'apps.geoattendance.tasks.refresh_timesheets_task',
+        'schedule': 60.0,
+    },
+    'compact-trails': {
+        'task': 'apps.geoattendance.tasks.compact_trails_task',
+        'schedule': 3600.0,  # Merges each finished day's trail chunks
+    },
+    'dispatch-jobs': {
+        'task': 'apps.handyconnect.tasks.dispatch_jobs_task',
+        'schedule': 5.0,  # Or run `manage.py run_dispatcher` for offer timeouts to the second
+    },
+    'refresh-email-availability': {
+        'task': 'apps.users.tasks.refresh_email_availability_task',
+        'schedule': 300.0,  # At most AVAILABILITY_BLOOM_REFRESH, or the shared filter expires in between
+    },
 }
 
 @app.task(bind=True)
@@ -0,0 +1,95 @@
+"""
+Gunicorn configuration for production.
+
+Run from the backend directory::
+
+    gunicorn -c config/gunicorn.conf.py
+
+The application is preloaded and warmed up in the master (see
+``apps.core.warmup``), then ``gc.freeze()`` moves everything allocated so far
+into the permanent generation so the collector never writes to those pages
+and forked workers keep sharing them copy-on-write.
+
+``GUNICORN_WORKER_CLASS`` selects the worker model:
+
+* ``gthread`` (default) - threaded sync workers, no extra dependencies
+* ``gevent`` - cooperative workers for I/O-bound traffic (``pip install gevent psycogreen``)
+* ``uvicorn`` - ASGI workers serving ``config.asgi`` (``pip install uvicorn``)
+"""
+import gc
+import multiprocessing
+import os
+
+from apps.core.env_utils import get_boolean_env, get_env_variable, get_int_env
+
+WORKER_CLASSES = {
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+worker_model = get_env_variable('GUNICORN_WORKER_CLASS', 'gthread').strip().lower()
+if worker_model not in WORKER_CLASSES:
+    raise RuntimeError(
+        f"Unknown GUNICORN_WORKER_CLASS {worker_model!r}; choose from {', '.join(WORKER_CLASSES)}"
+    )
+if worker_model == 'gevent':
+    # Patch before the app is preloaded, or modules imported in the master keep blocking primitives
+    from gevent import monkey
+    monkey.patch_all()
+
+wsgi_app = 'config.asgi:application' if worker_model == 'uvicorn' else 'config.wsgi:application'
+bind = get_env_variable('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = WORKER_CLASSES[worker_model]
+workers = get_int_env('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+threads = get_int_env('GUNICORN_THREADS', 4) if worker_model == 'gthread' else 1
+worker_connections = get_int_env('GUNICORN_WORKER_CONNECTIONS', 1000)
+preload_app = get_boolean_env('GUNICORN_PRELOAD', True)
+
+# Recycle workers to bound slow leaks; jitter avoids restarting them all at once
+max_requests = get_int_env('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = get_int_env('GUNICORN_MAX_REQUESTS_JITTER', 100)
+timeout = get_int_env('GUNICORN_TIMEOUT', 60)
+graceful_timeout = get_int_env('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = get_int_env('GUNICORN_KEEPALIVE', 5)
+
+# Heartbeat files on tmpfs instead of the container's overlay filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+forwarded_allow_ips = get_env_variable('GUNICORN_FORWARDED_ALLOW_IPS', '*')
+proxy_allow_ips = forwarded_allow_ips
+accesslog = '-'
+errorlog = '-'
+capture_output = True
+loglevel = get_env_variable('LOG_LEVEL', 'info').lower()
+
+
+def when_ready(server):
+    """Warm the preloaded application, then freeze the heap before forking."""
+    if not preload_app:
+        return
+    from apps.core.warmup import warm_up
+
+    results = warm_up()
+    server.log.info("Warm-up finished: %s", results)
+    gc.collect()
+    gc.freeze()
+    server.log.info("Froze %d objects into the permanent generation", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative under gevent."""
+    if worker_model != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed; database calls will block the gevent loop")
+        return
+    patch_psycopg()
+
+
+def child_exit(server, worker):
+    """Drop the exited worker's Prometheus multiprocess files."""
+    from apps.core.metrics import mark_worker_dead
+
+    mark_worker_dead(worker.pid)
@@ -6,77 +6,57 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
-# Build paths inside the project like this: BASE_DIR / 'subdir'.
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-
-# Add the apps directory to the Python path
-import sys
-APPS_DIR = os.path.join(BASE_DIR, 'apps')
-if APPS_DIR not in sys.path:
-    sys.path.insert(0, APPS_DIR)
+from corsheaders.defaults import default_headers
 
-# Import environment utilities
-from core.env_utils import (
+from apps.core.env_utils import (
+    load_settings,
     get_env_variable,
     get_boolean_env,
     get_int_env,
     get_list_env,
-    get_float_env
+    get_float_env,
+    get_database_config,
+    get_sqlite_pragmas,
+    get_cache_config,
 )
 
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Parsed and validated once; also loads backend/.env before anything below reads os.environ
+env = load_settings()
+
 # Core settings
-DEBUG = get_boolean_env('DEBUG', True)
-SECRET_KEY = get_env_variable('SECRET_KEY', 'django-insecure-your-secret-key')
-ALLOWED_HOSTS = get_list_env('ALLOWED_HOSTS', ['*'])
-
-# Database settings
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# SECURITY WARNING: keep the secret key used in production secret and don't run
+# with debug turned on in production! Both are enforced when DEBUG is off.
+DEBUG = env.debug
+SECRET_KEY = env.secret_key
+ALLOWED_HOSTS = list(env.allowed_hosts)
+# Reverse proxies in front of the app that append to X-Forwarded-For. Client IPs are the
+# entry the outermost one added; with 0 the header is ignored and REMOTE_ADDR is used.
+TRUSTED_PROXY_COUNT = get_int_env('TRUSTED_PROXY_COUNT', 0)
 
 # Email settings
-EMAIL_BACKEND = get_env_variable('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
-EMAIL_HOST = get_env_variable('EMAIL_HOST', 'smtp.gmail.com')
-EMAIL_PORT = get_int_env('EMAIL_PORT', 587)
-EMAIL_USE_TLS = get_boolean_env('EMAIL_USE_TLS', True)
-EMAIL_HOST_USER = get_env_variable('EMAIL_HOST_USER', '')
-EMAIL_HOST_PASSWORD = get_env_variable('EMAIL_HOST_PASSWORD', '')
-DEFAULT_FROM_EMAIL = get_env_variable('DEFAULT_FROM_EMAIL', 'noreply@yourdomain.com')
+EMAIL_BACKEND = env.email_backend
+EMAIL_HOST = env.email_host
+EMAIL_PORT = env.email_port
+EMAIL_USE_TLS = env.email_use_tls
+EMAIL_HOST_USER = env.email_host_user
+EMAIL_HOST_PASSWORD = env.email_host_password
+DEFAULT_FROM_EMAIL = env.default_from_email
 
 # JWT settings
-JWT_SECRET_KEY = get_env_variable('JWT_SECRET_KEY')
+JWT_SECRET_KEY = env.jwt_secret_key
 JWT_ALGORITHM = get_env_variable('JWT_ALGORITHM', 'HS256')
 
 # AWS settings
-AWS_ACCESS_KEY_ID = get_env_variable('AWS_ACCESS_KEY_ID', '')
-AWS_SECRET_ACCESS_KEY = get_env_variable('AWS_SECRET_ACCESS_KEY', '')
-AWS_STORAGE_BUCKET_NAME = get_env_variable('AWS_STORAGE_BUCKET_NAME', '')
+AWS_ACCESS_KEY_ID = env.aws_access_key_id
+AWS_SECRET_ACCESS_KEY = env.aws_secret_access_key
+AWS_STORAGE_BUCKET_NAME = env.aws_storage_bucket_name
 
 # Celery settings
-CELERY_BROKER_URL = get_env_variable('CELERY_BROKER_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = get_env_variable('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
-env_file = os.path.join(BASE_DIR.parent, '.env')
-print(f"Looking for .env file at: {env_file}")
-print(f".env file exists: {os.path.exists(env_file)}")
-if os.path.exists(env_file):
-    print("Reading .env file...")
-    env.read_env(env_file)
-    print("Environment variables loaded from .env file")
-    print(f"DEBUG: {env('DEBUG')}")
-    print(f"SECRET_KEY: {'*' * len(env('SECRET_KEY')) if env('SECRET_KEY') else 'NOT SET'}")
-    print(f"ALLOWED_HOSTS: {env('ALLOWED_HOSTS')}")
-
-# SECURITY WARNING: keep the secret key used in production secret!
-# Temporarily hardcoded values
-SECRET_KEY = 'django-insecure-your-secure-key-here-1234567890'
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
-
-ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+CELERY_BROKER_URL = env.celery_broker_url
+CELERY_RESULT_BACKEND = env.celery_result_backend
 
 # Application definition
 INSTALLED_APPS = [
@@ -102,6 +82,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',  # Outermost, so timings cover the whole stack
+    'apps.core.profiling.ProfilingMiddleware',  # Removed at startup unless PROFILING_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware should be as high as possible
@@ -110,6 +92,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.core.middleware.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -117,7 +100,7 @@ ROOT_URLCONF = 'config.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [os.path.join(BASE_DIR, 'templates'), os.path.join(BASE_DIR, 'templates/admin')],
+        'DIRS': [BASE_DIR / 'backend' / 'templates', BASE_DIR / 'backend' / 'templates' / 'admin'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -132,25 +115,48 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
-# Database - Using SQLite for now
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
-}
-
-# Uncomment this to use PostgreSQL when the database is ready
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': env('DB_NAME'),
-#         'USER': env('DB_USER'),
-#         'PASSWORD': env('DB_PASSWORD'),
-#         'HOST': env('DB_HOST', default='localhost'),
-#         'PORT': env('DB_PORT', default='5432'),
-#     }
-# }
+# Database - SQLite by default; set DB_ENGINE=postgresql for production
+DATABASES = get_database_config(BASE_DIR)
+DATABASE_ROUTERS = ['apps.core.db_routers.PrimaryReplicaRouter']
+# Replica reads fall back to the primary when replication lag exceeds this (seconds)
+DATABASE_REPLICA_MAX_LAG = get_float_env('DB_REPLICA_MAX_LAG', 5.0)
+# Reads stay on the primary this long after a client's own write (read-your-writes)
+DATABASE_REPLICA_PIN_SECONDS = get_int_env('DB_REPLICA_PIN_SECONDS', 10)
+SQLITE_PRAGMAS = get_sqlite_pragmas()
+
+# Cache - Redis when CACHE_URL is set, local memory otherwise
+CACHES = get_cache_config()
+
+# Health probes
+# Dependencies checked by /readyz, each bounded by READINESS_TIMEOUT seconds
+READINESS_CHECKS = get_list_env(
+    'READINESS_CHECKS',
+    default=['database', 'cache', 'broker'] if get_env_variable('CELERY_BROKER_URL') else ['database', 'cache'],
+)
+READINESS_TIMEOUT = get_float_env('READINESS_TIMEOUT', 1.0)
+# Seconds between background samples of CPU/memory/disk for /health
+SYSTEM_METRICS_INTERVAL = get_float_env('SYSTEM_METRICS_INTERVAL', 15.0)
+
+# Prometheus scrape endpoint (/metrics); require this bearer token when set. Without one
+# the endpoint is only served when DEBUG is on
+METRICS_TOKEN = get_env_variable('METRICS_TOKEN', '')
+
+# Request profiling (apps.core.profiling). Off unless enabled; then requests are
+# profiled when they carry a signed X-Profile header or are picked by the sample rate.
+PROFILING_ENABLED = get_boolean_env('PROFILING_ENABLED', False)
+PROFILING_SAMPLE_RATE = get_float_env('PROFILING_SAMPLE_RATE', 0.0)
+PROFILING_TOKEN_MAX_AGE = get_int_env('PROFILING_TOKEN_MAX_AGE', 3600)
+PROFILING_MAX_ARTIFACTS = get_int_env('PROFILING_MAX_ARTIFACTS', 200)
+PROFILING_ARTIFACT_DIR = get_env_variable('PROFILING_ARTIFACT_DIR', '')
+
+# Password hashing - PBKDF2 with timings exported to /metrics
+PASSWORD_HASHERS = [
+    'apps.core.hashers.InstrumentedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -184,6 +190,10 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Files the application writes for staff only (profiles, reports, uploads); never
+# under MEDIA_ROOT or anything else the web server serves
+PRIVATE_ROOT = get_env_variable('PRIVATE_ROOT', '') or os.path.join(BASE_DIR, 'private')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -213,7 +223,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'user': '1000/day',
+        # Per client, for CheckAvailabilityView (checked as the user types)
+        'availability': get_env_variable('AVAILABILITY_THROTTLE_RATE', '30/minute'),
     }
 }
 
@@ -225,7 +237,7 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
     'UPDATE_LAST_LOGIN': True,
     'ALGORITHM': 'HS256',
-    'SIGNING_KEY': get_env_variable('JWT_SECRET_KEY', default=SECRET_KEY),
+    'SIGNING_KEY': JWT_SECRET_KEY,
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
@@ -237,10 +249,102 @@ CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 #     'https://yourdomain.com',  # Your production domain
 # ]
 CORS_ALLOW_CREDENTIALS = True
-
-# Email settings
-EMAIL_BACKEND = get_env_variable('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
-DEFAULT_FROM_EMAIL = get_env_variable('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-device-id', 'content-encoding')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'Retry-After']
+
+# MazePay ledger (apps.mazepay.ledger): retries when a post loses a lock race
+LEDGER_MAX_RETRIES = get_int_env('LEDGER_MAX_RETRIES', 5)
+# Batch payouts (apps.mazepay.payouts): items posted per transaction, and per batch
+PAYOUT_CHUNK_SIZE = get_int_env('PAYOUT_CHUNK_SIZE', 500)
+PAYOUT_MAX_ITEMS = get_int_env('PAYOUT_MAX_ITEMS', 100000)
+# Seconds without a posted chunk after which a processing batch counts as stalled and can be resumed
+PAYOUT_LEASE_SECONDS = get_int_env('PAYOUT_LEASE_SECONDS', 300)
+# Balance snapshots (apps.mazepay.statements): wait this long after a day ends before snapshotting it
+LEDGER_SNAPSHOT_DELAY = get_int_env('LEDGER_SNAPSHOT_DELAY', 300)
+# Outbound webhooks (apps.mazepay.webhooks): delivery concurrency, timeouts and retry schedule
+WEBHOOK_CONCURRENCY = get_int_env('WEBHOOK_CONCURRENCY', 100)
+WEBHOOK_TIMEOUT = get_float_env('WEBHOOK_TIMEOUT', 10.0)
+WEBHOOK_BATCH_SIZE = get_int_env('WEBHOOK_BATCH_SIZE', 500)
+WEBHOOK_LEASE_SECONDS = get_int_env('WEBHOOK_LEASE_SECONDS', 120)
+WEBHOOK_MAX_ATTEMPTS = get_int_env('WEBHOOK_MAX_ATTEMPTS', 8)
+WEBHOOK_BACKOFF_BASE = get_int_env('WEBHOOK_BACKOFF_BASE', 30)
+WEBHOOK_BACKOFF_MAX = get_int_env('WEBHOOK_BACKOFF_MAX', 6 * 3600)
+# Plain-http endpoint URLs, and endpoints on loopback or private networks, are refused unless enabled here
+WEBHOOK_ALLOW_HTTP = get_boolean_env('WEBHOOK_ALLOW_HTTP', False)
+WEBHOOK_ALLOW_PRIVATE_ADDRESSES = get_boolean_env('WEBHOOK_ALLOW_PRIVATE_ADDRESSES', False)
+# Settlement reconciliation (apps.mazepay.reconciliation): file rows per chunk, default date tolerance in days,
+# and where reports are written (default: PRIVATE_ROOT/reconciliation/reports; never under MEDIA_ROOT)
+RECONCILIATION_CHUNK_SIZE = get_int_env('RECONCILIATION_CHUNK_SIZE', 100000)
+RECONCILIATION_DATE_TOLERANCE = get_int_env('RECONCILIATION_DATE_TOLERANCE', 2)
+RECONCILIATION_REPORT_DIR = get_env_variable('RECONCILIATION_REPORT_DIR', '')
+# Transfer risk checks (apps.mazepay.risk): checks run before posting and the score that flags an entry for review;
+# a failing check is skipped unless RISK_FAIL_OPEN is off
+RISK_CHECKS = get_list_env('RISK_CHECKS', default=['apps.mazepay.risk.velocity_check'])
+RISK_REVIEW_SCORE = get_int_env('RISK_REVIEW_SCORE', 80)
+RISK_FAIL_OPEN = get_boolean_env('RISK_FAIL_OPEN', True)
+# Velocity limits per user, device (X-Device-ID header; client-chosen, so advisory only) and IP: window in
+# seconds -> (max transfers, max amount in minor units); None leaves one uncapped. Windows are rings of
+# RISK_WINDOW_BUCKETS buckets, kept in Redis when CACHE_URL is set and per process otherwise (at most
+# RISK_LOCAL_MAX_KEYS users, devices and IPs)
+RISK_VELOCITY_LIMITS = {
+    'user': {60: (5, 2000000), 3600: (30, 5000000), 86400: (100, 10000000)},
+    'device': {60: (10, 2000000), 3600: (60, 10000000), 86400: (200, 20000000)},
+    'ip': {60: (20, 5000000), 3600: (200, 20000000), 86400: (1000, 100000000)},
+}
+RISK_WINDOW_BUCKETS = get_int_env('RISK_WINDOW_BUCKETS', 12)
+RISK_LOCAL_MAX_KEYS = get_int_env('RISK_LOCAL_MAX_KEYS', 20000)
+
+# GeoAttendance geofence index (apps.geoattendance.geofence): grid cell size in degrees (0.01 is about 1.1 km),
+# fences spanning more cells than GEOFENCE_MAX_CELLS are checked on every lookup, and how often (seconds) a process
+# checks whether another one changed the fences
+GEOFENCE_CELL_DEGREES = get_float_env('GEOFENCE_CELL_DEGREES', 0.01)
+GEOFENCE_MAX_CELLS = get_int_env('GEOFENCE_MAX_CELLS', 4096)
+GEOFENCE_INDEX_REFRESH = get_int_env('GEOFENCE_INDEX_REFRESH', 5)
+# Check-ins whose reported GPS accuracy is worse than this many metres are refused
+GEOFENCE_MAX_ACCURACY = get_float_env('GEOFENCE_MAX_ACCURACY', 100.0)
+# Offline check-in sync (apps.geoattendance.sync): events and uncompressed bytes per upload, and the oldest event
+# accepted in days
+CHECKIN_SYNC_MAX_EVENTS = get_int_env('CHECKIN_SYNC_MAX_EVENTS', 10000)
+CHECKIN_SYNC_MAX_BYTES = get_int_env('CHECKIN_SYNC_MAX_BYTES', 20 * 1024 * 1024)
+CHECKIN_SYNC_MAX_AGE_DAYS = get_int_env('CHECKIN_SYNC_MAX_AGE_DAYS', 31)
+# Timesheet shift rules (apps.geoattendance.timesheets): repeated taps ignored within seconds, longest shift before an
+# in is unpaired, unpaid break length deducted past so many hours, and hours before overtime
+TIMESHEET_DEBOUNCE_SECONDS = get_int_env('TIMESHEET_DEBOUNCE_SECONDS', 120)
+TIMESHEET_MAX_SHIFT_HOURS = get_float_env('TIMESHEET_MAX_SHIFT_HOURS', 16.0)
+TIMESHEET_BREAK_AFTER_HOURS = get_float_env('TIMESHEET_BREAK_AFTER_HOURS', 6.0)
+TIMESHEET_BREAK_MINUTES = get_int_env('TIMESHEET_BREAK_MINUTES', 30)
+TIMESHEET_OVERTIME_AFTER_HOURS = get_float_env('TIMESHEET_OVERTIME_AFTER_HOURS', 8.0)
+# Changed user-days recomputed per refresh pass, and processes for range recomputes (0: one per CPU)
+TIMESHEET_REFRESH_BATCH = get_int_env('TIMESHEET_REFRESH_BATCH', 2000)
+TIMESHEET_WORKERS = get_int_env('TIMESHEET_WORKERS', 0)
+# Location trails (apps.geoattendance.trails): pings per upload, and user-days merged per compaction pass
+TRAIL_MAX_PINGS = get_int_env('TRAIL_MAX_PINGS', 50000)
+TRAIL_COMPACT_BATCH = get_int_env('TRAIL_COMPACT_BATCH', 1000)
+
+# HandyConnect artisan matching (apps.handyconnect.matching): geohash characters per index cell (5 is about 4.9 km),
+# how often (seconds) a process polls for changed artisans, and the default and largest search radius in km
+MATCHING_GEOHASH_PRECISION = get_int_env('MATCHING_GEOHASH_PRECISION', 5)
+MATCHING_INDEX_REFRESH = get_int_env('MATCHING_INDEX_REFRESH', 5)
+MATCHING_RADIUS_KM = get_float_env('MATCHING_RADIUS_KM', 10.0)
+MATCHING_MAX_RADIUS_KM = get_float_env('MATCHING_MAX_RADIUS_KM', 50.0)
+# Weights of nearness, rating and recent activity in a match's score, and the minutes after which an artisan's last
+# report counts half
+MATCHING_DISTANCE_WEIGHT = get_float_env('MATCHING_DISTANCE_WEIGHT', 0.5)
+MATCHING_RATING_WEIGHT = get_float_env('MATCHING_RATING_WEIGHT', 0.3)
+MATCHING_AVAILABILITY_WEIGHT = get_float_env('MATCHING_AVAILABILITY_WEIGHT', 0.2)
+MATCHING_STALE_MINUTES = get_float_env('MATCHING_STALE_MINUTES', 30.0)
+# HandyConnect job dispatch (apps.handyconnect.dispatch): artisans offered a job per wave, waves before a job is
+# unfilled, seconds each offer stays open, open offers an artisan may hold at once, timer wheel tick in seconds, and
+# jobs advanced per pass
+DISPATCH_WAVE_SIZE = get_int_env('DISPATCH_WAVE_SIZE', 3)
+DISPATCH_WAVES = get_int_env('DISPATCH_WAVES', 4)
+DISPATCH_OFFER_SECONDS = get_int_env('DISPATCH_OFFER_SECONDS', 45)
+DISPATCH_MAX_PENDING_OFFERS = get_int_env('DISPATCH_MAX_PENDING_OFFERS', 2)
+DISPATCH_TICK = get_float_env('DISPATCH_TICK', 0.5)
+DISPATCH_BATCH = get_int_env('DISPATCH_BATCH', 1000)
+
+# Responses stored for Idempotency-Key replays (apps.core.idempotency)
+IDEMPOTENCY_TTL = get_int_env('IDEMPOTENCY_TTL', 86400)
 
 # Celery settings (disabled by default - uncomment and set CELERY_BROKER_URL to enable)
 # CELERY_BROKER_URL = get_env_variable('CELERY_BROKER_URL', default=None)
@@ -261,9 +365,24 @@ DEFAULT_FROM_EMAIL = get_env_variable('DEFAULT_FROM_EMAIL', default='webmaster@l
 #         'rate_limit': '5/m',  # 5 emails per minute
 #     }
 
-# Email verification settings
+# Multi-factor authentication (apps.users.mfa); counters live in the cache
+MFA_VALID_WINDOW = get_int_env('MFA_VALID_WINDOW', 1)
+MFA_MAX_ATTEMPTS = get_int_env('MFA_MAX_ATTEMPTS', 5)
+MFA_LOCKOUT_SECONDS = get_int_env('MFA_LOCKOUT_SECONDS', 300)
+# Seconds between passing the password or magic link and entering the MFA code
+MFA_LOGIN_TIMEOUT = get_int_env('MFA_LOGIN_TIMEOUT', 300)
+
+# One-time tokens (apps.users.tokens); used tokens are remembered in the cache until they expire
+FRONTEND_URL = get_env_variable('FRONTEND_URL', 'http://localhost:3000').rstrip('/')
+SITE_NAME = get_env_variable('SITE_NAME', 'Volt Conglomerate')
 EMAIL_VERIFICATION_LINK_EXPIRE_DAYS = 3
 PASSWORD_RESET_TIMEOUT = 86400  # 24 hours
+MAGIC_LINK_TIMEOUT = get_int_env('MAGIC_LINK_TIMEOUT', 900)  # 15 minutes
+
+# Email availability Bloom filter (apps.users.availability); shared via Redis when CACHE_URL is set
+AVAILABILITY_BLOOM_CAPACITY = get_int_env('AVAILABILITY_BLOOM_CAPACITY', 100000)
+AVAILABILITY_BLOOM_ERROR_RATE = get_float_env('AVAILABILITY_BLOOM_ERROR_RATE', 0.001)
+AVAILABILITY_BLOOM_REFRESH = get_int_env('AVAILABILITY_BLOOM_REFRESH', 300)
 
 # Authentication settings
 LOGIN_URL = '/web/login/'
@@ -11,8 +11,15 @@ from django.urls import include, path
 
 # Import our custom admin site
 from apps.core.admin_site import custom_admin_site
+from apps.core import views as core_views
 
 urlpatterns = [
+    # Probes for load balancers and orchestrators
+    path('livez', core_views.liveness, name='livez'),
+    path('readyz', core_views.readiness, name='readyz'),
+    path('health', core_views.health_check, name='health'),
+    path('metrics', core_views.metrics_view, name='metrics'),
+    
     # Admin
     path('admin/', custom_admin_site.urls),
     
@@ -24,7 +24,7 @@ const MFASetup = () => {
       try {
         const { data } = await api.get('/api/users/mfa/setup/');
         setMfaData({
-          qrCode: `data:image/png;base64,${data.qr_code}`,
+          qrCode: data.qr_code_data_uri || `data:image/png;base64,${data.qr_code}`,
           secret: data.mfa_secret,
           backupCodes: data.backup_codes || [],
         });
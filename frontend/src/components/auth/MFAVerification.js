@@ -57,9 +57,8 @@ const MFAVerification = () => {
       
       // Call the MFA verification endpoint
       const response = await api.post('/api/users/login/mfa/verify/', {
-        email: verifyEmail,
+        mfa_token: verifyToken,
         token: code,
-        temp_token: verifyToken,
         is_backup: usingBackupCode
       });
       
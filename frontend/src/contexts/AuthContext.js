@@ -1,6 +1,6 @@
 import React, { createContext, useState, useEffect, useContext, useCallback } from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
-import api from '../services/api';
+import api, { idempotencyHeaders } from '../services/api';
 import { toast } from 'react-toastify';
 import LoadingSplash from '../components/common/LoadingSplash';
 
@@ -151,6 +151,7 @@ export const AuthProvider = ({ children }) => {
       await api.post('/auth/register/', formData, {
         headers: {
           'Content-Type': 'application/json',
+          ...idempotencyHeaders('/auth/register/', formData),
         },
       });
       
@@ -421,7 +422,9 @@ export const AuthProvider = ({ children }) => {
   // Request password reset
   const requestPasswordReset = async (email) => {
     try {
-      await api.post('/auth/password/reset/', { email });
+      await api.post('/auth/password/reset/', { email }, {
+        headers: idempotencyHeaders('/auth/password/reset/', { email }),
+      });
       toast.success('Password reset instructions sent to your email');
       return { success: true };
     } catch (err) {
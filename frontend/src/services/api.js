@@ -38,4 +38,28 @@ api.interceptors.response.use(
   }
 );
 
+// Identical submissions within this window reuse one Idempotency-Key, so the
+// backend answers a double-click with the first response instead of redoing it
+const IDEMPOTENCY_WINDOW_MS = 60 * 1000;
+const recentIdempotencyKeys = new Map();
+
+const newIdempotencyKey = () =>
+  (window.crypto && window.crypto.randomUUID)
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
+export const idempotencyHeaders = (url, data) => {
+  const now = Date.now();
+  for (const [fingerprint, entry] of recentIdempotencyKeys) {
+    if (now - entry.createdAt > IDEMPOTENCY_WINDOW_MS) {
+      recentIdempotencyKeys.delete(fingerprint);
+    }
+  }
+  const fingerprint = `${url}:${JSON.stringify(data)}`;
+  if (!recentIdempotencyKeys.has(fingerprint)) {
+    recentIdempotencyKeys.set(fingerprint, { key: newIdempotencyKey(), createdAt: now });
+  }
+  return { 'Idempotency-Key': recentIdempotencyKeys.get(fingerprint).key };
+};
+
 export default api;